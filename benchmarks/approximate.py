@@ -0,0 +1,107 @@
+"""
+Compares the exact simplified view (GroupingEmailMessageProcessor) with the approximate view
+(ApproximateSenderProcessor) on a mailbox with a lot of distinct senders and recipients.
+The exact view also counts the distinct recipients with a set, like an exact implementation of the approximate view.
+Records are generated one by one and dropped after processing, like in the streaming pipeline, the memory
+retained by the processors after processing the messages is measured with tracemalloc in a separate run.
+Accuracy of the approximate view: relative error of the distinct senders and recipients, recall of the top senders
+and the ratio of the counted senders whose true count is between the lower and upper bound of the table.
+
+Usage: python -m benchmarks.approximate [--messages 1000000] [--senders 200000] [--recipients 50000] [--skew 1.1]
+                                        [--top-senders 1000]
+"""
+import argparse
+import datetime
+import gc
+import json
+import time
+import tracemalloc
+from collections import Counter
+from typing import Iterator, Tuple, Optional
+
+from benchmarks.synthetic import BASE_DATE, iter_sender_indices
+from emailsorter.common.model import MessageRecord, ProcessorResultType, create_message_processor
+
+TOP_RECALL = 100
+
+
+def iter_records(no_of_messages: int, no_of_senders: int, no_of_recipients: int,
+                 skew: Optional[float]) -> Iterator[Tuple[str, MessageRecord]]:
+    for idx, sender_idx in enumerate(iter_sender_indices(no_of_messages, no_of_senders, skew)):
+        # Recipients are not correlated with the senders, e.g. mailing lists and aliases
+        yield f"sender{sender_idx}@example.com", MessageRecord(f"thread-{idx:08d}", f"msg-{idx:08d}",
+                                                               f"Subject of message {idx}",
+                                                               f"user{idx * 7919 % no_of_recipients}@example.com",
+                                                               BASE_DATE + datetime.timedelta(minutes=idx))
+
+
+def process(approximate: bool, args, memory: bool):
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    recipients = set()
+    if approximate:
+        processor = create_message_processor(ProcessorResultType.APPROXIMATE, top_senders=args.top_senders)
+    else:
+        processor = create_message_processor(ProcessorResultType.SIMPLIFIED)
+    for sender, record in iter_records(args.messages, args.senders, args.recipients, args.skew):
+        processor.add(sender, record)
+        if not approximate:
+            recipients.add(record.recipient_email)
+    seconds = time.perf_counter() - start_time
+    retained = None
+    if memory:
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return processor, recipients, seconds, retained
+
+
+def run(args):
+    exact, recipients, exact_seconds, _ = process(False, args, memory=False)
+    approximate, _, approximate_seconds, _ = process(True, args, memory=False)
+    _, _, _, exact_retained = process(False, args, memory=True)
+    _, _, _, approximate_retained = process(True, args, memory=True)
+
+    true_counts = Counter(exact.count_by_sender)
+    summary = approximate.get_summary()
+    _, rows = approximate.convert_to_table_rows()
+    bounds = {row[0]: (row[2], row[1]) for row in rows}
+    top_senders = [sender for sender, _ in true_counts.most_common(TOP_RECALL)]
+    estimated_top = set(sorted(bounds, key=lambda sender: -bounds[sender][1])[:TOP_RECALL])
+    within_bounds = sum(1 for sender, (lower, upper) in bounds.items() if lower <= true_counts[sender] <= upper)
+    return {"exact_seconds": round(exact_seconds, 2),
+            "approximate_seconds": round(approximate_seconds, 2),
+            "exact_retained_mb": round(exact_retained / 1024 / 1024, 1),
+            "approximate_retained_mb": round(approximate_retained / 1024 / 1024, 2),
+            "distinct_senders": len(true_counts),
+            "distinct_senders_error_pct": round(_relative_error(summary["distinct_senders"], len(true_counts)), 2),
+            "distinct_recipients": len(recipients),
+            "distinct_recipients_error_pct": round(_relative_error(summary["distinct_recipients"],
+                                                                   len(recipients)), 2),
+            f"top_{TOP_RECALL}_recall": len(estimated_top.intersection(top_senders)) / len(top_senders),
+            "within_bounds": within_bounds / len(bounds),
+            "max_messages_of_other_senders": summary["max_messages_of_other_senders"],
+            "messages_match": summary["messages"] == args.messages}
+
+
+def _relative_error(estimate: int, actual: int) -> float:
+    return abs(estimate - actual) / actual * 100
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--senders", type=int, default=200000)
+    parser.add_argument("--recipients", type=int, default=50000)
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="Exponent of the Zipf distribution of senders, 0 distributes messages evenly")
+    parser.add_argument("--top-senders", type=int, default=1000, help="Number of senders counted by the sketch")
+    args = parser.parse_args()
+    args.skew = args.skew or None
+    print(json.dumps({"messages": args.messages, "senders": args.senders, "recipients": args.recipients,
+                      "top_senders": args.top_senders, **run(args)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures fetching messages through the Gmail API with different batch sizes, against a local stand-in server
+of the Gmail API that answers each HTTP request after a simulated round-trip latency.
+Runs with an empty email cache (threads are fetched in METADATA format) and with a warm one
+(only the message IDs of the threads are checked).
+
+Usage: python -m benchmarks.batch_fetch [--messages 5000] [--latency 0.02] [--batch-sizes 1,10,50,100]
+"""
+import argparse
+import json
+import tempfile
+import time
+
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from benchmarks.gmail_server import FakeGmailServer, LocalGmailWrapper
+from benchmarks.synthetic import iter_thread_responses
+from emailsorter.core.source import GmailApiMessageSource
+
+
+def run(threads, batch_size: int, latency: float, cache_dir: str):
+    with FakeGmailServer(threads, latency=latency) as server:
+        wrapper = LocalGmailWrapper(server.url, cache_dir, use_cache=True)
+        source = GmailApiMessageSource(wrapper, query="label:inbox", fetch_mode=ThreadQueryFormat.METADATA,
+                                       expect_one_message_per_thread=False, batch_size=batch_size)
+        start_time = time.perf_counter()
+        no_of_messages = sum(len(page) for page in source.iter_pages())
+        seconds = time.perf_counter() - start_time
+        return no_of_messages, seconds, server.http_requests, server.calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--senders", type=int, default=100)
+    parser.add_argument("--messages-per-thread", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per HTTP request")
+    parser.add_argument("--batch-sizes", default="1,10,50,100")
+    args = parser.parse_args()
+
+    threads = list(iter_thread_responses(args.messages, args.senders, messages_per_thread=args.messages_per_thread))
+    for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for cache in ("cold", "warm"):
+                no_of_messages, seconds, http_requests, calls = run(threads, batch_size, args.latency, cache_dir)
+                print(json.dumps({
+                    "batch_size": batch_size,
+                    "cache": cache,
+                    "messages": no_of_messages,
+                    "latency": args.latency,
+                    "seconds": round(seconds, 3),
+                    "http_requests": http_requests,
+                    "api_calls": calls,
+                    "messages_per_second": round(no_of_messages / seconds, 1),
+                }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compares the grouping engines of the simplified and detailed views: GroupingEmailMessageProcessor (dict) and
+ColumnarGroupingProcessor (columnar, NumPy).
+Both get the same senders and message fields, a MessageRecord is created for each message like in the pipeline,
+and dropped by the processor unless it keeps it. The time of processing the messages and converting the results
+to table rows is measured, then the memory retained by the processor after processing the messages and the peak
+memory of converting the results are measured with tracemalloc in a separate run, as tracing slows down both.
+The rows and examples of the two engines are checked to be the same.
+
+Usage: python -m benchmarks.columnar_grouping [--messages 1000000] [--senders 10000] [--skew 1.1]
+                                              [--result-type detailed] [--repeat 3]
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import List, Tuple, Optional
+
+from benchmarks.trend import create_records
+from emailsorter.common.model import MessageRecord, ProcessorResultType, GroupingEngine, create_message_processor
+
+RESULT_TYPES = [ProcessorResultType.SIMPLIFIED, ProcessorResultType.DETAILED]
+
+
+def create_messages(no_of_messages: int, no_of_senders: int, skew: Optional[float]) -> List[Tuple[str, tuple]]:
+    """
+    :return: Sender and the fields of the MessageRecord of each message
+    """
+    return [(sender, (r.thread_id, r.msg_id, r.subject, r.recipient_email, r.date))
+            for sender, r in create_records(no_of_messages, no_of_senders, skew, days=730)]
+
+
+def process(engine: GroupingEngine, result_type: ProcessorResultType, messages: List[Tuple[str, tuple]]):
+    processor = create_message_processor(result_type, engine=engine)
+    for sender, fields in messages:
+        processor.add(sender, MessageRecord(*fields))
+    return processor
+
+
+def time_engine(engine: GroupingEngine, result_type: ProcessorResultType, messages: List[Tuple[str, tuple]]):
+    start_time = time.perf_counter()
+    processor = process(engine, result_type, messages)
+    process_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    results = processor.convert_to_table_rows()
+    return results, process_seconds, time.perf_counter() - start_time
+
+
+def measure_memory(engine: GroupingEngine, result_type: ProcessorResultType, messages: List[Tuple[str, tuple]]):
+    """
+    :return: Memory retained by the processor after processing the messages and the peak memory of converting
+    the results, in bytes. The fields of the messages are allocated before tracing, they are not counted.
+    """
+    gc.collect()
+    tracemalloc.start()
+    processor = process(engine, result_type, messages)
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    results = processor.convert_to_table_rows()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return retained, peak
+
+
+def run(messages: List[Tuple[str, tuple]], result_type: ProcessorResultType, repeat: int = 1,
+        memory: bool = True):
+    results = {}
+    all_results = {}
+    for engine in GroupingEngine:
+        timings = []
+        for _ in range(repeat):
+            engine_results, process_seconds, convert_seconds = time_engine(engine, result_type, messages)
+            timings.append((process_seconds + convert_seconds, process_seconds, convert_seconds))
+        total, process_seconds, convert_seconds = min(timings)
+        all_results[engine] = engine_results
+        results[engine.value] = {"seconds": round(total, 3),
+                                 "process_seconds": round(process_seconds, 3),
+                                 "convert_seconds": round(convert_seconds, 3)}
+        if memory:
+            retained, peak = measure_memory(engine, result_type, messages)
+            results[engine.value].update({"retained_mb": round(retained / 1024 / 1024, 1),
+                                          "convert_peak_mb": round(peak / 1024 / 1024, 1)})
+    results["speedup"] = round(results[GroupingEngine.DICT.value]["seconds"] /
+                               results[GroupingEngine.COLUMNAR.value]["seconds"], 2)
+    results["results_match"] = all_results[GroupingEngine.DICT] == all_results[GroupingEngine.COLUMNAR]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--senders", type=int, default=10000)
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="Exponent of the Zipf distribution of senders, 0 distributes messages evenly")
+    parser.add_argument("--result-type", choices=[t.value for t in RESULT_TYPES], action="append",
+                        help="Result types to compare, can be repeated. Default: all of them")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="Skip measuring the memory with tracemalloc")
+    args = parser.parse_args()
+
+    messages = create_messages(args.messages, args.senders, args.skew or None)
+    for result_type in [ProcessorResultType(t) for t in args.result_type] if args.result_type else RESULT_TYPES:
+        result = run(messages, result_type, repeat=args.repeat, memory=not args.no_memory)
+        print(json.dumps({"result_type": result_type.value, "messages": args.messages, "senders": args.senders,
+                          **result}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Local stand-in for the Gmail API, for the benchmarks and tests of fetching messages over HTTP.
+Implements threads.list, threads.get and the batch endpoint, with a simulated round-trip latency
+and calls that fail with a given status a number of times before they succeed.
+"""
+import email.parser
+import json
+import logging
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Tuple, Optional, Callable
+
+from emailsorter.core.scheduler import get_quota_units, RequestScheduler, ScheduledHttp
+
+THREADS_PATH = "/gmail/v1/users/me/threads"
+BATCH_PATH = "/batch"
+STATUS_REASONS = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class FakeGmailServer:
+    """
+    Serves the threads (threads.get responses in METADATA format) on a free local port.
+    Use it as a context manager or call start / stop.
+    """
+    def __init__(self, threads: List[Dict[str, Any]], latency: float = 0.0, list_page_size: int = 100,
+                 quota_units_per_second: float = None, clock: Callable[[], float] = time.monotonic):
+        """
+        :param latency: Seconds each HTTP request takes before it is answered, a batch request counts once
+        :param quota_units_per_second: Calls exceeding the quota are answered with 429, like the per-user rate
+        limit of Gmail. The quota can be spent in bursts of one second.
+        :param clock: Clock of the quota, tests can share a fake clock with the request scheduler
+        """
+        self.threads: Dict[str, Dict[str, Any]] = {thread["id"]: thread for thread in threads}
+        self.thread_ids = [thread["id"] for thread in threads]
+        self.latency = latency
+        self.list_page_size = list_page_size
+        # Thread ID -> (status, number of calls failing with the status)
+        self.failures: Dict[str, Tuple[int, int]] = {}
+        self.quota_units_per_second = quota_units_per_second
+        self._quota_tokens = quota_units_per_second
+        self._clock = clock
+        self._quota_updated = clock()
+        self.http_requests = 0
+        self.batch_requests = 0
+        self.calls = 0
+        self.throttled_calls = 0
+        self.units = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def fail_calls(self, thread_id: str, status: int, times: int = 1):
+        self.failures[thread_id] = (status, times)
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, delayed ACKs would add 40ms to each response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server._count_request()
+                status, body = server.handle_call("GET", self.path)
+                self._send(status, "application/json; charset=UTF-8", json.dumps(body))
+
+            def do_POST(self):
+                server._count_request()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                if urllib.parse.urlsplit(self.path).path != BATCH_PATH:
+                    self._send(404, "application/json; charset=UTF-8", json.dumps({"error": "Not found"}))
+                    return
+                boundary, content = server.handle_batch(self.headers["Content-Type"], body)
+                self._send(200, f"multipart/mixed; boundary={boundary}", content)
+
+            def _send(self, status: int, content_type: str, content: str):
+                data = content.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-gmail-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _count_request(self):
+        with self._lock:
+            self.http_requests += 1
+        time.sleep(self.latency)
+
+    def handle_call(self, method: str, path: str) -> Tuple[int, Dict[str, Any]]:
+        parts = urllib.parse.urlsplit(path)
+        params = urllib.parse.parse_qs(parts.query)
+        if method != "GET" or not parts.path.startswith(THREADS_PATH):
+            return 404, {"error": {"code": 404, "message": f"Unknown path: {parts.path}"}}
+        with self._lock:
+            self.calls += 1
+            if not self._take_quota(get_quota_units(method, path)):
+                self.throttled_calls += 1
+                return 429, {"error": {"code": 429, "message": "User-rate limit exceeded",
+                                       "errors": [{"reason": "rateLimitExceeded"}]}}
+        thread_id = urllib.parse.unquote(parts.path[len(THREADS_PATH):].lstrip("/"))
+        if not thread_id:
+            return 200, self._list_threads(params)
+
+        with self._lock:
+            status, times = self.failures.get(thread_id, (200, 0))
+            if times:
+                self.failures[thread_id] = (status, times - 1)
+                return status, {"error": {"code": status, "message": "Failed by request"}}
+        thread = self.threads.get(thread_id)
+        if not thread:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        if params.get("format", ["full"])[0] == "minimal":
+            return 200, {"id": thread_id, "messages": [{key: msg[key] for key in ("id", "threadId", "labelIds")}
+                                                       for msg in thread["messages"]]}
+        return 200, thread
+
+    def _take_quota(self, units: int) -> bool:
+        if self.quota_units_per_second:
+            now = self._clock()
+            self._quota_tokens = min(self.quota_units_per_second,
+                                     self._quota_tokens + (now - self._quota_updated) * self.quota_units_per_second)
+            self._quota_updated = now
+            if self._quota_tokens < units:
+                return False
+            self._quota_tokens -= units
+        self.units += units
+        return True
+
+    def _list_threads(self, params: Dict[str, List[str]]) -> Dict[str, Any]:
+        start = int(params.get("pageToken", ["0"])[0])
+        page_size = min(int(params.get("maxResults", [self.list_page_size])[0]), self.list_page_size)
+        end = start + page_size
+        response = {"threads": [{"id": thread_id, "historyId": "1", "snippet": ""}
+                                for thread_id in self.thread_ids[start:end]],
+                    "resultSizeEstimate": len(self.thread_ids)}
+        if end < len(self.thread_ids):
+            response["nextPageToken"] = str(end)
+        return response
+
+    def handle_batch(self, content_type: str, body: str) -> Tuple[str, str]:
+        """
+        :return: Boundary and content of the multipart/mixed response, one part per call in the order of the calls
+        """
+        with self._lock:
+            self.batch_requests += 1
+        request = email.parser.Parser().parsestr(f"Content-Type: {content_type}\r\n\r\n{body}")
+        boundary = f"batch_{uuid.uuid4().hex}"
+        response_parts = []
+        for part in request.get_payload():
+            request_line = part.get_payload().split("\n", 1)[0].strip()
+            method, path, _ = request_line.split(" ", 2)
+            status, call_body = self.handle_call(method, path)
+            content_id = part["Content-ID"]
+            response_parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id[1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {STATUS_REASONS.get(status, 'Error')}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(call_body)}\r\n"
+            )
+        return boundary, "".join(response_parts) + f"--{boundary}--\r\n"
+
+
+class LocalGmailWrapper:
+    """
+    The parts of GmailWrapper used to fetch messages, talking to a FakeGmailServer without authorization.
+    """
+    def __init__(self, url: str, cache_dir: str, use_cache: bool = False, scheduler: RequestScheduler = None):
+        import httplib2
+        from googleapiclient.discovery import build
+        from googleapiwrapper.gmail_api import GmailApiFetcher
+        from googleapiwrapper.gmail_api_extensions import ApiFetchingContext
+        from googleapiwrapper.gmail_cache import CachingStrategyType
+        from pythoncommons.logging_setup import SimpleLoggingSetup
+
+        # The Gmail API wrapper logs on the TRACE level, it is added by the logging setup of the CLI
+        if not hasattr(logging.getLoggerClass(), "trace"):
+            SimpleLoggingSetup.add_logging_level("TRACE", logging.DEBUG - 5)
+        strategy_type = CachingStrategyType.FILESYSTEM_CACHE_STRATEGY if use_cache else CachingStrategyType.NO_CACHE
+        self.api_fetching_ctx = ApiFetchingContext(strategy_type.value(cache_dir, "emailsorter", "me@example.com"))
+        self.http = ScheduledHttp(scheduler) if scheduler else httplib2.Http()
+        service = build("gmail", "v1", http=self.http, static_discovery=True,
+                        client_options={"api_endpoint": url})
+        self.fetcher = GmailApiFetcher(service)
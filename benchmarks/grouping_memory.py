@@ -0,0 +1,50 @@
+"""
+Measures the memory retained by GroupingEmailMessageProcessor after processing synthetic messages.
+Messages are generated one by one and dropped after processing, like in the streaming pipeline,
+so the measured memory is the state kept by the processor.
+
+Usage: python -m benchmarks.grouping_memory [--messages 1000000] [--senders 10000] [--result-type simplified]
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from benchmarks.synthetic import create_message
+from emailsorter.common.model import ProcessorResultType, create_message_processor
+
+
+def run(no_of_messages: int, no_of_senders: int, result_type: ProcessorResultType):
+    gc.collect()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    processor = create_message_processor(result_type)
+    for i in range(no_of_messages):
+        processor.process(create_message(i, f"sender{i % no_of_senders}@example.com", body_lines=0))
+    process_seconds = time.perf_counter() - start_time
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "result_type": result_type.value,
+        "messages": no_of_messages,
+        "senders": no_of_senders,
+        "retained_mb": round(retained / 1024 / 1024, 1),
+        "peak_mb": round(peak / 1024 / 1024, 1),
+        "process_seconds": round(process_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--senders", type=int, default=10000)
+    parser.add_argument("--result-type", choices=[t.value for t in ProcessorResultType],
+                        default=ProcessorResultType.SIMPLIFIED.value)
+    args = parser.parse_args()
+    print(json.dumps(run(args.messages, args.senders, ProcessorResultType(args.result_type))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measures the overhead of the per-message logging of message processing with different logging setups.
+Records are written to a log file, like the file handlers set up by the CLI.
+
+Usage: python -m benchmarks.logging_overhead [--messages 100000] [--senders 1000] [--repeat 3]
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import create_messages
+from emailsorter.actions.inbox_discovery import InboxDiscovery
+from emailsorter.common.model import GroupingEmailMessageProcessor, ProcessorResultType, NoOpEmailContentProcessor
+from emailsorter.core.constants import DEFAULT_LINE_SEP
+from emailsorter.core.log import QueueLogging, SampledLog
+
+LOGGER_NAME = "emailsorter"
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+SAMPLE_EVERY = 100
+
+# Mode name -> (level, queue logging, log every n-th message)
+MODES = {
+    "info_level": (logging.INFO, False, 1),
+    "debug": (logging.DEBUG, False, 1),
+    "debug_queue": (logging.DEBUG, True, 1),
+    f"debug_every_{SAMPLE_EVERY}": (logging.DEBUG, False, SAMPLE_EVERY),
+    f"debug_queue_every_{SAMPLE_EVERY}": (logging.DEBUG, True, SAMPLE_EVERY),
+}
+
+
+def run(messages, level: int, queue_logging: bool, every: int, log_file: str):
+    logger = logging.getLogger(LOGGER_NAME)
+    handler = logging.FileHandler(log_file, mode="w")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    SampledLog.default_every = every
+    queue_logger = QueueLogging(logger)
+    try:
+        if queue_logging:
+            queue_logger.start()
+        start_time = time.perf_counter()
+        InboxDiscovery.process_messages(messages, DEFAULT_LINE_SEP, [NoOpEmailContentProcessor()],
+                                        [GroupingEmailMessageProcessor(ProcessorResultType.SIMPLIFIED)])
+        process_seconds = time.perf_counter() - start_time
+        # Queued records are still written after processing finished
+        queue_logger.stop()
+        total_seconds = time.perf_counter() - start_time
+    finally:
+        queue_logger.stop()
+        logger.removeHandler(handler)
+        handler.close()
+        SampledLog.default_every = 1
+    return process_seconds, total_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--senders", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    messages = create_messages(args.messages, args.senders, body_lines=0)
+    log_file = os.path.join(tempfile.gettempdir(), "emailsorter_logging_overhead.log")
+    baseline = None
+    for mode, (level, queue_logging, every) in MODES.items():
+        timings = [run(messages, level, queue_logging, every, log_file) for _ in range(args.repeat)]
+        process_seconds = min(t[0] for t in timings)
+        total_seconds = min(t[1] for t in timings)
+        if baseline is None:
+            baseline = process_seconds
+        print(json.dumps({
+            "mode": mode,
+            "messages": args.messages,
+            "process_seconds": round(process_seconds, 3),
+            "total_seconds": round(total_seconds, 3),
+            "us_per_message": round(process_seconds / args.messages * 1_000_000, 3),
+            "overhead_us_per_message": round((process_seconds - baseline) / args.messages * 1_000_000, 3),
+        }))
+
+
+if __name__ == "__main__":
+    main()
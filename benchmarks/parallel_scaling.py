@@ -0,0 +1,71 @@
+"""
+Measures how parallel message processing scales with the number of worker processes.
+A synthetic mailbox is indexed into a message store (not timed), then the messages of the store are grouped
+serially and with an increasing number of workers. Results of the parallel runs are checked against the serial run.
+
+Usage: python -m benchmarks.parallel_scaling [--messages 200000] [--workers 1 2 4 8] [--result-type simplified]
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_cached_mailbox
+from emailsorter.actions.inbox_discovery import InboxDiscovery
+from emailsorter.common.model import ProcessorResultType, create_message_processor
+from emailsorter.core.constants import DEFAULT_LINE_SEP
+from emailsorter.core.source import MessageStoreSource
+from emailsorter.core.store import MessageStore
+
+
+def run(store: MessageStore, result_type: ProcessorResultType, workers: int):
+    source = MessageStoreSource(store, "label:inbox")
+    start = time.perf_counter()
+    if workers == 1:
+        processor = create_message_processor(result_type)
+        InboxDiscovery.process_messages(source.iter_messages(), DEFAULT_LINE_SEP, [], [processor])
+    else:
+        factory = functools.partial(create_message_processor, result_type)
+        processor = InboxDiscovery.process_message_shards(source.split(workers), DEFAULT_LINE_SEP, [], [factory],
+                                                          parallelism=workers)[0]
+    return processor.convert_to_table_rows(), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--senders", type=int, default=10000)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--result-type", choices=[t.value for t in ProcessorResultType],
+                        default=ProcessorResultType.SIMPLIFIED.value)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    result_type = ProcessorResultType(args.result_type)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        threads_dir = os.path.join(tmp_dir, "threads")
+        write_cached_mailbox(threads_dir, args.messages, args.senders, skew=args.skew)
+        store = MessageStore(os.path.join(tmp_dir, "store.sqlite3"), threads_dir)
+        store.rebuild()
+
+        serial_rows, serial_seconds = run(store, result_type, workers=1)
+        for workers in args.workers:
+            rows, seconds = run(store, result_type, workers) if workers > 1 else (serial_rows, serial_seconds)
+            print(json.dumps({
+                "workers": workers,
+                "cpus": os.cpu_count(),
+                "messages": args.messages,
+                "result_type": result_type.value,
+                "seconds": round(seconds, 3),
+                "speedup": round(serial_seconds / seconds, 2),
+                "identical_to_serial": rows == serial_rows,
+            }))
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
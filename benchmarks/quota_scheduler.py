@@ -0,0 +1,97 @@
+"""
+Measures the sustained throughput of Gmail API requests against a local stand-in server that enforces
+a per-user quota, with and without the request scheduler.
+Several threads send threads.get calls for a fixed time. Without the scheduler, the calls exceeding the quota
+fail with 429. With the scheduler, the throughput should stay close to the quota with few throttled calls.
+
+Usage: python -m benchmarks.quota_scheduler [--quota 250] [--threads 8] [--seconds 10] [--latency 0.02]
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+from typing import Callable
+
+from googleapiclient.errors import HttpError
+
+from benchmarks.gmail_server import FakeGmailServer, LocalGmailWrapper
+from benchmarks.synthetic import iter_thread_responses
+from emailsorter.core.scheduler import RequestScheduler, RequestSchedulerConfig
+
+
+def run(server: FakeGmailServer, thread_ids, no_of_threads: int, seconds: float, scheduler: RequestScheduler = None,
+        clock: Callable[[], float] = time.perf_counter):
+    """
+    :param clock: Clock of the duration of the run, tests use the fake clock of the scheduler and the server
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if scheduler:
+            # The scheduled transport can be shared by the threads
+            shared_wrapper = LocalGmailWrapper(server.url, cache_dir, scheduler=scheduler)
+            wrappers = [shared_wrapper] * no_of_threads
+        else:
+            wrappers = [LocalGmailWrapper(server.url, cache_dir) for _ in range(no_of_threads)]
+        results = {"ok": 0, "failed": 0}
+        lock = threading.Lock()
+        deadline = clock() + seconds
+
+        def worker(idx: int):
+            threads_svc = wrappers[idx].fetcher.threads_svc
+            call = idx
+            while clock() < deadline:
+                thread_id = thread_ids[call % len(thread_ids)]
+                call += no_of_threads
+                try:
+                    threads_svc.get(userId="me", id=thread_id, format="minimal").execute()
+                    result = "ok"
+                except HttpError:
+                    result = "failed"
+                with lock:
+                    results[result] += 1
+
+        start_units = server.units
+        start_throttled = server.throttled_calls
+        start_time = clock()
+        workers = [threading.Thread(target=worker, args=(idx,)) for idx in range(no_of_threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = clock() - start_time
+        return {
+            "successful_calls": results["ok"],
+            "failed_calls": results["failed"],
+            "throttled_calls": server.throttled_calls - start_throttled,
+            "units_per_second": round((server.units - start_units) / elapsed, 1),
+            "seconds": round(elapsed, 2),
+            "connections": wrappers[0].http.connections_created if scheduler else no_of_threads,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quota", type=float, default=250, help="Quota units per second of the server")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per HTTP request")
+    args = parser.parse_args()
+
+    threads = list(iter_thread_responses(1000, 10, messages_per_thread=1))
+    thread_ids = [thread["id"] for thread in threads]
+    modes = {
+        "unscheduled": None,
+        "scheduled": RequestScheduler(RequestSchedulerConfig(units_per_second=args.quota)),
+    }
+    for mode, scheduler in modes.items():
+        with FakeGmailServer(threads, latency=args.latency, quota_units_per_second=args.quota) as server:
+            result = run(server, thread_ids, args.threads, args.seconds, scheduler=scheduler)
+        result = {"mode": mode, "quota_units_per_second": args.quota, "threads": args.threads, **result}
+        # The server allows a burst of one second of the quota at the start
+        result["quota_utilization"] = round(result["units_per_second"] * result["seconds"]
+                                            / (args.quota * (result["seconds"] + 1)), 3)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
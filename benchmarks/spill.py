@@ -0,0 +1,84 @@
+"""
+Compares the memory of the detailed view kept in memory (GroupingEmailMessageProcessor) and with a memory budget
+(SpillingGroupingProcessor, messages spilled to temporary files).
+Synthetic messages are generated one by one and dropped after processing, like in the streaming pipeline,
+then the result table is exported to CSV. The peak memory of processing and exporting is measured with tracemalloc,
+so the times are slower than without tracing. The exported files of the two modes are checked to be identical.
+
+Usage: python -m benchmarks.spill [--messages 1000000] [--senders 10000] [--skew 1.1] [--memory-budget 16]
+"""
+import argparse
+import filecmp
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Optional
+
+from benchmarks.synthetic import iter_messages
+from emailsorter.common.model import ProcessorResultType, create_message_processor
+from emailsorter.core.output import InboxDiscoveryResults, create_processor_representation
+from emailsorter.display.export import ExportFormat
+from emailsorter.display.table import TableRenderSettings
+
+
+def run_mode(no_of_messages: int, no_of_senders: int, skew: Optional[float], memory_budget: Optional[int],
+             tmp_dir: str, export_file: str):
+    representation = create_processor_representation(ProcessorResultType.DETAILED)
+    render_settings = TableRenderSettings(representation.get_col_styles(),
+                                          sort_by_column=representation.get_sort_column())
+    gc.collect()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    processor = create_message_processor(ProcessorResultType.DETAILED, memory_budget=memory_budget, spill_dir=tmp_dir)
+    try:
+        for message in iter_messages(no_of_messages, no_of_senders, body_lines=0, skew=skew):
+            processor.process(message)
+        process_seconds = time.perf_counter() - start_time
+        _, process_peak = tracemalloc.get_traced_memory()
+        start_time = time.perf_counter()
+        _, rows = processor.convert_to_table_rows()
+        InboxDiscoveryResults.export(rows, representation.get_cols(), render_settings, {ExportFormat.CSV: export_file},
+                                     col_types=representation.get_col_types())
+        export_seconds = time.perf_counter() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        runs = len(getattr(processor, "runs", []))
+    finally:
+        tracemalloc.stop()
+        processor.close()
+    return {"process_seconds": round(process_seconds, 2),
+            "export_seconds": round(export_seconds, 2),
+            "process_peak_mb": round(process_peak / 1024 / 1024, 1),
+            "peak_mb": round(peak / 1024 / 1024, 1),
+            "runs": runs}
+
+
+def run(no_of_messages: int, no_of_senders: int, skew: Optional[float], memory_budget: int):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = {}
+        for name, budget in [("in_memory", None), ("spill", memory_budget)]:
+            files[name] = os.path.join(tmp_dir, f"{name}.csv")
+            results[name] = run_mode(no_of_messages, no_of_senders, skew, budget, tmp_dir, files[name])
+        results["files_match"] = filecmp.cmp(files["in_memory"], files["spill"], shallow=False)
+        results["export_mb"] = round(os.path.getsize(files["spill"]) / 1024 / 1024, 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--senders", type=int, default=10000)
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="Exponent of the Zipf distribution of senders, 0 distributes messages evenly")
+    parser.add_argument("--memory-budget", type=int, default=16, help="Memory budget of the spill mode in MB")
+    args = parser.parse_args()
+    result = run(args.messages, args.senders, args.skew or None, args.memory_budget * 1024 * 1024)
+    print(json.dumps({"messages": args.messages, "senders": args.senders, "memory_budget_mb": args.memory_budget,
+                      **result}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Measures the cold start of the CLI in fresh interpreters: the import time of the modules of the commands
+and the time to the first output of an offline discovery run, like a cron job running on a local message store.
+Also reports whether the Gmail API client was imported, offline runs should never need it,
+and whether the JSON serialization libraries were imported, only the commands that read or write JSON files need them.
+
+Usage: python -m benchmarks.startup [--messages 2000] [--senders 100] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any
+
+from benchmarks.synthetic import write_cached_mailbox
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that are only needed to talk to the Gmail API
+API_CLIENT_MODULES = ["googleapiclient", "google_auth_oauthlib", "googleapiwrapper.gmail_api"]
+# Modules that are only needed to read and write checkpoints, filters and metrics
+JSON_MODULES = ["dataclasses_json", "marshmallow"]
+IMPORTED_MODULES = {
+    # cli.py imports its siblings as top-level modules, it is run from the package dir
+    "cli": os.path.join(PROJECT_ROOT, "emailsorter"),
+    "emailsorter.actions.inbox_discovery": PROJECT_ROOT,
+}
+
+IMPORT_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": [m for m in {api_modules!r} if m in sys.modules],
+                  "json_modules": [m for m in {json_modules!r} if m in sys.modules]}}))
+"""
+
+# Runs the discover-inbox command on a message store, the first line printed by the run is the result table
+OFFLINE_RUN_SCRIPT = """
+import sys, json
+from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+from emailsorter.core.common import EmailSorterConfig
+from emailsorter.core.store import MessageStore
+from emailsorter.display.console import CliLogger
+
+
+class OfflineContext:
+    def __init__(self, session_dir, message_store):
+        self.session_dir = session_dir
+        self.output_dir = session_dir
+        self.message_store = message_store
+
+
+out_dir, db_file, threads_dir = sys.argv[1:4]
+EmailSorterConfig.PROJECT_OUT_ROOT = out_dir
+CliLogger.set_console_only(True)
+ctx = OfflineContext(out_dir, MessageStore(db_file, threads_dir))
+conf = InboxDiscoveryConfig(ctx, gmail_query="label:inbox", fetch_mode=None, offline_mode=True, top=10)
+InboxDiscovery(conf, ctx).run()
+print(json.dumps({{"modules": [m for m in {api_modules!r} if m in sys.modules]}}))
+"""
+
+
+def run_script(script: str, cwd: str) -> Dict[str, Any]:
+    """
+    Runs the script in a new interpreter.
+    :return: The wall time of the process, the time until its first line of output and its last line parsed as JSON
+    """
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT, PYTHONDONTWRITEBYTECODE="1")
+    start_time = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", script], cwd=cwd, env=env, stdout=subprocess.PIPE, text=True)
+    first_line = proc.stdout.readline()
+    first_output_seconds = time.perf_counter() - start_time
+    lines = [first_line] + proc.stdout.readlines()
+    if proc.wait() != 0:
+        raise RuntimeError(f"Script failed with exit code {proc.returncode}")
+    wall_seconds = time.perf_counter() - start_time
+    result = json.loads(lines[-1])
+    result.update(wall_seconds=wall_seconds, first_output_seconds=first_output_seconds)
+    return result
+
+
+def measure_imports(repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for module, cwd in IMPORTED_MODULES.items():
+        script = IMPORT_SCRIPT.format(module=module, api_modules=API_CLIENT_MODULES, json_modules=JSON_MODULES)
+        runs = [run_script(script, cwd) for _ in range(repeat)]
+        results.append({
+            "case": f"import[{module}]",
+            "import_seconds": round(min(r["seconds"] for r in runs), 3),
+            "wall_seconds": round(min(r["wall_seconds"] for r in runs), 3),
+            "api_client_modules": runs[0]["modules"],
+            "json_modules": runs[0]["json_modules"],
+        })
+    return results
+
+
+def measure_offline_run(work_dir: str, messages: int, senders: int, repeat: int) -> Dict[str, Any]:
+    threads_dir = os.path.join(work_dir, "threads")
+    db_file = os.path.join(work_dir, "store.sqlite3")
+    out_dir = os.path.join(work_dir, "out")
+    os.makedirs(out_dir, exist_ok=True)
+    write_cached_mailbox(threads_dir, messages, senders)
+    # Cron jobs run on an up-to-date store, the store is indexed by a run before the measured ones
+    script = OFFLINE_RUN_SCRIPT.format(api_modules=API_CLIENT_MODULES)
+    args = ["", out_dir, db_file, threads_dir]
+    script = f"import sys; sys.argv = {args!r}\n{script}"
+    run_script(script, PROJECT_ROOT)
+    runs = [run_script(script, PROJECT_ROOT) for _ in range(repeat)]
+    return {
+        "case": "offline_discovery",
+        "messages": messages,
+        "first_output_seconds": round(min(r["first_output_seconds"] for r in runs), 3),
+        "wall_seconds": round(min(r["wall_seconds"] for r in runs), 3),
+        "api_client_modules": runs[0]["modules"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--senders", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for result in measure_imports(args.repeat):
+        print(json.dumps(result))
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(json.dumps(measure_offline_run(work_dir, args.messages, args.senders, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
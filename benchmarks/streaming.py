@@ -0,0 +1,98 @@
+"""
+Compares peak memory and time to first result of processing fully materialized query results
+with the streaming message pipeline.
+Each mode runs in a separate process so peak RSS values are independent of each other.
+
+Usage: python -m benchmarks.streaming [--messages 100000] [--page-size 100] [--page-latency 0.01]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from typing import Iterator, List
+
+from googleapiwrapper.gmail_domain import GmailMessage
+
+from benchmarks.synthetic import create_message
+from emailsorter.actions.inbox_discovery import InboxDiscovery
+from emailsorter.common.model import EmailMessageProcessor, NoOpEmailContentProcessor
+from emailsorter.core.constants import DEFAULT_LINE_SEP
+from emailsorter.core.source import MessageSource, PrefetchingMessageSource
+
+MODES = ["materialized", "streaming"]
+
+
+class SyntheticMessageSource(MessageSource):
+    def __init__(self, no_of_messages: int, page_size: int, page_latency: float):
+        self.no_of_messages = no_of_messages
+        self.page_size = page_size
+        self.page_latency = page_latency
+
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        for start in range(0, self.no_of_messages, self.page_size):
+            time.sleep(self.page_latency)
+            end = min(start + self.page_size, self.no_of_messages)
+            yield [create_message(i, f"sender{i % 1000}@example.com") for i in range(start, end)]
+
+
+class FirstResultRecordingProcessor(EmailMessageProcessor):
+    def __init__(self, start_time: float):
+        self.start_time = start_time
+        self.first_result_seconds = None
+        self.count = 0
+
+    def process(self, email_message: 'GmailMessage'):
+        if self.first_result_seconds is None:
+            self.first_result_seconds = time.perf_counter() - self.start_time
+        self.count += 1
+
+    def convert_to_table_rows(self):
+        return []
+
+
+def run_mode(mode: str, no_of_messages: int, page_size: int, page_latency: float):
+    source = SyntheticMessageSource(no_of_messages, page_size, page_latency)
+    start_time = time.perf_counter()
+    processor = FirstResultRecordingProcessor(start_time)
+    if mode == "materialized":
+        # Equivalent of ThreadQueryResults: all messages are kept in memory before processing starts
+        messages = [m for page in source.iter_pages() for m in page]
+    else:
+        messages = PrefetchingMessageSource(source).iter_messages()
+    InboxDiscovery.process_messages(messages, DEFAULT_LINE_SEP, [NoOpEmailContentProcessor()], [processor])
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        # Linux reports kilobytes, macOS reports bytes
+        max_rss *= 1024
+    return {
+        "mode": mode,
+        "messages": processor.count,
+        "time_to_first_result_seconds": round(processor.first_result_seconds, 4),
+        "total_seconds": round(time.perf_counter() - start_time, 4),
+        "peak_rss_mb": round(max_rss / 1024 / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--page-latency", type=float, default=0.01)
+    parser.add_argument("--mode", choices=MODES)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.messages, args.page_size, args.page_latency)))
+        return
+
+    for mode in MODES:
+        cmd = [sys.executable, "-m", "benchmarks.streaming", "--mode", mode, "--messages", str(args.messages),
+               "--page-size", str(args.page_size), "--page-latency", str(args.page_latency)]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        print(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Times the hot paths of inbox discovery on synthetic mailboxes and writes the results to a JSON file,
+so the results of two commits can be compared.
+
+Usage:
+    python -m benchmarks.suite [--scales 1000 10000 100000] [--senders 1000] [--skew 1.1] [--repeat 3]
+                               [--output benchmark_results.json] [--compare previous_results.json]
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, List, Dict, Any, Optional
+
+from benchmarks.synthetic import create_thread_query_results
+from emailsorter.actions.inbox_discovery import InboxDiscovery
+from emailsorter.common.model import GroupingEmailMessageProcessor, ProcessorResultType, NoOpEmailContentProcessor, \
+    EmailContentProcessor, create_message_processor
+from emailsorter.core.constants import DEFAULT_LINE_SEP
+from emailsorter.core.output import InboxDiscoveryResults, create_processor_representation
+from emailsorter.core.snapshot import ResultSnapshot, SNAPSHOT_EXTENSION
+from emailsorter.display.export import ExportFormat
+from emailsorter.display.table import EmailTable, TableRenderSettings
+
+DEFAULT_SCALES = [1000, 10000, 100000]
+REGRESSION_THRESHOLD = 1.1
+TOP_ROWS = 100
+
+
+class LineCountingEmailContentProcessor(EmailContentProcessor):
+    def __init__(self):
+        self.no_of_lines = 0
+
+    def process(self, email_content: 'EmailContent'):
+        self.no_of_lines += len(email_content.lines)
+
+
+@dataclass
+class BenchmarkResult:
+    case: str
+    messages: int
+    senders: int
+    skew: Optional[float]
+    repeat: int
+    min_seconds: float
+    median_seconds: float
+    us_per_message: float
+
+    @property
+    def key(self):
+        return f"{self.case}/{self.messages}"
+
+
+class BenchmarkCases:
+    """
+    Each case is a function that prepares its input (not timed) and returns the function to time.
+    """
+    def __init__(self, no_of_messages: int, no_of_senders: int, skew: Optional[float], body_lines: int):
+        self.query_result = create_thread_query_results(no_of_messages, no_of_senders, body_lines, skew=skew)
+        self.messages = self.query_result.threads.messages
+
+    def all(self) -> Dict[str, Callable[[], Callable[[], Any]]]:
+        cases = {
+            "process_gmail_results": self.process_gmail_results,
+            "process_gmail_results[reading_content]":
+                lambda: self.process_gmail_results(LineCountingEmailContentProcessor()),
+            "create_email_content": self.create_email_content,
+            "create_email_content[reading_lines]": lambda: self.create_email_content(read_lines=True),
+            "save_snapshot[detailed]": self.save_snapshot,
+        }
+        for result_type in get_result_types():
+            name = result_type.name.lower()
+            cases[f"convert_to_table_rows[{name}]"] = lambda rt=result_type: self.convert_to_table_rows(rt)
+            cases[f"table_do_sorting[{name}]"] = lambda rt=result_type: self.table_do_sorting(rt)
+            cases[f"table_render[{name}]"] = lambda rt=result_type: self.table_render(rt)
+            cases[f"table_render[{name},top={TOP_ROWS}]"] = lambda rt=result_type: self.table_render(rt, top=TOP_ROWS)
+            for export_format in ExportFormat:
+                cases[f"export[{name},{export_format.value}]"] = \
+                    lambda rt=result_type, fmt=export_format: self.export(rt, fmt)
+            cases[f"load_snapshot[{name}]"] = lambda rt=result_type: self.load_snapshot(rt)
+        return cases
+
+    def process_gmail_results(self, content_processor: EmailContentProcessor = None):
+        def run():
+            processor = GroupingEmailMessageProcessor(ProcessorResultType.DETAILED)
+            InboxDiscovery.process_gmail_results(self.query_result, DEFAULT_LINE_SEP,
+                                                 [content_processor or NoOpEmailContentProcessor()], [processor])
+        return run
+
+    def create_email_content(self, read_lines: bool = False):
+        def run():
+            for message in self.messages:
+                email_content = InboxDiscovery._create_email_content(message, DEFAULT_LINE_SEP)
+                if read_lines:
+                    email_content.lines
+        return run
+
+    def convert_to_table_rows(self, result_type: ProcessorResultType):
+        processor = self._create_processor(result_type)
+        return processor.convert_to_table_rows
+
+    def table_do_sorting(self, result_type: ProcessorResultType):
+        table, rows = self._create_table(result_type)
+        return lambda: table._do_sorting(rows)
+
+    def table_render(self, result_type: ProcessorResultType, top: int = None):
+        def run():
+            table, rows = self._create_table(result_type, top=top)
+            table.render(rows)
+        return run
+
+    def export(self, result_type: ProcessorResultType, export_format: ExportFormat):
+        representation = create_processor_representation(result_type)
+        _, rows = self._create_processor(result_type).convert_to_table_rows()
+        render_settings = TableRenderSettings(representation.get_col_styles(),
+                                              sort_by_column=representation.get_sort_column())
+        out_file = os.path.join(tempfile.gettempdir(), f"emailsorter_benchmark.{export_format.extension}")
+        export_files = {export_format: out_file}
+        return lambda: InboxDiscoveryResults.export(rows, representation.get_cols(), render_settings, export_files,
+                                                    col_types=representation.get_col_types())
+
+    def save_snapshot(self):
+        processor = self._create_processor(ProcessorResultType.DETAILED)
+        return lambda: ResultSnapshot.save(self._get_snapshot_file(), processor)
+
+    def load_snapshot(self, result_type: ProcessorResultType):
+        """
+        Loading the state of the processor from a snapshot of the detailed view, instead of processing the messages
+        """
+        ResultSnapshot.save(self._get_snapshot_file(), self._create_processor(ProcessorResultType.DETAILED))
+
+        def run():
+            with ResultSnapshot(self._get_snapshot_file()) as snapshot:
+                snapshot.to_processor(result_type)
+        return run
+
+    @staticmethod
+    def _get_snapshot_file():
+        return os.path.join(tempfile.gettempdir(), f"emailsorter_benchmark.{SNAPSHOT_EXTENSION}")
+
+    def _create_processor(self, result_type: ProcessorResultType):
+        processor = create_message_processor(result_type)
+        for message in self.messages:
+            processor.process(message)
+        return processor
+
+    def _create_table(self, result_type: ProcessorResultType, top: int = None):
+        _, rows = self._create_processor(result_type).convert_to_table_rows()
+        representation = create_processor_representation(result_type)
+        render_settings = TableRenderSettings(representation.get_col_styles(), wide_print=True,
+                                              sort_by_column=representation.get_sort_column(), top=top)
+        return EmailTable(representation.get_cols(), render_settings, col_types=representation.get_col_types()), rows
+
+
+def get_result_types() -> List[ProcessorResultType]:
+    # The trend view is skipped if NumPy is not installed
+    return [result_type for result_type in ProcessorResultType if result_type.is_available]
+
+
+def time_case(prepare: Callable[[], Callable[[], Any]], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        func = prepare()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_suite(scales: List[int], no_of_senders: int, skew: Optional[float], body_lines: int, repeat: int,
+              cases_filter: Optional[str] = None) -> List[BenchmarkResult]:
+    results = []
+    for no_of_messages in scales:
+        cases = BenchmarkCases(no_of_messages, no_of_senders, skew, body_lines)
+        for name, prepare in cases.all().items():
+            if cases_filter and cases_filter not in name:
+                continue
+            timings = time_case(prepare, repeat)
+            result = BenchmarkResult(name, no_of_messages, no_of_senders, skew, repeat,
+                                     round(min(timings), 6), round(statistics.median(timings), 6),
+                                     round(min(timings) / no_of_messages * 1_000_000, 3))
+            print(f"{result.key:<50} min: {result.min_seconds:10.4f}s  median: {result.median_seconds:10.4f}s  "
+                  f"per message: {result.us_per_message:8.3f}us", file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[BenchmarkResult], previous_file: str):
+    with open(previous_file) as f:
+        previous = {f"{r['case']}/{r['messages']}": r for r in json.load(f)["results"]}
+    print(f"Comparing with {previous_file} (min seconds, previous -> current):", file=sys.stderr)
+    for result in results:
+        if result.key not in previous:
+            continue
+        prev_seconds = previous[result.key]["min_seconds"]
+        ratio = result.min_seconds / prev_seconds if prev_seconds else float("inf")
+        marker = "  REGRESSION" if ratio > REGRESSION_THRESHOLD else ""
+        print(f"{result.key:<50} {prev_seconds:10.4f} -> {result.min_seconds:10.4f}  x{ratio:.2f}{marker}",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Number of messages")
+    parser.add_argument("--senders", type=int, default=1000)
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="Exponent of the Zipf distribution of senders, 0 distributes messages evenly")
+    parser.add_argument("--body-lines", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", help="Only run cases containing this string")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Results file of a previous run to compare with")
+    args = parser.parse_args()
+
+    # Processing logs every message on debug level, only the timings are interesting here
+    logging.disable(logging.INFO)
+    results = run_suite(args.scales, args.senders, args.skew or None, args.body_lines, args.repeat, args.cases)
+    report = {
+        "commit": get_git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [asdict(r) for r in results],
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved benchmark results to {args.output}", file=sys.stderr)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
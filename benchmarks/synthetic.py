@@ -0,0 +1,118 @@
+"""
+Generators of synthetic mailboxes for the benchmarks.
+Messages are deterministic for the same arguments so results of different commits can be compared.
+"""
+import datetime
+import itertools
+import json
+import os
+import random
+from typing import List, Iterator, Optional, Dict, Any
+
+# GmailMessage looks up its conversion context from the gmail_api module, it has to be imported
+import googleapiwrapper.gmail_api  # noqa: F401
+from googleapiwrapper.gmail_api import ThreadQueryResults
+from googleapiwrapper.gmail_common import THREAD_JSON_FILENAME
+from googleapiwrapper.gmail_domain import GmailMessage, GmailMessageBodyPart, MimeType, GmailThreads, GmailThread
+
+BASE_DATE = datetime.datetime(2023, 1, 1)
+DEFAULT_SEED = 42
+
+
+def create_message(idx: int, sender_email: str, body_lines: int = 20, thread_idx: int = None) -> GmailMessage:
+    thread_id = f"thread-{idx if thread_idx is None else thread_idx:08d}"
+    date = BASE_DATE + datetime.timedelta(minutes=idx)
+    message = GmailMessage(f"msg-{idx:08d}",
+                           thread_id,
+                           f"Subject of message {idx}",
+                           date,
+                           f"Sender <{sender_email}>",
+                           sender_email,
+                           "Me <me@example.com>",
+                           "me@example.com",
+                           date.strftime("%a, %d %b %Y %H:%M:%S +0000"),
+                           [])
+    body = "\\r\\n".join(f"Line {line} of message {idx}, some filler text to make the body realistic"
+                         for line in range(body_lines))
+    message.message_body_parts = [GmailMessageBodyPart(body, MimeType.TEXT_PLAIN.value)]
+    return message
+
+
+def create_messages(count: int, no_of_senders: int, body_lines: int = 20, skew: Optional[float] = None,
+                    seed: int = DEFAULT_SEED) -> List[GmailMessage]:
+    return list(iter_messages(count, no_of_senders, body_lines, skew=skew, seed=seed))
+
+
+def iter_messages(count: int, no_of_senders: int, body_lines: int = 20, skew: Optional[float] = None,
+                  seed: int = DEFAULT_SEED, messages_per_thread: int = 1) -> Iterator[GmailMessage]:
+    """
+    :param skew: Exponent of the Zipf distribution of the senders, None distributes the messages evenly
+    :param messages_per_thread: Number of consecutive messages put into the same thread
+    """
+    senders = iter_sender_indices(count, no_of_senders, skew, seed)
+    for idx, sender_idx in enumerate(senders):
+        yield create_message(idx, f"sender{sender_idx}@example.com", body_lines,
+                             thread_idx=idx // messages_per_thread)
+
+
+def iter_sender_indices(count: int, no_of_senders: int, skew: Optional[float] = None,
+                        seed: int = DEFAULT_SEED) -> Iterator[int]:
+    if not skew:
+        return (i % no_of_senders for i in range(count))
+    # Sender 0 is the most frequent one, like newsletters / notification senders of real inboxes
+    cum_weights = list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, no_of_senders + 1)))
+    rnd = random.Random(seed)
+    return iter(rnd.choices(range(no_of_senders), cum_weights=cum_weights, k=count))
+
+
+def create_thread_query_results(count: int, no_of_senders: int, body_lines: int = 20, skew: Optional[float] = None,
+                                seed: int = DEFAULT_SEED, messages_per_thread: int = 1) -> ThreadQueryResults:
+    threads = GmailThreads()
+    messages = iter_messages(count, no_of_senders, body_lines, skew=skew, seed=seed,
+                             messages_per_thread=messages_per_thread)
+    for thread_id, thread_messages in itertools.groupby(messages, key=lambda m: m.thread_id):
+        threads.threads.append(GmailThread(thread_id, list(thread_messages)))
+    return ThreadQueryResults(threads, None)
+
+
+def iter_thread_responses(count: int, no_of_senders: int, skew: Optional[float] = None, seed: int = DEFAULT_SEED,
+                          messages_per_thread: int = 10) -> Iterator[Dict[str, Any]]:
+    """
+    Generates threads in the format of threads.get responses of the Gmail API (METADATA format).
+    """
+    senders = list(iter_sender_indices(count, no_of_senders, skew, seed))
+    base_millis = int(BASE_DATE.timestamp() * 1000)
+    for thread_start in range(0, count, messages_per_thread):
+        thread_id = f"thread-{thread_start // messages_per_thread:08d}"
+        messages = []
+        for idx in range(thread_start, min(thread_start + messages_per_thread, count)):
+            date = BASE_DATE + datetime.timedelta(minutes=idx)
+            headers = {
+                "From": f"Sender <sender{senders[idx]}@example.com>",
+                "To": "Me <me@example.com>",
+                "Subject": f"Subject of message {idx}",
+                "Date": date.strftime("%a, %d %b %Y %H:%M:%S +0000"),
+            }
+            messages.append({
+                "id": f"msg-{idx:08d}",
+                "threadId": thread_id,
+                "labelIds": ["INBOX"],
+                "snippet": "",
+                "internalDate": str(base_millis + idx * 60000),
+                "payload": {"partId": "", "mimeType": "text/plain",
+                            "headers": [{"name": k, "value": v} for k, v in headers.items()]},
+            })
+        yield {"id": thread_id, "messages": messages}
+
+
+def write_cached_mailbox(threads_dir: str, count: int, no_of_senders: int, skew: Optional[float] = None,
+                         seed: int = DEFAULT_SEED, messages_per_thread: int = 10):
+    """
+    Writes messages to a directory in the layout of the email cache of GmailWrapper
+    (<thread ID>/thread.json, messages in the METADATA format of the Gmail API), so a MessageStore can be built.
+    """
+    for thread in iter_thread_responses(count, no_of_senders, skew, seed, messages_per_thread):
+        thread_dir = os.path.join(threads_dir, thread["id"])
+        os.makedirs(thread_dir, exist_ok=True)
+        with open(os.path.join(thread_dir, THREAD_JSON_FILENAME), "w") as f:
+            json.dump(thread, f)
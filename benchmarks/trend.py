@@ -0,0 +1,146 @@
+"""
+Compares the trend view (SenderTrendProcessor, NumPy) with a pure Python implementation updating
+the counts of the senders per time bucket in dicts for each message.
+Both get the same senders and message records, the time of processing the messages and converting the results
+to table rows is measured, and the rows of the two implementations are checked to be the same.
+
+Usage: python -m benchmarks.trend [--messages 1000000] [--senders 10000] [--skew 1.1] [--time-bucket week]
+                                  [--buckets 12] [--repeat 3]
+"""
+import argparse
+import datetime
+import json
+import math
+import time
+from collections import Counter
+from typing import List, Tuple, Optional, Dict
+
+from benchmarks.synthetic import iter_sender_indices, BASE_DATE
+from emailsorter.common.model import MessageRecord, TimeBucket, ProcessorResultType, create_message_processor
+from emailsorter.core.constants import DEFAULT_TREND_BUCKETS
+from emailsorter.core.trend import HISTOGRAM_CHARS
+
+
+class PurePythonTrendProcessor:
+    """
+    Baseline of SenderTrendProcessor: counts the messages of each sender per time bucket in a dict,
+    histograms and trends are computed sender by sender.
+    """
+    def __init__(self, time_bucket: TimeBucket = TimeBucket.WEEK, buckets: int = DEFAULT_TREND_BUCKETS):
+        self.time_bucket = time_bucket
+        self.buckets = buckets
+        self.count_by_sender: Counter = Counter()
+        self.example_by_sender: Dict[str, MessageRecord] = {}
+        self.count_by_sender_and_bucket: Counter = Counter()
+
+    def add(self, sender: Optional[str], record: MessageRecord):
+        self.count_by_sender[sender] += 1
+        self.example_by_sender[sender] = record
+        if record.date:
+            self.count_by_sender_and_bucket[(sender, self._to_bucket(record.date))] += 1
+
+    def _to_bucket(self, date: datetime.datetime) -> int:
+        if self.time_bucket == TimeBucket.DAY:
+            return date.toordinal()
+        if self.time_bucket == TimeBucket.WEEK:
+            return (date.toordinal() - 1) // 7
+        return (date.year - 1970) * 12 + date.month - 1
+
+    def convert_to_table_rows(self):
+        last_bucket = max((bucket for _, bucket in self.count_by_sender_and_bucket), default=None)
+        positions = [idx - (self.buckets - 1) / 2 for idx in range(self.buckets)]
+        variance = sum(p * p for p in positions)
+        table_rows = []
+        for sender, count in self.count_by_sender.items():
+            if last_bucket is None:
+                histogram = [0] * self.buckets
+            else:
+                histogram = [self.count_by_sender_and_bucket.get((sender, bucket), 0)
+                             for bucket in range(last_bucket - self.buckets + 1, last_bucket + 1)]
+            trend = round(sum(h * p for h, p in zip(histogram, positions)) / variance, 3) if variance else 0.0
+            peak = max(max(histogram), 1)
+            drawn = "".join(HISTOGRAM_CHARS[math.ceil(h * (len(HISTOGRAM_CHARS) - 1) / peak)] for h in histogram)
+            table_rows.append([sender, count, histogram[-1], trend, drawn])
+        grouping_for_result_table = {sender: (r.thread_id, r.msg_id, r.subject)
+                                     for sender, r in self.example_by_sender.items()}
+        return grouping_for_result_table, table_rows
+
+
+def create_records(no_of_messages: int, no_of_senders: int, skew: Optional[float],
+                   days: int) -> List[Tuple[str, MessageRecord]]:
+    """
+    :param days: Messages are spread evenly over this many days
+    """
+    minutes_per_message = days * 24 * 60 / no_of_messages
+    records = []
+    for idx, sender_idx in enumerate(iter_sender_indices(no_of_messages, no_of_senders, skew)):
+        date = BASE_DATE + datetime.timedelta(minutes=idx * minutes_per_message)
+        records.append((f"sender{sender_idx}@example.com",
+                        MessageRecord(f"thread-{idx:08d}", f"msg-{idx:08d}", f"Subject of message {idx}",
+                                      "me@example.com", date)))
+    return records
+
+
+def time_processor(processor, records: List[Tuple[str, MessageRecord]]):
+    start_time = time.perf_counter()
+    for sender, record in records:
+        processor.add(sender, record)
+    process_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    _, rows = processor.convert_to_table_rows()
+    return rows, process_seconds, time.perf_counter() - start_time
+
+
+def rows_match(rows: List[list], other_rows: List[list]) -> bool:
+    if len(rows) != len(other_rows):
+        return False
+    for row, other_row in zip(rows, other_rows):
+        if row[:3] + row[4:] != other_row[:3] + other_row[4:] or abs(row[3] - other_row[3]) > 1e-9:
+            return False
+    return True
+
+
+def run(records: List[Tuple[str, MessageRecord]], time_bucket: TimeBucket, buckets: int, repeat: int = 1):
+    results = {}
+    all_rows = {}
+    for name in ["pure_python", "numpy"]:
+        timings = []
+        for _ in range(repeat):
+            if name == "numpy":
+                processor = create_message_processor(ProcessorResultType.TREND, time_bucket=time_bucket,
+                                                     buckets=buckets)
+            else:
+                processor = PurePythonTrendProcessor(time_bucket=time_bucket, buckets=buckets)
+            rows, process_seconds, convert_seconds = time_processor(processor, records)
+            timings.append((process_seconds + convert_seconds, process_seconds, convert_seconds))
+        total, process_seconds, convert_seconds = min(timings)
+        all_rows[name] = rows
+        results[name] = {"seconds": round(total, 3),
+                         "process_seconds": round(process_seconds, 3),
+                         "convert_seconds": round(convert_seconds, 3),
+                         "us_per_message": round(total / len(records) * 1_000_000, 3)}
+    results["speedup"] = round(results["pure_python"]["seconds"] / results["numpy"]["seconds"], 2)
+    results["rows_match"] = rows_match(all_rows["numpy"], all_rows["pure_python"])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--senders", type=int, default=10000)
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="Exponent of the Zipf distribution of senders, 0 distributes messages evenly")
+    parser.add_argument("--days", type=int, default=730, help="Messages are spread over this many days")
+    parser.add_argument("--time-bucket", choices=[b.value for b in TimeBucket], default=TimeBucket.WEEK.value)
+    parser.add_argument("--buckets", type=int, default=DEFAULT_TREND_BUCKETS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = create_records(args.messages, args.senders, args.skew or None, args.days)
+    result = run(records, TimeBucket(args.time_bucket), args.buckets, repeat=args.repeat)
+    print(json.dumps({"messages": args.messages, "senders": args.senders, "time_bucket": args.time_bucket,
+                      "buckets": args.buckets, **result}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,50 @@
 import datetime
+import functools
+import itertools
 import json
 import logging
+import os
 import time
 import urllib
-from dataclasses import dataclass, field
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from functools import cached_property
 from pprint import pformat
-from typing import List, Iterable, Tuple
+from typing import List, Iterable, Tuple, Any, Dict, Callable, Iterator, Optional, TYPE_CHECKING
 
 import rich
 from dataclasses_json import dataclass_json, config
-from googleapiwrapper.gmail_api import ThreadQueryResults
 from googleapiwrapper.gmail_domain import GmailMessage, ThreadQueryFormat
 from pythoncommons.file_utils import FileUtils
 
 from emailsorter.common.model import EmailContentProcessor, \
-    GroupingEmailMessageProcessor, EmailMessageProcessor, NoOpEmailContentProcessor, ProcessorResultType, \
-    MultipleFilterResultProcessor
+    EmailMessageProcessor, NoOpEmailContentProcessor, ProcessorResultType, \
+    MultipleFilterResultProcessor, MessageSummary, TimeBucket, GroupingEngine, create_message_processor
+from emailsorter.core.checkpoint import DiscoveryCheckpointStore, DiscoveryCheckpoint
 from emailsorter.core.common import CommandType, EmailSorterConfig
-from emailsorter.core.constants import DEFAULT_LINE_SEP
+from emailsorter.core.constants import DEFAULT_LINE_SEP, DEFAULT_BATCH_SIZE, DEFAULT_QUERY_CACHE_SIZE, \
+    DEFAULT_TREND_BUCKETS, DEFAULT_TOP_SENDERS
+from emailsorter.core.context import GmailWrapperFactory
+from emailsorter.core.log import SampledLog
+from emailsorter.core.metrics import RunMetrics
+from emailsorter.core.query import LocalFilterEvaluator, normalize_query
+from emailsorter.core.query_cache import QueryResultCache
+from emailsorter.core.snapshot import ResultSnapshot, SNAPSHOT_EXTENSION, SENDERS_TABLE, diff_snapshots
+from emailsorter.core.source import MessageSource, MessageStoreSource, PrefetchingMessageSource, \
+    GmailApiMessageSource, InMemoryMessageSource, MeteredMessageSource, HISTORY_ID_FIELD
+from emailsorter.core.store import MessageStore
 
 from emailsorter.core.output import InboxDiscoveryResults, ProcessorRepresentationAbs, \
-    MultipleFilterResultProcessorRepresentation, GroupingEmailMessageProcessorRepresentation
+    MultipleFilterResultProcessorRepresentation, create_processor_representation, SnapshotDiffRepresentation
 from emailsorter.display.console import CliLogger
-from emailsorter.display.table import TableRenderSettings
+from emailsorter.display.export import ExportFormat
+from emailsorter.display.progress import ProgressDisplay
+from emailsorter.display.table import TableRenderSettings, DEFAULT_PAGE_SIZE
+
+if TYPE_CHECKING:
+    # Importing the Gmail API client is slow, offline runs don't need it
+    from googleapiwrapper.gmail_api import ThreadQueryResults, GmailWrapper
 
 LOG = logging.getLogger(__name__)
 
@@ -30,6 +52,15 @@ SUBJECT = "subject:"
 CMD = CommandType.EMAIL_SORTER
 
 CLI_LOG = CliLogger(LOG)
+# Base names of the exported result files in the session dir
+DISCOVERY_RESULTS_NAME = "discovery_results"
+FILTER_STATS_RESULTS_NAME = "filter_stats"
+SNAPSHOT_DIFF_RESULTS_NAME = "snapshot_diff"
+# Number of messages sent to a worker at once if the message source can't be split
+DEFAULT_SHARD_SIZE = 10000
+
+# GmailWrapper of the current filter query worker process, see: _init_filter_query_worker
+_WORKER_GMAIL_WRAPPER: 'GmailWrapper' = None
 
 
 @dataclass
@@ -38,7 +69,24 @@ class EmailContent:
     thread_id: str
     date: datetime.datetime
     subject: str
-    lines: Iterable[str]
+    message: GmailMessage = field(repr=False)
+    split_body_by: str = field(repr=False)
+
+    @cached_property
+    def lines(self) -> List[str]:
+        """
+        Stripped lines of all plain text parts of the message.
+        Bodies are only decoded and split when a processor reads the lines, once per message.
+        """
+        all_lines = []
+        for msg_part in self.message.get_all_plain_text_parts():
+            if not isinstance(msg_part.body_data, str):
+                LOG.warning("Skipping plain text part of message %s, its body is not a string: %s",
+                            self.msg_id, type(msg_part.body_data).__name__)
+                continue
+            all_lines.extend(line.strip() for line in msg_part.body_data.split(self.split_body_by))
+        return all_lines
+
 
 @dataclass_json
 @dataclass
@@ -54,8 +102,24 @@ class GmailFilter:
         self.gmail_link = f"https://mail.google.com/mail/u/0/#search/{encoded_expr}"
 
 
+@dataclass
+class FilterQueryResult:
+    filter: GmailFilter
+    processor_results: Any
+    seconds: float
+
+
 class InboxDiscoveryConfig:
-    def __init__(self, email_sorter_ctx, gmail_query, fetch_mode: ThreadQueryFormat, offline_mode: bool, request_limit=1000000):
+    def __init__(self, email_sorter_ctx, gmail_query, fetch_mode: ThreadQueryFormat, offline_mode: bool, request_limit=1000000,
+                 parallelism: int = 1, incremental: bool = False, local_evaluation: bool = False,
+                 top: int = None, page: int = None, page_size: int = DEFAULT_PAGE_SIZE,
+                 export_formats: List[ExportFormat] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 estimate_counts: bool = False, query_cache_ttl: float = None,
+                 query_cache_size: int = DEFAULT_QUERY_CACHE_SIZE,
+                 result_type: ProcessorResultType = ProcessorResultType.SIMPLIFIED, drill_down: str = None,
+                 save_snapshot: bool = False, time_bucket: TimeBucket = TimeBucket.WEEK,
+                 trend_buckets: int = DEFAULT_TREND_BUCKETS, grouping_engine: GroupingEngine = GroupingEngine.DICT,
+                 memory_budget: int = None, spill_dir: str = None, top_senders: int = DEFAULT_TOP_SENDERS):
         #self.session_dir = ProjectUtils.get_session_dir_under_child_dir(FileUtils.basename(output_dir))
         FileUtils.create_symlink_path_dir(
             CMD.session_link_name,
@@ -67,6 +131,53 @@ class InboxDiscoveryConfig:
         self.request_limit = request_limit
         self.offline_mode = offline_mode
         self.content_line_sep = DEFAULT_LINE_SEP
+        if parallelism < 1:
+            raise ValueError(f"Parallelism should be a positive number. Actual value: {parallelism}")
+        self.parallelism = parallelism
+        self.incremental = incremental
+        self.local_evaluation = local_evaluation
+        # Row selection of the result table
+        self.top = top
+        self.page = page
+        self.page_size = page_size
+        # All rows of the result table are written to files of these formats in the session dir
+        self.export_formats: List[ExportFormat] = export_formats or []
+        self.export_dir = email_sorter_ctx.session_dir
+        # Number of threads.get calls sent in one HTTP batch request while fetching messages from the API
+        self.batch_size = batch_size
+        # Filter statistics show the result size estimates of the Gmail API instead of counting the threads
+        self.estimate_counts = estimate_counts
+        # Results of the filter queries are reused by later runs for this many seconds, None disables the cache
+        self.query_cache_ttl = query_cache_ttl
+        self.query_cache_size = query_cache_size
+        # Rows of the result table of inbox discovery, rollup views can be limited to a domain
+        if drill_down and not result_type.is_rollup:
+            raise ValueError(f"Only the views {[t.value for t in ProcessorResultType if t.is_rollup]} "
+                             f"can be drilled down. Actual view: {result_type.value}")
+        self.result_type = result_type
+        self.drill_down = drill_down
+        # Histograms of the trend view: the number of messages per time bucket in the last buckets
+        self.time_bucket = time_bucket
+        self.trend_buckets = trend_buckets
+        # Messages of the simplified and detailed views are grouped by sender with this engine
+        self.grouping_engine = grouping_engine
+        # Messages of the detailed view are written to temporary files in the spill dir when their estimated memory
+        # reaches the memory budget (bytes), then the rows are read from the files in the order of the result table
+        if memory_budget is not None and result_type != ProcessorResultType.DETAILED:
+            raise ValueError(f"Memory budget can only be used with the view: {ProcessorResultType.DETAILED.value}. "
+                             f"Actual view: {result_type.value}")
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        # Number of senders counted by the approximate view
+        self.top_senders = top_senders
+        # Results of inbox discovery are saved to a snapshot in the session dir, to be rendered or compared later
+        self.save_snapshot = save_snapshot
+
+    def get_export_files(self, name: str) -> Dict[ExportFormat, str]:
+        return {fmt: FileUtils.join_path(self.export_dir, f"{name}.{fmt.extension}") for fmt in self.export_formats}
+
+    def get_snapshot_file(self) -> str:
+        return FileUtils.join_path(self.export_dir, f"{DISCOVERY_RESULTS_NAME}.{SNAPSHOT_EXTENSION}")
 
 
 class InboxDiscoveryHelpers:
@@ -85,113 +196,520 @@ class InboxDiscovery:
     def __init__(self, config, email_sorter_ctx):
         self.config: InboxDiscoveryConfig = config
         self.ctx = email_sorter_ctx
+        # Replaced by the metrics of the command when a command is run
+        self.metrics = RunMetrics(type(self).__name__)
+        self.progress = ProgressDisplay()
 
     def run(self):
         LOG.info(f"Starting Gmail Inbox discovery. Config: \n{str(self.config)}")
-        # TODO Add new method to gmail_wrapper that only works from cache
-        start_time = time.time()
-        query_result: ThreadQueryResults = self.ctx.gmail_wrapper.query_threads(
-            query=self.config.gmail_query,
-            limit=self.config.request_limit,
-            expect_one_message_per_thread=True,
-            format=self.config.fetch_mode,
-            show_empty_body_errors=False,
-            offline=self.config.offline_mode
-        )
-        LOG.trace(f"Received thread query result: {query_result}")
-        end_time = time.time()
-        seconds = end_time - start_time
-        LOG.info("Fetched email threads in %d seconds", seconds)
+        self.metrics = RunMetrics("discover-inbox", query=self.config.gmail_query, offline=self.config.offline_mode,
+                                  incremental=self.config.incremental, parallelism=self.config.parallelism)
+        with self.progress:
+            grouping_processor = self.discover(self.config.result_type)
+        try:
+            if self.config.save_snapshot and self.config.memory_budget is not None:
+                # The messages table of the snapshot would be built in memory
+                LOG.warning("Results are not saved to a snapshot with a memory budget")
+            elif self.config.save_snapshot:
+                with self.metrics.phase("snapshot") as span:
+                    snapshot_file = self.config.get_snapshot_file()
+                    span.bytes += ResultSnapshot.save(snapshot_file, grouping_processor,
+                                                      query=self.config.gmail_query, account=self.ctx.account_email)
+                LOG.info("Saved results to snapshot: %s", snapshot_file)
+            self._print_discovery_results(grouping_processor)
+        finally:
+            grouping_processor.close()
+        self.metrics.save(self.ctx.session_dir)
+
+    def render_snapshot(self, snapshot_file: str):
+        """
+        Prints the result table of a snapshot saved by inbox discovery, in the view of the config
+        """
+        LOG.info("Rendering snapshot: %s", snapshot_file)
+        self.metrics = RunMetrics("render-snapshot", snapshot=snapshot_file, view=self.config.result_type.value)
+        with self.metrics.phase("load") as span, ResultSnapshot(snapshot_file) as snapshot:
+            LOG.info("Snapshot metadata: %s", snapshot.metadata)
+            processor = snapshot.to_processor(self.config.result_type, **self._get_processor_options())
+            span.bytes += snapshot.size
+            span.incr("senders", snapshot.get_no_of_rows(SENDERS_TABLE))
+        self._print_discovery_results(processor)
+        self.metrics.save(self.ctx.session_dir)
+
+    def diff_snapshots(self, old_snapshot_file: str, new_snapshot_file: str):
+        """
+        Prints the change of the number of messages of each sender between two snapshots
+        """
+        LOG.info("Comparing snapshots: %s -> %s", old_snapshot_file, new_snapshot_file)
+        self.metrics = RunMetrics("diff-snapshots", old_snapshot=old_snapshot_file, new_snapshot=new_snapshot_file)
+        with self.metrics.phase("load") as span, ResultSnapshot(old_snapshot_file) as old, \
+                ResultSnapshot(new_snapshot_file) as new:
+            table_rows = diff_snapshots(old, new)
+            span.bytes += old.size + new.size
+            span.incr("rows", len(table_rows))
+        processor_repr = SnapshotDiffRepresentation()
+        InboxDiscovery.print_result_table(table_rows,
+                                          processor_repr,
+                                          sort_by_column=processor_repr.get_sort_column(),
+                                          top=self.config.top,
+                                          page=self.config.page,
+                                          page_size=self.config.page_size,
+                                          export_files=self.config.get_export_files(SNAPSHOT_DIFF_RESULTS_NAME),
+                                          metrics=self.metrics)
+        self.metrics.save(self.ctx.session_dir)
+
+    def _print_discovery_results(self, grouping_processor: EmailMessageProcessor):
+        with self.metrics.phase("convert") as span:
+            grouping_for_result_table, table_rows = grouping_processor.convert_to_table_rows()
+            span.incr("rows", len(table_rows))
+
+        processor_repr = create_processor_representation(self.config.result_type)
+        shown_rows = InboxDiscovery.print_result_table(table_rows,
+                                                       processor_repr,
+                                                       sort_by_column=processor_repr.get_sort_column(),
+                                                       top=self.config.top,
+                                                       page=self.config.page,
+                                                       page_size=self.config.page_size,
+                                                       export_files=self.config.get_export_files(DISCOVERY_RESULTS_NAME),
+                                                       metrics=self.metrics)
+        if not CLI_LOG.is_console_only():
+            # Only print the example messages of the senders that are shown in the table
+            rich.print({row[0]: grouping_for_result_table[row[0]] for row in shown_rows})
+        if hasattr(grouping_processor, "get_summary"):
+            # Totals of the approximate view
+            summary = grouping_processor.get_summary()
+            LOG.info("Summary of the results: %s", summary)
+            if not CLI_LOG.is_console_only():
+                rich.print(summary)
+
+    def discover(self, result_type: ProcessorResultType, source: MessageSource = None) -> EmailMessageProcessor:
+        if not source:
+            source = self._create_message_source()
+        fetch_span = self.metrics.get_span("fetch")
+        process_span = self.metrics.get_span("process")
+        # Counting is only worth it if the progress is displayed
+        total = source.count_messages() if self.progress.enabled and not self.config.incremental else None
+        task = self.progress.add_task("Processing messages", total=total)
+        source = MeteredMessageSource(source, fetch_span,
+                                      on_page=lambda span: self.progress.update_from_span(task, span, "messages"))
+        if self.config.incremental:
+            messages = self._load_messages_incrementally(source)
+        else:
+            messages = source.iter_messages()
+
+        if self.config.parallelism > 1:
+            if self.config.incremental:
+                shards = InboxDiscovery._create_in_memory_shards(messages)
+            else:
+                shards = InboxDiscovery._split_source(source, self.config.parallelism)
+            factory = self._get_message_processor_factory(result_type)
+
+            def on_shard_processed(no_of_messages: int):
+                process_span.incr("shards")
+                process_span.incr("messages", no_of_messages)
+                self.progress.update(task, completed=process_span.counts["messages"],
+                                     details=f"shards: {process_span.counts['shards']}")
+
+            with self.metrics.phase("process"):
+                processors = self.process_message_shards(shards,
+                                                         split_body_by=self.config.content_line_sep,
+                                                         email_content_processors=[NoOpEmailContentProcessor()],
+                                                         email_message_processor_factories=[factory],
+                                                         parallelism=self.config.parallelism,
+                                                         on_shard_processed=on_shard_processed)
+            self.progress.finish(task)
+            return processors[0]
+
+        grouping_processor = self._get_message_processor_factory(result_type)()
+        fetch_seconds_before = fetch_span.seconds
+        try:
+            with self.metrics.phase("process"):
+                no_of_messages = self.process_messages(messages,
+                                                       split_body_by=self.config.content_line_sep,
+                                                       email_content_processors=[NoOpEmailContentProcessor()],
+                                                       email_message_processors=[grouping_processor])
+        except BaseException:
+            # E.g. deletes the messages spilled to disk
+            grouping_processor.close()
+            raise
+        # Pages are fetched while the messages are processed, the time spent waiting for them belongs to fetching
+        process_span.add_seconds(-(fetch_span.seconds - fetch_seconds_before))
+        process_span.incr("messages", no_of_messages)
+        self.progress.finish(task)
+        return grouping_processor
+
+    def _get_message_processor_factory(self, result_type: ProcessorResultType) -> Callable[[], EmailMessageProcessor]:
+        # The factory is sent to the worker processes of parallel processing
+        return functools.partial(create_message_processor, result_type, **self._get_processor_options())
+
+    def _get_processor_options(self) -> Dict[str, Any]:
+        return {"drill_down": self.config.drill_down,
+                "time_bucket": self.config.time_bucket,
+                "buckets": self.config.trend_buckets,
+                "engine": self.config.grouping_engine,
+                "memory_budget": self.config.memory_budget,
+                "spill_dir": self.config.spill_dir,
+                "top_senders": self.config.top_senders}
 
-        result_type = ProcessorResultType.SIMPLIFIED
-        grouping_processor = GroupingEmailMessageProcessor(result_type)
-        self.process_gmail_results(query_result,
-                                   split_body_by=self.config.content_line_sep,
-                                   email_content_processors=[NoOpEmailContentProcessor()],
-                                   email_message_processors=[grouping_processor])
-        grouping_for_result_table, table_rows = grouping_processor.convert_to_table_rows()
+    @staticmethod
+    def _split_source(source: MessageSource, no_of_shards: int) -> Iterable[MessageSource]:
+        try:
+            # Workers read their shards themselves, e.g. from the local message store
+            return source.split(no_of_shards)
+        except NotImplementedError:
+            return InboxDiscovery._create_in_memory_shards(source.iter_messages())
 
-        # TODO order table rows by 'no_of_messages_from_sender'
-        rich.print(grouping_for_result_table)
-        InboxDiscovery.print_result_table(table_rows, GroupingEmailMessageProcessorRepresentation(result_type))
+    @staticmethod
+    def _create_in_memory_shards(messages: Iterable[GmailMessage],
+                                 shard_size: int = DEFAULT_SHARD_SIZE) -> Iterator[MessageSource]:
+        # Bodies are not needed by the message processors, summaries are cheaper to send to the workers
+        summaries = (MessageSummary.from_message(m) for m in messages)
+        while True:
+            shard = list(itertools.islice(summaries, shard_size))
+            if not shard:
+                return
+            yield InMemoryMessageSource(shard)
+
+    def _load_messages_incrementally(self, source: MessageSource) -> Iterable[MessageSummary]:
+        """
+        Only fetches threads that are new or changed since the checkpoint of the previous run,
+        drops threads that are not matching the query anymore and saves the updated checkpoint.
+        Processors are fed with the summaries of all messages of the checkpoint,
+        so the results are the same as if all messages were fetched again.
+        """
+        checkpoint_store = DiscoveryCheckpointStore(self.ctx.output_dir)
+        checkpoint = checkpoint_store.load(self.config.gmail_query)
+        if not checkpoint:
+            checkpoint = DiscoveryCheckpoint(self.config.gmail_query)
+
+        current_versions: Dict[str, str] = source.list_thread_versions()
+        known_versions: Dict[str, str] = checkpoint.thread_versions
+        changed = [thread_id for thread_id, version in current_versions.items() if known_versions.get(thread_id) != version]
+        removed = [thread_id for thread_id in known_versions.keys() if thread_id not in current_versions]
+        LOG.info("Incremental discovery: %d threads matching the query, %d new or changed, %d removed",
+                 len(current_versions), len(changed), len(removed))
+
+        for thread_id in removed:
+            checkpoint.messages_by_thread.pop(thread_id, None)
+        for thread_id in changed:
+            checkpoint.messages_by_thread[thread_id] = []
+        for page in source.iter_pages_for_threads(changed):
+            for message in page:
+                checkpoint.messages_by_thread.setdefault(message.thread_id, []).append(MessageSummary.from_message(message))
+        checkpoint.thread_versions = current_versions
+        checkpoint_store.save(checkpoint)
+        return checkpoint.iter_messages()
 
     def create_filter_stats(self, filters_file: str):
         start_time = time.time()
         LOG.info(f"Starting creating filter statistics. Config: \n{str(self.config)}")
+        self.metrics = RunMetrics("filter-stats", offline=self.config.offline_mode,
+                                  local_evaluation=self.config.local_evaluation, parallelism=self.config.parallelism)
         filters: List[GmailFilter] = InboxDiscoveryHelpers.convert_to_filter_objs(filters_file)
         LOG.debug("Parsed filters: %s", filters)
 
-        result_processor = MultipleFilterResultProcessor()
-        for filter in filters:
-            LOG.info("Executing gmail query for filter: %s", filter)
-            query_result: ThreadQueryResults = self.ctx.gmail_wrapper.query_threads(
-                query=filter.filter_expression,
-                limit=self.config.request_limit,
-                expect_one_message_per_thread=True,
-                format=self.config.fetch_mode,
-                show_empty_body_errors=False,
-                offline=self.config.offline_mode,
-                load_messages=False
-            )
-            LOG.debug(f"Received thread query result: {query_result}")
-            result_processor.add_result(filter, query_result.processor_results)
-
+        with self.progress:
+            result_processor = self.query_filters(filters)
 
         end_time = time.time()
         seconds = end_time - start_time
         LOG.info("Fetched all email filters in %d seconds", seconds)
 
         table_rows = result_processor.convert_to_table_rows()
-        InboxDiscovery.print_result_table(table_rows, MultipleFilterResultProcessorRepresentation(), sort_by_column=None)
+        InboxDiscovery.print_result_table(table_rows, MultipleFilterResultProcessorRepresentation(), sort_by_column=None,
+                                          export_files=self.config.get_export_files(FILTER_STATS_RESULTS_NAME),
+                                          metrics=self.metrics)
+        self.metrics.save(self.ctx.session_dir)
+
+    def _create_message_source(self) -> MessageSource:
+        if self.config.offline_mode:
+            store: MessageStore = self.ctx.message_store
+            store.refresh()
+            return MessageStoreSource(store, self.config.gmail_query)
+        # Pages are fetched in the background while the messages of the previous page are processed
+        return PrefetchingMessageSource(GmailApiMessageSource(self.ctx.gmail_wrapper,
+                                                              query=self.config.gmail_query,
+                                                              fetch_mode=self.config.fetch_mode,
+                                                              limit=self.config.request_limit,
+                                                              batch_size=self.config.batch_size))
+
+    def query_filters(self, filters: List[GmailFilter]) -> MultipleFilterResultProcessor:
+        results: List[FilterQueryResult] = []
+        remaining_filters = filters
+        if self.config.offline_mode or self.config.local_evaluation:
+            with self.metrics.phase("local_evaluation") as span:
+                results, remaining_filters = self._evaluate_filters_locally(filters)
+                span.incr("filters", len(results))
+            if self.config.offline_mode:
+                for filter in remaining_filters:
+                    LOG.warning("Skipping filter '%s' as it can't be answered in offline mode", filter.description)
+                remaining_filters = []
+
+        query_cache = self._open_query_cache() if remaining_filters else None
+        history_id = None
+        if query_cache:
+            with self.metrics.phase("query_cache") as span:
+                history_id = self._get_history_id()
+                cached_results, remaining_filters = self._get_cached_results(query_cache, remaining_filters, history_id)
+                results.extend(cached_results)
+                span.incr("filters", len(cached_results))
+
+        # Filters with equivalent expressions are only queried once
+        filters_by_query: Dict[str, List[GmailFilter]] = {}
+        for f in remaining_filters:
+            filters_by_query.setdefault(normalize_query(f.filter_expression), []).append(f)
+        unique_filters = [filters[0] for filters in filters_by_query.values()]
+        if self.config.parallelism > 1 and len(unique_filters) > 1:
+            query_results = self._query_filters_concurrently(unique_filters)
+        else:
+            query_results = (InboxDiscovery._execute_filter_query(self.ctx.gmail_wrapper, self.config, f)
+                             for f in unique_filters)
+        task = self.progress.add_task("Querying filters", total=len(unique_filters))
+        with self.metrics.phase("query") as span:
+            # Results of the workers hold copies of the filters, map them back to the original objects
+            for r, same_query_filters in zip(query_results, filters_by_query.values()):
+                for f in same_query_filters:
+                    results.append(FilterQueryResult(f, r.processor_results, r.seconds))
+                if query_cache:
+                    query_cache.put(r.filter.filter_expression, r.processor_results["count"],
+                                    r.processor_results["exact"], history_id, limit=self.config.request_limit,
+                                    thread_ids=r.processor_results.get("thread_ids"))
+                span.incr("filters", len(same_query_filters))
+                span.incr("queries")
+                self.progress.update(task, completed=span.counts["queries"])
+        if query_cache:
+            self._record_query_cache_stats(query_cache)
+            query_cache.close()
+
+        # Keep the order of the filters file in the table rows
+        filter_order = {id(f): idx for idx, f in enumerate(filters)}
+        results.sort(key=lambda r: filter_order[id(r.filter)])
+        result_processor = MultipleFilterResultProcessor()
+        for result in results:
+            LOG.info("Query for filter '%s' took %.2f seconds", result.filter.description, result.seconds)
+            result_processor.add_result(result.filter, result.processor_results, seconds=result.seconds)
+
+        slowest = sorted(results, key=lambda r: r.seconds, reverse=True)[:5]
+        LOG.info("Slowest filter queries: %s", [(r.filter.description, round(r.seconds, 2)) for r in slowest])
+        return result_processor
+
+    def _evaluate_filters_locally(self, filters: List[GmailFilter]) -> Tuple[List[FilterQueryResult], List[GmailFilter]]:
+        """
+        Evaluates all supported filters with a single pass over the messages of the local message store.
+        :return: Results of the supported filters and the filters that can't be evaluated locally
+        """
+        store: MessageStore = self.ctx.message_store
+        store.refresh()
+        evaluator = LocalFilterEvaluator(f.filter_expression for f in filters)
+        for expression, e in evaluator.unsupported:
+            LOG.info("Filter expression can't be evaluated locally: '%s'. Reason: %s", expression, e)
+
+        start_time = time.perf_counter()
+        counts = evaluator.count_threads(store.iter_message_metadata())
+        seconds = time.perf_counter() - start_time
+        LOG.info("Evaluated %d filter expressions locally in %.2f seconds", len(counts), seconds)
+
+        supported = [f for f in filters if f.filter_expression in counts]
+        unsupported = [f for f in filters if f.filter_expression not in counts]
+        # There is one pass for all the filters, the time is distributed evenly
+        seconds_per_filter = seconds / len(supported) if supported else 0.0
+        results = [FilterQueryResult(f, {"count": counts[f.filter_expression]}, seconds_per_filter) for f in supported]
+        return results, unsupported
+
+    def _open_query_cache(self) -> Optional[QueryResultCache]:
+        if not self.config.query_cache_ttl:
+            return None
+        return QueryResultCache.for_account(self.ctx.email_cache_dir, self.ctx.account_email,
+                                            ttl=self.config.query_cache_ttl, max_entries=self.config.query_cache_size)
+
+    def _get_history_id(self) -> Optional[str]:
+        # The history ID of the mailbox advances with every change of the mailbox
+        profile = self.ctx.gmail_wrapper.fetcher.users_svc.getProfile(userId="me").execute()
+        return profile.get(HISTORY_ID_FIELD)
+
+    def _get_cached_results(self, query_cache: QueryResultCache, filters: List[GmailFilter],
+                            history_id: Optional[str]) -> Tuple[List[FilterQueryResult], List[GmailFilter]]:
+        """
+        :return: Results of the filters found in the query cache and the filters that need to be queried
+        """
+        results = []
+        remaining_filters = []
+        for f in filters:
+            start_time = time.perf_counter()
+            cached = query_cache.get(f.filter_expression, history_id, limit=self.config.request_limit,
+                                     exact=not self.config.estimate_counts)
+            if cached:
+                processor_results = {"count": cached.count, "exact": cached.exact, "thread_ids": cached.thread_ids}
+                results.append(FilterQueryResult(f, processor_results, time.perf_counter() - start_time))
+            else:
+                remaining_filters.append(f)
+        return results, remaining_filters
+
+    def _record_query_cache_stats(self, query_cache: QueryResultCache):
+        stats = query_cache.stats
+        span = self.metrics.get_span("query_cache")
+        for counter, value in asdict(stats).items():
+            span.incr(counter, value)
+        LOG.info("Query cache: %d hits, %d misses (%d expired, %d invalidated by mailbox changes), %d evicted. "
+                 "File: %s", stats.hits, stats.misses, stats.expired, stats.invalidated, stats.evicted,
+                 query_cache.db_file)
+
+    def _query_filters_concurrently(self, filters: List[GmailFilter]) -> Iterator[FilterQueryResult]:
+        # GmailWrapper is not thread-safe (it keeps its conversion context in a module-level variable
+        # and the underlying HTTP client can't be shared), so each worker process creates its own wrapper.
+        max_workers = min(self.config.parallelism, len(filters))
+        # The quota of the account is shared by the workers
+        wrapper_factory: GmailWrapperFactory = self.ctx.gmail_wrapper_factory.share_quota(max_workers)
+        LOG.info("Executing %d filter queries with %d workers", len(filters), max_workers)
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_filter_query_worker,
+                                 initargs=(wrapper_factory,)) as executor:
+            configs = [self.config] * len(filters)
+            yield from executor.map(_execute_filter_query_in_worker, configs, filters)
 
+    @staticmethod
+    def _execute_filter_query(gmail_wrapper: 'GmailWrapper', config: InboxDiscoveryConfig,
+                              filter: GmailFilter) -> FilterQueryResult:
+        LOG.info("Executing gmail query for filter: %s", filter)
+        start_time = time.perf_counter()
+        # Only the number of matching threads is needed, the threads are not loaded
+        source = GmailApiMessageSource(gmail_wrapper, query=filter.filter_expression, fetch_mode=config.fetch_mode,
+                                       limit=config.request_limit)
+        thread_count = source.count_threads(estimate=config.estimate_counts)
+        seconds = time.perf_counter() - start_time
+        LOG.debug("Received thread count of filter '%s': %s", filter.description, thread_count)
+        processor_results = {"count": thread_count.count, "exact": thread_count.exact,
+                             "thread_ids": thread_count.thread_ids}
+        return FilterQueryResult(filter, processor_results, seconds)
 
     @staticmethod
     def process_gmail_results(
-        query_result: ThreadQueryResults,
+        query_result: 'ThreadQueryResults',
         split_body_by: str,
         email_content_processors: Iterable[EmailContentProcessor],
         email_message_processors: Iterable[EmailMessageProcessor],
     ):
-        if not email_content_processors:
-            email_content_processors = []
+        InboxDiscovery.process_messages(query_result.threads.messages,
+                                        split_body_by,
+                                        email_content_processors,
+                                        email_message_processors)
 
+    @staticmethod
+    def process_messages(
+        messages: Iterable[GmailMessage],
+        split_body_by: str,
+        email_content_processors: Iterable[EmailContentProcessor],
+        email_message_processors: Iterable[EmailMessageProcessor],
+    ) -> int:
+        """
+        :return: Number of processed messages
+        """
+        # Processors that declared they don't need the email content are not invoked at all,
+        # if none of them needs it, EmailContent objects are not created either
+        email_content_processors = [p for p in email_content_processors or [] if p.needs_content]
+
+        # Formatting a record for each message would cost more than processing it, see: SampledLog
+        message_log = SampledLog(LOG, logging.DEBUG)
+        log_message = message_log.log if message_log.enabled else None
+
+        start_time = time.perf_counter()
+        no_of_messages = 0
         skipped_emails: List[EmailContent] = []
-        for message in query_result.threads.messages:
-            email_content = InboxDiscovery._create_email_content(message, split_body_by)
+        for message in messages:
+            if no_of_messages == 0:
+                LOG.info("Received first message after %.2f seconds", time.perf_counter() - start_time)
+            no_of_messages += 1
             # TODO print date
-            LOG.debug("Processing message: %s", email_content.subject)
+            if log_message:
+                log_message("Processing message: %s", message.subject)
 
-            # Email content processor is invoked with original lines from email (except stripping)
-            for p in email_content_processors:
-                p.process(email_content)
+            if email_content_processors:
+                email_content = InboxDiscovery._create_email_content(message, split_body_by)
+                # Email content processor is invoked with original lines from email (except stripping)
+                for p in email_content_processors:
+                    p.process(email_content)
 
             for p in email_message_processors:
                 p.process(message)
 
+        LOG.info("Fetched and processed %d messages in %.2f seconds", no_of_messages, time.perf_counter() - start_time)
+        if message_log.no_of_suppressed:
+            LOG.debug("Logged %d of %d processed messages", message_log.no_of_logged, message_log.no_of_calls)
         if skipped_emails:
             LOG.warning(
                 "The following emails were skipped: %s",
                 pformat(skipped_emails),
             )
+        return no_of_messages
 
     @staticmethod
-    def _create_email_content(message: GmailMessage, split_body_by: str):
-        # Extract all lines first (from all message parts)
-        all_lines = []
-        for msg_part in message.get_all_plain_text_parts():
-            if not isinstance(msg_part.body_data, str):
-                print("INSTANCE IS WRONG: " + str(msg_part.body_data))
-                continue
-            lines = msg_part.body_data.split(split_body_by)
-            lines = list(map(lambda line: line.strip(), lines))
-            all_lines.extend(lines)
+    def process_message_shards(
+        shards: Iterable[MessageSource],
+        split_body_by: str,
+        email_content_processors: Iterable[EmailContentProcessor],
+        email_message_processor_factories: List[Callable[[], EmailMessageProcessor]],
+        parallelism: int,
+        on_shard_processed: Callable[[int], None] = None,
+    ) -> List[EmailMessageProcessor]:
+        """
+        Processes the shards in worker processes, each with its own message processors created by the factories.
+        Partial results are merged in the order of the shards, so the returned processors have the same state
+        as if all messages were processed with process_messages.
+        The factories have to be picklable, e.g. classes or functools.partial objects.
+        If processing fails, the processors and the partial results of the shards that were not merged are closed.
+        :param on_shard_processed: Invoked with the number of messages of each shard after it was merged
+        """
+        if any(p.needs_content for p in email_content_processors or []):
+            raise ValueError("Email content processors can't be used with parallel processing")
+        processors = [factory() for factory in email_message_processor_factories]
+        for p in processors:
+            if not p.supports_merge():
+                raise ValueError(f"Processor doesn't support parallel processing: {type(p).__name__}")
+
+        def merge(shard_result: Tuple[List[EmailMessageProcessor], int]):
+            partial_processors, no_of_messages = shard_result
+            try:
+                for processor, partial_processor in zip(processors, partial_processors):
+                    processor.merge(partial_processor)
+            except BaseException:
+                _close_processors(partial_processors)
+                raise
+            if on_shard_processed:
+                on_shard_processed(no_of_messages)
+
+        start_time = time.perf_counter()
+        no_of_shards = 0
+        # Limit the number of shards in flight, as shards of in-memory sources hold their messages
+        pending = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=parallelism) as executor:
+                for shard in shards:
+                    no_of_shards += 1
+                    pending.append(executor.submit(_process_message_shard, shard, split_body_by,
+                                                   email_message_processor_factories))
+                    if len(pending) >= 2 * parallelism:
+                        merge(pending.popleft().result())
+                while pending:
+                    merge(pending.popleft().result())
+        except BaseException:
+            # The executor waited for the shards in flight, their results are not merged
+            for future in pending:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    _close_processors(future.result()[0])
+            _close_processors(processors)
+            raise
+        LOG.info("Processed %d shards with %d workers in %.2f seconds",
+                 no_of_shards, parallelism, time.perf_counter() - start_time)
+        return processors
 
+    @staticmethod
+    def _create_email_content(message: GmailMessage, split_body_by: str):
         return EmailContent(
             message.msg_id,
             message.thread_id,
             message.date,
             message.subject,
-            all_lines,
+            message,
+            split_body_by,
         )
 
     @staticmethod
@@ -203,18 +721,58 @@ class InboxDiscovery:
 
     @classmethod
     def print_result_table(cls, rows, processor_repr: ProcessorRepresentationAbs,
-                           sort_by_column="Count from this sender"):
-        # TODO implement console mode --> Just print this and do not log anything to console other than the table
-        # TODO add progressbar while loading emails
-
-        CLI_LOG.record_console()
+                           sort_by_column="Count from this sender", top: int = None, page: int = None,
+                           page_size: int = DEFAULT_PAGE_SIZE, export_files: Dict[ExportFormat, str] = None,
+                           metrics: RunMetrics = None):
+        """
+        :param export_files: All rows are exported to these files, in the order of the table
+        :param metrics: The render and export phases are recorded to these metrics
+        :return: The rows shown in the table, in the order of the table
+        """
+        if not metrics:
+            metrics = RunMetrics("print-result-table")
         cols = processor_repr.get_cols()
         col_styles = processor_repr.get_col_styles()
-        render_settings = TableRenderSettings(col_styles, wide_print=True, show_lines=False, sort_by_column=sort_by_column)
-        InboxDiscoveryResults.print(rows, cols, render_settings)
-        out_file = "/tmp/rich_table_output.html"
-        files = CLI_LOG.export_to_html(out_file)
-        CLI_LOG.info("Saved console output to HTML files: %s", files)
-
-        LOG.info("Execute: ")
-        LOG.info("open " + out_file)
+        col_types = processor_repr.get_col_types()
+        render_settings = TableRenderSettings(col_styles, wide_print=True, show_lines=False, sort_by_column=sort_by_column,
+                                              top=top, page=page, page_size=page_size)
+        with metrics.phase("render") as span:
+            shown_rows = InboxDiscoveryResults.print(rows, cols, render_settings, col_types=col_types)
+            span.incr("rows", len(rows))
+            span.incr("shown_rows", len(shown_rows))
+        if export_files:
+            with metrics.phase("export") as span:
+                files = InboxDiscoveryResults.export(rows, cols, render_settings, export_files, col_types=col_types)
+                span.incr("rows", len(rows) * len(files))
+                span.incr("files", len(files))
+                span.bytes += sum(os.path.getsize(f) for f in files)
+            LOG.info("Exported result table to files: %s", files)
+        return shown_rows
+
+
+def _init_filter_query_worker(wrapper_factory: GmailWrapperFactory):
+    global _WORKER_GMAIL_WRAPPER
+    _WORKER_GMAIL_WRAPPER = wrapper_factory.create()
+
+
+def _execute_filter_query_in_worker(config: InboxDiscoveryConfig, filter: GmailFilter) -> FilterQueryResult:
+    return InboxDiscovery._execute_filter_query(_WORKER_GMAIL_WRAPPER, config, filter)
+
+
+def _process_message_shard(shard: MessageSource, split_body_by: str,
+                           email_message_processor_factories: List[Callable[[], EmailMessageProcessor]]):
+    processors = [factory() for factory in email_message_processor_factories]
+    try:
+        no_of_messages = InboxDiscovery.process_messages(shard.iter_messages(), split_body_by, [], processors)
+    except BaseException:
+        _close_processors(processors)
+        raise
+    return processors, no_of_messages
+
+
+def _close_processors(processors: Iterable[EmailMessageProcessor]):
+    for processor in processors:
+        try:
+            processor.close()
+        except Exception:
+            LOG.exception("Failed to close processor: %s", type(processor).__name__)
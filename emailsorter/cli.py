@@ -1,22 +1,32 @@
 import logging
 import time
+from typing import Tuple
 
 import click
 from googleapiwrapper.gmail_domain import ThreadQueryFormat
 from pythoncommons.constants import ExecutionMode
-from rich import print as rich_print, box
-from rich.table import Table
 
+from emailsorter.common.model import ProcessorResultType, TimeBucket, GroupingEngine
+from emailsorter.core.constants import DEFAULT_PAGE_SIZE, DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE, \
+    DEFAULT_QUERY_CACHE_TTL, DEFAULT_QUERY_CACHE_SIZE, DEFAULT_TREND_BUCKETS, DEFAULT_TOP_SENDERS
 from emailsorter.core.error import EmailSorterException
-from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
 from emailsorter.core.context import EmailSorterContext
 from emailsorter.core.handler import MainCommandHandler
+from emailsorter.core.log import SampledLog
+from emailsorter.core.scheduler import RequestSchedulerConfig, DEFAULT_QUOTA_UNITS_PER_SECOND
+from emailsorter.display.export import ExportFormat
 from initializer import Initializer
 
 GMAIL_QUERY_INBOX = "label:inbox"
 GMAIL_QUERY_LABEL_EXTERNAL = "label:external"
+EXPORT_FORMAT_CHOICE = click.Choice([f.value for f in ExportFormat], case_sensitive=False)
+VIEW_CHOICE = click.Choice([t.value for t in ProcessorResultType], case_sensitive=False)
+SNAPSHOT_FILE = click.Path(exists=True, dir_okay=False)
+TIME_BUCKET_CHOICE = click.Choice([b.value for b in TimeBucket], case_sensitive=False)
+ENGINE_CHOICE = click.Choice([e.value for e in GroupingEngine], case_sensitive=False)
 
 LOG = logging.getLogger(__name__)
+# Modules of the commands are imported by the commands, so the CLI starts fast and only loads what the command needs
 
 
 @click.group()
@@ -24,19 +34,37 @@ LOG = logging.getLogger(__name__)
 @click.option('-d', '--debug', is_flag=True, help='turn on DEBUG level logging')
 @click.option('-t', '--trace', is_flag=True, help='turn on TRACE level logging')
 @click.option('--no-cache', is_flag=True, help='Disable email caching')
+@click.option('-c', '--console-only', is_flag=True,
+              help='Only print the result table to stdout, e.g. to pipe it into other tools. '
+                   'Logs are only written to the log files, warnings and errors to stderr')
+@click.option('--queue-logging', is_flag=True,
+              help='Format and write log records in a background thread instead of the processing thread')
+@click.option('--log-every-message', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Only log every N-th processed message on DEBUG level')
+@click.option('--max-message-logs-per-second', type=click.IntRange(min=1),
+              help='Log at most this many processed messages per second on DEBUG level')
+@click.option('--quota-units-per-second', type=click.FloatRange(min=0), default=DEFAULT_QUOTA_UNITS_PER_SECOND,
+              show_default=True, help='Gmail API quota units spent per second, 0 disables pacing the requests')
 @click.pass_context
-def cli(ctx, account_email, debug: bool, trace: bool, no_cache: bool):
+def cli(ctx, account_email, debug: bool, trace: bool, no_cache: bool, console_only: bool, queue_logging: bool,
+        log_every_message: int, max_message_logs_per_second: int, quota_units_per_second: float):
     if ctx.invoked_subcommand == "usage":
         return
 
     level = logging.DEBUG if debug else logging.INFO
-    Initializer.configure_logging(debug, trace)
+    Initializer.configure_logging(debug, trace, console_only=console_only, queue_logging=queue_logging)
+    SampledLog.default_every = log_every_message
+    SampledLog.default_max_per_second = max_message_logs_per_second
 
     ctx.ensure_object(dict)
     ctx.obj['loglevel'] = level
 
     LOG.info("Invoked command {}".format(ctx.invoked_subcommand))
-    context = EmailSorterContext(use_cache=not no_cache, account_email=account_email)
+    scheduler_config = None
+    if quota_units_per_second:
+        scheduler_config = RequestSchedulerConfig(units_per_second=quota_units_per_second)
+    context = EmailSorterContext(use_cache=not no_cache, account_email=account_email,
+                                 scheduler_config=scheduler_config)
     ctx.obj['handler'] = MainCommandHandler(context)
 
 
@@ -46,6 +74,9 @@ def usage(no_wrap: bool = False):
     """
     Prints the aggregated usage of Email sorter
     """
+    from rich import print as rich_print, box
+    from rich.table import Table
+
     table = Table(title="Email Sorter CLI", show_lines=True, box=box.SQUARE)
     table.add_column("Command")
     table.add_column("Description")
@@ -74,16 +105,64 @@ def usage(no_wrap: bool = False):
 
 
 @cli.command()
-@click.option('-o', '--offline', is_flag=True, help='Offline mode, only work from cache')
+@click.option('-o', '--offline', is_flag=True, help='Offline mode, only work from the local message store')
 @click.option('-mq', '--main-query', help='Main query to filter gmail results off. Default is: All items from Gmail inbox')
 @click.option('--fetch-mode', required=False, type=click.Choice([ThreadQueryFormat.FULL.value, ThreadQueryFormat.METADATA.value], case_sensitive=True), help='Fetch mode for querying threads and messages')
+@click.option('-i', '--incremental', is_flag=True, help='Only fetch threads that changed since the previous incremental run')
+@click.option('-p', '--parallelism', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of worker processes processing the messages')
+@click.option('--top', type=click.IntRange(min=1), help='Only show the top N rows of the result table')
+@click.option('--page', type=click.IntRange(min=1), help='Only show this page of the result table (starting from 1)')
+@click.option('--page-size', type=click.IntRange(min=1), default=DEFAULT_PAGE_SIZE, show_default=True,
+              help='Number of rows of a page of the result table, used with --page')
+@click.option('--export', 'export_formats', multiple=True, type=EXPORT_FORMAT_CHOICE,
+              help='Export all rows of the result table to a file of this format in the session dir, can be repeated')
+@click.option('--batch-size', type=click.IntRange(min=1, max=MAX_BATCH_SIZE), default=DEFAULT_BATCH_SIZE,
+              show_default=True, help='Number of threads fetched with one HTTP batch request, 1 disables batching')
+@click.option('--view', type=VIEW_CHOICE, default=ProcessorResultType.SIMPLIFIED.value, show_default=True,
+              help='Rows of the result table: messages per sender, or per sender, domain or organization '
+                   'of the sender with the sender, domain and organization views. '
+                   'The approximate view estimates the counts of the top senders in constant memory')
+@click.option('--drill-down', metavar='DOMAIN',
+              help='Only show the senders, domains or organizations of this domain and its subdomains')
+@click.option('--time-bucket', type=TIME_BUCKET_CHOICE, default=TimeBucket.WEEK.value, show_default=True,
+              help='Time bucket of the histograms of the trend view')
+@click.option('--buckets', type=click.IntRange(min=1), default=DEFAULT_TREND_BUCKETS, show_default=True,
+              help='Number of the last time buckets shown by the trend view, the trend is computed over them')
+@click.option('--engine', type=ENGINE_CHOICE, default=GroupingEngine.DICT.value, show_default=True,
+              help='Engine of grouping the messages by sender for the simplified and detailed views. '
+                   'The columnar engine groups them with NumPy after collecting them')
+@click.option('--memory-budget', type=click.IntRange(min=1), metavar='MB',
+              help='Only keep this many megabytes of messages of the detailed view in memory, more messages are '
+                   'written to temporary files and the result table is read from them. Snapshots are not saved')
+@click.option('--spill-dir', type=click.Path(exists=True, file_okay=False, writable=True),
+              help='Directory of the temporary files of --memory-budget. Default: the temp dir of the system')
+@click.option('--top-senders', type=click.IntRange(min=1), default=DEFAULT_TOP_SENDERS, show_default=True,
+              help='Number of senders counted by the approximate view. Counts are estimated in constant memory, '
+                   'senders with more than 1/N of the messages are always counted')
+@click.option('--snapshot', is_flag=True,
+              help='Save the results to a snapshot in the session dir, see render-snapshot and diff-snapshots. '
+                   'Snapshots of the detailed view can be rendered in every view, the others in every view but the '
+                   'detailed one')
 @click.pass_context
-def discover_inbox(ctx, offline, main_query: str, fetch_mode: str):
+def discover_inbox(ctx, offline, main_query: str, fetch_mode: str, incremental: bool, parallelism: int,
+                   top: int, page: int, page_size: int, export_formats: Tuple[str], batch_size: int, view: str,
+                   drill_down: str, time_bucket: str, buckets: int, engine: str, memory_budget: int, spill_dir: str,
+                   top_senders: int, snapshot: bool):
     """
     Discovers Inbox
     """
+    from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+
     handler: MainCommandHandler = ctx.obj['handler']
     email_sorter_ctx = handler.ctx
+    result_type = _get_result_type(view, drill_down, top, page)
+    grouping_engine = GroupingEngine(engine.lower())
+    if not grouping_engine.is_available:
+        raise click.UsageError(f"The {grouping_engine.value} engine requires NumPy, install it with: pip install numpy")
+    if memory_budget and (result_type != ProcessorResultType.DETAILED or grouping_engine != GroupingEngine.DICT):
+        raise click.UsageError(f"Option --memory-budget can only be used with the {ProcessorResultType.DETAILED.value} "
+                               f"view and the {GroupingEngine.DICT.value} engine")
 
     if not main_query:
         main_query = GMAIL_QUERY_INBOX
@@ -96,11 +175,115 @@ def discover_inbox(ctx, offline, main_query: str, fetch_mode: str):
     conf = InboxDiscoveryConfig(email_sorter_ctx,
                                 gmail_query=main_query,
                                 fetch_mode=fetch_mode,
-                                offline_mode=offline)
+                                offline_mode=offline,
+                                incremental=incremental,
+                                parallelism=parallelism,
+                                top=top,
+                                page=page,
+                                page_size=page_size,
+                                export_formats=[ExportFormat(f) for f in export_formats],
+                                batch_size=batch_size,
+                                result_type=result_type,
+                                drill_down=drill_down,
+                                save_snapshot=snapshot,
+                                time_bucket=TimeBucket(time_bucket.lower()),
+                                trend_buckets=buckets,
+                                grouping_engine=grouping_engine,
+                                memory_budget=memory_budget * 1024 * 1024 if memory_budget else None,
+                                spill_dir=spill_dir,
+                                top_senders=top_senders)
     discovery = InboxDiscovery(conf, email_sorter_ctx)
     discovery.run()
 
 
+def _get_result_type(view: str, drill_down: str, top: int, page: int) -> ProcessorResultType:
+    if top and page:
+        raise click.UsageError("Options --top and --page can't be used together")
+    result_type = ProcessorResultType(view.lower())
+    if drill_down and not result_type.is_rollup:
+        raise click.UsageError(f"Option --drill-down can't be used with the view: {result_type.value}")
+    if not result_type.is_available:
+        raise click.UsageError(f"The {result_type.value} view requires NumPy, install it with: pip install numpy")
+    return result_type
+
+
+@cli.command()
+@click.argument('snapshot_file', type=SNAPSHOT_FILE)
+@click.option('--view', type=VIEW_CHOICE, default=ProcessorResultType.SIMPLIFIED.value, show_default=True,
+              help='Rows of the result table, see discover-inbox')
+@click.option('--drill-down', metavar='DOMAIN',
+              help='Only show the senders, domains or organizations of this domain and its subdomains')
+@click.option('--time-bucket', type=TIME_BUCKET_CHOICE, default=TimeBucket.WEEK.value, show_default=True,
+              help='Time bucket of the histograms of the trend view')
+@click.option('--buckets', type=click.IntRange(min=1), default=DEFAULT_TREND_BUCKETS, show_default=True,
+              help='Number of the last time buckets shown by the trend view, the trend is computed over them')
+@click.option('--top-senders', type=click.IntRange(min=1), default=DEFAULT_TOP_SENDERS, show_default=True,
+              help='Number of senders counted by the approximate view')
+@click.option('--top', type=click.IntRange(min=1), help='Only show the top N rows of the result table')
+@click.option('--page', type=click.IntRange(min=1), help='Only show this page of the result table (starting from 1)')
+@click.option('--page-size', type=click.IntRange(min=1), default=DEFAULT_PAGE_SIZE, show_default=True,
+              help='Number of rows of a page of the result table, used with --page')
+@click.option('--export', 'export_formats', multiple=True, type=EXPORT_FORMAT_CHOICE,
+              help='Export all rows of the result table to a file of this format in the session dir, can be repeated')
+@click.pass_context
+def render_snapshot(ctx, snapshot_file: str, view: str, drill_down: str, time_bucket: str, buckets: int,
+                    top_senders: int, top: int, page: int, page_size: int, export_formats: Tuple[str]):
+    """
+    Prints the result table of a snapshot saved by discover-inbox --snapshot, without fetching the messages again
+    """
+    from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+
+    handler: MainCommandHandler = ctx.obj['handler']
+    email_sorter_ctx = handler.ctx
+    result_type = _get_result_type(view, drill_down, top, page)
+    conf = InboxDiscoveryConfig(email_sorter_ctx,
+                                gmail_query=None,
+                                fetch_mode=None,
+                                offline_mode=True,
+                                top=top,
+                                page=page,
+                                page_size=page_size,
+                                export_formats=[ExportFormat(f) for f in export_formats],
+                                result_type=result_type,
+                                drill_down=drill_down,
+                                time_bucket=TimeBucket(time_bucket.lower()),
+                                trend_buckets=buckets,
+                                top_senders=top_senders)
+    InboxDiscovery(conf, email_sorter_ctx).render_snapshot(snapshot_file)
+
+
+@cli.command()
+@click.argument('old_snapshot_file', type=SNAPSHOT_FILE)
+@click.argument('new_snapshot_file', type=SNAPSHOT_FILE)
+@click.option('--top', type=click.IntRange(min=1), help='Only show the top N rows of the result table')
+@click.option('--page', type=click.IntRange(min=1), help='Only show this page of the result table (starting from 1)')
+@click.option('--page-size', type=click.IntRange(min=1), default=DEFAULT_PAGE_SIZE, show_default=True,
+              help='Number of rows of a page of the result table, used with --page')
+@click.option('--export', 'export_formats', multiple=True, type=EXPORT_FORMAT_CHOICE,
+              help='Export all rows of the result table to a file of this format in the session dir, can be repeated')
+@click.pass_context
+def diff_snapshots(ctx, old_snapshot_file: str, new_snapshot_file: str, top: int, page: int, page_size: int,
+                   export_formats: Tuple[str]):
+    """
+    Prints the change of the number of messages of each sender between two snapshots saved by discover-inbox --snapshot
+    """
+    from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+
+    handler: MainCommandHandler = ctx.obj['handler']
+    email_sorter_ctx = handler.ctx
+    if top and page:
+        raise click.UsageError("Options --top and --page can't be used together")
+    conf = InboxDiscoveryConfig(email_sorter_ctx,
+                                gmail_query=None,
+                                fetch_mode=None,
+                                offline_mode=True,
+                                top=top,
+                                page=page,
+                                page_size=page_size,
+                                export_formats=[ExportFormat(f) for f in export_formats])
+    InboxDiscovery(conf, email_sorter_ctx).diff_snapshots(old_snapshot_file, new_snapshot_file)
+
+
 @cli.command()
 @click.option(
     '--filters-file',
@@ -108,22 +291,60 @@ def discover_inbox(ctx, offline, main_query: str, fetch_mode: str):
     required=True,
     help='Path to the json file containing filters'
 )
+@click.option('-o', '--offline', is_flag=True, help='Offline mode, only work from the local message store')
+@click.option('-p', '--parallelism', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of filter queries executed concurrently')
+@click.option('-l', '--local', is_flag=True,
+              help='Evaluate supported filters locally in a single pass over the message store, '
+                   'only query Gmail for the rest')
+@click.option('--export', 'export_formats', multiple=True, type=EXPORT_FORMAT_CHOICE,
+              help='Export all rows of the result table to a file of this format in the session dir, can be repeated')
+@click.option('--estimate', is_flag=True,
+              help='Show the result size estimates of Gmail instead of counting the matching threads, '
+                   'takes one request per filter')
+@click.option('--query-cache-ttl', type=click.FloatRange(min=0), default=DEFAULT_QUERY_CACHE_TTL, show_default=True,
+              help='Seconds the results of filter queries are reused by later runs if the mailbox did not change, '
+                   '0 disables the query cache')
+@click.option('--query-cache-size', type=click.IntRange(min=1), default=DEFAULT_QUERY_CACHE_SIZE, show_default=True,
+              help='Maximum number of query results kept, the least recently used ones are evicted')
 @click.pass_context
-def filter_stats(ctx, filters_file: str):
+def filter_stats(ctx, filters_file: str, offline: bool, parallelism: int, local: bool, export_formats: Tuple[str],
+                 estimate: bool, query_cache_ttl: float, query_cache_size: int):
     """
     Prints statistics by provided filter file
     """
+    from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+
     handler: MainCommandHandler = ctx.obj['handler']
     email_sorter_ctx = handler.ctx
 
     conf = InboxDiscoveryConfig(email_sorter_ctx,
                                 gmail_query=GMAIL_QUERY_INBOX,
                                 fetch_mode=ThreadQueryFormat.MINIMAL,
-                                offline_mode=False)
+                                offline_mode=offline,
+                                parallelism=parallelism,
+                                local_evaluation=local,
+                                export_formats=[ExportFormat(f) for f in export_formats],
+                                estimate_counts=estimate,
+                                query_cache_ttl=query_cache_ttl,
+                                query_cache_size=query_cache_size)
     discovery = InboxDiscovery(conf, email_sorter_ctx)
     discovery.create_filter_stats(filters_file)
 
 
+@cli.command()
+@click.option('-i', '--incremental', is_flag=True, help='Only index threads that were added or changed in the email cache')
+@click.pass_context
+def rebuild_message_store(ctx, incremental: bool):
+    """
+    Rebuilds the local message store used by offline mode from the email cache
+    """
+    handler: MainCommandHandler = ctx.obj['handler']
+    store = handler.ctx.message_store
+    stats = store.refresh() if incremental else store.rebuild()
+    LOG.info("Message store %s is up to date. %s", store.db_file, stats)
+
+
 
 if __name__ == "__main__":
     LOG.info("Started application")
@@ -1,21 +1,106 @@
 from abc import abstractmethod, ABC
 
 
+import datetime
+import importlib.util
 import logging
-from collections import defaultdict
+import sys
+from collections import defaultdict, Counter
+from dataclasses import dataclass
 from enum import Enum
-from typing import Iterable, Callable
+from typing import Iterable, List, Dict, Optional, Any, Tuple
 
-from googleapiwrapper.gmail_domain import GmailMessage
+from googleapiwrapper.gmail_domain import GmailMessage, GmailMessageBodyPart
+
+from emailsorter.core.constants import DEFAULT_TREND_BUCKETS, DEFAULT_TOP_SENDERS, DEFAULT_HLL_PRECISION
+from emailsorter.core.rollup import DomainTrie, DomainNode
+from emailsorter.core.sketch import HyperLogLog, SpaceSaving
 
 LOG = logging.getLogger(__name__)
 
 class ProcessorResultType(Enum):
     SIMPLIFIED = "simplified"
     DETAILED = "detailed"
+    # Views of SenderRollupProcessor: senders, domains and organizations of the senders
+    SENDER = "sender"
+    DOMAIN = "domain"
+    ORGANIZATION = "organization"
+    # Messages of the senders per time bucket and the trend of the counts, see SenderTrendProcessor
+    TREND = "trend"
+    # Estimated counts of the top senders and the number of distinct senders, see ApproximateSenderProcessor
+    APPROXIMATE = "approximate"
+
+    @property
+    def is_rollup(self) -> bool:
+        return self in (ProcessorResultType.SENDER, ProcessorResultType.DOMAIN, ProcessorResultType.ORGANIZATION)
+
+    @property
+    def is_available(self) -> bool:
+        """
+        :return: False if the optional dependencies of the view are not installed (NumPy for the trend view)
+        """
+        return self != ProcessorResultType.TREND or importlib.util.find_spec("numpy") is not None
+
+
+class TimeBucket(Enum):
+    DAY = "day"
+    # Weeks start on Monday
+    WEEK = "week"
+    MONTH = "month"
+
+
+class GroupingEngine(Enum):
+    # Counts and groups the messages in dicts while processing them
+    DICT = "dict"
+    # Collects the messages into columns, they are grouped with NumPy when converted to table rows
+    COLUMNAR = "columnar"
+
+    @property
+    def is_available(self) -> bool:
+        """
+        :return: Whether the optional dependencies of the engine are installed
+        """
+        return self != GroupingEngine.COLUMNAR or importlib.util.find_spec("numpy") is not None
+
+
+@dataclass
+class MessageSummary:
+    """
+    Metadata of a GmailMessage that is required by the message processors, without the message body.
+    Summaries are stored in the checkpoints of discovery runs, see emailsorter.core.checkpoint.
+    """
+    msg_id: str
+    thread_id: str
+    subject: str
+    date: datetime.datetime
+    sender_email: str
+    recipient: str
+    recipient_email: str
+    date_str: str
+    # Not stored in checkpoints of earlier versions
+    sender: str = None
+
+    @staticmethod
+    def from_message(message: GmailMessage) -> 'MessageSummary':
+        return MessageSummary(message.msg_id,
+                              message.thread_id,
+                              message.subject,
+                              message.date,
+                              message.sender_email,
+                              message.recipient,
+                              message.recipient_email,
+                              message.date_str,
+                              sender=message.sender)
+
+    def get_all_plain_text_parts(self) -> List[GmailMessageBodyPart]:
+        # Message bodies are not kept in summaries
+        return []
 
 
 class EmailContentProcessor(ABC):
+    # Processors that never use the email content can set this to False, so they are not invoked at all
+    needs_content = True
+
     @abstractmethod
     def process(self, email_content: 'EmailContent'):
         pass
@@ -29,6 +114,25 @@ class EmailMessageProcessor(ABC):
     def convert_to_table_rows(self) -> Iterable[Iterable[str]]:
         pass
 
+    def merge(self, other: 'EmailMessageProcessor'):
+        """
+        Merges the state of another processor of the same type into this one.
+        'other' processed the messages right after the ones processed by this processor,
+        the merged state has to be the same as if all messages were processed by this processor.
+        Processors implementing this method can be used with parallel message processing.
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't be merged")
+
+    @classmethod
+    def supports_merge(cls) -> bool:
+        return cls.merge is not EmailMessageProcessor.merge
+
+    def close(self):
+        """
+        Releases the resources of the processor, e.g. temporary files, once its results are not needed anymore.
+        """
+        pass
+
 
 class PrintingEmailContentProcessor(EmailContentProcessor):
     def __init__(self):
@@ -39,6 +143,8 @@ class PrintingEmailContentProcessor(EmailContentProcessor):
 
 
 class NoOpEmailContentProcessor(EmailContentProcessor):
+    needs_content = False
+
     def __init__(self):
         pass
 
@@ -46,80 +152,288 @@ class NoOpEmailContentProcessor(EmailContentProcessor):
         pass
 
 
+class MessageRecord:
+    """
+    Compact representation of a message for the result table of GroupingEmailMessageProcessor.
+    """
+    __slots__ = ("thread_id", "msg_id", "subject", "recipient_email", "date")
+
+    def __init__(self, thread_id: str, msg_id: str, subject: str, recipient_email: str, date: datetime.datetime):
+        self.thread_id = thread_id
+        self.msg_id = msg_id
+        self.subject = subject
+        self.recipient_email = recipient_email
+        self.date = date
+
+    def __reduce__(self):
+        # Records are sent back from the worker processes of parallel processing, this is faster than pickling slots
+        return MessageRecord, (self.thread_id, self.msg_id, self.subject, self.recipient_email, self.date)
+
+    @staticmethod
+    def from_message(message: 'GmailMessage') -> 'MessageRecord':
+        recipient_email = message.recipient_email
+        # Relatively few distinct recipients are repeated for a lot of messages
+        if recipient_email is not None:
+            recipient_email = sys.intern(recipient_email)
+        return MessageRecord(message.thread_id, message.msg_id, message.subject, recipient_email, message.date)
+
+
 class GroupingEmailMessageProcessor(EmailMessageProcessor):
     def __init__(self, result_type: ProcessorResultType):
-        self.senders = []
-        self.recipients = []
-        self.subjects = []
-        self.senders_set = set()
-        self.grouping_by_sender = defaultdict(list)
         self.result_type = result_type
-
-        self._visited_senders = set()
+        self.count_by_sender: Counter = Counter()
+        # Last message of each sender, it is shown in the grouping result table
+        self.example_by_sender: Dict[str, MessageRecord] = {}
+        # Only filled in DETAILED mode, as SIMPLIFIED mode only prints the number of messages per sender
+        self.grouping_by_sender: Dict[str, List[MessageRecord]] = defaultdict(list)
 
     def process(self, message: 'GmailMessage'):
         # This does print the whole email
         # LOG.info("Processing email: %s", message)
+        self.add(message.sender_email, MessageRecord.from_message(message))
+
+    def add(self, sender: Optional[str], record: MessageRecord):
+        if sender is not None:
+            sender = sys.intern(sender)
+        self.count_by_sender[sender] += 1
+        self.example_by_sender[sender] = record
+        if self.result_type == ProcessorResultType.DETAILED:
+            self.grouping_by_sender[sender].append(record)
+
+    def merge(self, other: 'GroupingEmailMessageProcessor'):
+        if other.result_type != self.result_type:
+            raise ValueError(f"Can't merge processors of different result types: "
+                             f"{self.result_type}, {other.result_type}")
+        # Senders keep the order of their first message and the example is the last message of the sender
+        for sender, count in other.count_by_sender.items():
+            sender = sys.intern(sender) if sender is not None else None
+            self.count_by_sender[sender] += count
+            self.example_by_sender[sender] = other.example_by_sender[sender]
+            if self.result_type == ProcessorResultType.DETAILED:
+                self.grouping_by_sender[sender].extend(other.grouping_by_sender[sender])
+
+    def convert_to_table_rows(self):
+        grouping_for_result_table = {sender: (r.thread_id, r.msg_id, r.subject) for sender, r in self.example_by_sender.items()}
+        if self.result_type == ProcessorResultType.SIMPLIFIED:
+            table_rows = [[sender, count] for sender, count in self.count_by_sender.items()]
+        else:
+            table_rows = self._get_detailed_rows()
+        return grouping_for_result_table, table_rows
 
-        self.senders_set.add(message.sender_email)
-        self.senders.append(message.sender_email)
-        self.recipients.append(message.recipient)
-        self.subjects.append(message.subject)
+    def _get_detailed_rows(self):
+        table_rows = []
+        for sender, records in self.grouping_by_sender.items():
+            no_of_messages_from_sender = self.count_by_sender[sender]
+            # TODO add gmail query URL for each recipient: https://mail.google.com/mail/u/0/#search/label%3Ainbox
+            for record in records:
+                table_rows.append([sender,
+                                   no_of_messages_from_sender,
+                                   record.recipient_email,
+                                   record.date,
+                                   record.subject,
+                                   record.thread_id,
+                                   record.msg_id])
+        return table_rows
+
+
+class SenderRollupProcessor(EmailMessageProcessor):
+    """
+    Counts the messages per sender address, domain and organization (registrable domain) in a single pass.
+    The result type selects the level shown in the result table, 'drill_down' limits the rows to a domain.
+    The counts of all levels are kept, so any level can be converted to table rows without processing
+    the messages again.
+    """
+    def __init__(self, result_type: ProcessorResultType, drill_down: str = None):
+        if not result_type.is_rollup:
+            raise ValueError(f"Not a result type of sender rollups: {result_type}")
+        self.result_type = result_type
+        self.drill_down = drill_down
+        self.trie = DomainTrie()
+        # Last message of each sender, it is shown in the sender result table
+        self.example_by_sender: Dict[str, MessageRecord] = {}
 
-        if len(self.senders_set) > 1:
-            # This can happen in a following case:
-            # Sender X sends a mail to email Z
-            # Z forwards the mail to recipient Y
-            # So Z becomes the sender and Sender X was the original sender
-            # TODO Debug this with warning log
-            # LOG.warning("Multiple senders found for email thread. Sender, recipient, subject: %s",
-            #             list(zip(self.senders, self.recipients, self.subjects)))
-            pass
+    def process(self, message: 'GmailMessage'):
+        record = MessageRecord.from_message(message)
+        sender, _ = self.trie.add(message.sender_email, example=record)
+        self.example_by_sender[sender] = record
 
-        self.grouping_by_sender[message.sender_email].append((message.thread_id, message))
+    def merge(self, other: 'SenderRollupProcessor'):
+        if other.result_type != self.result_type:
+            raise ValueError(f"Can't merge processors of different result types: "
+                             f"{self.result_type}, {other.result_type}")
+        self.trie.merge(other.trie)
+        self.example_by_sender.update(other.example_by_sender)
 
     def convert_to_table_rows(self):
-        row_producer = self._produce_simplified_row if self.result_type == ProcessorResultType.SIMPLIFIED else self._produce_detailed_row
-        grouping_for_result_table, table_rows = self._get_results(row_producer)
+        root = self._get_drill_down_root()
+        if not root:
+            return {}, []
+        if self.result_type == ProcessorResultType.SENDER:
+            table_rows = self._get_sender_rows(root)
+            examples = self.example_by_sender
+        else:
+            totals = self.trie.count_distinct(root)
+            if self.result_type == ProcessorResultType.DOMAIN:
+                table_rows = self._get_domain_rows(root, totals)
+            else:
+                table_rows = self._get_organization_rows(root, totals)
+            examples = {row[0]: self.trie.find(row[0]).example for row in table_rows}
+        grouping_for_result_table = {row[0]: (examples[row[0]].thread_id, examples[row[0]].msg_id,
+                                              examples[row[0]].subject) for row in table_rows}
         return grouping_for_result_table, table_rows
 
-    def _produce_simplified_row(self, thread_id: str, message: GmailMessage, sender: str, no_of_messages_from_sender: int):
-        if sender not in self._visited_senders:
-            self._visited_senders.add(sender)
-            return [sender,
-                str(no_of_messages_from_sender)
-                ]
-        # This sender was already visited, do not return new row for this sender again
-        return None
-
-    def _produce_detailed_row(self, thread_id: str, message: GmailMessage, sender: str, no_of_messages_from_sender: int):
-        return [sender,
-                str(no_of_messages_from_sender),
-                message.recipient_email,
-                message.date_str,
-                message.subject,
-                thread_id,
-                message.msg_id]
-
-    def _get_results(self, row_producer: Callable[[str, GmailMessage, str, int], None]):
-        grouping_for_result_table = {}
+    def _get_drill_down_root(self) -> Optional[DomainNode]:
+        if not self.drill_down:
+            return self.trie.root
+        node = self.trie.find(self.drill_down)
+        if not node:
+            LOG.warning("No messages from domain: %s", self.drill_down)
+        elif self.result_type == ProcessorResultType.ORGANIZATION and not node.is_organization and node.organization:
+            # Drilling down into a subdomain shows its organization
+            node = node.organization
+        return node
+
+    @staticmethod
+    def _get_sender_rows(root: DomainNode):
         table_rows = []
-        for sender, thread_message_lst in self.grouping_by_sender.items():
-            no_of_messages_from_sender = len(thread_message_lst)
-            # TODO add gmail query URL for each recipient: https://mail.google.com/mail/u/0/#search/label%3Ainbox
+        for node in root.iter_nodes():
+            if node.senders:
+                organization = node.organization.domain
+                for local, count in node.senders.items():
+                    table_rows.append([DomainTrie.join_address(local, node.domain), node.domain, organization, count])
+        return table_rows
+
+    @staticmethod
+    def _get_domain_rows(root: DomainNode, totals):
+        # Domains that only lead to a single subdomain are skipped, they have the same counts as the subdomain
+        table_rows = []
+        for node in root.iter_nodes():
+            organization = node.organization
+            if organization and (node.senders or len(node.children) > 1):
+                table_rows.append([node.domain, organization.domain, node.count, totals[node][1]])
+        return table_rows
+
+    @staticmethod
+    def _get_organization_rows(root: DomainNode, totals):
+        table_rows = []
+        for node in root.iter_nodes():
+            if node.is_organization:
+                domains, senders = totals[node]
+                table_rows.append([node.domain, node.count, domains, senders])
+        return table_rows
+
+
+class ApproximateSenderProcessor(EmailMessageProcessor):
+    """
+    Top senders and the number of distinct senders and recipients, estimated in constant memory for any number
+    of messages: the messages of the top senders are counted by a Space-Saving sketch, the distinct senders and
+    recipients by HyperLogLog sketches. The number of messages is exact.
+    The count of each sender is an upper bound, the table shows the lower bound and the maximum error as well.
+    Senders that are not shown sent at most 'max_error' messages, see get_summary.
+    """
+    def __init__(self, top_senders: int = DEFAULT_TOP_SENDERS, precision: int = DEFAULT_HLL_PRECISION):
+        self.result_type = ProcessorResultType.APPROXIMATE
+        self.no_of_messages = 0
+        # The last message of each counted sender is kept with its count
+        self.top_senders = SpaceSaving(top_senders)
+        self.senders = HyperLogLog(precision)
+        # None if the recipients of the messages are not known, e.g. when the counts are loaded from a snapshot
+        # that only has the last message of each sender
+        self.recipients: Optional[HyperLogLog] = HyperLogLog(precision)
 
-            for thread_message in thread_message_lst:
-                thread = thread_message[0]
-                message = thread_message[1]
-                grouping_for_result_table[sender] = (thread, message.msg_id, message.subject)
-                row = row_producer(thread, message, sender, no_of_messages_from_sender)
-                if row:
-                    table_rows.append(row)
+    def process(self, message: 'GmailMessage'):
+        self.add(message.sender_email, MessageRecord.from_message(message))
+
+    def add(self, sender: Optional[str], record: MessageRecord, count: int = 1):
+        """
+        :param count: Number of messages of the sender, e.g. when counts are loaded from a snapshot
+        """
+        self.no_of_messages += count
+        self.top_senders.add(sender, count, value=record)
+        # Messages without a sender or recipient are counted as one more distinct sender or recipient
+        self.senders.add(sender or "")
+        if self.recipients is not None:
+            self.recipients.add(record.recipient_email or "")
+
+    def merge(self, other: 'ApproximateSenderProcessor'):
+        self.no_of_messages += other.no_of_messages
+        self.top_senders.merge(other.top_senders)
+        self.senders.merge(other.senders)
+        if self.recipients is None or other.recipients is None:
+            self.recipients = None
+        else:
+            self.recipients.merge(other.recipients)
+
+    def convert_to_table_rows(self):
+        examples = self.top_senders.values
+        grouping_for_result_table = {sender: (r.thread_id, r.msg_id, r.subject) for sender, r in examples.items()}
+        table_rows = []
+        for sender, count in self.top_senders.counts.items():
+            error = self.top_senders.errors[sender]
+            share = round(count / self.no_of_messages * 100, 2) if self.no_of_messages else 0.0
+            table_rows.append([sender, count, count - error, error, share])
         return grouping_for_result_table, table_rows
 
+    def get_summary(self) -> Dict[str, Any]:
+        """
+        :return: Number of messages, estimated number of distinct senders and recipients with the relative standard
+        error of the estimates, and the maximum number of messages of the senders that are not counted.
+        The distinct recipients are omitted if the recipients of the messages are not known.
+        """
+        summary = {"messages": self.no_of_messages, "distinct_senders": self.senders.estimate()}
+        if self.recipients is not None:
+            summary["distinct_recipients"] = self.recipients.estimate()
+        summary.update({"distinct_relative_error": round(self.senders.relative_error, 4),
+                        "counted_senders": len(self.top_senders.counts),
+                        "max_messages_of_other_senders": self.top_senders.max_error})
+        return summary
+
+    def get_sender_columns(self) -> Tuple[List[Optional[str]], List[int], List[MessageRecord]]:
+        """
+        :return: Counted senders, their estimated number of messages and their last message
+        """
+        senders = list(self.top_senders.counts)
+        return senders, list(self.top_senders.counts.values()), [self.top_senders.values[s] for s in senders]
+
+
+def create_message_processor(result_type: ProcessorResultType, drill_down: str = None,
+                             time_bucket: TimeBucket = TimeBucket.WEEK,
+                             buckets: int = DEFAULT_TREND_BUCKETS,
+                             engine: GroupingEngine = GroupingEngine.DICT, memory_budget: int = None,
+                             spill_dir: str = None, top_senders: int = DEFAULT_TOP_SENDERS) -> EmailMessageProcessor:
+    """
+    :param time_bucket: Time bucket of the histograms of the trend view
+    :param buckets: Number of the last time buckets shown by the trend view
+    :param engine: Engine of grouping the messages by sender, for the simplified and detailed views
+    :param memory_budget: Messages of the detailed view are written to temporary files in 'spill_dir'
+    when their estimated memory reaches this many bytes, None keeps all of them in memory
+    :param top_senders: Number of senders counted by the approximate view
+    :return: Processor of the messages of inbox discovery for the result type
+    """
+    if result_type == ProcessorResultType.TREND:
+        # NumPy is an optional dependency and slow to import, it is only imported for the trend view
+        from emailsorter.core.trend import SenderTrendProcessor
+        return SenderTrendProcessor(time_bucket=time_bucket, buckets=buckets)
+    if result_type == ProcessorResultType.APPROXIMATE:
+        return ApproximateSenderProcessor(top_senders=top_senders)
+    if result_type.is_rollup:
+        return SenderRollupProcessor(result_type, drill_down=drill_down)
+    if memory_budget is not None and result_type == ProcessorResultType.DETAILED:
+        if engine != GroupingEngine.DICT:
+            raise ValueError(f"Memory budget can't be used with the {engine.value} engine")
+        from emailsorter.core.spill import SpillingGroupingProcessor
+        return SpillingGroupingProcessor(memory_budget, spill_dir=spill_dir)
+    if engine == GroupingEngine.COLUMNAR:
+        from emailsorter.core.columnar import ColumnarGroupingProcessor
+        return ColumnarGroupingProcessor(result_type)
+    return GroupingEmailMessageProcessor(result_type)
+
+
 class MultipleFilterResultProcessor(EmailMessageProcessor):
     def __init__(self):
         self.count_per_filter = {}
+        self.seconds_per_filter = {}
+        self.exact_per_filter = {}
         self._filters_by_description = {}
 
     def process(self, message: 'GmailMessage'):
@@ -133,12 +447,21 @@ class MultipleFilterResultProcessor(EmailMessageProcessor):
         rows = []
         for filter_desc, count in self.count_per_filter.items():
             filter = self._filters_by_description[filter_desc]
-            rows.append([filter_desc, count, filter.gmail_link])
+            count_type = "exact" if self.exact_per_filter.get(filter_desc, True) else "estimated"
+            rows.append([filter_desc, count, filter.gmail_link, self.seconds_per_filter.get(filter_desc), count_type])
         return rows
 
-    def add_result(self, filter: 'GmailFilter', processor_results):
+    def merge(self, other: 'MultipleFilterResultProcessor'):
+        self._filters_by_description.update(other._filters_by_description)
+        self.count_per_filter.update(other.count_per_filter)
+        self.seconds_per_filter.update(other.seconds_per_filter)
+        self.exact_per_filter.update(other.exact_per_filter)
+
+    def add_result(self, filter: 'GmailFilter', processor_results, seconds: float = None):
         self._filters_by_description[filter.description] = filter
         self.count_per_filter[filter.description] = processor_results["count"]
+        self.seconds_per_filter[filter.description] = seconds
+        self.exact_per_filter[filter.description] = processor_results.get("exact", True)
 
 
 
@@ -0,0 +1,226 @@
+import logging
+import time
+import urllib.parse
+from dataclasses import dataclass
+from typing import List, Dict, Any, Set, Optional
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+from googleapiwrapper.gmail_api import DefaultGmailThreadProcessor, GmailApiFetcher, ApiConversionContext, \
+    GmailApiHelpers, GmailWrapper
+from googleapiwrapper.gmail_cache import CacheResultItems
+from googleapiwrapper.gmail_common import GmailRequestType
+from googleapiwrapper.gmail_domain import ThreadQueryFormat, ThreadField, MessageField, ThreadQueryParam, \
+    GenericObjectHelper as GH
+
+from emailsorter.core.constants import DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE
+from emailsorter.core.error import BatchRequestException
+from emailsorter.core.scheduler import RequestScheduler, get_scheduler, get_quota_units
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 1.0
+# Path of the batch endpoint, relative to the root URL of the API (batchPath of the discovery document)
+BATCH_PATH = "batch"
+# Calls failing with these statuses are retried, e.g. if the rate limit of concurrent requests was exceeded
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class BatchStats:
+    batches: int = 0
+    calls: int = 0
+    retried_calls: int = 0
+
+
+class BatchThreadFetcher:
+    """
+    Sends threads.get calls in batch requests of up to batch_size calls, so fetching a page of threads
+    takes a few HTTP round trips instead of one per thread.
+    Calls of a batch fail independently: calls failing with a retryable status are sent again in a new batch
+    after an exponential backoff, the successful ones are kept.
+    """
+    def __init__(self, fetcher: GmailApiFetcher, batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, retry_delay: float = DEFAULT_RETRY_DELAY):
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"Batch size should be between 1 and {MAX_BATCH_SIZE}. Actual value: {batch_size}")
+        self.fetcher = fetcher
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stats = BatchStats()
+        # Set if the requests are sent through a request scheduler
+        self._scheduler: Optional[RequestScheduler] = None
+
+    def fetch_threads(self, ctx: ApiConversionContext, thread_ids: List[str],
+                      format: ThreadQueryFormat) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: Thread responses by thread ID
+        """
+        responses: Dict[str, Dict[str, Any]] = {}
+        if not thread_ids:
+            return responses
+        batch_size = self._get_batch_size(thread_ids[0], format)
+        pending = list(thread_ids)
+        attempt = 1
+        while pending:
+            failed: List[str] = []
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                failed.extend(self._execute_batch(ctx, chunk, format, responses))
+            if not failed:
+                break
+            if attempt >= self.max_attempts:
+                raise BatchRequestException(f"Failed to fetch {len(failed)} threads after {attempt} attempts. "
+                                            f"Thread IDs: {failed}")
+            if self._scheduler:
+                # The scheduler delays the next requests and lowers their rate
+                LOG.warning("Retrying %d failed threads.get calls (attempt %d / %d)",
+                            len(failed), attempt + 1, self.max_attempts)
+                self._scheduler.record_throttled()
+            else:
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                LOG.warning("Retrying %d failed threads.get calls in %.1f seconds (attempt %d / %d)",
+                            len(failed), delay, attempt + 1, self.max_attempts)
+                time.sleep(delay)
+            self.stats.retried_calls += len(failed)
+            pending = failed
+            attempt += 1
+        return responses
+
+    def _execute_batch(self, ctx: ApiConversionContext, thread_ids: List[str], format: ThreadQueryFormat,
+                       responses: Dict[str, Dict[str, Any]]) -> List[str]:
+        """
+        :return: IDs of the threads whose call failed with a retryable status
+        """
+        failed: List[str] = []
+        errors: List[HttpError] = []
+
+        def callback(thread_id: str, response: Dict[str, Any], exception: Exception):
+            if exception is None:
+                responses[thread_id] = response
+            elif BatchThreadFetcher._is_retryable(exception):
+                failed.append(thread_id)
+            else:
+                errors.append(exception)
+
+        batch = None
+        for thread_id in thread_ids:
+            request = self.fetcher.threads_svc.get(**BatchThreadFetcher._create_get_kwargs(thread_id, format))
+            if batch is None:
+                batch = BatchHttpRequest(callback=callback, batch_uri=BatchThreadFetcher._get_batch_uri(request.uri))
+            batch.add(request, request_id=thread_id)
+        LOG.debug("Requesting %d gmail threads in a batch request, format: %s", len(thread_ids), format.value)
+        self.stats.batches += 1
+        self.stats.calls += len(thread_ids)
+        for _ in thread_ids:
+            ctx.progress.incr_requests(GmailRequestType.THREADS_GET)
+        try:
+            batch.execute()
+        except HttpError as e:
+            if not BatchThreadFetcher._is_retryable(e):
+                raise
+            LOG.warning("Batch request of %d threads failed with status %s", len(thread_ids), e.resp.status)
+            return thread_ids
+        if errors:
+            raise errors[0]
+        return failed
+
+    def _get_batch_size(self, thread_id: str, format: ThreadQueryFormat) -> int:
+        """
+        :return: Number of calls per batch. If the requests are sent through a request scheduler, a batch is limited
+        to the calls fitting into a burst of the quota, the calls of larger batches would be throttled every time.
+        """
+        request = self.fetcher.threads_svc.get(**BatchThreadFetcher._create_get_kwargs(thread_id, format))
+        self._scheduler = get_scheduler(request.http)
+        if not self._scheduler:
+            return self.batch_size
+        units_per_call = get_quota_units(request.method, request.uri)
+        return min(self.batch_size, self._scheduler.get_max_calls_per_burst(units_per_call))
+
+    @staticmethod
+    def _create_get_kwargs(thread_id: str, format: ThreadQueryFormat) -> Dict[str, str]:
+        kwargs = GmailApiHelpers.get_new_kwargs()
+        kwargs[ThreadField.ID.value] = thread_id
+        kwargs[ThreadQueryParam.FORMAT.value] = format.value
+        return kwargs
+
+    @staticmethod
+    def _get_batch_uri(request_uri: str) -> str:
+        parts = urllib.parse.urlsplit(request_uri)
+        return f"{parts.scheme}://{parts.netloc}/{BATCH_PATH}"
+
+    @staticmethod
+    def _is_retryable(exception: Exception) -> bool:
+        return isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES
+
+
+class BatchingGmailThreadProcessor(DefaultGmailThreadProcessor):
+    """
+    Processes the threads of a page like DefaultGmailThreadProcessor, but the threads that are not fully cached
+    are fetched with batch requests before the threads are converted.
+    Threads unknown to the cache are fetched in the requested format right away,
+    the message IDs of the other threads are checked against the cache first (MINIMAL format).
+    """
+    def __init__(self, fetcher: GmailApiFetcher, api_fetching_ctx, batch_fetcher: BatchThreadFetcher):
+        super().__init__(fetcher, api_fetching_ctx)
+        self.batch_fetcher = batch_fetcher
+
+    def process_threads(self, ctx: ApiConversionContext, rt: GmailRequestType, thread_ids: List[str]):
+        progress = ctx.progress
+        cache_state: CacheResultItems = self.api_fetching_ctx.get_cache_state_for_threads(
+            thread_ids, ctx.expect_one_message_per_thread
+        )
+        GmailApiHelpers.log_cache_state_details(cache_state, thread_ids)
+
+        processed_ids = []
+        for thread_id in thread_ids:
+            progress.incr_processed_items(rt, thread_id)
+            if progress.is_limit_reached(rt):
+                LOG.warning(f"Reached request limit of {progress.limit}, stop processing more items.")
+                break
+            processed_ids.append(thread_id)
+
+        fetched = self._fetch_threads(ctx, cache_state, processed_ids)
+        for thread_id in processed_ids:
+            if thread_id in fetched:
+                thread_resp_full = fetched[thread_id]
+                self.api_fetching_ctx.process_thread(thread_resp_full)
+            else:
+                thread_resp_full = GmailApiHelpers.get_item_from_cache(cache_state, thread_id)
+            thread_obj = self._convert_to_thread_object(ctx, ctx.sanity_check, thread_id, thread_resp_full)
+            ctx.threads.add(thread_obj)
+            ctx.handle_empty_bodies(lambda desc: self.request_attachment_or_load_from_cache(desc, ctx))
+
+        self.api_fetching_ctx.print_cache_actions()
+
+    def _fetch_threads(self, ctx: ApiConversionContext, cache_state: CacheResultItems,
+                       thread_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        accepted_thread_query_formats = (ThreadQueryFormat.FULL, ThreadQueryFormat.RAW, ThreadQueryFormat.METADATA)
+        if ctx.format not in accepted_thread_query_formats:
+            raise ValueError(
+                "Expecting Gmail query format to be in: {}. Actual value: {}".format(
+                    accepted_thread_query_formats, ctx.format
+                )
+            )
+        not_cached: Set[str] = set(cache_state.not_cached_ids)
+        to_check = [t_id for t_id in thread_ids if t_id not in not_cached and not cache_state.is_fully_cached(t_id)]
+        minimal_responses = self.batch_fetcher.fetch_threads(ctx, to_check, ThreadQueryFormat.MINIMAL)
+        for thread_id in to_check:
+            messages = GH.get_field(minimal_responses[thread_id], ThreadField.MESSAGES)
+            message_ids = [GH.get_field(msg, MessageField.ID) for msg in messages]
+            self.api_fetching_ctx.process_messages(cache_state, thread_id, message_ids)
+
+        to_fetch = [t_id for t_id in thread_ids if not cache_state.is_fully_cached(t_id)]
+        return self.batch_fetcher.fetch_threads(ctx, to_fetch, ctx.format)
+
+
+def create_thread_processor(gmail_wrapper: GmailWrapper, batch_size: int) -> DefaultGmailThreadProcessor:
+    """
+    :param batch_size: Number of threads.get calls per HTTP request, 1 sends a request per call
+    """
+    if batch_size > 1:
+        return BatchingGmailThreadProcessor(gmail_wrapper.fetcher, gmail_wrapper.api_fetching_ctx,
+                                            BatchThreadFetcher(gmail_wrapper.fetcher, batch_size=batch_size))
+    return DefaultGmailThreadProcessor(gmail_wrapper.fetcher, gmail_wrapper.api_fetching_ctx)
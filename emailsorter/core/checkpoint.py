@@ -0,0 +1,89 @@
+import datetime
+import logging
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Any
+
+from dataclasses_json import dataclass_json, config
+from pythoncommons.file_utils import FileUtils, JsonFileUtils
+from pythoncommons.string_utils import StringUtils
+
+from emailsorter.common.model import MessageSummary
+
+LOG = logging.getLogger(__name__)
+
+CHECKPOINTS_DIR_NAME = "checkpoints"
+
+
+def _encode_messages(messages_by_thread: Dict[str, List[MessageSummary]]) -> Dict[str, List[Dict[str, Any]]]:
+    return {thread_id: [_encode_message(m) for m in messages] for thread_id, messages in messages_by_thread.items()}
+
+
+def _decode_messages(data: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[MessageSummary]]:
+    return {thread_id: [_decode_message(m) for m in messages] for thread_id, messages in data.items()}
+
+
+def _encode_message(message: MessageSummary) -> Dict[str, Any]:
+    data = asdict(message)
+    data["date"] = message.date.timestamp() if message.date else None
+    return data
+
+
+def _decode_message(data: Dict[str, Any]) -> MessageSummary:
+    # Dates of GmailMessages are naive local datetimes, keep them like that after decoding from JSON.
+    # Checkpoints of earlier versions don't store the sender.
+    date = data["date"]
+    return MessageSummary(**dict(data, date=datetime.datetime.fromtimestamp(date) if date else None))
+
+
+@dataclass_json
+@dataclass
+class DiscoveryCheckpoint:
+    """
+    State of a discover-inbox run: the version of each thread matching the query
+    (history ID for Gmail, modification time for the local message store) and the summaries of its messages.
+    """
+    query: str
+    created: Optional[str] = None
+    thread_versions: Dict[str, str] = field(default_factory=dict)
+    # MessageSummary is a plain dataclass, importing dataclasses_json would slow down the start of the CLI
+    messages_by_thread: Dict[str, List[MessageSummary]] = field(default_factory=dict, metadata=config(
+        encoder=_encode_messages, decoder=_decode_messages))
+
+    @property
+    def newest_message_date(self) -> Optional[datetime.datetime]:
+        dates = [m.date for messages in self.messages_by_thread.values() for m in messages if m.date]
+        return max(dates) if dates else None
+
+    @property
+    def no_of_messages(self) -> int:
+        return sum(len(messages) for messages in self.messages_by_thread.values())
+
+    def iter_messages(self):
+        for messages in self.messages_by_thread.values():
+            yield from messages
+
+
+class DiscoveryCheckpointStore:
+    def __init__(self, output_dir: str):
+        self.checkpoints_dir = FileUtils.ensure_dir_created(FileUtils.join_path(output_dir, CHECKPOINTS_DIR_NAME))
+
+    def _get_file(self, query: str):
+        return FileUtils.join_path(self.checkpoints_dir, f"discovery_{StringUtils.md5_hash(query)}.json")
+
+    def load(self, query: str) -> Optional[DiscoveryCheckpoint]:
+        file = self._get_file(query)
+        if not FileUtils.does_file_exist(file):
+            LOG.info("Checkpoint not found for query '%s'", query)
+            return None
+        data, bytes_read = JsonFileUtils.load_data_from_json_file(file)
+        checkpoint = DiscoveryCheckpoint.from_dict(data)
+        LOG.info("Loaded checkpoint for query '%s' from %s (%d bytes). Created: %s, threads: %d, messages: %d, "
+                 "newest message date: %s", query, file, bytes_read, checkpoint.created,
+                 len(checkpoint.thread_versions), checkpoint.no_of_messages, checkpoint.newest_message_date)
+        return checkpoint
+
+    def save(self, checkpoint: DiscoveryCheckpoint):
+        checkpoint.created = datetime.datetime.now().isoformat()
+        file = self._get_file(checkpoint.query)
+        bytes_written = JsonFileUtils.write_data_to_file_as_json(file, checkpoint.to_dict(encode_json=True))
+        LOG.info("Saved checkpoint for query '%s' to %s (%d bytes)", checkpoint.query, file, bytes_written)
@@ -0,0 +1,133 @@
+import logging
+import sys
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from emailsorter.common.model import EmailMessageProcessor, MessageRecord, ProcessorResultType
+from emailsorter.core.error import EmailSorterException
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise EmailSorterException("The columnar grouping engine requires NumPy, install it with: pip install numpy") from e
+
+LOG = logging.getLogger(__name__)
+
+
+class ColumnarGroupingProcessor(EmailMessageProcessor):
+    """
+    Grouping of the messages by sender, with the same results as GroupingEmailMessageProcessor.
+    Processing a message appends the ID of its sender to a column, and in DETAILED mode the fields of the message
+    to a column each, instead of a record per message. The counts and the messages grouped by sender are computed
+    at once with NumPy (bincount, stable argsort of the sender IDs) when the results are converted to table rows.
+    """
+    def __init__(self, result_type: ProcessorResultType):
+        if result_type not in (ProcessorResultType.SIMPLIFIED, ProcessorResultType.DETAILED):
+            raise ValueError(f"Not a result type of grouping by sender: {result_type}")
+        self.result_type = result_type
+        # Senders by their ID, in the order of their first message
+        self.senders: List[Optional[str]] = []
+        self._id_by_sender: Dict[Optional[str], int] = {}
+        # Last message of each sender by the ID of the sender, it is shown in the grouping result table
+        self.examples: List[MessageRecord] = []
+        # Sender ID of each message
+        self.sender_ids = array("i")
+        # Fields of each message, only filled in DETAILED mode
+        self.thread_ids: List[str] = []
+        self.msg_ids: List[str] = []
+        self.subjects: List[str] = []
+        self.recipient_emails: List[str] = []
+        self.dates: List['datetime.datetime'] = []
+
+    def process(self, message: 'GmailMessage'):
+        self.add(message.sender_email, MessageRecord.from_message(message))
+
+    def add(self, sender: Optional[str], record: MessageRecord):
+        sender_id = self._get_sender_id(sender, record)
+        self.examples[sender_id] = record
+        self.sender_ids.append(sender_id)
+        if self.result_type == ProcessorResultType.DETAILED:
+            self.thread_ids.append(record.thread_id)
+            self.msg_ids.append(record.msg_id)
+            self.subjects.append(record.subject)
+            self.recipient_emails.append(record.recipient_email)
+            self.dates.append(record.date)
+
+    def _get_sender_id(self, sender: Optional[str], example: MessageRecord) -> int:
+        sender_id = self._id_by_sender.get(sender)
+        if sender_id is None:
+            if sender is not None:
+                sender = sys.intern(sender)
+            sender_id = self._id_by_sender[sender] = len(self.senders)
+            self.senders.append(sender)
+            self.examples.append(example)
+        return sender_id
+
+    def merge(self, other: 'ColumnarGroupingProcessor'):
+        if other.result_type != self.result_type:
+            raise ValueError(f"Can't merge processors of different result types: "
+                             f"{self.result_type}, {other.result_type}")
+        # Sender IDs of the other processor are mapped to the IDs of this processor
+        id_mapping = np.array([self._get_sender_id(sender, example)
+                               for sender, example in zip(other.senders, other.examples)], dtype=np.intc)
+        for sender_id, example in zip(id_mapping.tolist(), other.examples):
+            self.examples[sender_id] = example
+        self.sender_ids.frombytes(id_mapping[np.frombuffer(other.sender_ids, dtype=np.intc)].tobytes())
+        for column, other_column in zip(self._get_record_columns(), other._get_record_columns()):
+            column.extend(other_column)
+
+    def _get_record_columns(self) -> List[list]:
+        """
+        :return: Columns of the fields of the messages, in the order of the arguments of MessageRecord
+        """
+        return [self.thread_ids, self.msg_ids, self.subjects, self.recipient_emails, self.dates]
+
+    def _get_counts(self, sender_ids):
+        return np.bincount(sender_ids, minlength=len(self.senders))
+
+    def convert_to_table_rows(self):
+        sender_ids = np.frombuffer(self.sender_ids, dtype=np.intc)
+        counts = self._get_counts(sender_ids)
+        grouping_for_result_table = {sender: (example.thread_id, example.msg_id, example.subject)
+                                     for sender, example in zip(self.senders, self.examples)}
+        if self.result_type == ProcessorResultType.SIMPLIFIED:
+            table_rows = [list(row) for row in zip(self.senders, counts.tolist())]
+        else:
+            # Rows are created in the order of the messages, reading the columns sequentially,
+            # then they are grouped by sender at once
+            table_rows = [list(row) for row in zip(_take(self.senders, sender_ids), counts[sender_ids].tolist(),
+                                                   self.recipient_emails, self.dates, self.subjects,
+                                                   self.thread_ids, self.msg_ids)]
+            table_rows = _take(table_rows, self._group(sender_ids))
+        return grouping_for_result_table, table_rows
+
+    @staticmethod
+    def _group(sender_ids):
+        """
+        :return: Indices of the messages grouped by sender. Senders keep the order of their first message,
+        as their IDs do, and the messages of a sender keep their order.
+        """
+        return np.argsort(sender_ids, kind="stable")
+
+    def get_sender_columns(self) -> Tuple[List[Optional[str]], List[int], List[MessageRecord]]:
+        """
+        :return: Senders, the number of messages and the last message of each sender
+        """
+        counts = self._get_counts(np.frombuffer(self.sender_ids, dtype=np.intc)).tolist()
+        return list(self.senders), counts, list(self.examples)
+
+    def get_grouped_messages(self) -> Tuple[List[Optional[str]], List[MessageRecord]]:
+        """
+        :return: Sender and record of each message of the detailed view, grouped by sender
+        """
+        sender_ids = np.frombuffer(self.sender_ids, dtype=np.intc)
+        order = self._group(sender_ids)
+        records = [MessageRecord(*values) for values in zip(*self._get_record_columns())]
+        return _take(self.senders, sender_ids[order]), _take(records, order)
+
+
+def _take(values: list, indices) -> list:
+    """
+    :return: The values at the indices, gathered by NumPy
+    """
+    return np.fromiter(values, dtype=object, count=len(values))[indices].tolist()
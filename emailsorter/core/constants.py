@@ -1,2 +1,18 @@
 EMAIL_SORTER_MODULE_NAME = "emailsorter"
 DEFAULT_LINE_SEP = "\\r\\n"
+# Number of rows of a page of the result table
+DEFAULT_PAGE_SIZE = 50
+# Maximum number of calls of a batch request accepted by the Gmail API
+MAX_BATCH_SIZE = 100
+# Gmail recommends at most 50 calls per batch, larger batches are likely to be rate limited
+DEFAULT_BATCH_SIZE = 50
+# Seconds the result of a filter query is reused for, if the mailbox didn't change meanwhile
+DEFAULT_QUERY_CACHE_TTL = 3600
+# Maximum number of query results kept, the least recently used ones are evicted
+DEFAULT_QUERY_CACHE_SIZE = 1000
+# Number of the last days, weeks or months shown by the histograms of the trend view
+DEFAULT_TREND_BUCKETS = 12
+# Number of senders counted by the approximate view
+DEFAULT_TOP_SENDERS = 1000
+# Precision of the HyperLogLog sketches of the approximate view, 2^14 registers have a relative error of 0.8%
+DEFAULT_HLL_PRECISION = 14
@@ -1,17 +1,83 @@
-from googleapiwrapper.gmail_cache import CachingStrategyType
+from typing import TYPE_CHECKING
 
 from emailsorter.core.common import CommandType
 from emailsorter.core.common import PROJECT_NAME, SECRET_PROJECTS_DIR
-from googleapiwrapper.common import ServiceType
-from googleapiwrapper.gmail_api import GmailWrapper
-from googleapiwrapper.google_auth import GoogleApiAuthorizer
 from pythoncommons.file_utils import FileUtils
 from pythoncommons.os_utils import OsUtils
 from pythoncommons.project_utils import ProjectUtils
 
+from emailsorter.core.scheduler import RequestSchedulerConfig, RequestScheduler
+
+if TYPE_CHECKING:
+    from emailsorter.core.store import MessageStore
+    from googleapiwrapper.gmail_api import GmailWrapper
+    from googleapiwrapper.google_auth import GoogleApiAuthorizer
+
+
+class GmailWrapperFactory:
+    """
+    Holds everything that is required to set up a GmailWrapper.
+    Instances are picklable so worker processes can create their own GmailWrapper,
+    as a GmailWrapper can't be shared between threads or processes.
+    The requests of all wrappers created by a factory in a process are paced by the same request scheduler.
+    """
+    def __init__(self, account_email: str, email_cache_dir: str, use_cache: bool,
+                 scheduler_config: RequestSchedulerConfig = None):
+        self.account_email = account_email
+        self.email_cache_dir = email_cache_dir
+        self.use_cache = use_cache
+        # No scheduling if not set
+        self.scheduler_config = scheduler_config
+        self._scheduler: RequestScheduler = None
+
+    def __getstate__(self):
+        # Each process creates its own scheduler
+        state = self.__dict__.copy()
+        state["_scheduler"] = None
+        return state
+
+    @property
+    def scheduler(self) -> RequestScheduler:
+        if not self._scheduler and self.scheduler_config:
+            self._scheduler = RequestScheduler(self.scheduler_config)
+        return self._scheduler
+
+    def share_quota(self, no_of_processes: int) -> 'GmailWrapperFactory':
+        """
+        :return: Factory for worker processes, the schedulers of the processes share the quota equally
+        """
+        scheduler_config = self.scheduler_config.share(no_of_processes) if self.scheduler_config else None
+        return GmailWrapperFactory(self.account_email, self.email_cache_dir, self.use_cache,
+                                   scheduler_config=scheduler_config)
+
+    def create_authorizer(self) -> 'GoogleApiAuthorizer':
+        # The Google API client libraries are imported when they are first used, as importing them is slow
+        from googleapiwrapper.common import ServiceType
+        from googleapiwrapper.google_auth import GoogleApiAuthorizer
+
+        return GoogleApiAuthorizer(
+            ServiceType.GMAIL,
+            project_name=PROJECT_NAME,
+            secret_basedir=SECRET_PROJECTS_DIR,
+            account_email=self.account_email,
+        )
+
+    def create(self, authorizer: 'GoogleApiAuthorizer' = None) -> 'GmailWrapper':
+        from googleapiwrapper.gmail_api import GmailWrapper
+        from googleapiwrapper.gmail_cache import CachingStrategyType
+
+        if not authorizer:
+            authorizer = self.create_authorizer()
+        caching_strategy = CachingStrategyType.FILESYSTEM_CACHE_STRATEGY if self.use_cache else CachingStrategyType.NO_CACHE
+        if self.scheduler:
+            from emailsorter.core.gmail import ScheduledGmailWrapper
+            return ScheduledGmailWrapper(authorizer, caching_strategy, self.scheduler,
+                                         output_basedir=self.email_cache_dir)
+        return GmailWrapper(authorizer, cache_strategy_type=caching_strategy, output_basedir=self.email_cache_dir)
+
 
 class EmailSorterContext:
-    def __init__(self, use_cache: bool, account_email: str):
+    def __init__(self, use_cache: bool, account_email: str, scheduler_config: RequestSchedulerConfig = None):
         # Set up dirs
         self.output_dir = ProjectUtils.get_output_child_dir(CommandType.EMAIL_SORTER.output_dir_name)
         self.session_dir = ProjectUtils.get_session_dir_under_child_dir(FileUtils.basename(self.output_dir))
@@ -20,15 +86,32 @@ class EmailSorterContext:
         self.account_email: str = account_email
         self.full_cmd: str = OsUtils.determine_full_command_filtered(filter_password=True)
 
-        # Set up Gmail API objects
-        self.authorizer = GoogleApiAuthorizer(
-            ServiceType.GMAIL,
-            project_name=PROJECT_NAME,
-            secret_basedir=SECRET_PROJECTS_DIR,
-            account_email=self.account_email,
-        )
-        caching_strategy = CachingStrategyType.FILESYSTEM_CACHE_STRATEGY if use_cache else CachingStrategyType.NO_CACHE
-        self.gmail_wrapper = GmailWrapper(self.authorizer, cache_strategy_type=caching_strategy, output_basedir=self.email_cache_dir)
+        # Gmail API objects are only set up when they are first used, so offline commands don't need authorization
+        self.gmail_wrapper_factory = GmailWrapperFactory(self.account_email, self.email_cache_dir, use_cache,
+                                                         scheduler_config=scheduler_config)
+        self._authorizer: 'GoogleApiAuthorizer' = None
+        self._gmail_wrapper: 'GmailWrapper' = None
+        self._message_store: 'MessageStore' = None
+
+    @property
+    def authorizer(self) -> 'GoogleApiAuthorizer':
+        if not self._authorizer:
+            self._authorizer = self.gmail_wrapper_factory.create_authorizer()
+        return self._authorizer
+
+    @property
+    def gmail_wrapper(self) -> 'GmailWrapper':
+        if not self._gmail_wrapper:
+            self._gmail_wrapper = self.gmail_wrapper_factory.create(self.authorizer)
+        return self._gmail_wrapper
+
+    @property
+    def message_store(self) -> 'MessageStore':
+        if not self._message_store:
+            from emailsorter.core.store import MessageStore
+
+            self._message_store = MessageStore.for_account(self.email_cache_dir, self.account_email)
+        return self._message_store
 
     @staticmethod
     def _get_attribute(args, attr_name, default=None):
@@ -13,3 +13,15 @@ class ConfigSetupException(EmailSorterException):
 
 class CliArgException(EmailSorterException):
     pass
+
+
+class UnsupportedQueryException(EmailSorterException):
+    pass
+
+
+class BatchRequestException(EmailSorterException):
+    pass
+
+
+class SnapshotException(EmailSorterException):
+    pass
@@ -0,0 +1,30 @@
+import logging
+
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiwrapper.gmail_api import GmailWrapper, GmailApiFetcher
+from googleapiwrapper.gmail_api_extensions import ApiFetchingContext
+from googleapiwrapper.gmail_cache import CachingStrategyType
+from googleapiwrapper.google_auth import GoogleApiAuthorizer
+
+from emailsorter.core.scheduler import RequestScheduler, ScheduledHttp
+
+LOG = logging.getLogger(__name__)
+
+
+class ScheduledGmailWrapper(GmailWrapper):
+    """
+    GmailWrapper that sends its requests through a request scheduler.
+    """
+    def __init__(self, authorizer: GoogleApiAuthorizer, cache_strategy_type: CachingStrategyType,
+                 scheduler: RequestScheduler, output_basedir: str = None):
+        # Same as GmailWrapper.__init__, but the service is built once, with the transport of the scheduler
+        self.authed_session = authorizer.authorize()
+        cache_strategy = cache_strategy_type.value(output_basedir, self.authed_session.project_name,
+                                                   self.authed_session.user_email)
+        self.api_fetching_ctx = ApiFetchingContext(cache_strategy)
+        service_type = authorizer.service_type
+        self.http = AuthorizedHttp(self.authed_session.authed_creds, http=ScheduledHttp(scheduler))
+        self.fetcher = GmailApiFetcher(build(service_type.service_name, service_type.default_api_version,
+                                             http=self.http))
+        LOG.debug("Gmail API requests are paced by the request scheduler: %s", scheduler.config)
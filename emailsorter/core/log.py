@@ -0,0 +1,155 @@
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+
+LOG = logging.getLogger(__name__)
+
+
+class DeferredFormattingQueueHandler(QueueHandler):
+    """
+    Puts the records to the queue as they are, the message is formatted by the handlers in the writer thread.
+    As the records are not pickled, the arguments of a log call must not be modified after the call.
+    """
+    def prepare(self, record):
+        return record
+
+
+class RoutingQueueListener(QueueListener):
+    """
+    Records queued by a RoutedQueueHandler are only handled by the target handler of the RoutedQueueHandler,
+    other records by all handlers of the listener.
+    """
+    def handle(self, record):
+        if isinstance(record, tuple):
+            target, record = record
+            target.handle(record)
+        else:
+            super().handle(record)
+
+
+class RoutedQueueHandler(logging.Handler):
+    """
+    Hands the records over to the target handler in the writer thread of the QueueLogging.
+    If queue logging is not started, the records are handled by the target handler in the logging thread.
+    """
+    def __init__(self, queue_logging: 'QueueLogging', target: logging.Handler):
+        super().__init__()
+        self._queue_logging = queue_logging
+        self.target = target
+
+    def handle(self, record):
+        if self._queue_logging.started:
+            self._queue_logging.enqueue((self.target, record))
+        else:
+            self.target.handle(record)
+
+    def emit(self, record):
+        pass
+
+
+class QueueLogging:
+    """
+    Moves the handlers of a logger to a background writer thread.
+    The logging thread only creates the record and puts it to an unbounded queue,
+    formatting and writing to the files and to the console happens in the writer thread.
+    Handlers that are not attached to the logger can be moved to the writer thread as well, see route.
+    """
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+        self._queue = queue.SimpleQueue()
+        self._handlers: List[logging.Handler] = []
+        self._queue_handler: Optional[QueueHandler] = None
+        self._listener: Optional[QueueListener] = None
+
+    @property
+    def started(self) -> bool:
+        return self._listener is not None
+
+    def start(self):
+        if self.started:
+            return self
+        self._handlers = list(self._logger.handlers)
+        self._queue_handler = DeferredFormattingQueueHandler(self._queue)
+        self._listener = RoutingQueueListener(self._queue, *self._handlers, respect_handler_level=True)
+        for handler in self._handlers:
+            self._logger.removeHandler(handler)
+        self._logger.addHandler(self._queue_handler)
+        self._listener.start()
+        LOG.debug("Started queue logging of logger '%s' with handlers: %s", self._logger.name, self._handlers)
+        return self
+
+    def stop(self):
+        """
+        Writes all queued records and restores the original handlers of the logger.
+        """
+        if not self.started:
+            return
+        self._listener.stop()
+        self._logger.removeHandler(self._queue_handler)
+        for handler in self._handlers:
+            self._logger.addHandler(handler)
+        self._listener = None
+        self._queue_handler = None
+
+    def route(self, handler: logging.Handler) -> logging.Handler:
+        """
+        :return: Handler that queues the records for the given handler only, they are handled in the writer thread
+        """
+        return RoutedQueueHandler(self, handler)
+
+    def enqueue(self, item):
+        self._queue.put_nowait(item)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class SampledLog:
+    """
+    Logs a record of a hot loop (e.g. one per message) only for every n-th call
+    and at most 'max_per_second' times per second.
+    If the level is disabled for the logger, log returns without any formatting or clock reads,
+    hot loops can also check 'enabled' once and skip the call entirely.
+    """
+    # Defaults of the per-message logs, set from the command line
+    default_every = 1
+    default_max_per_second: Optional[int] = None
+
+    def __init__(self, logger: logging.Logger, level: int, every: int = None, max_per_second: int = None):
+        self._logger = logger
+        self._level = level
+        self._every = every or SampledLog.default_every
+        self._max_per_second = max_per_second if max_per_second is not None else SampledLog.default_max_per_second
+        if self._every < 1:
+            raise ValueError(f"every should be a positive number. Actual value: {self._every}")
+        self.enabled = logger.isEnabledFor(level)
+        self.no_of_calls = 0
+        self.no_of_logged = 0
+        self._window_start = 0.0
+        self._logged_in_window = 0
+
+    def log(self, msg, *args):
+        if not self.enabled:
+            return
+        self.no_of_calls += 1
+        if self.no_of_calls % self._every:
+            return
+        if self._max_per_second is not None:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._logged_in_window = 0
+            if self._logged_in_window >= self._max_per_second:
+                return
+            self._logged_in_window += 1
+        self.no_of_logged += 1
+        self._logger.log(self._level, msg, *args)
+
+    @property
+    def no_of_suppressed(self) -> int:
+        return self.no_of_calls - self.no_of_logged
@@ -0,0 +1,98 @@
+import datetime
+import json
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any
+
+from dataclasses_json import dataclass_json
+from pythoncommons.file_utils import FileUtils
+
+LOG = logging.getLogger(__name__)
+
+METRICS_FILENAME = "metrics.json"
+
+
+@dataclass_json
+@dataclass
+class PhaseSpan:
+    """
+    Time spent in a phase of a run, with the number of items (messages, pages, rows...) and bytes it handled.
+    The time of a phase can be accumulated from several intervals, e.g. the time spent waiting for pages.
+    """
+    name: str
+    started: str
+    seconds: float = 0.0
+    counts: Dict[str, int] = field(default_factory=dict)
+    bytes: int = 0
+
+    def incr(self, counter: str, value: int = 1):
+        self.counts[counter] = self.counts.get(counter, 0) + value
+
+    def add_seconds(self, seconds: float):
+        self.seconds += seconds
+
+    def get_rates(self) -> Dict[str, float]:
+        """
+        :return: Items per second for each counter
+        """
+        if not self.seconds:
+            return {}
+        return {counter: round(value / self.seconds, 1) for counter, value in self.counts.items()}
+
+
+class RunMetrics:
+    """
+    Collects one span per phase of a command run and writes them to the session dir as JSON,
+    so the runs of different mailboxes and versions can be compared.
+    """
+    def __init__(self, command: str, **attributes):
+        self.command = command
+        self.attributes: Dict[str, Any] = attributes
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self._start_time = time.perf_counter()
+        self.spans: Dict[str, PhaseSpan] = {}
+
+    def get_span(self, name: str) -> PhaseSpan:
+        """
+        :return: The span of the phase, created on the first call
+        """
+        if name not in self.spans:
+            self.spans[name] = PhaseSpan(name, datetime.datetime.now().isoformat(timespec="milliseconds"))
+        return self.spans[name]
+
+    @contextmanager
+    def phase(self, name: str):
+        span = self.get_span(name)
+        start_time = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.add_seconds(time.perf_counter() - start_time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        spans: List[Dict[str, Any]] = []
+        for span in self.spans.values():
+            span_dict = span.to_dict()
+            span_dict["seconds"] = round(span.seconds, 3)
+            span_dict["rates"] = span.get_rates()
+            spans.append(span_dict)
+        return {
+            "command": self.command,
+            "started": self.started,
+            "seconds": round(time.perf_counter() - self._start_time, 3),
+            "attributes": self.attributes,
+            "spans": spans,
+        }
+
+    def save(self, output_dir: str, file_name: str = METRICS_FILENAME) -> Optional[str]:
+        file = FileUtils.join_path(output_dir, file_name)
+        try:
+            with open(file, "w") as f:
+                json.dump(self.to_dict(), f, indent=2)
+        except OSError:
+            LOG.exception("Failed to save run metrics to %s", file)
+            return None
+        LOG.info("Saved run metrics to %s", file)
+        return file
@@ -1,16 +1,39 @@
 from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
 
 from emailsorter.common.model import ProcessorResultType
-from emailsorter.display.table import TableColumnStyles, TableRenderSettings, EmailTable
+from emailsorter.display.export import ExportFormat, create_exporter
+from emailsorter.display.table import TableColumnStyles, TableRenderSettings, EmailTable, ColumnType
 
 
 class InboxDiscoveryResults:
     @staticmethod
-    def print(rows, cols, render_settings: TableRenderSettings):
+    def print(rows, cols, render_settings: TableRenderSettings, col_types: Dict[str, ColumnType] = None):
         # TODO add this to TableRenderSettings: title="Grouping results", expand=True, min_width=300
-        table = EmailTable(cols, render_settings)
+        table = EmailTable(cols, render_settings, col_types=col_types)
         table.render(rows)
         table.print()
+        return table.rendered_rows
+
+    @staticmethod
+    def export(rows, cols, render_settings: TableRenderSettings, export_files: Dict[ExportFormat, str],
+               col_types: Dict[str, ColumnType] = None) -> List[str]:
+        """
+        Writes all rows in the order of the table to the files, regardless of the rows selected for the console.
+        :return: The written files
+        """
+        sorted_rows = EmailTable(cols, render_settings, col_types=col_types).sort(rows)
+        exporters = [create_exporter(fmt, path, cols, col_types=col_types) for fmt, path in export_files.items()]
+        try:
+            for exporter in exporters:
+                exporter.open()
+            for row in sorted_rows:
+                for exporter in exporters:
+                    exporter.write_row(row)
+        finally:
+            for exporter in exporters:
+                exporter.close()
+        return [exporter.file_path for exporter in exporters]
 
 
 class ProcessorRepresentationAbs(ABC):
@@ -22,6 +45,18 @@ class ProcessorRepresentationAbs(ABC):
     def get_col_styles(self):
         pass
 
+    def get_col_types(self) -> Dict[str, ColumnType]:
+        """
+        :return: Type of the values of the columns, the type of missing columns is detected from the values
+        """
+        return {}
+
+    def get_sort_column(self) -> Optional[str]:
+        """
+        :return: The column the rows of the table are sorted by, None keeps the order of the rows
+        """
+        return None
+
 
 class GroupingEmailMessageProcessorRepresentation(ProcessorRepresentationAbs):
     def __init__(self, result_type: ProcessorResultType):
@@ -34,6 +69,19 @@ class GroupingEmailMessageProcessorRepresentation(ProcessorRepresentationAbs):
             return ["Sender", "Count from this sender", "Recipient", "Date", "Subject", "Thread ID", "Message ID"]
         return None
 
+    def get_sort_column(self) -> Optional[str]:
+        return "Count from this sender"
+
+    def get_col_types(self) -> Dict[str, ColumnType]:
+        col_types = {"Sender": ColumnType.STRING, "Count from this sender": ColumnType.INT}
+        if self.result_type == ProcessorResultType.DETAILED:
+            col_types.update({"Recipient": ColumnType.STRING,
+                              "Date": ColumnType.DATE,
+                              "Subject": ColumnType.STRING,
+                              "Thread ID": ColumnType.STRING,
+                              "Message ID": ColumnType.STRING})
+        return col_types
+
     def get_col_styles(self):
         col_styles = TableColumnStyles()
         if self.result_type == ProcessorResultType.DETAILED:
@@ -57,12 +105,120 @@ class GroupingEmailMessageProcessorRepresentation(ProcessorRepresentationAbs):
         return col_styles
 
 
+class SenderRollupProcessorRepresentation(ProcessorRepresentationAbs):
+    COLS = {
+        ProcessorResultType.SENDER: ["Sender", "Domain", "Organization", "Count"],
+        ProcessorResultType.DOMAIN: ["Domain", "Organization", "Count", "Senders"],
+        ProcessorResultType.ORGANIZATION: ["Organization", "Count", "Domains", "Senders"],
+    }
+    COL_TYPES = {"Sender": ColumnType.STRING, "Domain": ColumnType.STRING, "Organization": ColumnType.STRING,
+                 "Count": ColumnType.INT, "Domains": ColumnType.INT, "Senders": ColumnType.INT}
+
+    def __init__(self, result_type: ProcessorResultType):
+        self.result_type = result_type
+
+    def get_cols(self):
+        return SenderRollupProcessorRepresentation.COLS[self.result_type]
+
+    def get_col_types(self) -> Dict[str, ColumnType]:
+        return {col: SenderRollupProcessorRepresentation.COL_TYPES[col] for col in self.get_cols()}
+
+    def get_col_styles(self):
+        col_styles = TableColumnStyles()
+        for col in self.get_cols():
+            if SenderRollupProcessorRepresentation.COL_TYPES[col] == ColumnType.INT:
+                col_styles.bind_format_to_column(col, no_wrap=True, justify="right")
+            else:
+                col_styles.bind_format_to_column(col, no_wrap=True, justify="left")
+        col_styles.bind_style(self.get_cols()[0], "cyan")
+        return col_styles
+
+    def get_sort_column(self) -> Optional[str]:
+        return "Count"
+
+
+class SenderTrendProcessorRepresentation(ProcessorRepresentationAbs):
+    COLS = ["Sender", "Count", "Latest", "Trend", "Histogram"]
+
+    def get_cols(self):
+        return SenderTrendProcessorRepresentation.COLS
+
+    def get_col_types(self) -> Dict[str, ColumnType]:
+        return {"Sender": ColumnType.STRING,
+                "Count": ColumnType.INT,
+                "Latest": ColumnType.INT,
+                "Trend": ColumnType.FLOAT,
+                "Histogram": ColumnType.STRING}
+
+    def get_col_styles(self):
+        col_styles = TableColumnStyles()
+        (col_styles
+         .bind_style("Sender", "cyan")
+         .bind_format_to_column("Sender", no_wrap=True, justify="left")
+         .bind_format_to_column("Count", no_wrap=True, justify="right")
+         .bind_format_to_column("Latest", no_wrap=True, justify="right")
+         .bind_format_to_column("Trend", no_wrap=True, justify="right")
+         .bind_style("Histogram", "magenta")
+         .bind_format_to_column("Histogram", no_wrap=True, justify="left"))
+        return col_styles
+
+    def get_sort_column(self) -> Optional[str]:
+        # Senders sending more and more messages first
+        return "Trend"
+
+
+class ApproximateSenderProcessorRepresentation(ProcessorRepresentationAbs):
+    COLS = ["Sender", "Count", "At least", "Max error", "Share (%)"]
+
+    def get_cols(self):
+        return ApproximateSenderProcessorRepresentation.COLS
+
+    def get_col_types(self) -> Dict[str, ColumnType]:
+        return {"Sender": ColumnType.STRING,
+                "Count": ColumnType.INT,
+                "At least": ColumnType.INT,
+                "Max error": ColumnType.INT,
+                "Share (%)": ColumnType.FLOAT}
+
+    def get_col_styles(self):
+        col_styles = TableColumnStyles()
+        (col_styles
+         .bind_style("Sender", "cyan")
+         .bind_format_to_column("Sender", no_wrap=True, justify="left")
+         .bind_style("Count", "cyan")
+         .bind_format_to_column("Count", no_wrap=True, justify="right")
+         .bind_format_to_column("At least", no_wrap=True, justify="right")
+         .bind_format_to_column("Max error", no_wrap=True, justify="right")
+         .bind_format_to_column("Share (%)", no_wrap=True, justify="right"))
+        return col_styles
+
+    def get_sort_column(self) -> Optional[str]:
+        return "Count"
+
+
+def create_processor_representation(result_type: ProcessorResultType) -> ProcessorRepresentationAbs:
+    if result_type == ProcessorResultType.TREND:
+        return SenderTrendProcessorRepresentation()
+    if result_type == ProcessorResultType.APPROXIMATE:
+        return ApproximateSenderProcessorRepresentation()
+    if result_type.is_rollup:
+        return SenderRollupProcessorRepresentation(result_type)
+    return GroupingEmailMessageProcessorRepresentation(result_type)
+
+
 class MultipleFilterResultProcessorRepresentation(ProcessorRepresentationAbs):
     def __init__(self):
         pass
 
     def get_cols(self):
-        return ["Filter", "Expression", "Gmail link"]
+        return ["Filter", "Expression", "Gmail link", "Query time (s)", "Count type"]
+
+    def get_col_types(self) -> Dict[str, ColumnType]:
+        return {"Filter": ColumnType.STRING,
+                "Expression": ColumnType.INT,
+                "Gmail link": ColumnType.STRING,
+                "Query time (s)": ColumnType.FLOAT,
+                "Count type": ColumnType.STRING}
 
     def get_col_styles(self):
         col_styles = TableColumnStyles()
@@ -70,5 +226,31 @@ class MultipleFilterResultProcessorRepresentation(ProcessorRepresentationAbs):
          .bind_style("Filter", "cyan")
          .bind_format_to_column("Expression", no_wrap=True, justify="left")
          .bind_style("Gmail link", "yellow")
-         .bind_format_to_column("Gmail link", no_wrap=True, justify="right"))
-        return col_styles
\ No newline at end of file
+         .bind_format_to_column("Gmail link", no_wrap=True, justify="right")
+         .bind_format_to_column("Query time (s)", no_wrap=True, justify="right")
+         .bind_format_to_column("Count type", no_wrap=True, justify="left"))
+        return col_styles
+
+
+class SnapshotDiffRepresentation(ProcessorRepresentationAbs):
+    COLS = ["Sender", "Before", "After", "Change", "Growth (%)"]
+
+    def get_cols(self):
+        return SnapshotDiffRepresentation.COLS
+
+    def get_col_types(self) -> Dict[str, ColumnType]:
+        return {"Sender": ColumnType.STRING,
+                "Before": ColumnType.INT,
+                "After": ColumnType.INT,
+                "Change": ColumnType.INT,
+                "Growth (%)": ColumnType.FLOAT}
+
+    def get_col_styles(self):
+        col_styles = TableColumnStyles()
+        col_styles.bind_style("Sender", "cyan").bind_format_to_column("Sender", no_wrap=True, justify="left")
+        for col in SnapshotDiffRepresentation.COLS[1:]:
+            col_styles.bind_format_to_column(col, no_wrap=True, justify="right")
+        return col_styles
+
+    def get_sort_column(self) -> Optional[str]:
+        return "Change"
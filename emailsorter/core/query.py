@@ -0,0 +1,443 @@
+import datetime
+import logging
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Tuple, Any, Iterable, Set, FrozenSet
+
+from emailsorter.core.error import UnsupportedQueryException
+
+LOG = logging.getLogger(__name__)
+
+TOKEN_REGEX = re.compile(r'\s*(?:(?P<lparen>\()|(?P<rparen>\))|(?P<lbrace>\{)|(?P<rbrace>\})|(?P<minus>-)(?=\S)|'
+                         r'(?P<operator>\w+):|(?P<quoted>"[^"]*")|(?P<word>[^\s(){}"]+))')
+GMAIL_DATE_FORMATS = ["%Y/%m/%d", "%Y-%m-%d", "%m/%d/%Y"]
+OR_KEYWORD = "OR"
+AND_KEYWORD = "AND"
+# Label IDs of system labels are the same as their names, user labels can't be matched by name locally
+SYSTEM_LABELS = {"inbox", "spam", "trash", "unread", "starred", "important", "sent", "draft", "chat",
+                 "category_personal", "category_social", "category_promotions", "category_updates",
+                 "category_forums"}
+
+
+class QueryOperator(Enum):
+    FROM = "from"
+    TO = "to"
+    SUBJECT = "subject"
+    LABEL = "label"
+    IN = "in"
+    CATEGORY = "category"
+    AFTER = "after"
+    BEFORE = "before"
+
+    @staticmethod
+    def from_str(val):
+        allowed_values = {op.value: op for op in QueryOperator}
+        if val.lower() not in allowed_values:
+            raise UnsupportedQueryException(f"Unsupported query operator: {val}. "
+                                            f"Supported operators: {list(allowed_values.keys())}")
+        return allowed_values[val.lower()]
+
+
+class QueryNode(ABC):
+    @abstractmethod
+    def to_sql(self) -> Tuple[str, List[Any]]:
+        """
+        Converts this node to an SQL condition for the 'messages' table of the MessageStore, aliased as 'm'.
+        """
+        pass
+
+    @abstractmethod
+    def matches(self, message: 'MessageMetadata') -> bool:
+        pass
+
+    @abstractmethod
+    def normalize(self) -> str:
+        """
+        :return: Canonical form of the query of this node, equivalent queries have the same canonical form
+        """
+        pass
+
+
+@dataclass
+class QueryTerm(QueryNode):
+    operator: QueryOperator
+    value: str
+
+    def __post_init__(self):
+        # Values are compared case-insensitively, normalize them once
+        self._lower_value = self.value.lower()
+        self._is_address = "@" in self.value
+        # @example.com and *@example.com match every address of the domain, like Gmail
+        self._domain_suffix = None
+        if self.operator in (QueryOperator.FROM, QueryOperator.TO) and self._lower_value.startswith(("@", "*@")):
+            self._domain_suffix = self._lower_value.lstrip("*")
+        self._label = None
+        self._millis = None
+        if self.operator in (QueryOperator.LABEL, QueryOperator.IN, QueryOperator.CATEGORY):
+            self._label = self._parse_label()
+        elif self.operator in (QueryOperator.AFTER, QueryOperator.BEFORE):
+            self._millis = self._parse_date_to_millis()
+
+    def to_sql(self) -> Tuple[str, List[Any]]:
+        """
+        Full email addresses are matched exactly so that the sender / recipient indices can be used,
+        domains of addresses (@example.com) as suffixes of the addresses,
+        other values are matched as substrings of the whole header, similarly to Gmail.
+        """
+        op = self.operator
+        if op == QueryOperator.FROM:
+            return self._address_condition("sender")
+        elif op == QueryOperator.TO:
+            return self._address_condition("recipient")
+        elif op == QueryOperator.SUBJECT:
+            return "COALESCE(m.subject, '') LIKE ? ESCAPE '\\'", [f"%{_escape_like(self.value)}%"]
+        elif self._label:
+            return "m.msg_id IN (SELECT msg_id FROM message_labels WHERE label = ?)", [self._label]
+        elif op == QueryOperator.AFTER:
+            return "m.date >= ?", [self._millis]
+        elif op == QueryOperator.BEFORE:
+            return "m.date < ?", [self._millis]
+        raise UnsupportedQueryException(f"Unsupported query operator: {op}")
+
+    def matches(self, message: 'MessageMetadata') -> bool:
+        op = self.operator
+        if op == QueryOperator.FROM:
+            return self._matches_address(message.sender_email, message.sender)
+        elif op == QueryOperator.TO:
+            return self._matches_address(message.recipient_email, message.recipient)
+        elif op == QueryOperator.SUBJECT:
+            return self._lower_value in (message.subject or "").lower()
+        elif self._label:
+            return self._label in message.labels
+        elif op == QueryOperator.AFTER:
+            return message.date >= self._millis
+        elif op == QueryOperator.BEFORE:
+            return message.date < self._millis
+        raise UnsupportedQueryException(f"Unsupported query operator: {op}")
+
+    def normalize(self) -> str:
+        if self._label:
+            # in:inbox, label:Inbox and label:INBOX query the same label
+            return f"label:{self._label}"
+        value = self._domain_suffix or self._lower_value
+        if any(c.isspace() or c in "(){}" for c in value):
+            value = f'"{value}"'
+        return f"{self.operator.value}:{value}"
+
+    def _address_condition(self, col: str):
+        if self._domain_suffix:
+            return f"COALESCE(m.{col}_email, '') LIKE ? ESCAPE '\\'", [f"%{_escape_like(self._domain_suffix)}"]
+        if self._is_address:
+            # Like matches(), a missing address is not equal to the value: -from:address keeps the message.
+            # The column is not wrapped in COALESCE so that its index can still be used.
+            return f"m.{col}_email IS NOT NULL AND m.{col}_email = ? COLLATE NOCASE", [self.value]
+        return f"COALESCE(m.{col}, '') LIKE ? ESCAPE '\\'", [f"%{_escape_like(self.value)}%"]
+
+    def _matches_address(self, email: str, header: str):
+        if self._domain_suffix:
+            return (email or "").lower().endswith(self._domain_suffix)
+        if self._is_address:
+            return (email or "").lower() == self._lower_value
+        return self._lower_value in (header or "").lower()
+
+    def _parse_label(self) -> str:
+        label = normalize_label(self.value)
+        if self.operator == QueryOperator.CATEGORY:
+            label = f"category_{label}"
+        if label not in SYSTEM_LABELS:
+            raise UnsupportedQueryException(f"Only system labels can be queried locally, found: {self.value}. "
+                                            f"Supported labels: {sorted(SYSTEM_LABELS)}")
+        return label
+
+    def _parse_date_to_millis(self) -> int:
+        if self.value.isdigit():
+            # Gmail accepts seconds since epoch as well
+            return int(self.value) * 1000
+        for fmt in GMAIL_DATE_FORMATS:
+            try:
+                return int(datetime.datetime.strptime(self.value, fmt).timestamp() * 1000)
+            except ValueError:
+                pass
+        raise UnsupportedQueryException(f"Unsupported date format: {self.value}. Supported formats: {GMAIL_DATE_FORMATS}")
+
+
+class QueryAnd(QueryNode):
+    def __init__(self, children: List[QueryNode]):
+        self.children = children
+
+    def to_sql(self) -> Tuple[str, List[Any]]:
+        return _join_sql(self.children, "AND")
+
+    def matches(self, message: 'MessageMetadata') -> bool:
+        return all(c.matches(message) for c in self.children)
+
+    def normalize(self) -> str:
+        return _normalize_children(self.children, "(", ")")
+
+    def __repr__(self):
+        return f"AND{self.children}"
+
+
+class QueryOr(QueryNode):
+    def __init__(self, children: List[QueryNode]):
+        self.children = children
+
+    def to_sql(self) -> Tuple[str, List[Any]]:
+        return _join_sql(self.children, "OR")
+
+    def matches(self, message: 'MessageMetadata') -> bool:
+        return any(c.matches(message) for c in self.children)
+
+    def normalize(self) -> str:
+        return _normalize_children(self.children, "{", "}")
+
+    def __repr__(self):
+        return f"OR{self.children}"
+
+
+class QueryNot(QueryNode):
+    def __init__(self, child: QueryNode):
+        self.child = child
+
+    def to_sql(self) -> Tuple[str, List[Any]]:
+        condition, params = self.child.to_sql()
+        return f"NOT ({condition})", params
+
+    def matches(self, message: 'MessageMetadata') -> bool:
+        return not self.child.matches(message)
+
+    def normalize(self) -> str:
+        return f"-{self.child.normalize()}"
+
+    def __repr__(self):
+        return f"NOT({self.child})"
+
+
+class QueryMatchAll(QueryNode):
+    def to_sql(self) -> Tuple[str, List[Any]]:
+        return "1 = 1", []
+
+    def matches(self, message: 'MessageMetadata') -> bool:
+        return True
+
+    def normalize(self) -> str:
+        return ""
+
+    def __repr__(self):
+        return "ALL"
+
+
+@dataclass
+class MessageMetadata:
+    """
+    Message fields that can be evaluated by parsed queries. Dates are in milliseconds since epoch.
+    """
+    msg_id: str
+    thread_id: str
+    subject: str
+    date: int
+    sender: str
+    sender_email: str
+    recipient: str
+    recipient_email: str
+    labels: FrozenSet[str]
+
+
+@dataclass
+class ParsedQuery:
+    query: str
+    root: QueryNode
+
+    def to_sql(self) -> Tuple[str, List[Any]]:
+        return self.root.to_sql()
+
+    def matches(self, message: MessageMetadata) -> bool:
+        return self.root.matches(message)
+
+
+class GmailQueryParser:
+    """
+    Parses the subset of the Gmail search syntax that can be evaluated locally:
+    operator:value terms (see QueryOperator), implicit AND, OR, negation with '-',
+    grouping with parentheses, '{}' groups (any of the items) and grouped values like from:(a OR b).
+    Free text search and other operators raise UnsupportedQueryException.
+    """
+    def __init__(self, query: str):
+        self.query = query
+        self.tokens: List[Tuple[str, str]] = GmailQueryParser._tokenize(query)
+        self.pos = 0
+
+    @staticmethod
+    def parse(query: str) -> ParsedQuery:
+        if not query or not query.strip():
+            return ParsedQuery(query, QueryMatchAll())
+        parser = GmailQueryParser(query)
+        root = parser._parse_or()
+        if parser._peek():
+            raise UnsupportedQueryException(f"Unexpected token '{parser._peek()[1]}' in query: {query}")
+        LOG.debug("Parsed query '%s' to: %s", query, root)
+        return ParsedQuery(query, root)
+
+    @staticmethod
+    def _tokenize(query: str) -> List[Tuple[str, str]]:
+        tokens = []
+        pos = 0
+        query = query.rstrip()
+        while pos < len(query):
+            match = TOKEN_REGEX.match(query, pos)
+            if not match or match.end() == pos:
+                raise UnsupportedQueryException(f"Can't parse query '{query}' at position {pos}")
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            pos = match.end()
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if not token:
+            raise UnsupportedQueryException(f"Unexpected end of query: {self.query}")
+        self.pos += 1
+        return token
+
+    def _expect(self, kind: str):
+        token = self._next()
+        if token[0] != kind:
+            raise UnsupportedQueryException(f"Expected {kind} but found '{token[1]}' in query: {self.query}")
+        return token
+
+    @staticmethod
+    def _is_keyword(token, keyword: str):
+        return token and token[0] == "word" and token[1] == keyword
+
+    def _parse_or(self) -> QueryNode:
+        children = [self._parse_and()]
+        while GmailQueryParser._is_keyword(self._peek(), OR_KEYWORD):
+            self._next()
+            children.append(self._parse_and())
+        return children[0] if len(children) == 1 else QueryOr(children)
+
+    def _parse_and(self) -> QueryNode:
+        children = []
+        while True:
+            token = self._peek()
+            if not token or token[0] in ("rparen", "rbrace") or GmailQueryParser._is_keyword(token, OR_KEYWORD):
+                break
+            if GmailQueryParser._is_keyword(token, AND_KEYWORD):
+                self._next()
+                continue
+            children.append(self._parse_unary())
+        if not children:
+            raise UnsupportedQueryException(f"Empty expression in query: {self.query}")
+        return children[0] if len(children) == 1 else QueryAnd(children)
+
+    def _parse_unary(self) -> QueryNode:
+        kind, value = self._next()
+        if kind == "minus":
+            return QueryNot(self._parse_unary())
+        elif kind == "lparen":
+            node = self._parse_or()
+            self._expect("rparen")
+            return node
+        elif kind == "lbrace":
+            children = []
+            while self._peek() and self._peek()[0] != "rbrace":
+                children.append(self._parse_unary())
+            self._expect("rbrace")
+            return children[0] if len(children) == 1 else QueryOr(children)
+        elif kind == "operator":
+            return self._parse_operator_value(QueryOperator.from_str(value))
+        raise UnsupportedQueryException(f"Free text search is not supported, found '{value}' in query: {self.query}")
+
+    def _parse_operator_value(self, operator: QueryOperator) -> QueryNode:
+        kind, value = self._next()
+        if kind in ("word", "quoted"):
+            return QueryTerm(operator, value.strip('"'))
+        elif kind in ("lparen", "lbrace"):
+            # Grouped values: from:(a OR b), from:(a b), from:{a b}
+            closing = "rparen" if kind == "lparen" else "rbrace"
+            children: List[QueryNode] = []
+            combine_with_or = kind == "lbrace"
+            while self._peek() and self._peek()[0] != closing:
+                token = self._next()
+                if GmailQueryParser._is_keyword(token, OR_KEYWORD):
+                    combine_with_or = True
+                elif token[0] == "minus":
+                    children.append(QueryNot(QueryTerm(operator, self._expect("word")[1])))
+                elif token[0] in ("word", "quoted"):
+                    children.append(QueryTerm(operator, token[1].strip('"')))
+                else:
+                    raise UnsupportedQueryException(f"Unexpected token '{token[1]}' in query: {self.query}")
+            self._expect(closing)
+            if not children:
+                raise UnsupportedQueryException(f"Empty value group in query: {self.query}")
+            if len(children) == 1:
+                return children[0]
+            return QueryOr(children) if combine_with_or else QueryAnd(children)
+        raise UnsupportedQueryException(f"Missing value for operator '{operator.value}' in query: {self.query}")
+
+
+class LocalFilterEvaluator:
+    """
+    Counts the threads matching each of the filter expressions with a single pass over the messages.
+    Expressions that can't be parsed are collected in 'unsupported' so they can be executed by Gmail instead.
+    """
+    def __init__(self, expressions: Iterable[str]):
+        self.compiled: List[Tuple[str, ParsedQuery]] = []
+        self.unsupported: List[Tuple[str, UnsupportedQueryException]] = []
+        for expression in dict.fromkeys(expressions):
+            try:
+                self.compiled.append((expression, GmailQueryParser.parse(expression)))
+            except UnsupportedQueryException as e:
+                self.unsupported.append((expression, e))
+
+    def is_supported(self, expression: str) -> bool:
+        return any(expression == e for e, _ in self.compiled)
+
+    def count_threads(self, messages: Iterable[MessageMetadata]) -> dict:
+        thread_ids_by_expression: List[Set[str]] = [set() for _ in self.compiled]
+        for message in messages:
+            for idx, (_, parsed_query) in enumerate(self.compiled):
+                if parsed_query.matches(message):
+                    thread_ids_by_expression[idx].add(message.thread_id)
+        return {expression: len(thread_ids_by_expression[idx]) for idx, (expression, _) in enumerate(self.compiled)}
+
+
+def _join_sql(children: List[QueryNode], keyword: str) -> Tuple[str, List[Any]]:
+    conditions = []
+    params = []
+    for child in children:
+        condition, child_params = child.to_sql()
+        conditions.append(f"({condition})")
+        params.extend(child_params)
+    return f" {keyword} ".join(conditions), params
+
+
+def _escape_like(value: str) -> str:
+    # Values are matched literally by matches(), % and _ must not act as wildcards of LIKE
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _normalize_children(children: List[QueryNode], start: str, end: str) -> str:
+    # The order and the repetition of the terms don't matter
+    normalized = sorted(set(child.normalize() for child in children))
+    return normalized[0] if len(normalized) == 1 else f"{start}{' '.join(normalized)}{end}"
+
+
+def normalize_query(query: str) -> str:
+    """
+    :return: Canonical form of the query, e.g. for keys of query results.
+    Queries that can't be parsed only have their whitespace normalized.
+    """
+    try:
+        return GmailQueryParser.parse(query).root.normalize()
+    except UnsupportedQueryException:
+        return " ".join((query or "").split())
+
+
+def normalize_label(label: str) -> str:
+    # System labels are stored as label IDs (e.g. INBOX, CATEGORY_PROMOTIONS), Gmail queries are case-insensitive
+    return label.lower().replace(" ", "_").replace("-", "_")
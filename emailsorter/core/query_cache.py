@@ -0,0 +1,171 @@
+import json
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Callable
+
+from googleapiwrapper.utils import CommonUtils
+from pythoncommons.file_utils import FileUtils
+
+from emailsorter.core.constants import DEFAULT_QUERY_CACHE_TTL, DEFAULT_QUERY_CACHE_SIZE
+from emailsorter.core.query import normalize_query
+
+LOG = logging.getLogger(__name__)
+
+QUERY_CACHE_FILENAME = "query_cache.sqlite3"
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS query_results ("
+    "query TEXT PRIMARY KEY, count INTEGER NOT NULL, exact INTEGER NOT NULL, complete INTEGER NOT NULL, "
+    "thread_ids TEXT, history_id TEXT, created REAL NOT NULL, accessed REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_query_results_accessed ON query_results (accessed)",
+]
+
+
+@dataclass
+class QueryCacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    invalidated: int = 0
+    evicted: int = 0
+
+
+@dataclass
+class CachedQueryResult:
+    query: str
+    count: int
+    # False if the count is the result size estimate of the Gmail API
+    exact: bool
+    # False if the count was cut off by the request limit
+    complete: bool
+    thread_ids: Optional[List[str]]
+    # History ID of the mailbox when the query was executed
+    history_id: Optional[str]
+    created: float
+
+
+class QueryResultCache:
+    """
+    Results of Gmail queries (thread count and thread IDs) kept across runs in an SQLite database,
+    keyed by the normalized query, so equivalent filter expressions share their results.
+    Results are dropped when they are older than the TTL or when the history ID of the mailbox changed,
+    i.e. messages were added, removed or relabeled since the query was executed.
+    The least recently used results are evicted when there are more than 'max_entries' results.
+    """
+    SCHEMA_VERSION = "1"
+
+    def __init__(self, db_file: str, ttl: float = DEFAULT_QUERY_CACHE_TTL, max_entries: int = DEFAULT_QUERY_CACHE_SIZE,
+                 clock: Callable[[], float] = time.time):
+        if max_entries < 1:
+            raise ValueError(f"Size of the query cache should be a positive number. Actual value: {max_entries}")
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = QueryCacheStats()
+        self._clock = clock
+        self._conn = sqlite3.connect(db_file)
+        self._ensure_schema()
+
+    @staticmethod
+    def for_account(email_cache_dir: str, account_email: str, **kwargs) -> 'QueryResultCache':
+        account_dir = FileUtils.join_path(email_cache_dir, CommonUtils.convert_email_address_to_dirname(account_email))
+        FileUtils.ensure_dir_created(account_dir)
+        return QueryResultCache(FileUtils.join_path(account_dir, QUERY_CACHE_FILENAME), **kwargs)
+
+    def _ensure_schema(self):
+        version = None
+        try:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            version = row[0] if row else None
+        except sqlite3.OperationalError:
+            pass
+        if version and version != QueryResultCache.SCHEMA_VERSION:
+            LOG.info("Query cache schema version changed (%s -> %s), recreating: %s",
+                     version, QueryResultCache.SCHEMA_VERSION, self.db_file)
+            with self._conn:
+                for table in ["meta", "query_results"]:
+                    self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+        with self._conn:
+            for stmt in SCHEMA:
+                self._conn.execute(stmt)
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                               (QueryResultCache.SCHEMA_VERSION,))
+
+    def get(self, query: str, history_id: Optional[str], limit: int = None,
+            exact: bool = True) -> Optional[CachedQueryResult]:
+        """
+        :param history_id: Current history ID of the mailbox, None if unknown
+        :param exact: Whether an estimated count can answer the query
+        :return: The result of the query, with the count cut off at the limit, None if there is no usable result
+        """
+        key = normalize_query(query)
+        row = self._conn.execute("SELECT query, count, exact, complete, thread_ids, history_id, created "
+                                 "FROM query_results WHERE query = ?", (key,)).fetchone()
+        result = QueryResultCache._to_result(row) if row else None
+        now = self._clock()
+        if result and now - result.created > self.ttl:
+            LOG.debug("Cached result of query '%s' expired", key)
+            self.stats.expired += 1
+            self._delete(key)
+            result = None
+        elif result and history_id and result.history_id != history_id:
+            LOG.debug("Mailbox changed since query '%s' was cached (history ID %s -> %s)",
+                      key, result.history_id, history_id)
+            self.stats.invalidated += 1
+            self._delete(key)
+            result = None
+        if result and ((exact and not result.exact) or (not result.complete and (not limit or result.count < limit))):
+            result = None
+        if not result:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        with self._conn:
+            self._conn.execute("UPDATE query_results SET accessed = ? WHERE query = ?", (now, key))
+        if limit and result.count > limit:
+            result.count = limit
+            result.complete = False
+            if result.thread_ids is not None:
+                result.thread_ids = result.thread_ids[:limit]
+        return result
+
+    def put(self, query: str, count: int, exact: bool, history_id: Optional[str], limit: int = None,
+            thread_ids: List[str] = None):
+        """
+        :param limit: Request limit the query was executed with, the count may have been cut off at the limit
+        """
+        key = normalize_query(query)
+        complete = not limit or count < limit
+        now = self._clock()
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO query_results "
+                               "(query, count, exact, complete, thread_ids, history_id, created, accessed) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, count, exact, complete, json.dumps(thread_ids) if thread_ids is not None else None,
+                                history_id, now, now))
+            cursor = self._conn.execute("DELETE FROM query_results WHERE query IN "
+                                        "(SELECT query FROM query_results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                                        (self.max_entries,))
+        if cursor.rowcount > 0:
+            LOG.debug("Evicted %d results from the query cache", cursor.rowcount)
+            self.stats.evicted += cursor.rowcount
+
+    def size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM query_results").fetchone()[0]
+
+    def _delete(self, key: str):
+        with self._conn:
+            self._conn.execute("DELETE FROM query_results WHERE query = ?", (key,))
+
+    @staticmethod
+    def _to_result(row) -> CachedQueryResult:
+        query, count, exact, complete, thread_ids, history_id, created = row
+        return CachedQueryResult(query, count, bool(exact), bool(complete),
+                                 json.loads(thread_ids) if thread_ids is not None else None, history_id, created)
+
+    def close(self):
+        self._conn.close()
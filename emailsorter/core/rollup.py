@@ -0,0 +1,171 @@
+import logging
+from typing import Dict, Optional, Tuple, Iterator, Any, List
+
+LOG = logging.getLogger(__name__)
+
+# Domain of senders without a (valid) email address
+UNKNOWN_DOMAIN = "(unknown)"
+# Public suffixes of more than one label, the registrable domain of e.g. mail.example.co.uk is example.co.uk.
+# Not the complete Public Suffix List, only the second level domains that are common in sender addresses.
+MULTI_LABEL_PUBLIC_SUFFIXES = frozenset([
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "ltd.uk", "plc.uk", "me.uk", "net.uk", "nhs.uk",
+    "com.au", "net.au", "org.au", "edu.au", "gov.au",
+    "co.nz", "org.nz", "net.nz", "govt.nz",
+    "co.jp", "ne.jp", "or.jp", "ac.jp", "go.jp",
+    "co.kr", "or.kr", "ac.kr",
+    "com.cn", "net.cn", "org.cn", "edu.cn", "gov.cn",
+    "com.hk", "com.tw", "com.sg", "com.my", "com.ph", "co.th", "co.id", "co.il", "co.in", "net.in", "org.in",
+    "com.br", "net.br", "org.br", "gov.br", "com.mx", "com.ar", "com.co", "com.pe", "com.uy",
+    "co.za", "org.za", "com.tr", "com.ua", "com.pl", "com.ru", "com.eg", "com.sa", "com.ng",
+    "ac.at", "co.at", "or.at", "gv.at",
+])
+
+
+def split_address(address: Optional[str]) -> Tuple[str, str]:
+    """
+    :return: Local part and domain of the address, the domain is lower case. The domain of invalid addresses
+    is UNKNOWN_DOMAIN and the local part is the whole address.
+    """
+    if not address:
+        return "", UNKNOWN_DOMAIN
+    local, sep, domain = address.rpartition("@")
+    domain = domain.strip().strip(".").lower()
+    if not sep or not domain:
+        return address, UNKNOWN_DOMAIN
+    return local, domain
+
+
+def get_registrable_domain(domain: str) -> str:
+    """
+    :return: The domain directly under the public suffix (e.g. example.com for mail.example.com),
+    the organization that registered the domain
+    """
+    labels = domain.split(".")
+    if len(labels) <= 2:
+        return domain
+    if ".".join(labels[-2:]) in MULTI_LABEL_PUBLIC_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+class DomainNode:
+    """
+    Node of a DomainTrie, a domain name with the counts of the messages sent from the domain and its subdomains.
+    """
+    __slots__ = ("domain", "parent", "children", "senders", "count", "is_organization", "example")
+
+    def __init__(self, domain: str, parent: Optional['DomainNode']):
+        self.domain = domain
+        self.parent = parent
+        # Label of the subdomain -> node, e.g. 'mail' for mail.example.com under example.com
+        self.children: Dict[str, DomainNode] = {}
+        # Local part of the addresses of the domain -> number of messages
+        self.senders: Dict[str, int] = {}
+        # Number of messages from the domain and its subdomains
+        self.count = 0
+        # Registrable domain, the highest level below the public suffix
+        self.is_organization = False
+        # Last message from the domain or its subdomains
+        self.example: Any = None
+
+    @property
+    def organization(self) -> Optional['DomainNode']:
+        node = self
+        while node and not node.is_organization:
+            node = node.parent
+        return node
+
+    def iter_nodes(self) -> Iterator['DomainNode']:
+        """
+        Iterates over this node and its descendants, parents first and children in the order they were added.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(node.children.values())))
+
+    def __repr__(self):
+        return f"DomainNode({self.domain or '<root>'}, count={self.count})"
+
+
+class DomainTrie:
+    """
+    Message counts of sender addresses, rolled up to the domains of the addresses, to all their parent domains
+    and to their registrable domain (organization) while the messages are counted.
+    Domains are stored with their labels reversed (com -> example -> mail), so the counts of a domain
+    include the counts of its subdomains and any domain can be drilled down into without counting again.
+    """
+    def __init__(self):
+        self.root = DomainNode("", None)
+        # Every node of the trie by its domain, most messages come from domains that were seen before
+        self._nodes_by_domain: Dict[str, DomainNode] = {}
+
+    def add(self, address: Optional[str], count: int = 1, example: Any = None) -> Tuple[str, DomainNode]:
+        """
+        :return: The normalized address (with a lower case domain) and the node of its domain
+        """
+        local, domain = split_address(address)
+        node = self._nodes_by_domain.get(domain)
+        if node is None:
+            node = self._insert_domain(domain)
+        elif not node.senders:
+            # The domain was only inserted as the parent of other domains, its organization may not be marked yet
+            self._nodes_by_domain[get_registrable_domain(domain)].is_organization = True
+        node.senders[local] = node.senders.get(local, 0) + count
+        parent = node
+        while parent is not None:
+            parent.count += count
+            if example is not None:
+                parent.example = example
+            parent = parent.parent
+        return DomainTrie.join_address(local, domain), node
+
+    def _insert_domain(self, domain: str) -> DomainNode:
+        node = self.root
+        labels = domain.split(".")
+        for idx in range(len(labels) - 1, -1, -1):
+            child = node.children.get(labels[idx])
+            if child is None:
+                child = DomainNode(".".join(labels[idx:]), node)
+                node.children[labels[idx]] = child
+                self._nodes_by_domain[child.domain] = child
+            node = child
+        self._nodes_by_domain[get_registrable_domain(domain)].is_organization = True
+        return node
+
+    def find(self, domain: str) -> Optional[DomainNode]:
+        return self._nodes_by_domain.get(domain.strip().strip(".").lower())
+
+    def merge(self, other: 'DomainTrie'):
+        """
+        Adds the counts of the other trie to this one. The examples of the other trie are kept,
+        as they are the last messages if the other trie counted the messages after the ones counted by this trie.
+        """
+        for node in other.root.iter_nodes():
+            for local, count in node.senders.items():
+                self.add(DomainTrie.join_address(local, node.domain), count)
+        for node in other.root.iter_nodes():
+            if node is not other.root and node.example is not None:
+                self._nodes_by_domain[node.domain].example = node.example
+
+    def count_distinct(self, node: DomainNode) -> Dict[DomainNode, Tuple[int, int]]:
+        """
+        :return: Number of domains with senders and number of distinct sender addresses under each node
+        of the subtree of the node (including the node)
+        """
+        totals: Dict[DomainNode, Tuple[int, int]] = {}
+        nodes: List[DomainNode] = list(node.iter_nodes())
+        for n in reversed(nodes):
+            domains = 1 if n.senders else 0
+            senders = len(n.senders)
+            for child in n.children.values():
+                child_domains, child_senders = totals[child]
+                domains += child_domains
+                senders += child_senders
+            totals[n] = (domains, senders)
+        return totals
+
+    @staticmethod
+    def join_address(local: str, domain: str) -> str:
+        return local if domain == UNKNOWN_DOMAIN else f"{local}@{domain}"
@@ -0,0 +1,274 @@
+import dataclasses
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+from typing import Callable, Tuple, Any, Optional
+
+LOG = logging.getLogger(__name__)
+
+# Per-user quota of the Gmail API
+DEFAULT_QUOTA_UNITS_PER_SECOND = 250
+GMAIL_PATH_PREFIX = "/gmail/v1/users/"
+BATCH_PATH = "/batch"
+# Quota units of the methods of the Gmail API, by resource and method
+QUOTA_UNITS = {
+    ("threads", "list"): 10,
+    ("threads", "get"): 10,
+    ("messages", "list"): 5,
+    ("messages", "get"): 5,
+    ("attachments", "get"): 5,
+    ("history", "list"): 2,
+    ("labels", "list"): 1,
+    ("labels", "get"): 1,
+}
+DEFAULT_QUOTA_UNITS = 5
+THROTTLING_STATUSES = {429, 500, 502, 503, 504}
+# Gmail answers with 403 instead of 429 for some of the rate limits
+RATE_LIMIT_REASONS = (b"rateLimitExceeded", b"userRateLimitExceeded")
+BATCH_REQUEST_LINE = re.compile(r"^(GET|POST|PUT|PATCH|DELETE) (\S+) HTTP/1\.1", re.MULTILINE)
+
+
+def get_quota_units(method: str, uri: str, body: Any = None) -> int:
+    """
+    :return: Quota units the Gmail API charges for the request, the sum of the units of its calls for batch requests
+    """
+    path = urllib.parse.urlsplit(uri).path
+    if path == BATCH_PATH:
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", errors="replace")
+        return sum(get_quota_units(m.group(1), m.group(2)) for m in BATCH_REQUEST_LINE.finditer(body or ""))
+    if not path.startswith(GMAIL_PATH_PREFIX):
+        # E.g. refreshing the access token
+        return 0
+    # <user ID>/<resource>[/<ID>[/<resource>[/<ID>]]]
+    segments = path[len(GMAIL_PATH_PREFIX):].split("/")[1:]
+    if not segments:
+        return DEFAULT_QUOTA_UNITS
+    resource_idx = len(segments) - 1 if len(segments) % 2 == 1 else len(segments) - 2
+    api_method = "list" if len(segments) % 2 == 1 and method == "GET" else "get"
+    return QUOTA_UNITS.get((segments[resource_idx], api_method), DEFAULT_QUOTA_UNITS)
+
+
+@dataclass
+class RequestSchedulerConfig:
+    """
+    Settings of the request scheduler, picklable so worker processes can set up their own scheduler.
+    """
+    units_per_second: float = DEFAULT_QUOTA_UNITS_PER_SECOND
+    # Units that can be spent at once after an idle period, in seconds of the rate
+    burst_seconds: float = 1.0
+    # Number of times a throttled request is sent again, the response of the last attempt is returned
+    max_retries: int = 5
+    initial_backoff: float = 1.0
+    max_backoff: float = 32.0
+
+    def share(self, no_of_schedulers: int) -> 'RequestSchedulerConfig':
+        """
+        :return: Config of a scheduler that gets an equal share of the quota with the other schedulers
+        """
+        return dataclasses.replace(self, units_per_second=self.units_per_second / no_of_schedulers)
+
+
+@dataclass
+class RequestSchedulerStats:
+    requests: int = 0
+    units: int = 0
+    throttled: int = 0
+    retries: int = 0
+    waited_seconds: float = 0.0
+
+
+class TokenBucket:
+    """
+    Rate limiter of quota units. A caller takes the units right away, even if that leaves the bucket
+    in debt, and sleeps until the units it took have been refilled, so large requests aren't starved
+    and callers are served in the order they arrived.
+    """
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float) -> float:
+        """
+        :return: Seconds waited for the units
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= units
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class RequestScheduler:
+    """
+    Paces the requests of all Gmail API clients of a process to the quota of the account.
+    Requests take their quota units from a token bucket. Only their rate is limited, not their concurrency:
+    a process sends requests from its main thread and at most one prefetching thread.
+    Throttled requests (429, 5xx, 403 rate limit errors) pause all requests for an exponentially growing
+    backoff period, lower the rate of the bucket and are sent again. Successful requests reset the backoff
+    and let the rate recover to the configured one.
+    """
+    MIN_RATE_RATIO = 0.1
+    RATE_DECREASE_RATIO = 0.8
+    RATE_INCREASE_RATIO = 0.05
+
+    def __init__(self, config: RequestSchedulerConfig = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.config = config or RequestSchedulerConfig()
+        self._clock = clock
+        self._sleep = sleep
+        self.bucket = TokenBucket(self.config.units_per_second,
+                                  self.config.units_per_second * self.config.burst_seconds, clock=clock, sleep=sleep)
+        self.stats = RequestSchedulerStats()
+        self._backoff = 0.0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def execute(self, send: Callable[[], Tuple[Any, bytes]], units: int) -> Tuple[Any, bytes]:
+        """
+        :param send: Sends the request, returns the response (with a status) and the content like httplib2
+        """
+        attempt = 0
+        while True:
+            waited = self._wait_for_backoff()
+            waited += self.bucket.acquire(units)
+            response, content = send()
+            throttled = RequestScheduler._is_throttled(response.status, content)
+            with self._lock:
+                self.stats.requests += 1
+                self.stats.units += units
+                self.stats.waited_seconds += waited
+                if attempt:
+                    self.stats.retries += 1
+            if not throttled:
+                self._record_success()
+                return response, content
+            self.record_throttled(retry_after=RequestScheduler._get_retry_after(response))
+            if attempt >= self.config.max_retries:
+                LOG.warning("Giving up on request after %d attempts, status: %s", attempt + 1, response.status)
+                return response, content
+            attempt += 1
+
+    def get_max_calls_per_burst(self, units_per_call: int) -> int:
+        """
+        :return: Number of calls that can be sent at once without exceeding the quota, e.g. in a batch request
+        """
+        return max(1, int(self.bucket.capacity // max(1, units_per_call)))
+
+    def record_throttled(self, retry_after: float = None):
+        """
+        Backs off all requests, e.g. because calls of a batch request were throttled
+        """
+        with self._lock:
+            self.stats.throttled += 1
+            backoff = self._backoff * 2 if self._backoff else self.config.initial_backoff
+            self._backoff = min(self.config.max_backoff, backoff)
+            delay = retry_after if retry_after is not None else random.uniform(0.5, 1.0) * self._backoff
+            self._resume_at = max(self._resume_at, self._clock() + delay)
+            min_rate = self.config.units_per_second * RequestScheduler.MIN_RATE_RATIO
+            self.bucket.rate = max(min_rate, self.bucket.rate * RequestScheduler.RATE_DECREASE_RATIO)
+            LOG.debug("Request throttled, pausing requests for %.2f seconds, rate: %.1f units/s",
+                      delay, self.bucket.rate)
+
+    def _record_success(self):
+        with self._lock:
+            self._backoff = 0.0
+            if self.bucket.rate < self.config.units_per_second:
+                increase = self.config.units_per_second * RequestScheduler.RATE_INCREASE_RATIO
+                self.bucket.rate = min(self.config.units_per_second, self.bucket.rate + increase)
+
+    def _wait_for_backoff(self) -> float:
+        with self._lock:
+            wait = self._resume_at - self._clock()
+        if wait > 0:
+            self._sleep(wait)
+            return wait
+        return 0.0
+
+    @staticmethod
+    def _is_throttled(status: int, content: bytes) -> bool:
+        if status in THROTTLING_STATUSES:
+            return True
+        return status == 403 and isinstance(content, bytes) and any(r in content for r in RATE_LIMIT_REASONS)
+
+    @staticmethod
+    def _get_retry_after(response) -> Optional[float]:
+        try:
+            return float(response.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+
+class ScheduledHttp:
+    """
+    Transport for the Google API client with the interface of httplib2.Http.
+    Requests are sent through the scheduler, on keep-alive connections of a pool that can be used by several threads.
+    """
+    def __init__(self, scheduler: RequestScheduler, timeout: float = None):
+        import httplib2
+
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.follow_redirects = True
+        self.redirect_codes = httplib2.REDIRECT_CODES
+        self.connections = {}
+        self.connections_created = 0
+        self._pool: queue.LifoQueue = queue.LifoQueue()
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        units = get_quota_units(method, uri, body)
+
+        def send():
+            http = self._checkout()
+            try:
+                return http.request(uri, method=method, body=body, headers=headers, redirections=redirections,
+                                    connection_type=connection_type)
+            finally:
+                self._pool.put(http)
+
+        return self.scheduler.execute(send, units)
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            import httplib2
+
+            self.connections_created += 1
+            http = httplib2.Http(timeout=self.timeout)
+            http.follow_redirects = self.follow_redirects
+            http.redirect_codes = self.redirect_codes
+            return http
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def get_scheduler(http) -> Optional[RequestScheduler]:
+    """
+    :return: Scheduler of the transport, which may be wrapped into an authorizing transport
+    """
+    while http is not None:
+        if isinstance(http, ScheduledHttp):
+            return http.scheduler
+        http = getattr(http, "http", None)
+    return None
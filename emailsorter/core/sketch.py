@@ -0,0 +1,176 @@
+import hashlib
+import heapq
+import itertools
+import logging
+import math
+from typing import Any, Dict, List, Tuple
+
+LOG = logging.getLogger(__name__)
+
+# Number of distinct values buffered by a HyperLogLog before they are hashed
+PENDING_VALUES_SIZE = 4096
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct values in constant memory: 2^precision registers of one byte.
+    The relative standard error of the estimate is 1.04 / sqrt(2^precision), 0.8% with the default precision.
+    Values are hashed with BLAKE2b, so sketches of different processes and runs can be merged.
+    """
+    def __init__(self, precision: int = 14):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"Precision should be between 4 and 18. Actual value: {precision}")
+        self.precision = precision
+        self._registers = bytearray(1 << precision)
+        # Adding a value again doesn't change the registers, values are buffered so repeated values
+        # (e.g. recipients, frequent senders) are hashed once per batch
+        self._pending = set()
+
+    def add(self, value: str):
+        self._pending.add(value)
+        if len(self._pending) >= PENDING_VALUES_SIZE:
+            self._flush()
+
+    def _flush(self):
+        registers = self._registers
+        bits = 64 - self.precision
+        mask = (1 << bits) - 1
+        for value in self._pending:
+            hash_value = int.from_bytes(hashlib.blake2b(value.encode("utf-8", "surrogatepass"), digest_size=8).digest(),
+                                        "little")
+            idx = hash_value >> bits
+            # Position of the first 1 bit in the remaining bits of the hash
+            rank = bits - (hash_value & mask).bit_length() + 1
+            if rank > registers[idx]:
+                registers[idx] = rank
+        self._pending.clear()
+
+    @property
+    def registers(self) -> bytearray:
+        self._flush()
+        return self._registers
+
+    @registers.setter
+    def registers(self, registers: bytearray):
+        if len(registers) != 1 << self.precision:
+            raise ValueError(f"Expected {1 << self.precision} registers. Actual number: {len(registers)}")
+        self._pending.clear()
+        self._registers = registers
+
+    def merge(self, other: 'HyperLogLog'):
+        """
+        Afterwards the sketch estimates the number of distinct values added to any of the two sketches
+        """
+        if other.precision != self.precision:
+            raise ValueError(f"Can't merge sketches of different precisions: {self.precision}, {other.precision}")
+        self._registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        registers = self.registers
+        m = len(registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / math.fsum(2.0 ** -register for register in registers)
+        zeros = registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self._registers))
+
+    def __getstate__(self):
+        # Sketches are sent back from the worker processes of parallel processing, only the registers are sent
+        return {"precision": self.precision, "registers": self.registers}
+
+    def __setstate__(self, state):
+        self.precision = state["precision"]
+        self._registers = state["registers"]
+        self._pending = set()
+
+
+class SpaceSaving:
+    """
+    Counts the most frequent items of a stream with a fixed number of counters (Space-Saving algorithm).
+    When all counters are in use, the item with the smallest count is replaced by the new item, which takes over
+    the count of the replaced item as its error. The count of an item is an upper bound of its true count,
+    the count minus its error a lower bound. Items that are not counted occurred at most 'max_error' times,
+    at most total / capacity times without merges, so the most frequent items are always counted.
+    Each counted item keeps a value, the value given when it was added last.
+    """
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"Capacity should be a positive number. Actual value: {capacity}")
+        self.capacity = capacity
+        self.counts: Dict[Any, int] = {}
+        self.errors: Dict[Any, int] = {}
+        self.values: Dict[Any, Any] = {}
+        # Upper bound of the count of the items that are not counted
+        self.max_error = 0
+        # Count, sequence number and item of each counted item. Counts are not updated when an item is added,
+        # the entries are only refreshed when they are at the top of the heap.
+        self._heap: List[Tuple[int, int, Any]] = []
+        self._seq = 0
+
+    def add(self, item, weight: int = 1, value: Any = None):
+        count = self.counts.get(item)
+        if count is not None:
+            self.counts[item] = count + weight
+        else:
+            if len(self.counts) >= self.capacity:
+                self.max_error = max(self.max_error, self._evict_min())
+            self.counts[item] = self.max_error + weight
+            self.errors[item] = self.max_error
+            heapq.heappush(self._heap, (self.max_error + weight, self._next_seq(), item))
+        self.values[item] = value
+
+    def _next_seq(self) -> int:
+        # Entries with the same count are ordered by their sequence number, the items are never compared
+        self._seq += 1
+        return self._seq
+
+    def _evict_min(self) -> int:
+        """
+        :return: Count of the evicted item
+        """
+        while True:
+            count, _, item = self._heap[0]
+            current_count = self.counts[item]
+            if current_count == count:
+                heapq.heappop(self._heap)
+                del self.counts[item], self.errors[item], self.values[item]
+                return count
+            heapq.heapreplace(self._heap, (current_count, self._next_seq(), item))
+
+    def merge(self, other: 'SpaceSaving'):
+        """
+        Afterwards the counts are the sums of the counts of the two sketches, items counted by only one of them
+        add the 'max_error' of the other one to their count and error. The items with the largest counts are kept.
+        """
+        if other.capacity != self.capacity:
+            raise ValueError(f"Can't merge sketches of different capacities: {self.capacity}, {other.capacity}")
+        counts, errors, values = {}, {}, {}
+        for item in itertools.chain(self.counts, (item for item in other.counts if item not in self.counts)):
+            counts[item] = self.counts.get(item, self.max_error) + other.counts.get(item, other.max_error)
+            errors[item] = self.errors.get(item, self.max_error) + other.errors.get(item, other.max_error)
+            values[item] = other.values[item] if item in other.values else self.values[item]
+        max_error = self.max_error + other.max_error
+        # Items with the same count keep their order
+        items = sorted(counts, key=lambda i: -counts[i])
+        for item in items[self.capacity:]:
+            max_error = max(max_error, counts[item])
+        items = items[:self.capacity]
+        self.load({item: counts[item] for item in items}, {item: errors[item] for item in items},
+                  {item: values[item] for item in items}, max_error)
+
+    def load(self, counts: Dict[Any, int], errors: Dict[Any, int], values: Dict[Any, Any], max_error: int):
+        """
+        Replaces the state of the sketch, e.g. with the state saved to a snapshot
+        """
+        if len(counts) > self.capacity:
+            raise ValueError(f"Can't load {len(counts)} items into a sketch of capacity {self.capacity}")
+        self.counts, self.errors, self.values = counts, errors, values
+        self.max_error = max_error
+        self._heap = [(count, self._next_seq(), item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
@@ -0,0 +1,410 @@
+import datetime
+import json
+import logging
+import math
+import mmap
+import struct
+import sys
+from array import array
+from collections import Counter
+from enum import Enum
+from typing import Dict, List, Any, Tuple
+
+from emailsorter.common.model import EmailMessageProcessor, GroupingEmailMessageProcessor, SenderRollupProcessor, \
+    ApproximateSenderProcessor, MessageRecord, ProcessorResultType, create_message_processor
+from emailsorter.core.error import SnapshotException
+from emailsorter.core.rollup import DomainTrie, split_address
+
+LOG = logging.getLogger(__name__)
+
+SNAPSHOT_EXTENSION = "snapshot"
+# The line break detects files that were converted as text, like the signature of PNG files
+MAGIC = b"ESSNAP\r\n"
+FORMAT_VERSION = 1
+# Magic, format version, offset and length of the JSON header, the header follows the buffers of the columns
+PREAMBLE = struct.Struct("<8sHxxxxxxQQ")
+# Buffers start at multiples of the alignment, so they can be read as arrays straight from the mapped file
+ALIGNMENT = 8
+
+SENDERS_TABLE = "senders"
+MESSAGES_TABLE = "messages"
+# Registers of the HyperLogLog sketches of the approximate view
+DISTINCT_TABLE = "distinct"
+
+
+class ColumnKind(Enum):
+    """
+    Encoding of the values of a snapshot column.
+    INT: 64-bit integers. DATE: timestamps as 64-bit floats, NaN for None.
+    STRING: 32-bit codes (-1 for None) into a dictionary of the distinct values, the UTF-8 encoded values
+    with the offset of each value, so repeated values (senders, recipients) are stored once.
+    """
+    INT = "int"
+    DATE = "date"
+    STRING = "string"
+
+
+RECORD_COLUMNS = [("thread_id", ColumnKind.STRING), ("msg_id", ColumnKind.STRING), ("subject", ColumnKind.STRING),
+                  ("recipient_email", ColumnKind.STRING), ("date", ColumnKind.DATE)]
+SENDER_COLUMNS = [("sender", ColumnKind.STRING), ("count", ColumnKind.INT)] + RECORD_COLUMNS
+MESSAGE_COLUMNS = [("sender", ColumnKind.STRING)] + RECORD_COLUMNS
+# The counts of the approximate view are upper bounds, the senders table has the error of each count as well
+APPROXIMATE_SENDER_COLUMNS = SENDER_COLUMNS + [("error", ColumnKind.INT)]
+
+
+class ResultSnapshot:
+    """
+    Results of inbox discovery saved to a versioned, columnar file, so the result table can be rendered
+    in any view and compared with the results of other runs without fetching and processing the messages again.
+
+    The senders table has one row per sender: the number of messages and the last message of the sender.
+    The messages table has the messages of the senders, it is only saved by processors keeping all messages
+    (the detailed view), the other views are rendered from the senders table.
+    Snapshots of the approximate view have the estimated counts of the top senders with their errors
+    and the distinct table with the sketches of the distinct senders and recipients, they can only be rendered
+    in the approximate view.
+
+    The file starts with the magic and the format version, followed by the buffers of the columns
+    and a JSON header with the metadata and the location of the buffers.
+    The file is memory-mapped and only the columns needed by a view are read.
+    Use it as a context manager or call close.
+    """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = open(file_path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotException(f"Snapshot file is empty: {file_path}")
+        self._view = memoryview(self._mm)
+        try:
+            self._header = self._read_header()
+        except Exception:
+            self.close()
+            raise
+        self.metadata: Dict[str, Any] = self._header["metadata"]
+        self._tables: Dict[str, Dict[str, Any]] = self._header["tables"]
+
+    def _read_header(self) -> Dict[str, Any]:
+        if len(self._mm) < PREAMBLE.size:
+            raise SnapshotException(f"Not a snapshot file: {self.file_path}")
+        magic, version, header_offset, header_length = PREAMBLE.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise SnapshotException(f"Not a snapshot file: {self.file_path}")
+        if version != FORMAT_VERSION:
+            raise SnapshotException(f"Unsupported version of snapshot file {self.file_path}: {version}. "
+                                    f"Supported version: {FORMAT_VERSION}")
+        if not header_offset or header_offset + header_length > len(self._mm):
+            raise SnapshotException(f"Snapshot file is truncated: {self.file_path}")
+        return json.loads(bytes(self._view[header_offset:header_offset + header_length]).decode("utf-8"))
+
+    @property
+    def size(self) -> int:
+        return len(self._mm)
+
+    @property
+    def result_type(self) -> ProcessorResultType:
+        """
+        :return: View of the run that saved the snapshot
+        """
+        return ProcessorResultType(self.metadata["result_type"])
+
+    def has_table(self, table: str) -> bool:
+        return table in self._tables
+
+    def has_column(self, table: str, column: str) -> bool:
+        return self.has_table(table) and column in self._tables[table]["columns"]
+
+    def get_no_of_rows(self, table: str) -> int:
+        return self._tables[table]["rows"] if self.has_table(table) else 0
+
+    def read_column(self, table: str, column: str) -> List[Any]:
+        if not self.has_column(table, column):
+            raise SnapshotException(f"Snapshot {self.file_path} has no column '{column}' in table '{table}'")
+        desc = self._tables[table]["columns"][column]
+        kind = ColumnKind(desc["kind"])
+        if kind == ColumnKind.INT:
+            return self._read_array("q", desc["values"])
+        if kind == ColumnKind.DATE:
+            fromtimestamp = datetime.datetime.fromtimestamp
+            return [None if math.isnan(ts) else fromtimestamp(ts) for ts in self._read_array("d", desc["values"])]
+
+        offsets = self._read_array("q", desc["offsets"])
+        data_offset, data_length = desc["data"]
+        data = bytes(self._view[data_offset:data_offset + data_length])
+        values = [data[offsets[idx]:offsets[idx + 1]].decode("utf-8", "surrogatepass")
+                  for idx in range(len(offsets) - 1)]
+        return [values[code] if code >= 0 else None for code in self._read_array("i", desc["codes"])]
+
+    def _read_array(self, typecode: str, location: List[int]) -> List[Any]:
+        offset, length = location
+        if sys.byteorder == "little":
+            with self._view[offset:offset + length] as buffer, buffer.cast(typecode) as values:
+                return values.tolist()
+        values = array(typecode)
+        values.frombytes(self._view[offset:offset + length])
+        values.byteswap()
+        return values.tolist()
+
+    def read_records(self, table: str) -> List[MessageRecord]:
+        columns = [self.read_column(table, name) for name, _ in RECORD_COLUMNS]
+        return [MessageRecord(*values) for values in zip(*columns)]
+
+    def get_sender_counts(self) -> Counter:
+        """
+        :return: Number of messages of each sender. Addresses are normalized (lower case domain),
+        so the counts of snapshots saved by different views can be compared.
+        """
+        self._check_exact_counts("compare the counts of senders")
+        counts = Counter()
+        for sender, count in zip(self.read_column(SENDERS_TABLE, "sender"), self.read_column(SENDERS_TABLE, "count")):
+            counts[DomainTrie.join_address(*split_address(sender))] += count
+        return counts
+
+    def to_processor(self, result_type: ProcessorResultType, **options) -> EmailMessageProcessor:
+        """
+        :param options: Options of the processor, see create_message_processor
+        :return: A message processor with the state of the processor that saved the snapshot,
+        converting its results to the table rows of the result type
+        """
+        # The state of the processor is restored into dicts in memory, with the default grouping engine
+        for option in ("engine", "memory_budget", "spill_dir"):
+            options.pop(option, None)
+        if self.result_type == ProcessorResultType.APPROXIMATE:
+            if result_type != ProcessorResultType.APPROXIMATE:
+                self._check_exact_counts(f"render the {result_type.value} view")
+            return self._to_approximate_processor()
+        processor = create_message_processor(result_type, **options)
+        if result_type in (ProcessorResultType.DETAILED, ProcessorResultType.TREND) and \
+                not self.has_table(MESSAGES_TABLE):
+            raise SnapshotException(f"Snapshot {self.file_path} was saved by the {self.result_type.value} view, "
+                                    f"it has no messages to render the {result_type.value} view. "
+                                    f"Only snapshots of the {ProcessorResultType.DETAILED.value} view have them")
+        if result_type == ProcessorResultType.TREND or \
+                (result_type == ProcessorResultType.APPROXIMATE and self.has_table(MESSAGES_TABLE)):
+            for sender, record in zip(self.read_column(MESSAGES_TABLE, "sender"), self.read_records(MESSAGES_TABLE)):
+                processor.add(sender, record)
+            return processor
+
+        senders = self.read_column(SENDERS_TABLE, "sender")
+        counts = self.read_column(SENDERS_TABLE, "count")
+        examples = self.read_records(SENDERS_TABLE)
+        if result_type == ProcessorResultType.APPROXIMATE:
+            # Only the recipients of the last message of each sender are known, they are not estimated
+            processor.recipients = None
+            for sender, count, example in zip(senders, counts, examples):
+                processor.add(sender, example, count=count)
+            return processor
+        if isinstance(processor, SenderRollupProcessor):
+            for sender, count in zip(senders, counts):
+                processor.trie.add(sender, count)
+            # Domains show the newest message of their senders
+            for sender, example in sorted(zip(senders, examples), key=ResultSnapshot._get_example_date):
+                address, _ = processor.trie.add(sender, 0, example=example)
+                processor.example_by_sender[address] = example
+            return processor
+
+        for sender, count, example in zip(senders, counts, examples):
+            processor.count_by_sender[sender] = count
+            processor.example_by_sender[sender] = example
+        if result_type == ProcessorResultType.DETAILED:
+            for sender, record in zip(self.read_column(MESSAGES_TABLE, "sender"), self.read_records(MESSAGES_TABLE)):
+                processor.grouping_by_sender[sender].append(record)
+        return processor
+
+    def _check_exact_counts(self, purpose: str):
+        if self.result_type == ProcessorResultType.APPROXIMATE:
+            raise SnapshotException(f"Snapshot {self.file_path} was saved by the {self.result_type.value} view, "
+                                    f"it only has estimated counts of the top senders to {purpose}. "
+                                    f"Only the {self.result_type.value} view can render it")
+
+    def _to_approximate_processor(self) -> ApproximateSenderProcessor:
+        processor = ApproximateSenderProcessor(top_senders=self.metadata["top_senders"],
+                                               precision=self.metadata["precision"])
+        processor.no_of_messages = self.metadata["messages"]
+        senders = self.read_column(SENDERS_TABLE, "sender")
+        processor.top_senders.load(dict(zip(senders, self.read_column(SENDERS_TABLE, "count"))),
+                                   dict(zip(senders, self.read_column(SENDERS_TABLE, "error"))),
+                                   dict(zip(senders, self.read_records(SENDERS_TABLE))),
+                                   self.metadata["max_error"])
+        processor.senders.registers = bytearray(self.read_column(DISTINCT_TABLE, "senders"))
+        if self.has_column(DISTINCT_TABLE, "recipients"):
+            processor.recipients.registers = bytearray(self.read_column(DISTINCT_TABLE, "recipients"))
+        else:
+            processor.recipients = None
+        return processor
+
+    @staticmethod
+    def _get_example_date(sender_and_example: Tuple[str, MessageRecord]):
+        date = sender_and_example[1].date
+        return date is not None, date or datetime.datetime.min
+
+    def close(self):
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def save(file_path: str, processor: EmailMessageProcessor, **metadata) -> int:
+        """
+        Saves the state of an inbox discovery processor.
+        :param metadata: Saved to the header of the snapshot, e.g. the query of the run
+        :return: Number of bytes written
+        """
+        tables: Dict[str, Tuple[List[Tuple[str, ColumnKind]], List[List[Any]]]] = {}
+        senders, counts, examples = ResultSnapshot._get_sender_columns(processor)
+        tables[SENDERS_TABLE] = (SENDER_COLUMNS, [senders, counts] + ResultSnapshot._get_record_columns(examples))
+        if isinstance(processor, ApproximateSenderProcessor):
+            tables[SENDERS_TABLE][1].append([processor.top_senders.errors[sender] for sender in senders])
+            tables[SENDERS_TABLE] = (APPROXIMATE_SENDER_COLUMNS, tables[SENDERS_TABLE][1])
+            distinct_columns = [("senders", ColumnKind.INT), ("recipients", ColumnKind.INT)]
+            registers = [list(processor.senders.registers)]
+            if processor.recipients is not None:
+                registers.append(list(processor.recipients.registers))
+            tables[DISTINCT_TABLE] = (distinct_columns[:len(registers)], registers)
+            metadata = {"top_senders": processor.top_senders.capacity, "max_error": processor.top_senders.max_error,
+                        "precision": processor.senders.precision, **metadata}
+        if processor.result_type == ProcessorResultType.DETAILED:
+            message_senders, records = ResultSnapshot._get_message_columns(processor)
+            tables[MESSAGES_TABLE] = (MESSAGE_COLUMNS, [message_senders] + ResultSnapshot._get_record_columns(records))
+
+        metadata = {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "result_type": processor.result_type.value,
+                    # Counts of the approximate view are only kept for the top senders
+                    "messages": getattr(processor, "no_of_messages", sum(counts)),
+                    **metadata}
+        return SnapshotWriter(file_path, metadata).write(tables)
+
+    @staticmethod
+    def _get_sender_columns(processor: EmailMessageProcessor) -> Tuple[List[str], List[int], List[MessageRecord]]:
+        if isinstance(processor, SenderRollupProcessor):
+            senders, counts = [], []
+            for node in processor.trie.root.iter_nodes():
+                for local, count in node.senders.items():
+                    senders.append(DomainTrie.join_address(local, node.domain))
+                    counts.append(count)
+            return senders, counts, [processor.example_by_sender[sender] for sender in senders]
+        if isinstance(processor, GroupingEmailMessageProcessor):
+            senders = list(processor.count_by_sender.keys())
+            return (senders, list(processor.count_by_sender.values()),
+                    [processor.example_by_sender[sender] for sender in senders])
+        if hasattr(processor, "get_sender_columns"):
+            # Processors of the trend view and the columnar engine are not imported, as they require NumPy
+            return processor.get_sender_columns()
+        raise SnapshotException(f"Results of {type(processor).__name__} can't be saved to a snapshot")
+
+    @staticmethod
+    def _get_message_columns(processor: EmailMessageProcessor) -> Tuple[List[str], List[MessageRecord]]:
+        if hasattr(processor, "get_grouped_messages"):
+            return processor.get_grouped_messages()
+        message_senders, records = [], []
+        for sender, sender_records in processor.grouping_by_sender.items():
+            message_senders.extend([sender] * len(sender_records))
+            records.extend(sender_records)
+        return message_senders, records
+
+    @staticmethod
+    def _get_record_columns(records: List[MessageRecord]) -> List[List[Any]]:
+        return [[getattr(record, name) for record in records] for name, _ in RECORD_COLUMNS]
+
+
+def diff_snapshots(old: ResultSnapshot, new: ResultSnapshot) -> List[List[Any]]:
+    """
+    :return: Rows of the senders of both snapshots: the number of messages in the old and the new snapshot,
+    the change and the growth in percent (None for new senders). Senders of the new snapshot come first.
+    """
+    old_counts = old.get_sender_counts()
+    new_counts = new.get_sender_counts()
+    rows = []
+    for sender, count in new_counts.items():
+        old_count = old_counts.get(sender, 0)
+        growth = round((count - old_count) / old_count * 100, 1) if old_count else None
+        rows.append([sender, old_count, count, count - old_count, growth])
+    for sender, old_count in old_counts.items():
+        if sender not in new_counts:
+            rows.append([sender, old_count, 0, -old_count, -100.0])
+    return rows
+
+
+class SnapshotWriter:
+    def __init__(self, file_path: str, metadata: Dict[str, Any]):
+        self.file_path = file_path
+        self.metadata = metadata
+
+    def write(self, tables: Dict[str, Tuple[List[Tuple[str, ColumnKind]], List[List[Any]]]]) -> int:
+        """
+        :param tables: Name of each table -> columns (name and kind) and the values of the columns
+        :return: Number of bytes written
+        """
+        table_descs = {}
+        with open(self.file_path, "wb") as f:
+            # The preamble is written again when the location of the header is known
+            f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, 0))
+            position = PREAMBLE.size
+            for table, (columns, values_of_columns) in tables.items():
+                column_descs = {}
+                for (column, kind), values in zip(columns, values_of_columns):
+                    column_descs[column] = {"kind": kind.value}
+                    for buffer_name, buffer in SnapshotWriter._encode(kind, values).items():
+                        padding = SnapshotWriter._align(position) - position
+                        f.write(b"\0" * padding)
+                        position += padding
+                        f.write(buffer)
+                        column_descs[column][buffer_name] = [position, len(buffer)]
+                        position += len(buffer)
+                table_descs[table] = {"rows": len(values_of_columns[0]) if values_of_columns else 0,
+                                      "columns": column_descs}
+            header = json.dumps({"metadata": self.metadata, "tables": table_descs}).encode("utf-8")
+            f.write(header)
+            f.seek(0)
+            f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, position, len(header)))
+        size = position + len(header)
+        LOG.debug("Saved snapshot with %s to %s (%d bytes)",
+                  {table: desc["rows"] for table, desc in table_descs.items()}, self.file_path, size)
+        return size
+
+    @staticmethod
+    def _align(position: int) -> int:
+        return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+    @staticmethod
+    def _encode(kind: ColumnKind, values: List[Any]) -> Dict[str, bytes]:
+        """
+        :return: Buffers of the column by their name
+        """
+        if kind == ColumnKind.INT:
+            return {"values": SnapshotWriter._to_bytes(array("q", values))}
+        if kind == ColumnKind.DATE:
+            return {"values": SnapshotWriter._to_bytes(array("d", [math.nan if date is None else date.timestamp()
+                                                                   for date in values]))}
+        codes = array("i")
+        code_by_value: Dict[str, int] = {}
+        offsets = array("q", [0])
+        data = bytearray()
+        for value in values:
+            if value is None:
+                codes.append(-1)
+                continue
+            code = code_by_value.get(value)
+            if code is None:
+                code = code_by_value[value] = len(code_by_value)
+                data += value.encode("utf-8", "surrogatepass")
+                offsets.append(len(data))
+            codes.append(code)
+        return {"codes": SnapshotWriter._to_bytes(codes),
+                "offsets": SnapshotWriter._to_bytes(offsets),
+                "data": bytes(data)}
+
+    @staticmethod
+    def _to_bytes(values: array) -> bytes:
+        # Snapshots are little-endian
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values.tobytes()
@@ -0,0 +1,446 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Iterator, List, Dict, Optional, Callable, TYPE_CHECKING
+
+from googleapiwrapper.gmail_common import GmailRequestType
+from googleapiwrapper.gmail_domain import GmailMessage, GmailThreads, ListQueryParam, ThreadQueryFormat, \
+    ThreadsResponseField, ThreadField
+
+from emailsorter.core.metrics import PhaseSpan
+from emailsorter.core.store import MessageStore, MessageKey
+
+if TYPE_CHECKING:
+    # Importing the Gmail API client is slow, it is only imported when messages are fetched from the API
+    from googleapiwrapper.gmail_api import GmailWrapper, ApiConversionContext
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_STORE_PAGE_SIZE = 500
+DEFAULT_PREFETCHED_PAGES = 2
+# Maximum page size of threads.list if only IDs are requested
+MAX_LIST_PAGE_SIZE = 500
+FIELDS_PARAM = "fields"
+HISTORY_ID_FIELD = "historyId"
+RESULT_SIZE_ESTIMATE_FIELD = "resultSizeEstimate"
+
+
+@dataclass
+class FetchStats:
+    """
+    Requests sent to the Gmail API and threads loaded from the email cache instead, while fetching pages.
+    """
+    api_requests: int = 0
+    cache_hits: int = 0
+    # Less than the API requests if the calls are batched
+    http_requests: int = 0
+
+
+@dataclass
+class ThreadCount:
+    count: int
+    # False if the count is the result size estimate of the Gmail API
+    exact: bool = True
+    # IDs of the matching threads, only known for exact counts
+    thread_ids: Optional[List[str]] = None
+
+
+class MessageSource(ABC):
+    """
+    Produces messages page by page, so messages can be processed while the next page is being fetched
+    and a page can be dropped once it was processed.
+    """
+    @abstractmethod
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        pass
+
+    def iter_messages(self) -> Iterator[GmailMessage]:
+        for page in self.iter_pages():
+            yield from page
+
+    def list_thread_versions(self) -> Dict[str, str]:
+        """
+        :return: All thread IDs matching the query, mapped to a value that changes whenever the thread changes
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't list thread versions")
+
+    def iter_pages_for_threads(self, thread_ids: List[str]) -> Iterator[List[GmailMessage]]:
+        raise NotImplementedError(f"{type(self).__name__} can't fetch specific threads")
+
+    def split(self, no_of_shards: int) -> List['MessageSource']:
+        """
+        Splits the messages into consecutive shards, in the order of iter_messages.
+        Shards can be pickled and are read by the worker processes themselves.
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't be split into shards")
+
+    def count_messages(self) -> Optional[int]:
+        """
+        :return: Number of messages of the source, if it is known without fetching the messages
+        """
+        return None
+
+    def get_fetch_stats(self) -> Optional[FetchStats]:
+        """
+        :return: Statistics of the pages fetched so far, None if the source doesn't use the Gmail API
+        """
+        return None
+
+
+class GmailApiMessageSource(MessageSource):
+    """
+    Pages through the result of a Gmail thread query.
+    The threads of each page of the threads.list response are loaded (from the email cache or from the API)
+    and converted to messages before the next page is requested.
+    """
+    def __init__(self, gmail_wrapper: 'GmailWrapper', query: str, fetch_mode: ThreadQueryFormat, limit: int = None,
+                 expect_one_message_per_thread: bool = True, batch_size: int = 1):
+        """
+        :param batch_size: Number of threads.get calls sent in one batch request, 1 disables batching
+        """
+        self.gmail_wrapper = gmail_wrapper
+        self.query = query
+        self.fetch_mode = fetch_mode
+        self.limit = limit
+        self.expect_one_message_per_thread = expect_one_message_per_thread
+        self.batch_size = batch_size
+        self._fetch_stats = FetchStats()
+        self._thread_processor = None
+
+    def get_fetch_stats(self) -> Optional[FetchStats]:
+        return self._fetch_stats
+
+    def _update_fetch_stats(self, ctx: 'ApiConversionContext', req_type: GmailRequestType):
+        progress = ctx.progress
+        threads_get_requests = progress.req_counts[GmailRequestType.THREADS_GET]
+        self._fetch_stats.api_requests = sum(progress.req_counts.values())
+        self._fetch_stats.cache_hits = max(progress.processed_items[req_type] - threads_get_requests, 0)
+        self._fetch_stats.http_requests = self._fetch_stats.api_requests
+        batch_fetcher = getattr(self._thread_processor, "batch_fetcher", None)
+        if batch_fetcher:
+            batch_stats = batch_fetcher.stats
+            self._fetch_stats.http_requests += batch_stats.batches - batch_stats.calls
+
+    def _create_thread_processor(self):
+        from emailsorter.core.batch import create_thread_processor
+
+        self._thread_processor = create_thread_processor(self.gmail_wrapper, self.batch_size)
+        return self._thread_processor
+
+    def _create_conversion_context(self, expect_one_message_per_thread: bool) -> 'ApiConversionContext':
+        from googleapiwrapper import gmail_api
+
+        ctx = gmail_api.ApiConversionContext(
+            query=self.query,
+            limit=self.limit,
+            format=self.fetch_mode,
+            show_empty_body_errors=False,
+            sanity_check=True,
+            expect_one_message_per_thread=expect_one_message_per_thread,
+        )
+        # GmailMessage objects look up the conversion context from the gmail_api module while they are created
+        gmail_api.CONVERSION_CONTEXT = ctx
+        return ctx
+
+    def _create_list_kwargs(self):
+        from googleapiwrapper.gmail_api import GmailApiHelpers
+
+        kwargs = GmailApiHelpers.get_new_kwargs()
+        if self.query:
+            kwargs[ListQueryParam.QUERY.value] = self.query
+        return kwargs
+
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        from googleapiwrapper.gmail_api import GmailWrapper
+
+        LOG.info("Querying gmail threads page by page. Query: %s, Limit: %s, Batch size: %d",
+                 self.query, self.limit, self.batch_size)
+        ctx = self._create_conversion_context(self.expect_one_message_per_thread)
+        fetcher = self.gmail_wrapper.fetcher
+        thread_processor = self._create_thread_processor()
+
+        kwargs = self._create_list_kwargs()
+        if self.limit and self.limit < GmailWrapper.DEFAULT_PAGE_SIZE:
+            kwargs[ListQueryParam.MAX_RESULTS.value] = self.limit
+
+        request = fetcher.threads_svc.list(**kwargs)
+        while request is not None:
+            response = request.execute()
+            ctx.progress.incr_requests(GmailRequestType.THREADS_LIST)
+            ctx.threads = GmailThreads()
+            thread_processor.process_response(ctx, response)
+            ctx.handle_encoding_errors()
+            self._update_fetch_stats(ctx, GmailRequestType.THREADS_LIST)
+            yield ctx.threads.messages
+            ctx.threads = None
+
+            if ctx.progress.is_limit_reached(GmailRequestType.THREADS_LIST):
+                break
+            request = fetcher.threads_svc.list_next(request, response)
+        ctx.progress.print_stats()
+
+    def list_thread_versions(self) -> Dict[str, str]:
+        # The history ID of a thread changes whenever a message is added to the thread or a label is changed
+        kwargs = self._create_list_kwargs()
+        kwargs[ListQueryParam.MAX_RESULTS.value] = MAX_LIST_PAGE_SIZE
+        kwargs[FIELDS_PARAM] = "nextPageToken,threads(id,historyId)"
+        threads_svc = self.gmail_wrapper.fetcher.threads_svc
+
+        versions = {}
+        request = threads_svc.list(**kwargs)
+        while request is not None:
+            response = request.execute()
+            for thread in response.get(ThreadsResponseField.THREADS.value, []):
+                versions[thread[ThreadField.ID.value]] = thread.get(HISTORY_ID_FIELD)
+            request = threads_svc.list_next(request, response)
+        LOG.info("Listed %d thread IDs for query: %s", len(versions), self.query)
+        return versions
+
+    def count_threads(self, estimate: bool = False) -> ThreadCount:
+        """
+        Counts the threads matching the query without loading them, by paging through the thread IDs
+        with the maximum page size.
+        :param estimate: Only request the result size estimate of the Gmail API, takes a single request
+        even for queries matching lots of threads
+        """
+        kwargs = self._create_list_kwargs()
+        threads_svc = self.gmail_wrapper.fetcher.threads_svc
+        if estimate:
+            kwargs[ListQueryParam.MAX_RESULTS.value] = 1
+            kwargs[FIELDS_PARAM] = RESULT_SIZE_ESTIMATE_FIELD
+            response = threads_svc.list(**kwargs).execute()
+            self._record_list_request()
+            count = int(response.get(RESULT_SIZE_ESTIMATE_FIELD, 0))
+            return ThreadCount(min(count, self.limit) if self.limit else count, exact=False)
+
+        kwargs[ListQueryParam.MAX_RESULTS.value] = MAX_LIST_PAGE_SIZE
+        kwargs[FIELDS_PARAM] = "nextPageToken,threads/id"
+        thread_ids = []
+        request = threads_svc.list(**kwargs)
+        while request is not None:
+            response = request.execute()
+            self._record_list_request()
+            thread_ids.extend(thread[ThreadField.ID.value]
+                              for thread in response.get(ThreadsResponseField.THREADS.value, []))
+            if self.limit and len(thread_ids) >= self.limit:
+                return ThreadCount(self.limit, thread_ids=thread_ids[:self.limit])
+            request = threads_svc.list_next(request, response)
+        return ThreadCount(len(thread_ids), thread_ids=thread_ids)
+
+    def _record_list_request(self):
+        self._fetch_stats.api_requests += 1
+        self._fetch_stats.http_requests += 1
+
+    def iter_pages_for_threads(self, thread_ids: List[str]) -> Iterator[List[GmailMessage]]:
+        # Threads are requested because they are new or changed, so cached threads can't be considered
+        # fully cached: messages are checked against the cache and missing ones are fetched
+        from googleapiwrapper.gmail_api import GmailWrapper
+
+        ctx = self._create_conversion_context(expect_one_message_per_thread=False)
+        thread_processor = self._create_thread_processor()
+        req_type = GmailRequestType.THREADS_GET
+        for chunk in _chunks(thread_ids, GmailWrapper.DEFAULT_PAGE_SIZE):
+            ctx.progress.register_new_items(req_type, len(chunk), print_status=True)
+            ctx.threads = GmailThreads()
+            thread_processor.process_threads(ctx, req_type, chunk)
+            ctx.handle_encoding_errors()
+            self._update_fetch_stats(ctx, req_type)
+            yield ctx.threads.messages
+            ctx.threads = None
+        ctx.progress.print_stats()
+
+
+class MessageStoreSource(MessageSource):
+    def __init__(self, store: MessageStore, query: str, page_size: int = DEFAULT_STORE_PAGE_SIZE):
+        self.store = store
+        self.query = query
+        self.page_size = page_size
+
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        return _pages(self.store.query_messages(self.query), self.page_size)
+
+    def list_thread_versions(self) -> Dict[str, str]:
+        return self.store.query_thread_versions(self.query)
+
+    def count_messages(self) -> Optional[int]:
+        return self.store.count_messages(self.query)
+
+    def split(self, no_of_shards: int) -> List[MessageSource]:
+        # Shards are bounded by message keys, so workers don't have to skip the messages of the previous shards
+        first_keys = self.store.get_shard_boundaries(self.query, no_of_shards)
+        end_keys = first_keys[1:] + [None]
+        return [MessageStoreShardSource(self.store.db_file, self.store.threads_dir, self.query, first_key, end_key,
+                                        page_size=self.page_size)
+                for first_key, end_key in zip(first_keys, end_keys)]
+
+    def iter_pages_for_threads(self, thread_ids: List[str]) -> Iterator[List[GmailMessage]]:
+        # Keep the number of SQL parameters below SQLite's limit
+        for chunk in _chunks(thread_ids, self.page_size):
+            yield list(self.store.query_messages(self.query, thread_ids=chunk))
+
+
+class MessageStoreShardSource(MessageSource):
+    """
+    Consecutive range of the messages of a MessageStoreSource.
+    The message store is opened when the messages are read, so the shard can be sent to another process.
+    """
+    def __init__(self, db_file: str, threads_dir: str, query: str, first_key: MessageKey, end_key: Optional[MessageKey],
+                 page_size: int = DEFAULT_STORE_PAGE_SIZE):
+        self.db_file = db_file
+        self.threads_dir = threads_dir
+        self.query = query
+        self.first_key = first_key
+        self.end_key = end_key
+        self.page_size = page_size
+
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        store = MessageStore(self.db_file, self.threads_dir, read_only=True)
+        try:
+            messages = store.query_messages(self.query, key_range=(self.first_key, self.end_key))
+            yield from _pages(messages, self.page_size)
+        finally:
+            store.close()
+
+
+class InMemoryMessageSource(MessageSource):
+    def __init__(self, messages: List[GmailMessage]):
+        self.messages = messages
+
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        yield self.messages
+
+    def count_messages(self) -> Optional[int]:
+        return len(self.messages)
+
+
+class PrefetchingMessageSource(MessageSource):
+    """
+    Fetches pages of the wrapped source in a background thread, so fetching overlaps with processing.
+    At most 'max_prefetched_pages' pages are kept in memory ahead of the consumer.
+    """
+    _DONE = object()
+
+    def __init__(self, source: MessageSource, max_prefetched_pages: int = DEFAULT_PREFETCHED_PAGES):
+        self.source = source
+        self.max_prefetched_pages = max_prefetched_pages
+
+    def list_thread_versions(self) -> Dict[str, str]:
+        return self.source.list_thread_versions()
+
+    def iter_pages_for_threads(self, thread_ids: List[str]) -> Iterator[List[GmailMessage]]:
+        return self.source.iter_pages_for_threads(thread_ids)
+
+    def count_messages(self) -> Optional[int]:
+        return self.source.count_messages()
+
+    def get_fetch_stats(self) -> Optional[FetchStats]:
+        return self.source.get_fetch_stats()
+
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        pages = queue.Queue(maxsize=self.max_prefetched_pages)
+        stop = threading.Event()
+        errors = []
+
+        def produce():
+            try:
+                for page in self.source.iter_pages():
+                    while not stop.is_set():
+                        try:
+                            pages.put(page, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                errors.append(e)
+            finally:
+                pages.put(PrefetchingMessageSource._DONE)
+
+        producer = threading.Thread(target=produce, name="message-prefetcher", daemon=True)
+        producer.start()
+        try:
+            while True:
+                page = pages.get()
+                if page is PrefetchingMessageSource._DONE:
+                    break
+                yield page
+        finally:
+            stop.set()
+            # Unblock the producer if it is waiting to put the final marker
+            while producer.is_alive():
+                try:
+                    pages.get_nowait()
+                except queue.Empty:
+                    producer.join(0.1)
+        if errors:
+            raise errors[0]
+
+
+class MeteredMessageSource(MessageSource):
+    """
+    Records the pages and messages of the wrapped source and the time spent waiting for them to the span.
+    The callback is invoked after each page, e.g. to update the progress display.
+    """
+    def __init__(self, source: MessageSource, span: PhaseSpan, on_page: Callable[[PhaseSpan], None] = None):
+        self.source = source
+        self.span = span
+        self.on_page = on_page
+
+    def list_thread_versions(self) -> Dict[str, str]:
+        return self.source.list_thread_versions()
+
+    def count_messages(self) -> Optional[int]:
+        return self.source.count_messages()
+
+    def get_fetch_stats(self) -> Optional[FetchStats]:
+        return self.source.get_fetch_stats()
+
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        return self._record(self.source.iter_pages())
+
+    def iter_pages_for_threads(self, thread_ids: List[str]) -> Iterator[List[GmailMessage]]:
+        return self._record(self.source.iter_pages_for_threads(thread_ids))
+
+    def split(self, no_of_shards: int) -> List[MessageSource]:
+        # Shards are read by the workers, only the time of splitting is recorded
+        start_time = time.perf_counter()
+        shards = self.source.split(no_of_shards)
+        self.span.add_seconds(time.perf_counter() - start_time)
+        return shards
+
+    def _record(self, pages: Iterator[List[GmailMessage]]) -> Iterator[List[GmailMessage]]:
+        pages = iter(pages)
+        while True:
+            start_time = time.perf_counter()
+            page = next(pages, None)
+            self.span.add_seconds(time.perf_counter() - start_time)
+            if page is None:
+                return
+            self.span.incr("pages")
+            self.span.incr("messages", len(page))
+            fetch_stats = self.source.get_fetch_stats()
+            if fetch_stats:
+                self.span.counts["api_requests"] = fetch_stats.api_requests
+                self.span.counts["cache_hits"] = fetch_stats.cache_hits
+                self.span.counts["http_requests"] = fetch_stats.http_requests
+            if self.on_page:
+                self.on_page(self.span)
+            yield page
+
+
+def _chunks(items: List, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _pages(items: Iterator, size: int) -> Iterator[List]:
+    while True:
+        page = list(itertools.islice(items, size))
+        if not page:
+            return
+        yield page
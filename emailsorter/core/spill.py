@@ -0,0 +1,220 @@
+import contextlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Iterator, Any
+
+from emailsorter.common.model import EmailMessageProcessor, MessageRecord, ProcessorResultType
+from emailsorter.core.output import GroupingEmailMessageProcessorRepresentation
+from emailsorter.display.table import SortedRows
+
+LOG = logging.getLogger(__name__)
+
+SPILL_FILE_PREFIX = "emailsorter-spill-"
+# Maximum number of runs merged together, and read together by the rows of the table: each of them is an open file
+MERGE_FAN_IN = 64
+# Estimated memory of a buffered message without its strings: the record, its date and its slot in the list
+RECORD_OVERHEAD = sys.getsizeof(MessageRecord(None, None, None, None, None)) + 48 + 8
+
+
+class SpillRun:
+    """
+    Messages written to a temporary file when the buffer of SpillingGroupingProcessor was full,
+    or merged from other runs.
+    The messages of each sender are stored together, in the order they were processed, as consecutive chunks:
+    a run written from the buffer has one chunk per sender, a merged run has the chunks of the merged runs.
+    The messages of a sender are read with one seek.
+    """
+    def __init__(self, file_path: str, offset_by_sender: Dict[Optional[str], int], size: int,
+                 chunks_by_sender: Dict[Optional[str], int] = None, level: int = 0):
+        """
+        :param offset_by_sender: Offset of the first chunk of each sender
+        :param chunks_by_sender: Number of chunks of each sender, 1 if not given
+        :param level: Number of merges the messages of the run went through
+        """
+        self.file_path = file_path
+        self.offset_by_sender = offset_by_sender
+        self.chunks_by_sender = chunks_by_sender or {}
+        self.size = size
+        self.level = level
+
+    @staticmethod
+    def write(records_by_sender: Dict[Optional[str], List[MessageRecord]], spill_dir: str = None) -> 'SpillRun':
+        fd, file_path = tempfile.mkstemp(prefix=SPILL_FILE_PREFIX, suffix=".run", dir=spill_dir)
+        offset_by_sender = {}
+        with os.fdopen(fd, "wb") as f:
+            for sender, records in records_by_sender.items():
+                offset_by_sender[sender] = f.tell()
+                pickle.dump(records, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        return SpillRun(file_path, offset_by_sender, size)
+
+    @staticmethod
+    def merge(runs: List['SpillRun'], spill_dir: str = None) -> 'SpillRun':
+        """
+        Writes the messages of the runs to a new run, the messages of each sender in the order of the runs.
+        Only one chunk is kept in memory at a time. The merged runs are not deleted.
+        """
+        fd, file_path = tempfile.mkstemp(prefix=SPILL_FILE_PREFIX, suffix=".run", dir=spill_dir)
+        offset_by_sender = {}
+        chunks_by_sender = {}
+        try:
+            with os.fdopen(fd, "wb") as out, contextlib.ExitStack() as stack:
+                files = [stack.enter_context(open(run.file_path, "rb")) for run in runs]
+                for sender in dict.fromkeys(sender for run in runs for sender in run.offset_by_sender):
+                    offset_by_sender[sender] = out.tell()
+                    no_of_chunks = 0
+                    for run, f in zip(runs, files):
+                        for records in run.iter_chunks(f, sender):
+                            pickle.dump(records, out, protocol=pickle.HIGHEST_PROTOCOL)
+                            no_of_chunks += 1
+                    chunks_by_sender[sender] = no_of_chunks
+                size = out.tell()
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_path)
+            raise
+        return SpillRun(file_path, offset_by_sender, size, chunks_by_sender=chunks_by_sender,
+                        level=max(run.level for run in runs) + 1)
+
+    def iter_chunks(self, f, sender: Optional[str]) -> Iterator[List[MessageRecord]]:
+        """
+        :param f: The file of the run, opened for reading in binary mode
+        :return: Messages of the sender in the run, chunk by chunk
+        """
+        offset = self.offset_by_sender.get(sender)
+        if offset is None:
+            return
+        f.seek(offset)
+        for _ in range(self.chunks_by_sender.get(sender, 1)):
+            yield pickle.load(f)
+
+    def delete(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.file_path)
+
+
+class SpillingGroupingProcessor(EmailMessageProcessor):
+    """
+    Detailed view of GroupingEmailMessageProcessor with bounded memory.
+    Messages are buffered grouped by sender, when the estimated memory of the buffer reaches the memory budget,
+    the buffer is written to a run on disk. Only the number of messages and the last message of each sender
+    are kept in memory for all messages.
+    The rows are not kept in memory either: they are read in the order of the result table, sorted by the number
+    of messages of the sender (senders with the same count keep the order of their first message), merging
+    the messages of each sender from the runs in the order of the runs, then from the buffer.
+    The rows are the same as the rows of GroupingEmailMessageProcessor, sorted by the table.
+    Runs are merged in bounded passes, like the levels of a log-structured merge tree: when the last 'merge_fan_in'
+    runs have the same level, they are merged to one run of the next level. Each message is rewritten once per level,
+    so the number of runs, and the memory of their sender indices, only grows with the logarithm of the messages.
+    Close the processor to delete the runs.
+    """
+    def __init__(self, memory_budget: int, spill_dir: str = None, merge_fan_in: int = MERGE_FAN_IN):
+        """
+        :param memory_budget: Estimated memory of the buffered messages in bytes, before they are written to a run
+        :param spill_dir: Directory of the runs, the temp dir of the system by default
+        :param merge_fan_in: Maximum number of runs that are merged together or read together by the rows
+        """
+        if memory_budget < 1:
+            raise ValueError(f"Memory budget should be a positive number. Actual value: {memory_budget}")
+        if merge_fan_in < 2:
+            raise ValueError(f"Merge fan-in should be at least 2. Actual value: {merge_fan_in}")
+        self.result_type = ProcessorResultType.DETAILED
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.merge_fan_in = merge_fan_in
+        self.count_by_sender: Counter = Counter()
+        # Last message of each sender, it is shown in the grouping result table
+        self.example_by_sender: Dict[str, MessageRecord] = {}
+        self._buffer: Dict[Optional[str], List[MessageRecord]] = defaultdict(list)
+        self._buffer_size = 0
+        self.runs: List[SpillRun] = []
+
+    def process(self, message: 'GmailMessage'):
+        self.add(message.sender_email, MessageRecord.from_message(message))
+
+    def add(self, sender: Optional[str], record: MessageRecord):
+        if sender is not None:
+            sender = sys.intern(sender)
+        self.count_by_sender[sender] += 1
+        self.example_by_sender[sender] = record
+        self._buffer[sender].append(record)
+        self._buffer_size += (RECORD_OVERHEAD + sys.getsizeof(record.subject) + sys.getsizeof(record.thread_id) +
+                              sys.getsizeof(record.msg_id))
+        if self._buffer_size >= self.memory_budget:
+            self._spill()
+
+    def _spill(self):
+        if not self._buffer:
+            return
+        run = SpillRun.write(self._buffer, spill_dir=self.spill_dir)
+        self.runs.append(run)
+        LOG.debug("Spilled messages of %d senders (estimated %d bytes in memory) to run %d: %s (%d bytes)",
+                  len(self._buffer), self._buffer_size, len(self.runs), run.file_path, run.size)
+        self._buffer = defaultdict(list)
+        self._buffer_size = 0
+        self._compact()
+
+    def _compact(self):
+        while len(self.runs) >= self.merge_fan_in and len({r.level for r in self.runs[-self.merge_fan_in:]}) == 1:
+            self._merge_last_runs(self.merge_fan_in)
+
+    def _merge_last_runs(self, no_of_runs: int):
+        runs = self.runs[-no_of_runs:]
+        merged = SpillRun.merge(runs, spill_dir=self.spill_dir)
+        self.runs[-no_of_runs:] = [merged]
+        for run in runs:
+            run.delete()
+        LOG.debug("Merged %d runs to a run of level %d: %s (%d bytes)", len(runs), merged.level, merged.file_path,
+                  merged.size)
+
+    def merge(self, other: 'SpillingGroupingProcessor'):
+        # The messages of the other processor come after the buffered messages of this processor
+        self._spill()
+        self.runs.extend(other.runs)
+        other.runs = []
+        self._compact()
+        for sender, count in other.count_by_sender.items():
+            sender = sys.intern(sender) if sender is not None else None
+            self.count_by_sender[sender] += count
+            self.example_by_sender[sender] = other.example_by_sender[sender]
+        for sender, records in other._buffer.items():
+            self._buffer[sys.intern(sender) if sender is not None else None].extend(records)
+        self._buffer_size += other._buffer_size
+        if self._buffer_size >= self.memory_budget:
+            self._spill()
+
+    def convert_to_table_rows(self):
+        grouping_for_result_table = {sender: (r.thread_id, r.msg_id, r.subject)
+                                     for sender, r in self.example_by_sender.items()}
+        # The table sorts the rows by the number of messages of the sender, rows with the same count keep their order
+        senders = sorted(self.count_by_sender, key=lambda sender: -self.count_by_sender[sender])
+        sort_column = GroupingEmailMessageProcessorRepresentation(self.result_type).get_sort_column()
+        # The rows read all runs at once, with one open file per run
+        while len(self.runs) > self.merge_fan_in:
+            self._merge_last_runs(min(self.merge_fan_in, len(self.runs) - self.merge_fan_in + 1))
+        LOG.info("Reading the messages of %d senders from %d runs", len(senders), len(self.runs))
+        table_rows = SortedRows(lambda: self._iter_rows(senders), sum(self.count_by_sender.values()), [sort_column])
+        return grouping_for_result_table, table_rows
+
+    def _iter_rows(self, senders: List[Optional[str]]) -> Iterator[List[Any]]:
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(open(run.file_path, "rb")) for run in self.runs]
+            for sender in senders:
+                count = self.count_by_sender[sender]
+                for run, f in zip(self.runs, files):
+                    for records in run.iter_chunks(f, sender):
+                        for record in records:
+                            yield [sender, count, record.recipient_email, record.date, record.subject,
+                                   record.thread_id, record.msg_id]
+                for record in self._buffer.get(sender, []):
+                    yield [sender, count, record.recipient_email, record.date, record.subject, record.thread_id,
+                           record.msg_id]
+
+    def close(self):
+        for run in self.runs:
+            run.delete()
+        self.runs = []
@@ -0,0 +1,280 @@
+import datetime
+import json
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import Iterator, List, Dict, Any, Tuple, Optional
+
+from googleapiwrapper.gmail_common import THREADS_DIR_NAME, THREAD_JSON_FILENAME
+from googleapiwrapper.gmail_domain import ThreadField, GenericObjectHelper as GH
+from googleapiwrapper.utils import CommonUtils
+from pythoncommons.file_utils import FileUtils
+
+from emailsorter.common.model import MessageSummary
+from emailsorter.core.query import GmailQueryParser, ParsedQuery, normalize_label, MessageMetadata
+
+LOG = logging.getLogger(__name__)
+
+MESSAGE_STORE_FILENAME = "message_store.sqlite3"
+LABEL_IDS_FIELD = "labelIds"
+MESSAGE_COLUMNS = ["msg_id", "thread_id", "subject", "date", "sender", "sender_email",
+                   "recipient", "recipient_email", "date_str"]
+INSERT_BATCH_SIZE = 1000
+# Position of a message in the order of MessageStore.query_messages: (date, message ID)
+MessageKey = Tuple[int, str]
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, mtime REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "msg_id TEXT PRIMARY KEY, thread_id TEXT NOT NULL, subject TEXT, date INTEGER, "
+    "sender TEXT, sender_email TEXT, recipient TEXT, recipient_email TEXT, date_str TEXT)",
+    "CREATE TABLE IF NOT EXISTS message_labels ("
+    "label TEXT NOT NULL, msg_id TEXT NOT NULL, PRIMARY KEY (label, msg_id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS idx_messages_thread_id ON messages (thread_id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_sender_email ON messages (sender_email COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_recipient_email ON messages (recipient_email COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_date_msg_id ON messages (date, msg_id)",
+    "CREATE INDEX IF NOT EXISTS idx_message_labels_msg_id ON message_labels (msg_id)",
+]
+
+
+@dataclass
+class MessageStoreRefreshStats:
+    added_threads: int = 0
+    updated_threads: int = 0
+    removed_threads: int = 0
+    unchanged_threads: int = 0
+    failed_threads: int = 0
+
+    @property
+    def changed(self):
+        return self.added_threads + self.updated_threads + self.removed_threads > 0
+
+
+class MessageStore:
+    """
+    Local SQLite index of the message metadata found in the email cache of GmailWrapper
+    (<email cache dir>/<account>/threads/<thread ID>/thread.json).
+    The index is used by offline mode, so queries can be answered without the Gmail API
+    and without loading all thread files of the cache.
+    """
+    SCHEMA_VERSION = "2"
+
+    def __init__(self, db_file: str, threads_dir: str, read_only: bool = False):
+        self.db_file = db_file
+        self.threads_dir = threads_dir
+        if read_only:
+            # Used by worker processes, they must not take the write lock for the schema check
+            self._conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+        else:
+            self._conn = sqlite3.connect(db_file)
+            self._ensure_schema()
+
+    @staticmethod
+    def for_account(email_cache_dir: str, account_email: str) -> 'MessageStore':
+        account_dir = FileUtils.join_path(email_cache_dir, CommonUtils.convert_email_address_to_dirname(account_email))
+        FileUtils.ensure_dir_created(account_dir)
+        return MessageStore(FileUtils.join_path(account_dir, MESSAGE_STORE_FILENAME),
+                            FileUtils.join_path(account_dir, THREADS_DIR_NAME))
+
+    def _ensure_schema(self):
+        version = None
+        try:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            version = row[0] if row else None
+        except sqlite3.OperationalError:
+            pass
+        if version and version != MessageStore.SCHEMA_VERSION:
+            LOG.info("Message store schema version changed (%s -> %s), recreating: %s",
+                     version, MessageStore.SCHEMA_VERSION, self.db_file)
+            self._drop_tables()
+        with self._conn:
+            for stmt in SCHEMA:
+                self._conn.execute(stmt)
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                               (MessageStore.SCHEMA_VERSION,))
+
+    def _drop_tables(self):
+        with self._conn:
+            for table in ["meta", "threads", "messages", "message_labels"]:
+                self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def rebuild(self) -> MessageStoreRefreshStats:
+        LOG.info("Rebuilding message store from scratch: %s", self.db_file)
+        self._drop_tables()
+        self._ensure_schema()
+        return self.refresh()
+
+    def refresh(self) -> MessageStoreRefreshStats:
+        """
+        Incrementally synchronizes the store with the email cache.
+        Only thread files that are new or were modified since the last refresh are parsed.
+        """
+        stats = MessageStoreRefreshStats()
+        indexed: Dict[str, float] = dict(self._conn.execute("SELECT thread_id, mtime FROM threads"))
+        cached: Dict[str, float] = self._scan_cached_threads()
+
+        removed = [thread_id for thread_id in indexed.keys() if thread_id not in cached]
+        with self._conn:
+            self._delete_threads(removed)
+            stats.removed_threads = len(removed)
+
+            batch: List[Tuple[str, float]] = []
+            for thread_id, mtime in cached.items():
+                if thread_id not in indexed:
+                    stats.added_threads += 1
+                elif indexed[thread_id] != mtime:
+                    stats.updated_threads += 1
+                else:
+                    stats.unchanged_threads += 1
+                    continue
+                batch.append((thread_id, mtime))
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    stats.failed_threads += self._index_threads(batch)
+                    batch = []
+            stats.failed_threads += self._index_threads(batch)
+        LOG.info("Refreshed message store %s: %s", self.db_file, stats)
+        return stats
+
+    def _scan_cached_threads(self) -> Dict[str, float]:
+        result = {}
+        if not os.path.isdir(self.threads_dir):
+            LOG.warning("Email cache threads dir does not exist: %s", self.threads_dir)
+            return result
+        with os.scandir(self.threads_dir) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                try:
+                    result[entry.name] = os.stat(os.path.join(entry.path, THREAD_JSON_FILENAME)).st_mtime
+                except FileNotFoundError:
+                    LOG.warning("Thread file not found in email cache for thread: %s", entry.name)
+        return result
+
+    def _index_threads(self, threads: List[Tuple[str, float]]) -> int:
+        if not threads:
+            return 0
+        # Importing the Gmail API client is slow, it is only needed if there are threads to index
+        from googleapiwrapper.gmail_api import GmailMessageParser
+
+        failed = 0
+        message_rows = []
+        label_rows = []
+        indexed_threads = []
+        for thread_id, mtime in threads:
+            thread_file = FileUtils.join_path(self.threads_dir, thread_id, THREAD_JSON_FILENAME)
+            try:
+                with open(thread_file) as f:
+                    thread_response: Dict[str, Any] = json.load(f)
+                for message_dict in GH.get_field(thread_response, ThreadField.MESSAGES, []):
+                    message = GmailMessageParser.parse(message_dict)
+                    message_rows.append((message.id, thread_id, message.subject, int(message.date.timestamp() * 1000),
+                                         message.sender, message.sender_email, message.recipient,
+                                         message.recipient_email, message.date_str))
+                    for label in message_dict.get(LABEL_IDS_FIELD, []):
+                        label_rows.append((normalize_label(label), message.id))
+                indexed_threads.append((thread_id, mtime))
+            except Exception:
+                LOG.exception("Failed to index thread from email cache: %s", thread_file)
+                failed += 1
+
+        self._delete_threads([thread_id for thread_id, _ in indexed_threads])
+        placeholders = ", ".join(["?"] * len(MESSAGE_COLUMNS))
+        self._conn.executemany(f"INSERT OR REPLACE INTO messages ({', '.join(MESSAGE_COLUMNS)}) "
+                               f"VALUES ({placeholders})", message_rows)
+        self._conn.executemany("INSERT OR IGNORE INTO message_labels (label, msg_id) VALUES (?, ?)", label_rows)
+        self._conn.executemany("INSERT OR REPLACE INTO threads (thread_id, mtime) VALUES (?, ?)", indexed_threads)
+        return failed
+
+    def _delete_threads(self, thread_ids: List[str]):
+        for thread_id in thread_ids:
+            self._conn.execute("DELETE FROM message_labels WHERE msg_id IN "
+                               "(SELECT msg_id FROM messages WHERE thread_id = ?)", (thread_id,))
+            self._conn.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+
+    def query_messages(self, query: str, thread_ids: List[str] = None,
+                       key_range: Tuple[Optional[MessageKey], Optional[MessageKey]] = None) -> Iterator[MessageSummary]:
+        """
+        Messages are ordered by date and message ID (newest first).
+        :param key_range: First key (inclusive) and the key after the last message (exclusive) to return,
+        the boundaries of the shards returned by get_shard_boundaries. None means the range is not bounded.
+        """
+        condition, params = GmailQueryParser.parse(query).to_sql()
+        if thread_ids is not None:
+            condition = f"({condition}) AND m.thread_id IN ({', '.join(['?'] * len(thread_ids))})"
+            params = params + list(thread_ids)
+        if key_range:
+            first_key, end_key = key_range
+            if first_key:
+                condition = f"({condition}) AND (m.date, m.msg_id) <= (?, ?)"
+                params = params + list(first_key)
+            if end_key:
+                condition = f"({condition}) AND (m.date, m.msg_id) > (?, ?)"
+                params = params + list(end_key)
+        cursor = self._conn.execute(f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages m "
+                                    f"WHERE {condition} ORDER BY m.date DESC, m.msg_id DESC", params)
+        for row in cursor:
+            yield MessageStore._to_message_summary(row)
+
+    def get_shard_boundaries(self, query: str, no_of_shards: int) -> List[MessageKey]:
+        """
+        Splits the messages matching the query into (at most) 'no_of_shards' shards of the same size.
+        :return: Key of the first message of each shard, in the order of query_messages
+        """
+        count = self.count_messages(query)
+        if not count:
+            return []
+        shard_size = -(-count // no_of_shards)
+        condition, params = GmailQueryParser.parse(query).to_sql()
+        cursor = self._conn.execute(f"SELECT date, msg_id FROM ("
+                                    f"SELECT m.date, m.msg_id, "
+                                    f"ROW_NUMBER() OVER (ORDER BY m.date DESC, m.msg_id DESC) - 1 AS idx "
+                                    f"FROM messages m WHERE {condition}) "
+                                    f"WHERE idx % ? = 0 ORDER BY idx", params + [shard_size])
+        return [(date, msg_id) for date, msg_id in cursor]
+
+    def count_messages(self, query: str) -> int:
+        condition, params = GmailQueryParser.parse(query).to_sql()
+        return self._conn.execute(f"SELECT COUNT(*) FROM messages m WHERE {condition}", params).fetchone()[0]
+
+    def query_thread_versions(self, query: str) -> Dict[str, str]:
+        """
+        :return: Modification time of the cached thread file for all threads that have messages matching the query
+        """
+        condition, params = GmailQueryParser.parse(query).to_sql()
+        cursor = self._conn.execute(f"SELECT t.thread_id, t.mtime FROM threads t WHERE t.thread_id IN "
+                                    f"(SELECT m.thread_id FROM messages m WHERE {condition})", params)
+        return {thread_id: str(mtime) for thread_id, mtime in cursor}
+
+    def count_threads(self, query: str) -> int:
+        parsed_query: ParsedQuery = GmailQueryParser.parse(query)
+        condition, params = parsed_query.to_sql()
+        row = self._conn.execute(f"SELECT COUNT(DISTINCT m.thread_id) FROM messages m WHERE {condition}",
+                                 params).fetchone()
+        return row[0]
+
+    def iter_message_metadata(self) -> Iterator[MessageMetadata]:
+        """
+        Yields all stored messages with their labels, intended for evaluating many queries in a single pass.
+        """
+        cursor = self._conn.execute(f"SELECT {', '.join('m.' + c for c in MESSAGE_COLUMNS)}, GROUP_CONCAT(l.label, ' ') "
+                                    f"FROM messages m LEFT JOIN message_labels l ON l.msg_id = m.msg_id "
+                                    f"GROUP BY m.msg_id")
+        for row in cursor:
+            msg_id, thread_id, subject, date, sender, sender_email, recipient, recipient_email, _, labels = row
+            yield MessageMetadata(msg_id, thread_id, subject, date, sender, sender_email, recipient,
+                                  recipient_email, frozenset(labels.split(" ")) if labels else frozenset())
+
+    @staticmethod
+    def _to_message_summary(row) -> MessageSummary:
+        msg_id, thread_id, subject, date, sender, sender_email, recipient, recipient_email, date_str = row
+        # Message bodies are not stored, only metadata.
+        # Unlike GmailMessages, summaries can be created without loading the Gmail API client.
+        return MessageSummary(msg_id, thread_id, subject, datetime.datetime.fromtimestamp(date / 1000),
+                              sender_email, recipient, recipient_email, date_str, sender=sender)
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,152 @@
+import datetime
+import logging
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from emailsorter.common.model import EmailMessageProcessor, MessageRecord, ProcessorResultType, TimeBucket
+from emailsorter.core.constants import DEFAULT_TREND_BUCKETS
+from emailsorter.core.error import EmailSorterException
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise EmailSorterException("The trend view requires NumPy, install it with: pip install numpy") from e
+
+LOG = logging.getLogger(__name__)
+
+# Day of messages without a date, day ordinals start from 1
+NO_DATE = 0
+# Ordinal of 1970-01-01, the first day of NumPy dates
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+# Characters of the histogram of a sender, from no messages to the most messages of the sender in a bucket
+HISTOGRAM_CHARS = " ▁▂▃▄▅▆▇█"
+
+
+class SenderTrendProcessor(EmailMessageProcessor):
+    """
+    Number of messages of each sender per day, week or month over the last time buckets, with the trend of the
+    counts: the slope of the least squares line through the counts of the buckets, in messages per bucket.
+    Processing a message only appends the ID of its sender and its day to columns, the histograms and trends
+    of all senders are computed at once with NumPy when the results are converted to table rows.
+    """
+    def __init__(self, time_bucket: TimeBucket = TimeBucket.WEEK, buckets: int = DEFAULT_TREND_BUCKETS):
+        if buckets < 1:
+            raise ValueError(f"Number of time buckets should be a positive number. Actual value: {buckets}")
+        self.result_type = ProcessorResultType.TREND
+        self.time_bucket = time_bucket
+        self.buckets = buckets
+        # Senders by their ID, in the order of their first message
+        self.senders: List[str] = []
+        self._id_by_sender: Dict[str, int] = {}
+        # Last message of each sender by the ID of the sender
+        self.examples: List[MessageRecord] = []
+        # Sender ID and day ordinal of each message
+        self.sender_ids = array("i")
+        self.days = array("i")
+
+    def process(self, message: 'GmailMessage'):
+        self.add(message.sender_email, MessageRecord.from_message(message))
+
+    def add(self, sender: Optional[str], record: MessageRecord):
+        sender_id = self._get_sender_id(sender, record)
+        self.examples[sender_id] = record
+        self.sender_ids.append(sender_id)
+        self.days.append(record.date.toordinal() if record.date else NO_DATE)
+
+    def _get_sender_id(self, sender: Optional[str], example: MessageRecord) -> int:
+        sender_id = self._id_by_sender.get(sender)
+        if sender_id is None:
+            sender_id = self._id_by_sender[sender] = len(self.senders)
+            self.senders.append(sender)
+            self.examples.append(example)
+        return sender_id
+
+    def merge(self, other: 'SenderTrendProcessor'):
+        if (other.time_bucket, other.buckets) != (self.time_bucket, self.buckets):
+            raise ValueError(f"Can't merge processors of different time buckets: "
+                             f"{self.buckets} {self.time_bucket}, {other.buckets} {other.time_bucket}")
+        # Sender IDs of the other processor are mapped to the IDs of this processor
+        id_mapping = np.array([self._get_sender_id(sender, example)
+                               for sender, example in zip(other.senders, other.examples)], dtype=np.intc)
+        for sender_id, example in zip(id_mapping.tolist(), other.examples):
+            self.examples[sender_id] = example
+        self.sender_ids.frombytes(id_mapping[np.frombuffer(other.sender_ids, dtype=np.intc)].tobytes())
+        self.days.extend(other.days)
+
+    def get_sender_columns(self) -> Tuple[List[str], List[int], List[MessageRecord]]:
+        """
+        :return: Senders, the number of messages and the last message of each sender
+        """
+        counts = np.bincount(np.frombuffer(self.sender_ids, dtype=np.intc), minlength=len(self.senders)).tolist()
+        return list(self.senders), counts, list(self.examples)
+
+    def convert_to_table_rows(self):
+        sender_ids = np.frombuffer(self.sender_ids, dtype=np.intc)
+        days = np.frombuffer(self.days, dtype=np.intc)
+        counts = np.bincount(sender_ids, minlength=len(self.senders))
+        histograms = self._get_histograms(sender_ids, days)
+        trends = SenderTrendProcessor._get_trends(histograms)
+        table_rows = [list(row) for row in zip(self.senders, counts.tolist(), histograms[:, -1].tolist(),
+                                               trends.tolist(), SenderTrendProcessor._draw_histograms(histograms))]
+        grouping_for_result_table = {sender: (example.thread_id, example.msg_id, example.subject)
+                                     for sender, example in zip(self.senders, self.examples)}
+        return grouping_for_result_table, table_rows
+
+    def _get_histograms(self, sender_ids, days):
+        """
+        :return: Matrix of the number of messages of each sender (rows) in each of the last time buckets (columns),
+        the last bucket is the bucket of the newest message
+        """
+        has_date = days != NO_DATE
+        buckets = self._to_buckets(days[has_date])
+        if not buckets.size:
+            return np.zeros((len(self.senders), self.buckets), dtype=np.int64)
+        first_bucket = int(buckets.max()) - self.buckets + 1
+        in_window = buckets >= first_bucket
+        LOG.info("Trend of %d senders in the %d %ss starting from %s", len(self.senders), self.buckets,
+                 self.time_bucket.value, self.get_bucket_start(first_bucket))
+        cells = sender_ids[has_date][in_window].astype(np.int64) * self.buckets + (buckets[in_window] - first_bucket)
+        return np.bincount(cells, minlength=len(self.senders) * self.buckets).reshape(len(self.senders), self.buckets)
+
+    def _to_buckets(self, days):
+        """
+        :return: Index of the time bucket of each day ordinal
+        """
+        if self.time_bucket == TimeBucket.DAY:
+            return days.astype(np.int64)
+        if self.time_bucket == TimeBucket.WEEK:
+            # Day 1 is a Monday
+            return (days.astype(np.int64) - 1) // 7
+        return (days.astype(np.int64) - EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+    def get_bucket_start(self, bucket: int) -> datetime.date:
+        if self.time_bucket == TimeBucket.DAY:
+            return datetime.date.fromordinal(bucket)
+        if self.time_bucket == TimeBucket.WEEK:
+            return datetime.date.fromordinal(bucket * 7 + 1)
+        return datetime.date(1970 + bucket // 12, bucket % 12 + 1, 1)
+
+    @staticmethod
+    def _get_trends(histograms):
+        """
+        :return: Slope of the least squares line through the counts of each sender, in messages per time bucket
+        """
+        positions = np.arange(histograms.shape[1], dtype=np.float64)
+        positions -= positions.mean()
+        variance = positions @ positions
+        if not variance:
+            return np.zeros(histograms.shape[0])
+        return np.round(histograms @ positions / variance, 3)
+
+    @staticmethod
+    def _draw_histograms(histograms) -> List[str]:
+        """
+        :return: Histogram of each sender drawn with one character per time bucket, scaled to the largest count
+        """
+        if not histograms.size:
+            return []
+        peaks = np.maximum(histograms.max(axis=1, keepdims=True), 1)
+        levels = np.ceil(histograms * (len(HISTOGRAM_CHARS) - 1) / peaks).astype(np.intp)
+        chars = np.array([ord(char) for char in HISTOGRAM_CHARS], dtype=np.uint32)[levels]
+        # Rows of code points are the same in memory as strings of fixed length
+        return np.ascontiguousarray(chars).view(f"U{histograms.shape[1]}").ravel().tolist()
@@ -1,6 +1,5 @@
 import enum
 import logging
-import os.path
 
 from rich.console import Console
 from rich.theme import Theme
@@ -21,19 +20,32 @@ class TextStyle(enum.Enum):
 CUSTOM_THEME = Theme({t.style_name: t.style for t in TextStyle})
 
 
+class ThemedConsoleHandler(logging.Handler):
+    """
+    Prints the INFO records of CliLoggers to the console with the info style of the theme.
+    """
+    def emit(self, record):
+        CliLogger._themed_console.print(self.format(record), style=TextStyle.INFO.style_name)
+
+
 class CliLogger(logging.Logger):
     _themed_console = Console(theme=CUSTOM_THEME)
+    # Replaced by a handler that prints in the writer thread of queue logging, see set_themed_handler
+    _themed_handler: logging.Handler = ThemedConsoleHandler()
     _console: Console = None
     _wide_console: Console = None
+    # Only the result table is printed to stdout, themed texts are only logged
+    _console_only = False
     WIDE_PRINT_WIDTH = 300
 
     def __init__(self, logger):
         super().__init__(logger.name)
         self._logger: logging.Logger = logger
+        # Same list object, handlers added to or removed from the wrapped logger are used by this logger as well
+        self.handlers = logger.handlers
         if not CliLogger._console:
             CliLogger._console = Console()
             CliLogger._wide_console = Console(width=CliLogger.WIDE_PRINT_WIDTH)
-        self._formatter = logging.Formatter()
 
     def _set_file_handler(self):
         filtered_handlers = list(
@@ -42,21 +54,36 @@ class CliLogger(logging.Logger):
             raise ValueError("Expected at least one instance of FileHandler!")
         self._file_handler: logging.FileHandler = filtered_handlers[0]
 
-    def __getattribute__(self, item):
-        # print("getattr: " + item)
-        if item == "handlers":
-            return self._logger.handlers
-        return object.__getattribute__(self, item)
+    def isEnabledFor(self, level):
+        # This logger is not part of the logger hierarchy, the level is determined by the wrapped logger.
+        # Records of disabled levels are not even created.
+        return self._logger.isEnabledFor(level)
 
     def handle(self, record):
         super(CliLogger, self).handle(record)
-        from emailsorter.display.print import PrettyPrint
+        if record.levelno == logging.INFO and not self._console_only:
+            # The record is already logged by the handlers of the wrapped logger, it is only printed to the console
+            CliLogger._themed_handler.handle(record)
+
+    @classmethod
+    def set_console_only(cls, console_only: bool):
+        cls._console_only = console_only
+
+    @classmethod
+    def set_themed_handler(cls, handler: logging.Handler):
+        """
+        :param handler: Handler of the INFO records that are printed to the console, e.g. one that prints them
+        in the writer thread of queue logging
+        """
+        cls._themed_handler = handler
 
-        if record.levelno == logging.INFO:
-            formatted = self._formatter.format(record)
-            # The call to 'super(CliLogger, self).handle(record)' already logged the record via the Logger instance.
-            # As PrettyPrint.print_info_text will end up calling CliLogger.print_themed, we need to prevent logging the record again.
-            PrettyPrint.print_info_text(formatted, suppress_logger=True)
+    @classmethod
+    def get_themed_handler(cls) -> logging.Handler:
+        return cls._themed_handler
+
+    @classmethod
+    def is_console_only(cls) -> bool:
+        return cls._console_only
 
     def print(self, obj, wide_print=False):
         width = CliLogger.WIDE_PRINT_WIDTH if wide_print else None
@@ -72,36 +99,14 @@ class CliLogger(logging.Logger):
         :param text_style:
         :return:
         """
-        self._themed_console.print(text, style=text_style.style_name)
+        if not self._console_only:
+            self._themed_console.print(text, style=text_style.style_name)
         if not suppress_logger:
             self._logger.log(text_style.log_level, text)
 
     def print_exception(self, show_locals: bool = False):
         self._console.print_exception(show_locals=show_locals)
 
-    def record_console(self):
-        self._console.record = True
-        self._wide_console.record = True
-        self._themed_console.record = True
-
-    def export_to_html(self, file_path):
-        fp, ext = os.path.splitext(file_path)
-        themed_file_path = f"{fp}_themed{ext}"
-        wide_file_path = f"{fp}_wide{ext}"
-
-        if not self._console.record:
-            raise Exception("Cannot export to HTML, normal Console is not in recording mode!")
-        if not self._themed_console.record:
-            raise Exception("Cannot export to HTML, themed Console is not in recording mode!")
-        if not self._wide_console.record:
-            raise Exception("Cannot export to HTML, wide Console is not in recording mode!")
-
-        self._console.save_html(file_path)
-        self._themed_console.save_html(themed_file_path)
-        self._wide_console.save_html(wide_file_path)
-
-        return [file_path, themed_file_path, wide_file_path]
-
 
 class Object(object):
     def __contains__(self, key):
@@ -0,0 +1,156 @@
+import csv
+import datetime
+import html
+import json
+import logging
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import List, Any, Dict, Iterable, Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from emailsorter.display.table import ColumnType
+
+LOG = logging.getLogger(__name__)
+
+
+class ExportFormat(Enum):
+    HTML = "html"
+    CSV = "csv"
+    JSONL = "jsonl"
+
+    @property
+    def extension(self):
+        return self.value
+
+
+class ResultExporter(ABC):
+    """
+    Writes the rows of a result table to a file, row by row, so the rows don't have to be kept in memory
+    in another representation. Use it as a context manager or call open / close.
+    """
+    def __init__(self, file_path: str, cols: List[str], col_types: Dict[str, 'ColumnType'] = None):
+        """
+        :param col_types: Type of the values of the columns, columns without a type are written as strings
+        """
+        self.file_path = file_path
+        self._cols = cols
+        self._col_types: Dict[str, 'ColumnType'] = col_types or {}
+        self._file = None
+        self.no_of_rows = 0
+
+    def open(self):
+        self._file = open(self.file_path, "w", newline="", encoding="utf-8")
+        self._write_header()
+        return self
+
+    def write_row(self, row: List[Any]):
+        self._write_row(row)
+        self.no_of_rows += 1
+
+    def write_rows(self, rows: Iterable[List[Any]]):
+        for row in rows:
+            self.write_row(row)
+
+    def close(self):
+        if not self._file:
+            return
+        try:
+            self._write_footer()
+        finally:
+            self._file.close()
+            self._file = None
+        LOG.debug("Exported %d rows to %s", self.no_of_rows, self.file_path)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _create_converters(self) -> List[Callable[[Any], str]]:
+        # The CLI imports the export formats while starting, the table module (and rich) is only needed for exporting
+        from emailsorter.display.table import ColumnType
+
+        return [self._col_types.get(col, ColumnType.STRING).create_converter() for col in self._cols]
+
+    def _write_header(self):
+        pass
+
+    @abstractmethod
+    def _write_row(self, row: List[Any]):
+        pass
+
+    def _write_footer(self):
+        pass
+
+
+class CsvResultExporter(ResultExporter):
+    def _write_header(self):
+        self._converters = self._create_converters()
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self._cols)
+
+    def _write_row(self, row: List[Any]):
+        self._writer.writerow([convert(val) for convert, val in zip(self._converters, row)])
+
+
+class JsonLinesResultExporter(ResultExporter):
+    """
+    Writes one JSON object per row, keyed by the column names. Numbers are kept as numbers, dates are written
+    in ISO 8601 format and missing values as null.
+    """
+    def _write_row(self, row: List[Any]):
+        self._file.write(json.dumps(dict(zip(self._cols, row)), default=JsonLinesResultExporter._to_json))
+        self._file.write("\n")
+
+    @staticmethod
+    def _to_json(val):
+        if isinstance(val, (datetime.datetime, datetime.date)):
+            return val.isoformat()
+        return str(val)
+
+
+class HtmlResultExporter(ResultExporter):
+    HEADER_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="UTF-8">
+<style>
+table {{ border-collapse: collapse; font-family: monospace; }}
+th, td {{ border: 1px solid #ccc; padding: 2px 6px; text-align: left; }}
+</style>
+</head>
+<body>
+<table>
+<thead><tr>{header_cells}</tr></thead>
+<tbody>
+"""
+    FOOTER = """</tbody>
+</table>
+</body>
+</html>
+"""
+
+    def _write_header(self):
+        self._converters = self._create_converters()
+        header_cells = "".join(f"<th>{html.escape(col)}</th>" for col in self._cols)
+        self._file.write(HtmlResultExporter.HEADER_TEMPLATE.format(header_cells=header_cells))
+
+    def _write_row(self, row: List[Any]):
+        cells = "".join(f"<td>{html.escape(convert(val))}</td>" for convert, val in zip(self._converters, row))
+        self._file.write(f"<tr>{cells}</tr>\n")
+
+    def _write_footer(self):
+        self._file.write(HtmlResultExporter.FOOTER)
+
+
+EXPORTERS = {
+    ExportFormat.HTML: HtmlResultExporter,
+    ExportFormat.CSV: CsvResultExporter,
+    ExportFormat.JSONL: JsonLinesResultExporter,
+}
+
+
+def create_exporter(export_format: ExportFormat, file_path: str, cols: List[str],
+                    col_types: Dict[str, 'ColumnType'] = None) -> ResultExporter:
+    return EXPORTERS[export_format](file_path, cols, col_types=col_types)
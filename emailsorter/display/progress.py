@@ -0,0 +1,82 @@
+from typing import Optional
+
+from rich.console import Console
+from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, MofNCompleteColumn, TimeRemainingColumn, \
+    ProgressColumn, TaskID, Task
+from rich.text import Text
+
+from emailsorter.core.metrics import PhaseSpan
+from emailsorter.display.console import CliLogger
+
+
+class ItemsPerSecondColumn(ProgressColumn):
+    def render(self, task: Task) -> Text:
+        speed = task.finished_speed or task.speed
+        if speed is None:
+            return Text("-- /s", style="progress.data.speed")
+        return Text(f"{speed:,.0f} /s", style="progress.data.speed")
+
+
+class ProgressDisplay:
+    """
+    Live progress of the phases of a run on stderr, so stdout only has the results.
+    Nothing is displayed in console-only mode or if stderr is not a terminal, the methods can be called anyway.
+    """
+    def __init__(self, enabled: bool = True):
+        console = Console(stderr=True)
+        self.enabled = enabled and console.is_terminal and not CliLogger.is_console_only()
+        self._progress: Optional[Progress] = None
+        if self.enabled:
+            self._progress = Progress(SpinnerColumn(),
+                                      TextColumn("[progress.description]{task.description}"),
+                                      BarColumn(),
+                                      MofNCompleteColumn(),
+                                      ItemsPerSecondColumn(),
+                                      TextColumn("{task.fields[details]}"),
+                                      TimeRemainingColumn(),
+                                      console=console,
+                                      transient=True)
+
+    def start(self):
+        if self._progress:
+            self._progress.start()
+        return self
+
+    def stop(self):
+        if self._progress:
+            self._progress.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def add_task(self, description: str, total: Optional[int] = None) -> Optional[TaskID]:
+        if not self._progress:
+            return None
+        return self._progress.add_task(description, total=total, details="")
+
+    def update(self, task_id: Optional[TaskID], completed: int = None, details: str = None, total: int = None):
+        if task_id is None:
+            return
+        fields = {"details": details} if details is not None else {}
+        self._progress.update(task_id, completed=completed, total=total, **fields)
+
+    def update_from_span(self, task_id: Optional[TaskID], span: PhaseSpan, counter: str):
+        """
+        Shows the counter of the span as the completed items, with the pages and the cache hits vs. API requests
+        """
+        if task_id is None:
+            return
+        counts = span.counts
+        details = f"pages: {counts.get('pages', 0)}"
+        if "api_requests" in counts:
+            details += f", cache hits: {counts.get('cache_hits', 0)}, API calls: {counts['api_requests']}"
+        self.update(task_id, completed=counts.get(counter, 0), details=details)
+
+    def finish(self, task_id: Optional[TaskID]):
+        if task_id is None:
+            return
+        task = self._progress.tasks[task_id]
+        self._progress.update(task_id, total=task.completed)
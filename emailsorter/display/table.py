@@ -1,13 +1,77 @@
+import heapq
+import itertools
 import logging
+import math
 from collections import defaultdict
-from typing import List, Any, Dict
+from enum import Enum
+from operator import itemgetter
+from typing import List, Any, Dict, Tuple, Optional, Union, Callable, Iterator, Iterable
 
 from rich.table import Table
 
+from emailsorter.core.constants import DEFAULT_PAGE_SIZE
 from emailsorter.display.console import CliLogger
 
 LOG = logging.getLogger(__name__)
 CLI_LOG = CliLogger(LOG)
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Sorted after all strings, sort key of None values of string columns
+LAST_STRING = chr(0x10FFFF)
+
+
+class ColumnType(Enum):
+    """
+    Type of the values of a table column. Values are sorted descending for numbers and dates
+    (largest / newest first) and case-insensitively ascending for strings. None values are sorted last.
+    """
+    STRING = "string"
+    INT = "int"
+    FLOAT = "float"
+    DATE = "date"
+
+    def to_str(self, val: Any) -> str:
+        return self.create_converter()(val)
+
+    def create_converter(self) -> Callable[[Any], str]:
+        """
+        :return: Function converting the values of this type to their displayed string
+        """
+        if self == ColumnType.FLOAT:
+            return lambda val: "" if val is None else f"{val:.2f}"
+        if self == ColumnType.DATE:
+            # Same as strftime(DATE_FORMAT) for naive datetimes, but faster
+            return lambda val: "" if val is None else val.isoformat(" ", "seconds")
+        return lambda val: "" if val is None else str(val)
+
+    def create_sort_key(self, col_idx: int) -> Callable[[List[Any]], Any]:
+        """
+        :return: Function returning the sort key of a row by the value of the column, in ascending order
+        """
+        if self == ColumnType.STRING:
+            return lambda row: LAST_STRING if row[col_idx] is None else str(row[col_idx]).lower()
+        if self == ColumnType.DATE:
+            return lambda row: math.inf if row[col_idx] is None else -row[col_idx].timestamp()
+        return lambda row: math.inf if row[col_idx] is None else -row[col_idx]
+
+
+class SortedRows:
+    """
+    Rows that are already in the order of a table, read from an iterator created for each iteration,
+    so they don't have to be kept in memory. Tables only read the rows they render, exports stream all of them.
+    """
+    def __init__(self, iter_rows: Callable[[], Iterator[List[Any]]], no_of_rows: int, sort_by_columns: List[str]):
+        """
+        :param sort_by_columns: Columns the rows are sorted by, the same as the sort columns of the table
+        """
+        self._iter_rows = iter_rows
+        self._no_of_rows = no_of_rows
+        self.sort_by_columns = sort_by_columns
+
+    def __iter__(self) -> Iterator[List[Any]]:
+        return self._iter_rows()
+
+    def __len__(self):
+        return self._no_of_rows
 
 
 class TableColumnStyles:
@@ -49,16 +113,44 @@ class TableColumnStyles:
     def get_column_style_dict(self, col):
         return self._style_dict_per_column[col]
 
+    def get_colors(self, col: str) -> Dict[str, str]:
+        return self._color_by_value.get(col, {})
+
 
 class TableRenderSettings:
     def __init__(self, col_styles: TableColumnStyles, wide_print=False, show_lines=False,
-                 sort_by_column: str=None):
+                 sort_by_column: Union[str, List[str]] = None, top: int = None, page: int = None,
+                 page_size: int = DEFAULT_PAGE_SIZE):
+        """
+        :param sort_by_column: Column or columns to sort by, later columns are used if the previous ones are equal.
+        Rows that are equal in all of them keep their original order.
+        :param top: Only render the first 'top' rows (after sorting)
+        :param page: Only render the rows of this page (1-based, after sorting), pages have 'page_size' rows
+        """
         if not col_styles:
             raise ValueError("col_styles cannot be None!")
+        if top is not None and page is not None:
+            raise ValueError("Only one of top and page can be specified!")
+        for name, val in [("top", top), ("page", page), ("page_size", page_size)]:
+            if val is not None and val < 1:
+                raise ValueError(f"{name} should be a positive number. Actual value: {val}")
         self._col_styles: TableColumnStyles = col_styles
         self._wide_print = wide_print
         self._show_lines = show_lines
-        self.sort_by_column = sort_by_column
+        self.sort_by_columns: List[str] = [sort_by_column] if isinstance(sort_by_column, str) else sort_by_column or []
+        self.top = top
+        self.page = page
+        self.page_size = page_size
+
+    def get_row_range(self) -> Tuple[int, Optional[int]]:
+        """
+        :return: Start (inclusive) and end (exclusive) index of the rows to render, end is None if not limited
+        """
+        if self.top is not None:
+            return 0, self.top
+        if self.page is not None:
+            return (self.page - 1) * self.page_size, self.page * self.page_size
+        return 0, None
 
     def format_value(self, col: str, val: str):
         style = self._col_styles.style_by_col(col)
@@ -71,6 +163,28 @@ class TableRenderSettings:
             rich_style = ""
         return f"{rich_style}{val}"
 
+    def compile_formatter(self, col: str, col_type: ColumnType) -> Callable[[Any], str]:
+        """
+        Creates the function converting the values of a column to rich markup, same as format_value,
+        but the style lookups are done once per column instead of once per cell.
+        """
+        to_str = col_type.create_converter()
+        style = self._col_styles.style_by_col(col)
+        colors = self._col_styles.get_colors(col)
+        if not colors:
+            if not style:
+                return to_str
+            prefix = f"[{style} ]"
+            return lambda val: prefix + to_str(val)
+
+        prefixes = {val: f"[{style} {color}]" if style else f"[{color}]" for val, color in colors.items()}
+        default_prefix = f"[{style} ]" if style else ""
+
+        def format_value(val):
+            str_val = to_str(val)
+            return prefixes.get(str_val, default_prefix) + str_val
+        return format_value
+
     def get_column_style_dict(self, col_name: str):
         return self._col_styles.get_column_style_dict(col_name)
 
@@ -79,9 +193,15 @@ class TableRenderSettings:
 
 
 class EmailTable:
-    def __init__(self, cols: List[str], render_settings: TableRenderSettings):
+    def __init__(self, cols: List[str], render_settings: TableRenderSettings, col_types: Dict[str, ColumnType] = None):
+        """
+        :param col_types: Type of the values of the columns. The type of columns without a type is detected from
+        the values: integer if all values can be converted to int, string otherwise.
+        """
         self._render_settings: TableRenderSettings = render_settings
         self._cols = cols
+        self._col_types: Dict[str, ColumnType] = col_types or {}
+        self._detected_col_types: Dict[str, ColumnType] = {}
         self._rows = None
         self._table = Table(**self._render_settings.get_table_config_dict())
 
@@ -90,54 +210,104 @@ class EmailTable:
             col_style_dict = self._render_settings.get_column_style_dict(col)
             self._table.add_column(col, **col_style_dict)
 
-    def render(self, rows: List[List[Any]]):
-        self._rows = rows
-        self._rows = self._do_sorting(rows)
-
-        for row in self._rows:
-            vals = [self._render_settings.format_value(self._cols[idx], val) for idx, val in enumerate(row)]
-            self._table.add_row(*vals)
-
-    def _do_sorting(self, rows):
-        def is_numeric_column(col_idx):
-            for row in rows:
-                try:
-                    int(row[col_idx])
-                except (ValueError, TypeError):
-                    return False
-            return True
-
-        sort_by_column = self.get_sort_by_column()
-        sort_by_column_idx = self.get_sort_by_column_idx(sort_by_column)
-
-        LOG.debug("Sorting by column: %s", sort_by_column)
-        LOG.debug("Column index: %s", sort_by_column_idx)
-        LOG.debug("First 5 values to sort by: %s", [row[sort_by_column_idx] for row in rows[:5]])
-
-        # if sort_by_column:
-        #     rows = sorted(rows, key=lambda row: int(row[sort_by_column_idx]), reverse=True)
-        if sort_by_column:
-            if is_numeric_column(sort_by_column_idx):
-                rows = sorted(rows, key=lambda row: int(row[sort_by_column_idx]), reverse=True)
+    def render(self, rows: Union[List[List[Any]], SortedRows]):
+        start, end = self._render_settings.get_row_range()
+        self._rows = self._do_sorting(rows, limit=end)[start:end]
+        if end is not None:
+            if self._rows:
+                self._table.caption = f"Showing rows {start + 1}-{start + len(self._rows)} of {len(rows)}"
             else:
-                rows = sorted(rows, key=lambda row: str(row[sort_by_column_idx]).lower(), reverse=False)
-        return rows
+                self._table.caption = f"No rows from row {start + 1}, number of rows: {len(rows)}"
+
+        # Values are formatted column by column, with the formatter of the column compiled once
+        formatted_cols = []
+        for idx, col in enumerate(self._cols):
+            formatter = self._render_settings.compile_formatter(col, self._get_col_type(col, rows))
+            formatted_cols.append(list(map(formatter, map(itemgetter(idx), self._rows))))
+        add_row = self._table.add_row
+        for formatted_row in zip(*formatted_cols):
+            add_row(*formatted_row)
+
+    def sort(self, rows: Union[List[List[Any]], SortedRows]) -> Iterable[List[Any]]:
+        """
+        :return: All rows in the order of the table, without the row selection of the render settings.
+        Sorted rows are returned as they are, to be read once.
+        """
+        if isinstance(rows, SortedRows):
+            self._check_sorted(rows)
+            return rows
+        return self._do_sorting(rows)
+
+    def _do_sorting(self, rows, limit: int = None):
+        """
+        :param limit: Only the first 'limit' rows of the sorted result are needed.
+        These are selected with a heap, in O(n log limit) time instead of sorting all rows.
+        The result is the same as the first 'limit' rows of the fully sorted rows.
+        """
+        if isinstance(rows, SortedRows):
+            self._check_sorted(rows)
+            return list(itertools.islice(rows, limit))
+        sort_by_columns = self.get_sort_by_columns()
+        LOG.debug("Sorting by columns: %s", sort_by_columns)
+        if not sort_by_columns:
+            return rows[:limit]
+
+        key = self._create_sort_key(sort_by_columns, rows)
+        if limit is not None and limit < len(rows):
+            return heapq.nsmallest(limit, rows, key=key)
+        # The key of each row is computed once, rows with equal keys keep their original order
+        return sorted(rows, key=key)
+
+    def _check_sorted(self, rows: SortedRows):
+        if rows.sort_by_columns != self.get_sort_by_columns():
+            raise ValueError(f"Rows are sorted by columns {rows.sort_by_columns}, "
+                             f"the table is sorted by columns: {self.get_sort_by_columns()}")
+
+    def _create_sort_key(self, sort_by_columns: List[str], rows) -> Callable[[List[Any]], Any]:
+        key_funcs = []
+        for col in sort_by_columns:
+            col_idx = self.get_sort_by_column_idx(col)
+            col_type = self._get_col_type(col, rows)
+            if col in self._detected_col_types and col_type == ColumnType.INT:
+                # Detected integer columns may hold strings
+                key_funcs.append(lambda row, idx=col_idx: -int(row[idx]))
+            else:
+                key_funcs.append(col_type.create_sort_key(col_idx))
+        if len(key_funcs) == 1:
+            return key_funcs[0]
+        return lambda row: tuple(f(row) for f in key_funcs)
+
+    def _get_col_type(self, col: str, rows) -> ColumnType:
+        if col in self._col_types:
+            return self._col_types[col]
+        if col not in self._detected_col_types:
+            self._detected_col_types[col] = EmailTable._detect_col_type(self.get_sort_by_column_idx(col), rows)
+        return self._detected_col_types[col]
+
+    @staticmethod
+    def _detect_col_type(col_idx: int, rows) -> ColumnType:
+        for row in rows:
+            try:
+                int(row[col_idx])
+            except (ValueError, TypeError):
+                return ColumnType.STRING
+        return ColumnType.INT
+
+    @property
+    def rendered_rows(self) -> List[List[Any]]:
+        return self._rows
 
     def print(self):
         CLI_LOG.print(self._table, wide_print=self._render_settings._wide_print)
 
-    def get_sort_by_column(self):
-        col = self._render_settings.sort_by_column
-        if col:
+    def get_sort_by_columns(self) -> List[str]:
+        for col in self._render_settings.sort_by_columns:
             if col not in self._cols:
                 raise ValueError(f"Invalid sort by column: {col}. Available column names are: {self._cols}")
-            return col
-        return None
+        return self._render_settings.sort_by_columns
 
     def get_sort_by_column_idx(self, col: str):
         for idx, c in enumerate(self._cols):
             if c == col:
                 return idx
         return -1
-
-
@@ -1,4 +1,6 @@
+import atexit
 import os
+import sys
 
 from pythoncommons.constants import ExecutionMode
 from pythoncommons.logging_setup import SimpleLoggingSetupConfig, SimpleLoggingSetup
@@ -9,13 +11,14 @@ import logging
 
 from emailsorter.core.constants import EMAIL_SORTER_MODULE_NAME
 from emailsorter.core.common import EmailSorterEnvVar, EmailSorterConfig
+from emailsorter.core.log import QueueLogging
 
 LOG = logging.getLogger(__name__)
 
 
 class Initializer:
     @staticmethod
-    def configure_logging(debug_enabled=False, trace_enabled=False):
+    def configure_logging(debug_enabled=False, trace_enabled=False, console_only=False, queue_logging=False):
         logging_config: SimpleLoggingSetupConfig = SimpleLoggingSetup.init_logger(
             project_name=EMAIL_SORTER_MODULE_NAME,
             logger_name_prefix=EMAIL_SORTER_MODULE_NAME,
@@ -24,7 +27,22 @@ class Initializer:
             trace=trace_enabled,
             verbose_git_log=False,
             with_trace_level=True,
+            add_console_handler=not console_only,
         )
+        if console_only:
+            # Keep stdout clean for the result table, only warnings and errors are shown, on stderr
+            stderr_handler = logging.StreamHandler(stream=sys.stderr)
+            stderr_handler.setLevel(logging.WARNING)
+            logging_config.main_project_logger.addHandler(stderr_handler)
+            from emailsorter.display.console import CliLogger
+            CliLogger.set_console_only(True)
+        if queue_logging:
+            # Records are formatted and written by a background thread, queued records are written before exiting
+            queue_logger = QueueLogging(logging_config.main_project_logger).start()
+            atexit.register(queue_logger.stop)
+            # INFO records of CliLoggers are also printed to the console by the writer thread
+            from emailsorter.display.console import CliLogger
+            CliLogger.set_themed_handler(queue_logger.route(CliLogger.get_themed_handler()))
         LOG.info("Logging to files: %s", logging_config.log_file_paths)
         return logging_config
 
@@ -0,0 +1,6 @@
+import logging
+
+from pythoncommons.logging_setup import SimpleLoggingSetup
+
+# Some code paths log with TRACE level, which is only registered by the logging setup of the CLI
+SimpleLoggingSetup.add_logging_level("TRACE", logging.DEBUG - 5, strict=False)
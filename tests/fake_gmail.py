@@ -0,0 +1,178 @@
+import datetime
+import json
+import os
+import time
+from typing import Dict, List, Any, Iterator, Tuple
+
+# GmailMessage objects look up the conversion context from the gmail_api module while they are created
+from googleapiwrapper import gmail_api  # noqa: F401
+from googleapiwrapper.gmail_common import THREAD_JSON_FILENAME
+from googleapiwrapper.gmail_domain import GmailMessage
+
+from emailsorter.core.source import MessageSource
+
+
+class FakeListRequest:
+    def __init__(self, threads_svc: 'FakeThreadsResource', query: str, max_results: int, start: int = 0):
+        self.threads_svc = threads_svc
+        self.query = query
+        self.max_results = max_results
+        self.start = start
+
+    def execute(self) -> Dict[str, Any]:
+        return self.threads_svc.list_threads(self.query, self.max_results, self.start)
+
+
+class FakeThreadsResource:
+    """
+    The threads.list method of the Gmail API, matching the number of threads of a query in a dict of counts.
+    Each request takes 'latency' seconds.
+    """
+    def __init__(self, counts_by_query: Dict[str, int], latency: float, queries: List[str]):
+        self.counts_by_query = counts_by_query
+        self.latency = latency
+        self.queries = queries
+        self.requests = 0
+
+    def list(self, userId: str = "me", q: str = None, maxResults: int = 100, **kwargs) -> FakeListRequest:
+        self.queries.append(q)
+        return FakeListRequest(self, q, maxResults)
+
+    def list_next(self, previous_request: FakeListRequest, previous_response: Dict[str, Any]):
+        if "nextPageToken" not in previous_response:
+            return None
+        return FakeListRequest(self, previous_request.query, previous_request.max_results,
+                               int(previous_response["nextPageToken"]))
+
+    def list_threads(self, query: str, max_results: int, start: int) -> Dict[str, Any]:
+        self.requests += 1
+        time.sleep(self.latency)
+        count = self.counts_by_query.get(query, 0)
+        end = min(start + max_results, count)
+        response = {"threads": [{"id": f"thread-{i}"} for i in range(start, end)], "resultSizeEstimate": count}
+        if end < count:
+            response["nextPageToken"] = str(end)
+        return response
+
+
+class FakeRequest:
+    def __init__(self, response: Dict[str, Any]):
+        self.response = response
+
+    def execute(self) -> Dict[str, Any]:
+        return self.response
+
+
+class FakeUsersResource:
+    def __init__(self, history_id: str = "1"):
+        self.history_id = history_id
+
+    def getProfile(self, userId: str = "me") -> FakeRequest:
+        return FakeRequest({"emailAddress": "me@example.com", "historyId": self.history_id})
+
+
+class FakeGmailFetcher:
+    def __init__(self, threads_svc: FakeThreadsResource):
+        self.users_svc = FakeUsersResource()
+        self.threads_svc = threads_svc
+
+
+class FakeGmailWrapper:
+    """
+    Stand-in for GmailWrapper that answers thread queries from a dict of counts, after sleeping for 'latency' seconds
+    per request.
+    """
+    def __init__(self, counts_by_query: Dict[str, int], latency: float = 0.0):
+        self.counts_by_query = counts_by_query
+        self.latency = latency
+        self.queries = []
+        self.fetcher = FakeGmailFetcher(FakeThreadsResource(counts_by_query, latency, self.queries))
+
+
+class FakeGmailWrapperFactory:
+    def __init__(self, counts_by_query: Dict[str, int], latency: float = 0.0):
+        self.counts_by_query = counts_by_query
+        self.latency = latency
+
+    def create(self, authorizer=None) -> FakeGmailWrapper:
+        return FakeGmailWrapper(self.counts_by_query, latency=self.latency)
+
+    def share_quota(self, no_of_processes: int) -> 'FakeGmailWrapperFactory':
+        return self
+
+
+class FakeEmailSorterContext:
+    def __init__(self, session_dir: str, wrapper_factory: FakeGmailWrapperFactory, message_store=None):
+        self.session_dir = session_dir
+        self.output_dir = session_dir
+        self.email_cache_dir = os.path.join(session_dir, "email_cache")
+        self.account_email = "me@example.com"
+        self.gmail_wrapper_factory = wrapper_factory
+        self.gmail_wrapper = wrapper_factory.create()
+        self.message_store = message_store
+
+
+def create_message_response(msg_id: str, thread_id: str, sender: str, recipient: str, subject: str,
+                            internal_date: int, label_ids: List[str] = None) -> Dict[str, Any]:
+    """
+    Creates a message in the format of the Gmail API (METADATA format), as stored in the email cache.
+    """
+    return {
+        "id": msg_id,
+        "threadId": thread_id,
+        "labelIds": label_ids if label_ids is not None else ["INBOX"],
+        "snippet": "",
+        "internalDate": str(internal_date),
+        "payload": {
+            "partId": "",
+            "mimeType": "text/plain",
+            # Headers without a value are left out, e.g. messages without a recipient
+            "headers": [{"name": name, "value": value} for name, value in [
+                ("From", sender), ("To", recipient), ("Subject", subject), ("Date", "Mon, 1 May 2023 10:00:00 +0000")
+            ] if value is not None],
+        },
+    }
+
+
+def write_cached_thread(threads_dir: str, thread_id: str, messages: List[Dict[str, Any]]):
+    thread_dir = os.path.join(threads_dir, thread_id)
+    os.makedirs(thread_dir, exist_ok=True)
+    with open(os.path.join(thread_dir, THREAD_JSON_FILENAME), "w") as f:
+        json.dump({"id": thread_id, "messages": messages}, f)
+
+
+def create_gmail_message(msg_id: str, thread_id: str, sender_email: str, subject: str = "Subject",
+                         date: datetime.datetime = datetime.datetime(2023, 5, 1)) -> GmailMessage:
+    return GmailMessage(msg_id, thread_id, subject, date, f"Sender <{sender_email}>", sender_email,
+                        "Me <me@example.com>", "me@example.com", date.isoformat(), [])
+
+
+class FakeMailboxSource(MessageSource):
+    """
+    MessageSource backed by a mutable mailbox. Tests can replay mailbox changes between discovery runs.
+    Mailbox: thread ID -> (thread version, messages of thread).
+    """
+    def __init__(self, page_size: int = 2):
+        self.mailbox: Dict[str, Tuple[str, List[GmailMessage]]] = {}
+        self.page_size = page_size
+        self.fetched_thread_ids: List[str] = []
+
+    def put_thread(self, thread_id: str, version: str, messages: List[GmailMessage]):
+        self.mailbox[thread_id] = (version, messages)
+
+    def remove_thread(self, thread_id: str):
+        del self.mailbox[thread_id]
+
+    def iter_pages(self) -> Iterator[List[GmailMessage]]:
+        return self.iter_pages_for_threads(list(self.mailbox.keys()))
+
+    def list_thread_versions(self) -> Dict[str, str]:
+        return {thread_id: version for thread_id, (version, _) in self.mailbox.items()}
+
+    def iter_pages_for_threads(self, thread_ids: List[str]) -> Iterator[List[GmailMessage]]:
+        for i in range(0, len(thread_ids), self.page_size):
+            page = []
+            for thread_id in thread_ids[i:i + self.page_size]:
+                self.fetched_thread_ids.append(thread_id)
+                page.extend(self.mailbox[thread_id][1])
+            yield page
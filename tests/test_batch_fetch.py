@@ -0,0 +1,69 @@
+import tempfile
+import unittest
+
+from googleapiclient.errors import HttpError
+from googleapiwrapper.gmail_api import ApiConversionContext
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from benchmarks.gmail_server import FakeGmailServer, LocalGmailWrapper
+from benchmarks.synthetic import iter_thread_responses
+from emailsorter.core.batch import BatchThreadFetcher
+from emailsorter.core.error import BatchRequestException
+from emailsorter.core.source import GmailApiMessageSource
+
+
+class BatchFetchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        threads = list(iter_thread_responses(60, 5, messages_per_thread=2))
+        self.thread_ids = [thread["id"] for thread in threads]
+        self.server = FakeGmailServer(threads).start()
+        self.wrapper = LocalGmailWrapper(self.server.url, self.tmp_dir.name, use_cache=True)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+    def _create_source(self, batch_size: int) -> GmailApiMessageSource:
+        return GmailApiMessageSource(self.wrapper, query="label:inbox", fetch_mode=ThreadQueryFormat.METADATA,
+                                     expect_one_message_per_thread=False, batch_size=batch_size)
+
+    def test_batched_source_fetches_same_messages_with_fewer_requests(self):
+        source = self._create_source(batch_size=1)
+        unbatched = [m.msg_id for page in source.iter_pages() for m in page]
+        unbatched_requests = self.server.http_requests
+        self.server.http_requests = 0
+
+        source = self._create_source(batch_size=10)
+        batched = [m.msg_id for page in source.iter_pages() for m in page]
+        self.assertEqual(60, len(batched))
+        self.assertEqual(unbatched, batched)
+        # threads.list + 3 batches, the cache was filled by the first run so only the message IDs are checked
+        self.assertEqual(4, self.server.http_requests)
+        self.assertEqual(1 + 2 * 30, unbatched_requests)
+        self.assertEqual(4, source.get_fetch_stats().http_requests)
+        self.assertEqual(31, source.get_fetch_stats().api_requests)
+
+    def test_failed_calls_of_batch_are_retried(self):
+        self.server.fail_calls(self.thread_ids[3], 429, times=2)
+        self.server.fail_calls(self.thread_ids[7], 503)
+        fetcher = BatchThreadFetcher(self.wrapper.fetcher, batch_size=5, retry_delay=0)
+        responses = fetcher.fetch_threads(ApiConversionContext(), self.thread_ids[:10], ThreadQueryFormat.METADATA)
+
+        self.assertEqual(self.thread_ids[:10], sorted(responses.keys()))
+        self.assertEqual(2, len(responses[self.thread_ids[3]]["messages"]))
+        self.assertEqual(3, fetcher.stats.retried_calls)
+        # 2 batches, the 2 failed calls in a batch, then the one failing twice
+        self.assertEqual(4, fetcher.stats.batches)
+
+    def test_retries_are_limited(self):
+        self.server.fail_calls(self.thread_ids[0], 429, times=3)
+        fetcher = BatchThreadFetcher(self.wrapper.fetcher, batch_size=5, max_attempts=3, retry_delay=0)
+        with self.assertRaises(BatchRequestException):
+            fetcher.fetch_threads(ApiConversionContext(), self.thread_ids[:5], ThreadQueryFormat.METADATA)
+
+    def test_not_retryable_error_is_raised(self):
+        fetcher = BatchThreadFetcher(self.wrapper.fetcher, batch_size=5, retry_delay=0)
+        with self.assertRaises(HttpError) as cm:
+            fetcher.fetch_threads(ApiConversionContext(), ["unknown-thread"], ThreadQueryFormat.METADATA)
+        self.assertEqual(404, cm.exception.resp.status)
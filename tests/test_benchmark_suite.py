@@ -0,0 +1,27 @@
+import unittest
+from collections import Counter
+
+from benchmarks.suite import run_suite, get_result_types
+from benchmarks.synthetic import create_thread_query_results
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+    def test_synthetic_senders_are_skewed(self):
+        query_result = create_thread_query_results(1000, no_of_senders=100, body_lines=1, skew=1.1,
+                                                   messages_per_thread=2)
+        self.assertEqual(1000, query_result.no_of_messages)
+        self.assertEqual(500, query_result.no_of_threads)
+        counts = Counter(m.sender_email for m in query_result.threads.messages).most_common()
+        self.assertEqual("sender0@example.com", counts[0][0])
+        self.assertGreater(counts[0][1], 10 * counts[-1][1])
+
+    def test_all_cases_run(self):
+        results = run_suite([50], no_of_senders=10, skew=None, body_lines=2, repeat=1)
+        cases = {r.case for r in results}
+        self.assertIn("process_gmail_results", cases)
+        self.assertIn("export[detailed,csv]", cases)
+        self.assertIn("export[organization,csv]", cases)
+        self.assertIn("load_snapshot[detailed]", cases)
+        # 4 cases of message processing, saving a snapshot,
+        # 8 cases of converting, rendering, exporting and loading each result type
+        self.assertEqual(5 + 8 * len(get_result_types()), len(results))
@@ -0,0 +1,71 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from emailsorter.common.model import ProcessorResultType, GroupingEngine, create_message_processor
+from emailsorter.core.snapshot import ResultSnapshot
+from tests.fake_gmail import create_gmail_message
+
+RESULT_TYPES = [ProcessorResultType.SIMPLIFIED, ProcessorResultType.DETAILED]
+
+
+@unittest.skipUnless(GroupingEngine.COLUMNAR.is_available, "NumPy is not installed")
+class ColumnarGroupingProcessorTest(unittest.TestCase):
+    def setUp(self):
+        start = datetime.datetime(2024, 1, 1, 9, 0)
+        senders = ["alice@example.com", "bob@example.com", None, "alice@example.com", "carol@example.org"]
+        self.messages = [create_gmail_message(f"m{i}", f"t{i // 2}", senders[i % len(senders)],
+                                              subject=f"Subject {i}", date=start + datetime.timedelta(hours=i))
+                         for i in range(40)]
+
+    def _process(self, result_type: ProcessorResultType, engine: GroupingEngine, messages=None):
+        processor = create_message_processor(result_type, engine=engine)
+        for message in self.messages if messages is None else messages:
+            processor.process(message)
+        return processor
+
+    def test_results_match_dict_engine(self):
+        for result_type in RESULT_TYPES:
+            for messages in [self.messages, self.messages[:1], []]:
+                expected = self._process(result_type, GroupingEngine.DICT, messages).convert_to_table_rows()
+                actual = self._process(result_type, GroupingEngine.COLUMNAR, messages).convert_to_table_rows()
+                self.assertEqual(expected, actual, (result_type, len(messages)))
+
+    def test_detailed_rows_are_grouped_by_sender(self):
+        _, rows = self._process(ProcessorResultType.DETAILED, GroupingEngine.COLUMNAR,
+                                self.messages[:6]).convert_to_table_rows()
+        self.assertEqual([["alice@example.com", 3, "m0"], ["alice@example.com", 3, "m3"],
+                          ["alice@example.com", 3, "m5"], ["bob@example.com", 1, "m1"], [None, 1, "m2"],
+                          ["carol@example.org", 1, "m4"]],
+                         [[row[0], row[1], row[6]] for row in rows])
+
+    def test_merged_processors_match_single_processor(self):
+        for result_type in RESULT_TYPES:
+            processor = self._process(result_type, GroupingEngine.COLUMNAR, self.messages[:13])
+            processor.merge(self._process(result_type, GroupingEngine.COLUMNAR, self.messages[13:]))
+            expected = self._process(result_type, GroupingEngine.DICT).convert_to_table_rows()
+            self.assertEqual(expected, processor.convert_to_table_rows(), result_type)
+
+        with self.assertRaises(ValueError):
+            processor.merge(self._process(ProcessorResultType.SIMPLIFIED, GroupingEngine.COLUMNAR))
+
+    def test_snapshot_matches_dict_engine(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            files = {}
+            for engine in GroupingEngine:
+                files[engine] = os.path.join(tmp_dir, f"{engine.value}.snapshot")
+                ResultSnapshot.save(files[engine], self._process(ProcessorResultType.DETAILED, engine))
+            with ResultSnapshot(files[GroupingEngine.DICT]) as expected, \
+                    ResultSnapshot(files[GroupingEngine.COLUMNAR]) as actual:
+                for result_type in RESULT_TYPES:
+                    self.assertEqual(expected.to_processor(result_type).convert_to_table_rows(),
+                                     actual.to_processor(result_type, engine=GroupingEngine.COLUMNAR)
+                                     .convert_to_table_rows(), result_type)
+
+    def test_matches_dict_engine_in_benchmark(self):
+        from benchmarks.columnar_grouping import create_messages, run
+
+        messages = create_messages(2000, 50, 1.1)
+        for result_type in RESULT_TYPES:
+            self.assertTrue(run(messages, result_type, memory=False)["results_match"], result_type)
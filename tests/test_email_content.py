@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+
+from googleapiwrapper.gmail_domain import GmailMessage
+
+from benchmarks.synthetic import create_message
+from emailsorter.actions.inbox_discovery import InboxDiscovery, EmailContent
+from emailsorter.common.model import EmailContentProcessor, NoOpEmailContentProcessor
+from emailsorter.core.constants import DEFAULT_LINE_SEP
+
+
+class RecordingEmailContentProcessor(EmailContentProcessor):
+    def __init__(self, read_lines: bool):
+        self.read_lines = read_lines
+        self.lines = []
+
+    def process(self, email_content: EmailContent):
+        if self.read_lines:
+            self.lines.append(email_content.lines)
+
+
+class EmailContentTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = [create_message(i, "sender@example.com", body_lines=3) for i in range(5)]
+
+    def test_lines_are_decoded_once_when_read(self):
+        message = self.messages[0]
+        with patch.object(message, "get_all_plain_text_parts", wraps=message.get_all_plain_text_parts) as parts:
+            email_content = InboxDiscovery._create_email_content(message, DEFAULT_LINE_SEP)
+            parts.assert_not_called()
+            self.assertEqual("Line 0 of message 0, some filler text to make the body realistic", email_content.lines[0])
+            self.assertEqual(3, len(email_content.lines))
+            parts.assert_called_once()
+
+    def test_bodies_are_not_decoded_without_readers(self):
+        not_reading = RecordingEmailContentProcessor(read_lines=False)
+        with patch.object(GmailMessage, "get_all_plain_text_parts") as parts:
+            InboxDiscovery.process_messages(self.messages, DEFAULT_LINE_SEP, [not_reading], [])
+            parts.assert_not_called()
+
+    def test_content_is_not_created_if_not_needed(self):
+        with patch.object(InboxDiscovery, "_create_email_content") as create_email_content:
+            InboxDiscovery.process_messages(self.messages, DEFAULT_LINE_SEP, [NoOpEmailContentProcessor()], [])
+            create_email_content.assert_not_called()
+
+        reading = RecordingEmailContentProcessor(read_lines=True)
+        InboxDiscovery.process_messages(self.messages, DEFAULT_LINE_SEP, [NoOpEmailContentProcessor(), reading], [])
+        self.assertEqual(5, len(reading.lines))
+
+    def test_parts_without_text_are_skipped(self):
+        message = self.messages[0]
+        parts = message.get_all_plain_text_parts()
+        invalid_part = type(parts[0])(None, parts[0].mime_type)
+        invalid_part.body_data = b"binary"
+        with patch.object(message, "get_all_plain_text_parts", return_value=[invalid_part] + parts):
+            email_content = InboxDiscovery._create_email_content(message, DEFAULT_LINE_SEP)
+            with self.assertLogs("emailsorter.actions.inbox_discovery", level="WARNING") as logs:
+                self.assertEqual(3, len(email_content.lines))
+        self.assertIn("msg-00000000", logs.output[0])
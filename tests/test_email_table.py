@@ -0,0 +1,78 @@
+import datetime
+import random
+import unittest
+
+from emailsorter.display.table import EmailTable, TableRenderSettings, TableColumnStyles, ColumnType
+
+COLS = ["Sender", "Count", "Subject"]
+
+
+class EmailTableTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(1)
+        # Many equal counts, so the order of ties matters as well
+        self.rows = [[f"sender{i}", str(rnd.randint(1, 20)), f"Subject {rnd.randint(1, 1000)}"] for i in range(500)]
+
+    def _render(self, sort_by_column="Count", **kwargs):
+        settings = TableRenderSettings(TableColumnStyles(), sort_by_column=sort_by_column, **kwargs)
+        table = EmailTable(COLS, settings)
+        table.render(self.rows)
+        return table
+
+    def test_top_rows_match_full_sort(self):
+        for sort_by_column in ["Count", "Subject"]:
+            full = self._render(sort_by_column=sort_by_column).rendered_rows
+            self.assertEqual(full[:10], self._render(sort_by_column=sort_by_column, top=10).rendered_rows)
+        self.assertEqual(500, len(self._render(top=1000).rendered_rows))
+
+    def test_pages_match_full_sort(self):
+        full = self._render().rendered_rows
+        pages = [self._render(page=page, page_size=30).rendered_rows for page in range(1, 19)]
+        self.assertEqual(full, [row for page in pages for row in page])
+        self.assertEqual([], pages[-1])
+        self.assertEqual("Showing rows 31-60 of 500", self._render(page=2, page_size=30)._table.caption)
+
+    def test_rows_are_not_sorted_without_sort_column(self):
+        self.assertEqual(self.rows[:5], self._render(sort_by_column=None, top=5).rendered_rows)
+
+    def test_invalid_selection(self):
+        with self.assertRaises(ValueError):
+            self._render(top=5, page=1)
+        with self.assertRaises(ValueError):
+            self._render(page=0)
+
+
+class TypedEmailTableTest(unittest.TestCase):
+    def setUp(self):
+        self.cols = ["Sender", "Count", "Date"]
+        self.col_types = {"Sender": ColumnType.STRING, "Count": ColumnType.INT, "Date": ColumnType.DATE}
+        self.rows = [
+            ["b@example.com", 2, datetime.datetime(2023, 5, 1)],
+            ["a@example.com", 2, datetime.datetime(2023, 6, 1)],
+            ["c@example.com", 5, None],
+            ["A@example.com", 2, datetime.datetime(2023, 6, 1)],
+        ]
+
+    def _render(self, sort_by_column, col_styles=None):
+        settings = TableRenderSettings(col_styles or TableColumnStyles(), sort_by_column=sort_by_column)
+        table = EmailTable(self.cols, settings, col_types=self.col_types)
+        table.render(self.rows)
+        return table
+
+    def test_multi_column_sort_is_stable(self):
+        rows = self._render(["Count", "Date", "Sender"]).rendered_rows
+        self.assertEqual(["c@example.com", "a@example.com", "A@example.com", "b@example.com"], [r[0] for r in rows])
+        # Dates are sorted newest first, None last
+        rows = self._render("Date").rendered_rows
+        self.assertEqual(["a@example.com", "A@example.com", "b@example.com", "c@example.com"], [r[0] for r in rows])
+
+    def test_compiled_formatters_match_format_value(self):
+        col_styles = TableColumnStyles().bind_style("Sender", "cyan").bind_color("Sender", "a@example.com", "red") \
+            .bind_color("Count", "5", "green")
+        settings = TableRenderSettings(col_styles)
+        for col, col_type in self.col_types.items():
+            formatter = settings.compile_formatter(col, col_type)
+            col_idx = self.cols.index(col)
+            for row in self.rows:
+                self.assertEqual(settings.format_value(col, col_type.to_str(row[col_idx])), formatter(row[col_idx]))
+        self.assertEqual("2023-05-01 00:00:00", ColumnType.DATE.to_str(self.rows[0][2]))
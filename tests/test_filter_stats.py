@@ -0,0 +1,122 @@
+import os
+import tempfile
+import time
+import unittest
+
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from emailsorter.actions.inbox_discovery import GmailFilter, InboxDiscovery, InboxDiscoveryConfig
+from emailsorter.core.common import EmailSorterConfig
+from emailsorter.core.store import MessageStore
+from tests.fake_gmail import FakeGmailWrapperFactory, FakeEmailSorterContext, create_message_response, \
+    write_cached_thread
+
+LATENCY = 0.2
+NO_OF_FILTERS = 8
+
+
+class FilterStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        EmailSorterConfig.PROJECT_OUT_ROOT = self.tmp_dir.name
+        self.filters = [GmailFilter(f"filter-{i}", f"from:sender{i}@example.com") for i in range(NO_OF_FILTERS)]
+        counts = {f.filter_expression: i * 10 for i, f in enumerate(self.filters)}
+        self.ctx = FakeEmailSorterContext(self.tmp_dir.name, FakeGmailWrapperFactory(counts, latency=LATENCY))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _query_filters(self, parallelism: int, offline: bool = False, local: bool = False, estimate: bool = False,
+                       request_limit: int = 1000000):
+        conf = InboxDiscoveryConfig(self.ctx,
+                                    gmail_query="label:inbox",
+                                    fetch_mode=ThreadQueryFormat.MINIMAL,
+                                    offline_mode=offline,
+                                    parallelism=parallelism,
+                                    local_evaluation=local,
+                                    request_limit=request_limit,
+                                    estimate_counts=estimate)
+        start = time.perf_counter()
+        result_processor = InboxDiscovery(conf, self.ctx).query_filters(self.filters)
+        return result_processor, time.perf_counter() - start
+
+    def test_concurrent_results_match_serial_results_in_filter_order(self):
+        serial, _ = self._query_filters(parallelism=1)
+        concurrent, _ = self._query_filters(parallelism=4)
+
+        self.assertEqual([f.description for f in self.filters], list(concurrent.count_per_filter.keys()))
+        self.assertEqual(serial.count_per_filter, concurrent.count_per_filter)
+        rows = concurrent.convert_to_table_rows()
+        self.assertEqual(["filter-3", 30, self.filters[3].gmail_link], rows[3][:3])
+
+    def test_per_filter_latency_is_reported(self):
+        result_processor, _ = self._query_filters(parallelism=4)
+        for seconds in result_processor.seconds_per_filter.values():
+            self.assertGreaterEqual(seconds, LATENCY)
+
+    def test_concurrent_execution_is_faster(self):
+        _, serial_seconds = self._query_filters(parallelism=1)
+        _, concurrent_seconds = self._query_filters(parallelism=4)
+        self.assertGreaterEqual(serial_seconds, NO_OF_FILTERS * LATENCY)
+        self.assertLess(concurrent_seconds, serial_seconds / 2)
+
+    def test_counts_page_through_thread_ids_with_maximum_page_size(self):
+        self.ctx.gmail_wrapper.counts_by_query["from:sender1@example.com"] = 1234
+        result_processor, _ = self._query_filters(parallelism=1)
+
+        self.assertEqual(1234, result_processor.count_per_filter["filter-1"])
+        self.assertEqual("exact", result_processor.convert_to_table_rows()[1][4])
+        # 3 pages of 500 thread IDs for filter-1, 1 page for the others
+        self.assertEqual(3 + NO_OF_FILTERS - 1, self.ctx.gmail_wrapper.fetcher.threads_svc.requests)
+
+    def test_counts_are_limited_by_request_limit(self):
+        self.ctx.gmail_wrapper.counts_by_query["from:sender1@example.com"] = 1234
+        result_processor, _ = self._query_filters(parallelism=1, request_limit=600)
+        self.assertEqual(600, result_processor.count_per_filter["filter-1"])
+        self.assertEqual(30, result_processor.count_per_filter["filter-3"])
+
+    def test_estimated_counts_take_one_request_per_filter(self):
+        self.ctx.gmail_wrapper.counts_by_query["from:sender1@example.com"] = 1234
+        result_processor, _ = self._query_filters(parallelism=1, estimate=True)
+
+        self.assertEqual(1234, result_processor.count_per_filter["filter-1"])
+        self.assertEqual(NO_OF_FILTERS, self.ctx.gmail_wrapper.fetcher.threads_svc.requests)
+        self.assertEqual({"estimated"}, {row[4] for row in result_processor.convert_to_table_rows()})
+
+    def test_invalid_parallelism(self):
+        with self.assertRaises(ValueError):
+            self._query_filters(parallelism=0)
+
+    def _create_message_store(self):
+        threads_dir = os.path.join(self.tmp_dir.name, "threads")
+        for i in range(3):
+            write_cached_thread(threads_dir, f"t{i}", [
+                create_message_response(f"m{i}", f"t{i}", "sender1@example.com", "me@example.com", "Hi", 1682942400000)
+            ])
+        self.ctx.message_store = MessageStore(os.path.join(self.tmp_dir.name, "store.sqlite3"), threads_dir)
+
+    def test_offline_mode_counts_from_message_store(self):
+        self._create_message_store()
+        self.filters.append(GmailFilter("unsupported", "has:attachment"))
+
+        result_processor, _ = self._query_filters(parallelism=4, offline=True)
+
+        self.assertEqual([], self.ctx.gmail_wrapper.queries)
+        self.assertEqual(3, result_processor.count_per_filter["filter-1"])
+        self.assertEqual(0, result_processor.count_per_filter["filter-2"])
+        self.assertNotIn("unsupported", result_processor.count_per_filter)
+        self.ctx.message_store.close()
+
+    def test_local_evaluation_falls_back_to_gmail_for_unsupported_filters(self):
+        self._create_message_store()
+        self.filters.append(GmailFilter("unsupported", "has:attachment"))
+        self.ctx.gmail_wrapper.counts_by_query["has:attachment"] = 42
+
+        result_processor, _ = self._query_filters(parallelism=1, local=True)
+
+        self.assertEqual(["has:attachment"], self.ctx.gmail_wrapper.queries)
+        self.assertEqual([f.description for f in self.filters], list(result_processor.count_per_filter.keys()))
+        self.assertEqual(3, result_processor.count_per_filter["filter-1"])
+        self.assertEqual(42, result_processor.count_per_filter["unsupported"])
+        self.assertEqual({"exact"}, {row[4] for row in result_processor.convert_to_table_rows()})
+        self.ctx.message_store.close()
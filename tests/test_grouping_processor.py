@@ -0,0 +1,37 @@
+import unittest
+
+from emailsorter.common.model import GroupingEmailMessageProcessor, ProcessorResultType
+from tests.fake_gmail import create_gmail_message
+
+
+class GroupingEmailMessageProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = [
+            create_gmail_message("m1", "t1", "alice@example.com", subject="First"),
+            create_gmail_message("m2", "t2", "bob@example.com", subject="Second"),
+            create_gmail_message("m3", "t3", "alice@example.com", subject="Third"),
+        ]
+
+    def _process(self, result_type: ProcessorResultType) -> GroupingEmailMessageProcessor:
+        processor = GroupingEmailMessageProcessor(result_type)
+        for message in self.messages:
+            processor.process(message)
+        return processor
+
+    def test_simplified_rows(self):
+        processor = self._process(ProcessorResultType.SIMPLIFIED)
+        grouping, rows = processor.convert_to_table_rows()
+        self.assertEqual([["alice@example.com", 2], ["bob@example.com", 1]], rows)
+        self.assertEqual({"alice@example.com": ("t3", "m3", "Third"), "bob@example.com": ("t2", "m2", "Second")},
+                         grouping)
+        self.assertEqual({}, processor.grouping_by_sender)
+
+    def test_detailed_rows(self):
+        processor = self._process(ProcessorResultType.DETAILED)
+        _, rows = processor.convert_to_table_rows()
+        date = self.messages[0].date
+        self.assertEqual([
+            ["alice@example.com", 2, "me@example.com", date, "First", "t1", "m1"],
+            ["alice@example.com", 2, "me@example.com", date, "Third", "t3", "m3"],
+            ["bob@example.com", 1, "me@example.com", date, "Second", "t2", "m2"],
+        ], rows)
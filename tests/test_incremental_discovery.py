@@ -0,0 +1,74 @@
+import tempfile
+import unittest
+
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+from emailsorter.common.model import ProcessorResultType, MessageSummary
+from emailsorter.core.checkpoint import DiscoveryCheckpointStore, DiscoveryCheckpoint
+from emailsorter.core.common import EmailSorterConfig
+from tests.fake_gmail import FakeGmailWrapperFactory, FakeEmailSorterContext, FakeMailboxSource, \
+    create_gmail_message
+
+
+class IncrementalDiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        EmailSorterConfig.PROJECT_OUT_ROOT = self.tmp_dir.name
+        self.ctx = FakeEmailSorterContext(self.tmp_dir.name, FakeGmailWrapperFactory({}))
+        self.source = FakeMailboxSource()
+        for i in range(10):
+            sender = f"sender{i % 3}@example.com"
+            self.source.put_thread(f"t{i}", "1", [create_gmail_message(f"m{i}", f"t{i}", sender)])
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _sender_counts(self, incremental: bool, result_type=ProcessorResultType.SIMPLIFIED):
+        conf = InboxDiscoveryConfig(self.ctx,
+                                    gmail_query="label:inbox",
+                                    fetch_mode=ThreadQueryFormat.METADATA,
+                                    offline_mode=False,
+                                    incremental=incremental)
+        processor = InboxDiscovery(conf, self.ctx).discover(result_type, source=self.source)
+        _, rows = processor.convert_to_table_rows()
+        return sorted(tuple(row) for row in rows)
+
+    def test_incremental_results_match_full_rebuild_after_mailbox_changes(self):
+        self.assertEqual(self._sender_counts(incremental=False), self._sender_counts(incremental=True))
+
+        # New thread, new message in an existing thread, removed thread
+        self.source.put_thread("t10", "1", [create_gmail_message("m10", "t10", "sender9@example.com")])
+        self.source.put_thread("t1", "2", [create_gmail_message("m1", "t1", "sender1@example.com"),
+                                           create_gmail_message("m1-2", "t1", "sender2@example.com")])
+        self.source.remove_thread("t5")
+        self.source.fetched_thread_ids.clear()
+
+        incremental_counts = self._sender_counts(incremental=True)
+        self.assertEqual(["t1", "t10"], sorted(self.source.fetched_thread_ids))
+        self.assertEqual(self._sender_counts(incremental=False), incremental_counts)
+        self.assertIn(("sender2@example.com", 3), incremental_counts)
+        self.assertIn(("sender9@example.com", 1), incremental_counts)
+
+    def test_unchanged_mailbox_is_not_fetched_again(self):
+        self._sender_counts(incremental=True)
+        self.source.fetched_thread_ids.clear()
+        self._sender_counts(incremental=True)
+        self.assertEqual([], self.source.fetched_thread_ids)
+
+    def test_detailed_results_match_full_rebuild(self):
+        self._sender_counts(incremental=True, result_type=ProcessorResultType.DETAILED)
+        self.source.remove_thread("t0")
+        self.assertEqual(self._sender_counts(incremental=False, result_type=ProcessorResultType.DETAILED),
+                         self._sender_counts(incremental=True, result_type=ProcessorResultType.DETAILED))
+
+    def test_checkpoint_round_trip(self):
+        store = DiscoveryCheckpointStore(self.tmp_dir.name)
+        messages = [MessageSummary.from_message(m) for m in self.source.mailbox["t0"][1]]
+        store.save(DiscoveryCheckpoint("label:inbox", thread_versions={"t0": "1"}, messages_by_thread={"t0": messages}))
+
+        checkpoint = store.load("label:inbox")
+        self.assertEqual({"t0": "1"}, checkpoint.thread_versions)
+        self.assertEqual(messages, checkpoint.messages_by_thread["t0"])
+        # Dates stay naive local datetimes, like the dates of GmailMessages
+        self.assertIsNone(checkpoint.newest_message_date.tzinfo)
@@ -0,0 +1,80 @@
+import logging
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from emailsorter.core.log import QueueLogging, SampledLog
+from emailsorter.display.console import CliLogger
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+
+class LogTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("emailsorter.tests.log")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_sampled_log_logs_every_nth_call(self):
+        sampled_log = SampledLog(self.logger, logging.DEBUG, every=10)
+        for i in range(95):
+            sampled_log.log("Message %d", i)
+        self.assertEqual(["Message 9", "Message 19"], self.handler.messages[:2])
+        self.assertEqual(9, sampled_log.no_of_logged)
+        self.assertEqual(86, sampled_log.no_of_suppressed)
+
+    def test_sampled_log_is_rate_limited(self):
+        sampled_log = SampledLog(self.logger, logging.DEBUG, max_per_second=3)
+        with patch("emailsorter.core.log.time.monotonic", side_effect=[100.0] * 5 + [101.5] * 5):
+            for i in range(10):
+                sampled_log.log("Message %d", i)
+        self.assertEqual(["Message 0", "Message 1", "Message 2", "Message 5", "Message 6", "Message 7"],
+                         self.handler.messages)
+
+    def test_disabled_level_is_not_formatted(self):
+        self.logger.setLevel(logging.INFO)
+        sampled_log = SampledLog(self.logger, logging.DEBUG)
+        self.assertFalse(sampled_log.enabled)
+        arg = MagicMock()
+        sampled_log.log("Message %s", arg)
+        arg.__str__.assert_not_called()
+        self.assertEqual(0, sampled_log.no_of_calls)
+
+    def test_queue_logging_writes_records_in_background_thread(self):
+        with QueueLogging(self.logger):
+            self.assertNotIn(self.handler, self.logger.handlers)
+            for i in range(100):
+                self.logger.info("Message %d", i)
+        self.assertEqual([f"Message {i}" for i in range(100)], self.handler.messages)
+        self.assertNotIn(threading.current_thread().name, self.handler.threads)
+        self.assertEqual([self.handler], self.logger.handlers)
+
+    def test_themed_console_output_is_printed_in_background_thread(self):
+        themed_handler = CliLogger.get_themed_handler()
+        console_handler = RecordingHandler()
+        cli_logger = CliLogger(self.logger)
+        try:
+            with QueueLogging(self.logger) as queue_logging:
+                CliLogger.set_themed_handler(queue_logging.route(console_handler))
+                cli_logger.info("Info %d", 1)
+                cli_logger.debug("Debug %d", 2)
+        finally:
+            CliLogger.set_themed_handler(themed_handler)
+        # Only the INFO records of the CliLogger are printed, all records are written by the handlers of the logger
+        self.assertEqual(["Info 1"], console_handler.messages)
+        self.assertNotIn(threading.current_thread().name, console_handler.threads)
+        self.assertEqual(["Info 1", "Debug 2"], self.handler.messages)
@@ -0,0 +1,38 @@
+import unittest
+from typing import Iterator, List
+
+from emailsorter.core.source import MessageSource, PrefetchingMessageSource
+
+
+class ListMessageSource(MessageSource):
+    def __init__(self, pages: List[List[str]], fail_after_page: int = None):
+        self.pages = pages
+        self.fail_after_page = fail_after_page
+
+    def iter_pages(self) -> Iterator[List[str]]:
+        for idx, page in enumerate(self.pages):
+            if self.fail_after_page is not None and idx > self.fail_after_page:
+                raise ValueError("Failed to fetch page")
+            yield page
+
+
+class PrefetchingMessageSourceTest(unittest.TestCase):
+    def test_keeps_order_of_pages_and_messages(self):
+        pages = [[f"msg-{p}-{m}" for m in range(3)] for p in range(10)]
+        source = PrefetchingMessageSource(ListMessageSource(pages), max_prefetched_pages=2)
+        self.assertEqual([m for page in pages for m in page], list(source.iter_messages()))
+
+    def test_propagates_errors_of_wrapped_source(self):
+        source = PrefetchingMessageSource(ListMessageSource([["a"], ["b"], ["c"]], fail_after_page=1))
+        consumed = []
+        with self.assertRaises(ValueError):
+            for message in source.iter_messages():
+                consumed.append(message)
+        self.assertEqual(["a", "b"], consumed)
+
+    def test_consumer_can_stop_early(self):
+        pages = [[i] for i in range(100)]
+        source = PrefetchingMessageSource(ListMessageSource(pages), max_prefetched_pages=1)
+        for page in source.iter_pages():
+            if page == [5]:
+                break
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from emailsorter.core.error import UnsupportedQueryException
+from emailsorter.core.store import MessageStore
+from tests.fake_gmail import create_message_response, write_cached_thread
+
+# 2023-05-01, 2023-06-01, 2023-07-01 in millis
+MAY = 1682942400000
+JUNE = 1685620800000
+JULY = 1688212800000
+
+
+class MessageStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.threads_dir = os.path.join(self.tmp_dir, "threads")
+        write_cached_thread(self.threads_dir, "t1", [
+            create_message_response("m1", "t1", "Alice <alice@example.com>", "me@example.com", "Hello", MAY),
+            create_message_response("m2", "t1", "Bob <bob@example.com>", "me@example.com", "Re: Hello", JUNE),
+        ])
+        write_cached_thread(self.threads_dir, "t2", [
+            create_message_response("m3", "t2", "Alice <alice@example.com>", "other@example.com", "Invoice",
+                                    JULY, label_ids=["CATEGORY_UPDATES"]),
+        ])
+        self.store = MessageStore(os.path.join(self.tmp_dir, "store.sqlite3"), self.threads_dir)
+        self.store.refresh()
+
+    def tearDown(self) -> None:
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _msg_ids(self, query):
+        return sorted(m.msg_id for m in self.store.query_messages(query))
+
+    def test_query_by_indexed_columns(self):
+        self.assertEqual(["m1", "m2"], self._msg_ids("label:inbox"))
+        self.assertEqual(["m1", "m3"], self._msg_ids("from:alice@example.com"))
+        self.assertEqual(["m1", "m3"], self._msg_ids("from:Alice"))
+        self.assertEqual(["m3"], self._msg_ids("to:other@example.com from:alice@example.com"))
+        self.assertEqual(["m3"], self._msg_ids('subject:"invoice"'))
+        self.assertEqual(["m2", "m3"], self._msg_ids("after:2023/05/15"))
+        self.assertEqual(["m1", "m2", "m3"], self._msg_ids(""))
+
+    def test_messages_have_metadata(self):
+        message = next(self.store.query_messages("from:bob@example.com"))
+        self.assertEqual("t1", message.thread_id)
+        self.assertEqual("bob@example.com", message.sender_email)
+        self.assertEqual("me@example.com", message.recipient_email)
+        self.assertEqual("Re: Hello", message.subject)
+
+    def test_count_threads(self):
+        self.assertEqual(2, self.store.count_threads("from:alice@example.com"))
+        self.assertEqual(1, self.store.count_threads("label:inbox"))
+
+    def test_unsupported_query(self):
+        with self.assertRaises(UnsupportedQueryException):
+            self.store.count_threads("some free text")
+        with self.assertRaises(UnsupportedQueryException):
+            self.store.count_threads("has:attachment")
+
+    def test_incremental_refresh(self):
+        stats = self.store.refresh()
+        self.assertFalse(stats.changed)
+        self.assertEqual(2, stats.unchanged_threads)
+
+        shutil.rmtree(os.path.join(self.threads_dir, "t2"))
+        write_cached_thread(self.threads_dir, "t3", [
+            create_message_response("m4", "t3", "carol@example.com", "me@example.com", "New", JULY),
+        ])
+        # Make sure the modification time is different even on file systems with coarse timestamps
+        time.sleep(0.01)
+        write_cached_thread(self.threads_dir, "t1", [
+            create_message_response("m1", "t1", "Alice <alice@example.com>", "me@example.com", "Hello", MAY),
+        ])
+        os.utime(os.path.join(self.threads_dir, "t1", "thread.json"), (time.time() + 10, time.time() + 10))
+
+        stats = self.store.refresh()
+        self.assertEqual((1, 1, 1), (stats.added_threads, stats.updated_threads, stats.removed_threads))
+        self.assertEqual(["m1", "m4"], self._msg_ids(""))
+        self.assertEqual(["m1", "m4"], self._msg_ids("label:inbox"))
+
+    def test_rebuild(self):
+        stats = self.store.rebuild()
+        self.assertEqual(2, stats.added_threads)
+        self.assertEqual(["m1", "m2", "m3"], self._msg_ids(""))
+
+    def test_store_of_old_schema_is_recreated(self):
+        # Version 1 had an index on the date only
+        with self.store._conn as conn:
+            conn.execute("UPDATE meta SET value = '1' WHERE key = 'schema_version'")
+            conn.execute("CREATE INDEX idx_messages_date ON messages (date)")
+        self.store.close()
+        self.store = MessageStore(os.path.join(self.tmp_dir, "store.sqlite3"), self.threads_dir)
+        indices = [row[0] for row in self.store._conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertNotIn("idx_messages_date", indices)
+        self.assertIn("idx_messages_date_msg_id", indices)
+        self.assertEqual([], self._msg_ids(""))
+        self.assertEqual(2, self.store.refresh().added_threads)
+        self.assertEqual(["m1", "m2", "m3"], self._msg_ids(""))
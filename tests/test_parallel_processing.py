@@ -0,0 +1,113 @@
+import functools
+import os
+import tempfile
+import unittest
+
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig, GmailFilter
+from emailsorter.common.model import GroupingEmailMessageProcessor, ProcessorResultType, \
+    MultipleFilterResultProcessor, EmailMessageProcessor
+from emailsorter.core.common import EmailSorterConfig
+from emailsorter.core.constants import DEFAULT_LINE_SEP
+from emailsorter.core.source import MessageStoreSource
+from emailsorter.core.store import MessageStore
+from tests.fake_gmail import FakeGmailWrapperFactory, FakeEmailSorterContext, create_gmail_message, \
+    create_message_response, write_cached_thread
+
+MAY = 1682942400000
+
+
+class CountingEmailMessageProcessor(EmailMessageProcessor):
+    def __init__(self):
+        self.count = 0
+
+    def process(self, email_message):
+        self.count += 1
+
+    def convert_to_table_rows(self):
+        return [[str(self.count)]]
+
+
+class ProcessorMergeTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = [create_gmail_message(f"m{i}", f"t{i}", f"sender{i % 4}@example.com", subject=f"S{i}")
+                         for i in range(20)]
+
+    def _process(self, result_type: ProcessorResultType, messages):
+        processor = GroupingEmailMessageProcessor(result_type)
+        for message in messages:
+            processor.process(message)
+        return processor
+
+    def test_merged_grouping_results_match_serial_results(self):
+        for result_type in ProcessorResultType:
+            serial = self._process(result_type, self.messages)
+            merged = self._process(result_type, self.messages[:7])
+            merged.merge(self._process(result_type, self.messages[7:9]))
+            merged.merge(self._process(result_type, self.messages[9:]))
+            self.assertEqual(serial.convert_to_table_rows(), merged.convert_to_table_rows())
+
+    def test_merge_of_different_result_types(self):
+        with self.assertRaises(ValueError):
+            self._process(ProcessorResultType.SIMPLIFIED, []).merge(self._process(ProcessorResultType.DETAILED, []))
+
+    def test_merge_filter_results(self):
+        filters = [GmailFilter(f"filter-{i}", f"from:sender{i}@example.com") for i in range(3)]
+        serial = MultipleFilterResultProcessor()
+        partials = [MultipleFilterResultProcessor(), MultipleFilterResultProcessor()]
+        for i, f in enumerate(filters):
+            serial.add_result(f, {"count": i}, seconds=1.0)
+            partials[i % 2].add_result(f, {"count": i}, seconds=1.0)
+        merged = MultipleFilterResultProcessor()
+        for partial in partials:
+            merged.merge(partial)
+        self.assertEqual(sorted(serial.convert_to_table_rows()), sorted(merged.convert_to_table_rows()))
+
+
+class ParallelProcessingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        EmailSorterConfig.PROJECT_OUT_ROOT = self.tmp_dir.name
+        threads_dir = os.path.join(self.tmp_dir.name, "threads")
+        for i in range(50):
+            # Some messages share their date, so the order depends on the message ID as well
+            write_cached_thread(threads_dir, f"t{i}", [
+                create_message_response(f"m{i}", f"t{i}", f"sender{i % 7}@example.com", "me@example.com",
+                                        f"Subject {i}", MAY + (i // 3) * 1000)
+            ])
+        self.store = MessageStore(os.path.join(self.tmp_dir.name, "store.sqlite3"), threads_dir)
+        self.store.rebuild()
+        self.ctx = FakeEmailSorterContext(self.tmp_dir.name, FakeGmailWrapperFactory({}), message_store=self.store)
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def _discover(self, result_type: ProcessorResultType, parallelism: int):
+        conf = InboxDiscoveryConfig(self.ctx,
+                                    gmail_query="label:inbox",
+                                    fetch_mode=ThreadQueryFormat.METADATA,
+                                    offline_mode=True,
+                                    parallelism=parallelism)
+        return InboxDiscovery(conf, self.ctx).discover(result_type).convert_to_table_rows()
+
+    def test_parallel_results_match_serial_results(self):
+        for result_type in ProcessorResultType:
+            self.assertEqual(self._discover(result_type, parallelism=1), self._discover(result_type, parallelism=3))
+
+    def test_in_memory_shards(self):
+        messages = list(MessageStoreSource(self.store, "").iter_messages())
+        serial = GroupingEmailMessageProcessor(ProcessorResultType.DETAILED)
+        InboxDiscovery.process_messages(messages, DEFAULT_LINE_SEP, [], [serial])
+
+        shards = InboxDiscovery._create_in_memory_shards(messages, shard_size=4)
+        factory = functools.partial(GroupingEmailMessageProcessor, ProcessorResultType.DETAILED)
+        processors = InboxDiscovery.process_message_shards(shards, DEFAULT_LINE_SEP, [], [factory], parallelism=2)
+
+        self.assertEqual(serial.convert_to_table_rows(), processors[0].convert_to_table_rows())
+
+    def test_processors_without_merge_are_rejected(self):
+        with self.assertRaises(ValueError):
+            InboxDiscovery.process_message_shards([], DEFAULT_LINE_SEP, [], [CountingEmailMessageProcessor],
+                                                  parallelism=2)
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+from emailsorter.core.error import UnsupportedQueryException
+from emailsorter.core.query import GmailQueryParser, LocalFilterEvaluator, normalize_query
+from emailsorter.core.store import MessageStore
+from tests.fake_gmail import create_message_response, write_cached_thread
+
+MAY = 1682942400000  # 2023-05-01
+JULY = 1688212800000  # 2023-07-01
+
+SUPPORTED_EXPRESSIONS = [
+    "",
+    "from:alice@example.com",
+    "from:ALICE@example.com OR from:bob@example.com",
+    "from:(alice@example.com OR bob@example.com)",
+    "from:{alice@example.com carol@example.com}",
+    "from:alice@example.com -subject:invoice",
+    "-(from:alice@example.com OR to:team@example.com)",
+    "subject:\"weekly report\" after:2023/06/01",
+    "label:inbox before:2023-06-01",
+    "category:promotions OR from:example.com",
+    "in:inbox AND to:(me@example.com) -category:updates",
+    "from:@example.com",
+    "from:*@Other.org OR to:@example.com",
+    "subject:r_port",
+    "subject:50%",
+    "from:d_ve",
+    "-to:me@example.com",
+    "-(from:alice@example.com OR to:alice@example.com)",
+]
+
+
+class GmailQueryParserTest(unittest.TestCase):
+    def test_unsupported_expressions(self):
+        for expression in ["has:attachment", "hello", "from:a OR", "(from:a", "label:my-label", "after:yesterday"]:
+            with self.assertRaises(UnsupportedQueryException, msg=expression):
+                GmailQueryParser.parse(expression)
+
+    def test_operator_precedence(self):
+        # Implicit AND binds stronger than OR
+        parsed = GmailQueryParser.parse("from:a subject:b OR subject:c")
+        self.assertEqual("OR[AND[QueryTerm(operator=<QueryOperator.FROM: 'from'>, value='a'), "
+                         "QueryTerm(operator=<QueryOperator.SUBJECT: 'subject'>, value='b')], "
+                         "QueryTerm(operator=<QueryOperator.SUBJECT: 'subject'>, value='c')]", repr(parsed.root))
+
+    def test_equivalent_expressions_have_same_normalized_form(self):
+        self.assertEqual(normalize_query("from:alice@example.com label:INBOX"),
+                         normalize_query("in:inbox  FROM:Alice@example.com in:inbox"))
+        self.assertEqual(normalize_query("from:(a OR b) -subject:x"), normalize_query("-subject:x from:{b a}"))
+        self.assertNotEqual(normalize_query("from:a OR subject:b"), normalize_query("from:a subject:b"))
+        self.assertEqual(normalize_query("from:@example.com"), normalize_query("FROM:*@Example.com"))
+        # Expressions that can't be parsed only have their whitespace normalized
+        self.assertEqual("has:attachment larger:5M", normalize_query(" has:attachment   larger:5M"))
+
+
+class LocalFilterEvaluatorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        threads_dir = os.path.join(self.tmp_dir.name, "threads")
+        messages = [
+            ("m1", "t1", "alice@example.com", "me@example.com", "Weekly report", MAY, ["INBOX"]),
+            ("m2", "t1", "bob@example.com", "alice@example.com", "Re: Weekly report", JULY, ["INBOX", "UNREAD"]),
+            ("m3", "t2", "carol@example.com", "team@example.com", "Invoice", JULY, ["CATEGORY_PROMOTIONS"]),
+            ("m4", "t3", "alice@example.com", "me@example.com", "Invoice", MAY, ["INBOX", "CATEGORY_UPDATES"]),
+            ("m5", "t4", "dave@other.org", "me@example.com", "Hello", JULY, []),
+            ("m6", "t5", "erin@other.org", "me@example.com", "50% off", JULY, []),
+            ("m7", "t6", "frank@other.org", None, "No recipient", JULY, []),
+        ]
+        for thread_id in dict.fromkeys(m[1] for m in messages):
+            write_cached_thread(threads_dir, thread_id, [create_message_response(*m[:6], label_ids=m[6])
+                                                         for m in messages if m[1] == thread_id])
+        self.store = MessageStore(os.path.join(self.tmp_dir.name, "store.sqlite3"), threads_dir)
+        self.store.rebuild()
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_single_pass_counts_match_sql_counts(self):
+        evaluator = LocalFilterEvaluator(SUPPORTED_EXPRESSIONS)
+        self.assertEqual([], evaluator.unsupported)
+
+        counts = evaluator.count_threads(self.store.iter_message_metadata())
+
+        expected = {expression: self.store.count_threads(expression) for expression in SUPPORTED_EXPRESSIONS}
+        self.assertEqual(expected, counts)
+        self.assertEqual(6, counts[""])
+        self.assertEqual(2, counts["from:(alice@example.com OR bob@example.com)"])
+        # Domains match every address of the domain, like Gmail
+        self.assertEqual(3, counts["from:@example.com"])
+        self.assertEqual(6, counts["from:*@Other.org OR to:@example.com"])
+        # % and _ are matched literally, not as wildcards of LIKE
+        self.assertEqual(0, counts["subject:r_port"])
+        self.assertEqual(1, counts["subject:50%"])
+        self.assertEqual(0, counts["from:d_ve"])
+        # Negated addresses keep the messages without an address
+        self.assertEqual(3, counts["-to:me@example.com"])
+
+    def test_unsupported_expressions_are_collected(self):
+        evaluator = LocalFilterEvaluator(["from:alice@example.com", "has:attachment"])
+        self.assertTrue(evaluator.is_supported("from:alice@example.com"))
+        self.assertEqual(["has:attachment"], [expression for expression, _ in evaluator.unsupported])
+        self.assertEqual({"from:alice@example.com": 2}, evaluator.count_threads(self.store.iter_message_metadata()))
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from emailsorter.actions.inbox_discovery import GmailFilter, InboxDiscovery, InboxDiscoveryConfig
+from emailsorter.core.common import EmailSorterConfig
+from emailsorter.core.query_cache import QueryResultCache
+from tests.fake_gmail import FakeGmailWrapperFactory, FakeEmailSorterContext
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class QueryResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.cache = QueryResultCache(os.path.join(self.tmp_dir.name, "query_cache.sqlite3"), ttl=60, max_entries=3,
+                                      clock=self.clock)
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_results_are_shared_by_equivalent_queries(self):
+        self.cache.put("from:a@example.com label:inbox", 2, exact=True, history_id="10", thread_ids=["t1", "t2"])
+
+        result = self.cache.get("in:INBOX from:A@example.com", history_id="10")
+        self.assertEqual(2, result.count)
+        self.assertEqual(["t1", "t2"], result.thread_ids)
+        self.assertIsNone(self.cache.get("from:b@example.com", history_id="10"))
+        self.assertEqual((1, 1), (self.cache.stats.hits, self.cache.stats.misses))
+
+    def test_results_expire_after_ttl(self):
+        self.cache.put("from:a", 2, exact=True, history_id="10")
+        self.clock.now += 61
+        self.assertIsNone(self.cache.get("from:a", history_id="10"))
+        self.assertEqual(1, self.cache.stats.expired)
+        self.assertEqual(0, self.cache.size())
+
+    def test_results_are_invalidated_when_mailbox_changes(self):
+        self.cache.put("from:a", 2, exact=True, history_id="10")
+        self.assertIsNotNone(self.cache.get("from:a", history_id="10"))
+        self.assertIsNone(self.cache.get("from:a", history_id="11"))
+        self.assertEqual(1, self.cache.stats.invalidated)
+
+    def test_least_recently_used_results_are_evicted(self):
+        for idx, query in enumerate(["from:a", "from:b", "from:c"]):
+            self.clock.now += 1
+            self.cache.put(query, idx, exact=True, history_id="10")
+        self.clock.now += 1
+        self.cache.get("from:a", history_id="10")
+        self.clock.now += 1
+        self.cache.put("from:d", 3, exact=True, history_id="10")
+
+        self.assertEqual(1, self.cache.stats.evicted)
+        self.assertIsNone(self.cache.get("from:b", history_id="10"))
+        for query in ["from:a", "from:c", "from:d"]:
+            self.assertIsNotNone(self.cache.get(query, history_id="10"), msg=query)
+
+    def test_limited_and_estimated_counts(self):
+        self.cache.put("from:a", 100, exact=True, history_id="10", limit=100, thread_ids=[f"t{i}" for i in range(100)])
+        self.cache.put("from:b", 500, exact=False, history_id="10")
+
+        # The count of from:a was cut off at the limit, it only answers queries with a lower or the same limit
+        self.assertIsNone(self.cache.get("from:a", history_id="10", limit=200))
+        result = self.cache.get("from:a", history_id="10", limit=50)
+        self.assertEqual((50, 50), (result.count, len(result.thread_ids)))
+        self.assertIsNone(self.cache.get("from:b", history_id="10"))
+        self.assertEqual(500, self.cache.get("from:b", history_id="10", exact=False).count)
+
+
+class FilterStatsQueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        EmailSorterConfig.PROJECT_OUT_ROOT = self.tmp_dir.name
+        self.filters = [GmailFilter("alice", "from:alice@example.com"),
+                        GmailFilter("bob", "from:bob@example.com label:inbox"),
+                        GmailFilter("bob in inbox", "in:inbox from:bob@example.com")]
+        counts = {"from:alice@example.com": 3, "from:bob@example.com label:inbox": 5}
+        self.ctx = FakeEmailSorterContext(self.tmp_dir.name, FakeGmailWrapperFactory(counts))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _query_filters(self):
+        conf = InboxDiscoveryConfig(self.ctx,
+                                    gmail_query="label:inbox",
+                                    fetch_mode=ThreadQueryFormat.MINIMAL,
+                                    offline_mode=False,
+                                    query_cache_ttl=3600)
+        discovery = InboxDiscovery(conf, self.ctx)
+        result_processor = discovery.query_filters(self.filters)
+        return result_processor, discovery.metrics.get_span("query_cache").counts
+
+    def test_results_are_reused_until_mailbox_changes(self):
+        wrapper = self.ctx.gmail_wrapper
+        result_processor, cache_counts = self._query_filters()
+        # Equivalent expressions are queried once
+        self.assertEqual(["from:alice@example.com", "from:bob@example.com label:inbox"], wrapper.queries)
+        self.assertEqual({"alice": 3, "bob": 5, "bob in inbox": 5}, result_processor.count_per_filter)
+        self.assertEqual(3, cache_counts["misses"])
+
+        result_processor, cache_counts = self._query_filters()
+        self.assertEqual(2, len(wrapper.queries))
+        self.assertEqual({"alice": 3, "bob": 5, "bob in inbox": 5}, result_processor.count_per_filter)
+        self.assertEqual((3, 0), (cache_counts["hits"], cache_counts["misses"]))
+
+        wrapper.fetcher.users_svc.history_id = "2"
+        wrapper.counts_by_query["from:alice@example.com"] = 4
+        result_processor, cache_counts = self._query_filters()
+        self.assertEqual(4, len(wrapper.queries))
+        self.assertEqual(4, result_processor.count_per_filter["alice"])
+        # The results of both queries were invalidated, the second "bob" filter shares the result of the first one
+        self.assertEqual((2, 3), (cache_counts["invalidated"], cache_counts["misses"]))
@@ -0,0 +1,123 @@
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from google.oauth2.credentials import Credentials
+from googleapiwrapper.common import ServiceType
+from googleapiwrapper.gmail_api import ApiConversionContext
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from benchmarks.gmail_server import FakeGmailServer, LocalGmailWrapper
+from benchmarks.quota_scheduler import run
+from benchmarks.synthetic import iter_thread_responses
+from emailsorter.core.batch import BatchThreadFetcher
+from emailsorter.core.context import GmailWrapperFactory
+from emailsorter.core.scheduler import get_quota_units, TokenBucket, RequestScheduler, \
+    RequestSchedulerConfig, get_scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+class FakeAuthorizer:
+    service_type = ServiceType.GMAIL
+
+    def authorize(self):
+        return SimpleNamespace(authed_creds=Credentials("token"), project_name="emailsorter",
+                               user_email="me@example.com")
+
+
+class FakeResponse(dict):
+    def __init__(self, status: int, **headers):
+        super().__init__(headers)
+        self.status = status
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    def test_quota_units_of_requests(self):
+        base = "https://gmail.googleapis.com/gmail/v1/users/me"
+        self.assertEqual(10, get_quota_units("GET", f"{base}/threads?q=label%3Ainbox"))
+        self.assertEqual(10, get_quota_units("GET", f"{base}/threads/t1?format=minimal"))
+        self.assertEqual(5, get_quota_units("GET", f"{base}/messages/m1/attachments/a1"))
+        self.assertEqual(0, get_quota_units("POST", "https://oauth2.googleapis.com/token"))
+        batch_body = ("GET /gmail/v1/users/me/threads/t1?format=minimal HTTP/1.1\nAccept: application/json\n\n"
+                      "GET /gmail/v1/users/me/messages/m1 HTTP/1.1\nAccept: application/json\n\n")
+        self.assertEqual(15, get_quota_units("POST", "https://gmail.googleapis.com/batch", batch_body.encode()))
+
+    def test_token_bucket_paces_units(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=100, capacity=100, clock=clock, sleep=clock.sleep)
+        for _ in range(10):
+            bucket.acquire(10)
+        self.assertEqual([], clock.sleeps)
+        bucket.acquire(10)
+        bucket.acquire(250)
+        self.assertEqual([0.1, 2.5], clock.sleeps)
+
+    def test_throttled_requests_are_backed_off_and_retried(self):
+        clock = FakeClock()
+        scheduler = RequestScheduler(RequestSchedulerConfig(units_per_second=100, initial_backoff=1.0),
+                                     clock=clock, sleep=clock.sleep)
+        responses = [FakeResponse(429), FakeResponse(503, **{"retry-after": "5"}), FakeResponse(200)]
+        response, content = scheduler.execute(lambda: (responses.pop(0), b"{}"), units=10)
+
+        self.assertEqual(200, response.status)
+        self.assertEqual(2, scheduler.stats.throttled)
+        self.assertEqual(2, scheduler.stats.retries)
+        self.assertEqual(3, scheduler.stats.requests)
+        # Jittered backoff of the first 429, then the delay requested by the server
+        self.assertTrue(0.5 <= clock.sleeps[0] <= 1.0)
+        self.assertEqual(5, clock.sleeps[1])
+        self.assertLess(scheduler.bucket.rate, 100)
+
+    def test_requests_stay_within_quota_of_server(self):
+        threads = list(iter_thread_responses(100, 5, messages_per_thread=1))
+        thread_ids = [thread["id"] for thread in threads]
+        # The server, the scheduler and the run share a fake clock, only the scheduler advances it.
+        # The scheduler leaves some headroom, the server doesn't allow calls that are short of the quota by a rounding
+        clock = FakeClock()
+        scheduler = RequestScheduler(RequestSchedulerConfig(units_per_second=190),
+                                     clock=clock, sleep=clock.sleep)
+        with FakeGmailServer(threads, quota_units_per_second=200, clock=clock) as server:
+            result = run(server, thread_ids, no_of_threads=1, seconds=2, scheduler=scheduler, clock=clock)
+        self.assertEqual(0, result["failed_calls"])
+        self.assertEqual(0, result["throttled_calls"])
+        # 1 second burst + 2 seconds at 190 units / second, 10 units per call
+        self.assertEqual(57, result["successful_calls"])
+        self.assertEqual(2.0, result["seconds"])
+        self.assertLessEqual(server.units, 200 * (result["seconds"] + 1))
+
+    def test_batches_fit_into_burst_of_quota(self):
+        threads = list(iter_thread_responses(20, 5, messages_per_thread=1))
+        thread_ids = [thread["id"] for thread in threads]
+        scheduler = RequestScheduler(RequestSchedulerConfig(units_per_second=1000, burst_seconds=0.05))
+        with FakeGmailServer(threads) as server, tempfile.TemporaryDirectory() as cache_dir:
+            wrapper = LocalGmailWrapper(server.url, cache_dir, scheduler=scheduler)
+            fetcher = BatchThreadFetcher(wrapper.fetcher, batch_size=50)
+            responses = fetcher.fetch_threads(ApiConversionContext(), thread_ids, ThreadQueryFormat.METADATA)
+        self.assertEqual(sorted(thread_ids), sorted(responses.keys()))
+        # 50 units per burst, 10 units per threads.get call
+        self.assertEqual(4, fetcher.stats.batches)
+        self.assertEqual(4, server.batch_requests)
+
+    def test_wrapper_service_is_built_once_with_scheduled_transport(self):
+        import emailsorter.core.gmail
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch.object(emailsorter.core.gmail, "build", wraps=emailsorter.core.gmail.build) as build:
+            factory = GmailWrapperFactory("me@example.com", cache_dir, use_cache=False,
+                                          scheduler_config=RequestSchedulerConfig())
+            wrapper = factory.create(FakeAuthorizer())
+        self.assertEqual(1, build.call_count)
+        self.assertIs(factory.scheduler, get_scheduler(wrapper.fetcher.threads_svc.list(userId="me").http))
@@ -0,0 +1,71 @@
+import csv
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from emailsorter.core.output import InboxDiscoveryResults
+from emailsorter.display.export import ExportFormat, create_exporter
+from emailsorter.display.table import ColumnType, TableRenderSettings, TableColumnStyles
+
+COLS = ["Sender", "Count", "Date"]
+COL_TYPES = {"Sender": ColumnType.STRING, "Count": ColumnType.INT, "Date": ColumnType.DATE}
+
+
+class ResultExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.rows = [
+            ["b@example.com", 2, datetime.datetime(2023, 5, 1, 10, 30)],
+            ["<a>&co@example.com", 7, None],
+            ["c@example.com", 5, datetime.datetime(2023, 6, 1)],
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _export(self, *export_formats: ExportFormat, top: int = None):
+        export_files = {fmt: os.path.join(self.tmp_dir.name, f"results.{fmt.extension}") for fmt in export_formats}
+        settings = TableRenderSettings(TableColumnStyles(), sort_by_column="Count", top=top)
+        return InboxDiscoveryResults.export(self.rows, COLS, settings, export_files, col_types=COL_TYPES)
+
+    def test_csv_export(self):
+        files = self._export(ExportFormat.CSV)
+        with open(files[0], newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([COLS,
+                          ["<a>&co@example.com", "7", ""],
+                          ["c@example.com", "5", "2023-06-01 00:00:00"],
+                          ["b@example.com", "2", "2023-05-01 10:30:00"]], rows)
+
+    def test_json_lines_export_keeps_types(self):
+        files = self._export(ExportFormat.JSONL)
+        with open(files[0]) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual({"Sender": "<a>&co@example.com", "Count": 7, "Date": None}, rows[0])
+        self.assertEqual("2023-05-01T10:30:00", rows[2]["Date"])
+
+    def test_html_export_escapes_values(self):
+        files = self._export(ExportFormat.HTML)
+        with open(files[0]) as f:
+            content = f.read()
+        self.assertIn("<th>Sender</th><th>Count</th><th>Date</th>", content)
+        self.assertIn("<tr><td>&lt;a&gt;&amp;co@example.com</td><td>7</td><td></td></tr>", content)
+        self.assertTrue(content.rstrip().endswith("</html>"))
+
+    def test_all_rows_are_exported_regardless_of_selection(self):
+        files = self._export(ExportFormat.CSV, ExportFormat.JSONL, top=1)
+        self.assertEqual(2, len(files))
+        with open(files[1]) as f:
+            self.assertEqual(3, len(f.readlines()))
+
+    def test_exporter_writes_rows_as_they_are_produced(self):
+        file_path = os.path.join(self.tmp_dir.name, "streamed.jsonl")
+        with create_exporter(ExportFormat.JSONL, file_path, COLS, col_types=COL_TYPES) as exporter:
+            exporter.write_row(self.rows[0])
+            exporter._file.flush()
+            with open(file_path) as f:
+                self.assertEqual(1, len(f.readlines()))
+            exporter.write_rows(self.rows[1:])
+        self.assertEqual(3, exporter.no_of_rows)
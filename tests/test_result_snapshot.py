@@ -0,0 +1,184 @@
+import datetime
+import os
+import struct
+import tempfile
+import unittest
+
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+from emailsorter.common.model import ProcessorResultType, create_message_processor
+from emailsorter.core.common import EmailSorterConfig
+from emailsorter.core.error import SnapshotException
+from emailsorter.core.snapshot import ResultSnapshot, diff_snapshots, MAGIC, PREAMBLE, SENDERS_TABLE, MESSAGES_TABLE
+from emailsorter.display.export import ExportFormat
+from tests.fake_gmail import FakeGmailWrapperFactory, FakeEmailSorterContext, FakeMailboxSource, \
+    create_gmail_message
+
+
+class ResultSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        date = datetime.datetime(2023, 5, 1, 10, 30, 15)
+        self.messages = [
+            create_gmail_message("m1", "t1", "alice@example.com", subject="First", date=date),
+            create_gmail_message("m2", "t2", "bob@mail.example.com", subject="Zweite Nachricht ü✓",
+                                 date=date + datetime.timedelta(days=1)),
+            create_gmail_message("m3", "t3", "alice@example.com", subject=None),
+            create_gmail_message("m4", "t4", None, subject="No sender", date=date),
+            create_gmail_message("m5", "t4", "carol@example.org", subject="Fifth", date=date),
+        ]
+        self.messages[2].date = None
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _save(self, result_type: ProcessorResultType, messages=None, name: str = "results"):
+        processor = create_message_processor(result_type)
+        for message in messages or self.messages:
+            processor.process(message)
+        file = os.path.join(self.tmp_dir.name, f"{name}.snapshot")
+        ResultSnapshot.save(file, processor, query="label:inbox")
+        return processor, file
+
+    def test_detailed_snapshot_renders_every_view(self):
+        _, file = self._save(ProcessorResultType.DETAILED)
+        with ResultSnapshot(file) as snapshot:
+            self.assertEqual(ProcessorResultType.DETAILED, snapshot.result_type)
+            self.assertEqual("label:inbox", snapshot.metadata["query"])
+            self.assertEqual(5, snapshot.metadata["messages"])
+            self.assertEqual(4, snapshot.get_no_of_rows(SENDERS_TABLE))
+            self.assertEqual(5, snapshot.get_no_of_rows(MESSAGES_TABLE))
+            for result_type in filter(lambda t: t.is_available, ProcessorResultType):
+                live, _ = self._save(result_type, name=result_type.value)
+                live_examples, live_rows = live.convert_to_table_rows()
+                examples, rows = snapshot.to_processor(result_type).convert_to_table_rows()
+                self.assertEqual(live_rows, rows, result_type)
+                if not result_type.is_rollup:
+                    self.assertEqual(live_examples, examples, result_type)
+            # The processing order is not saved, domains show the newest message of their senders
+            examples, _ = snapshot.to_processor(ProcessorResultType.DOMAIN).convert_to_table_rows()
+            self.assertEqual(("t2", "m2", "Zweite Nachricht ü✓"), examples["example.com"])
+
+    def test_simplified_snapshot_has_no_messages(self):
+        _, file = self._save(ProcessorResultType.SIMPLIFIED)
+        with ResultSnapshot(file) as snapshot:
+            self.assertFalse(snapshot.has_table(MESSAGES_TABLE))
+            _, rows = snapshot.to_processor(ProcessorResultType.ORGANIZATION).convert_to_table_rows()
+            self.assertEqual([["example.com", 3, 2, 2], ["(unknown)", 1, 1, 1], ["example.org", 1, 1, 1]], rows)
+            with self.assertRaises(SnapshotException):
+                snapshot.to_processor(ProcessorResultType.DETAILED)
+
+    def test_rollup_snapshot_renders_sender_counts(self):
+        _, file = self._save(ProcessorResultType.DOMAIN)
+        with ResultSnapshot(file) as snapshot:
+            _, rows = snapshot.to_processor(ProcessorResultType.SIMPLIFIED).convert_to_table_rows()
+        self.assertEqual(sorted([["alice@example.com", 2], ["bob@mail.example.com", 1], ["", 1],
+                                 ["carol@example.org", 1]]), sorted(rows))
+
+    def test_invalid_files_are_rejected(self):
+        _, file = self._save(ProcessorResultType.SIMPLIFIED)
+        with open(file, "rb") as f:
+            content = f.read()
+        invalid_files = {
+            "empty": b"",
+            "text": b"sender,count\n",
+            "version": PREAMBLE.pack(MAGIC, 99, 0, 0) + content[PREAMBLE.size:],
+            "truncated": content[:len(content) // 2],
+        }
+        for name, invalid_content in invalid_files.items():
+            invalid_file = os.path.join(self.tmp_dir.name, f"{name}.snapshot")
+            with open(invalid_file, "wb") as f:
+                f.write(invalid_content)
+            with self.assertRaises(SnapshotException, msg=name):
+                ResultSnapshot(invalid_file)
+        self.assertEqual(struct.calcsize("<8sH6xQQ"), PREAMBLE.size)
+
+    def test_diff_of_sender_counts(self):
+        _, old_file = self._save(ProcessorResultType.SIMPLIFIED, messages=self.messages[:3], name="old")
+        _, new_file = self._save(ProcessorResultType.SENDER, messages=self.messages[1:], name="new")
+        with ResultSnapshot(old_file) as old, ResultSnapshot(new_file) as new:
+            rows = diff_snapshots(old, new)
+        self.assertEqual(sorted([
+            ["alice@example.com", 2, 1, -1, -50.0],
+            ["bob@mail.example.com", 1, 1, 0, 0.0],
+            ["", 0, 1, 1, None],
+            ["carol@example.org", 0, 1, 1, None],
+        ], key=str), sorted(rows, key=str))
+
+
+    def test_approximate_snapshot_keeps_error_bounds(self):
+        processor = create_message_processor(ProcessorResultType.APPROXIMATE, top_senders=5)
+        messages = [create_gmail_message(f"m{i}", f"t{i}", f"sender{i % 41}@example.com", subject=f"Subject {i}")
+                    for i in range(200)]
+        for message in messages:
+            processor.process(message)
+        file = os.path.join(self.tmp_dir.name, "approximate.snapshot")
+        ResultSnapshot.save(file, processor)
+        with ResultSnapshot(file) as snapshot:
+            loaded = snapshot.to_processor(ProcessorResultType.APPROXIMATE)
+            self.assertEqual(processor.convert_to_table_rows(), loaded.convert_to_table_rows())
+            self.assertEqual(processor.get_summary(), loaded.get_summary())
+            self.assertGreater(loaded.get_summary()["max_messages_of_other_senders"], 0)
+            for result_type in [ProcessorResultType.SIMPLIFIED, ProcessorResultType.DOMAIN]:
+                with self.assertRaises(SnapshotException, msg=result_type):
+                    snapshot.to_processor(result_type)
+            with self.assertRaises(SnapshotException):
+                diff_snapshots(snapshot, snapshot)
+        # Loaded sketches can be merged with the sketches of a new run
+        loaded.merge(processor)
+        self.assertEqual(400, loaded.get_summary()["messages"])
+
+    def test_simplified_snapshot_has_no_distinct_recipients(self):
+        _, file = self._save(ProcessorResultType.SIMPLIFIED)
+        with ResultSnapshot(file) as snapshot:
+            processor = snapshot.to_processor(ProcessorResultType.APPROXIMATE)
+        summary = processor.get_summary()
+        self.assertEqual(5, summary["messages"])
+        self.assertEqual(4, summary["distinct_senders"])
+        self.assertNotIn("distinct_recipients", summary)
+        file = os.path.join(self.tmp_dir.name, "approximate.snapshot")
+        ResultSnapshot.save(file, processor)
+        with ResultSnapshot(file) as snapshot:
+            self.assertEqual(summary, snapshot.to_processor(ProcessorResultType.APPROXIMATE).get_summary())
+
+
+class SnapshotDiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        EmailSorterConfig.PROJECT_OUT_ROOT = self.tmp_dir.name
+        self.ctx = FakeEmailSorterContext(self.tmp_dir.name, FakeGmailWrapperFactory({}))
+        self.source = FakeMailboxSource()
+        for i in range(20):
+            self.source.put_thread(f"t{i}", "1", [create_gmail_message(f"m{i}", f"t{i}", f"sender{i % 7}@example.com",
+                                                                       subject=f"Subject {i}")])
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _create_discovery(self, result_type: ProcessorResultType, save_snapshot: bool = False) -> InboxDiscovery:
+        conf = InboxDiscoveryConfig(self.ctx, gmail_query="label:inbox", fetch_mode=ThreadQueryFormat.METADATA,
+                                    offline_mode=False, export_formats=[ExportFormat.CSV], result_type=result_type,
+                                    save_snapshot=save_snapshot)
+        discovery = InboxDiscovery(conf, self.ctx)
+        discovery._create_message_source = lambda: self.source
+        return discovery
+
+    def _read_export(self) -> str:
+        with open(os.path.join(self.ctx.session_dir, "discovery_results.csv")) as f:
+            return f.read()
+
+    def test_rendered_snapshot_matches_results_of_run(self):
+        discovery = self._create_discovery(ProcessorResultType.DETAILED, save_snapshot=True)
+        discovery.run()
+        snapshot_file = discovery.config.get_snapshot_file()
+        self.assertTrue(os.path.exists(snapshot_file))
+        self.assertIn("snapshot", discovery.metrics.spans)
+
+        for result_type in [ProcessorResultType.DETAILED, ProcessorResultType.SIMPLIFIED]:
+            self._create_discovery(result_type).run()
+            exported = self._read_export()
+            renderer = self._create_discovery(result_type)
+            renderer.render_snapshot(snapshot_file)
+            self.assertEqual(exported, self._read_export(), result_type)
+            self.assertEqual({"senders": 7}, renderer.metrics.spans["load"].counts)
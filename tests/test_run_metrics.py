@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import unittest
+
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+from emailsorter.common.model import ProcessorResultType
+from emailsorter.core.common import EmailSorterConfig
+from emailsorter.core.metrics import RunMetrics, METRICS_FILENAME
+from emailsorter.core.output import GroupingEmailMessageProcessorRepresentation
+from emailsorter.core.source import MeteredMessageSource
+from tests.fake_gmail import FakeGmailWrapperFactory, FakeEmailSorterContext, FakeMailboxSource, \
+    create_gmail_message
+
+
+class RunMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        EmailSorterConfig.PROJECT_OUT_ROOT = self.tmp_dir.name
+        self.ctx = FakeEmailSorterContext(self.tmp_dir.name, FakeGmailWrapperFactory({}))
+        self.source = FakeMailboxSource(page_size=2)
+        for i in range(5):
+            self.source.put_thread(f"t{i}", "1", [create_gmail_message(f"m{i}", f"t{i}", f"sender{i % 2}@example.com")])
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_metered_source_counts_pages_and_messages(self):
+        metrics = RunMetrics("test")
+        pages_seen = []
+        source = MeteredMessageSource(self.source, metrics.get_span("fetch"),
+                                      on_page=lambda span: pages_seen.append(span.counts["pages"]))
+        self.assertEqual(5, len(list(source.iter_messages())))
+        self.assertEqual({"pages": 3, "messages": 5}, metrics.spans["fetch"].counts)
+        self.assertEqual([1, 2, 3], pages_seen)
+
+    def test_discovery_phases_are_recorded(self):
+        conf = InboxDiscoveryConfig(self.ctx, gmail_query="label:inbox", fetch_mode=ThreadQueryFormat.METADATA,
+                                    offline_mode=False)
+        discovery = InboxDiscovery(conf, self.ctx)
+        discovery.metrics = RunMetrics("discover-inbox", query=conf.gmail_query)
+        processor = discovery.discover(ProcessorResultType.SIMPLIFIED, source=self.source)
+        _, rows = processor.convert_to_table_rows()
+        representation = GroupingEmailMessageProcessorRepresentation(ProcessorResultType.SIMPLIFIED)
+        InboxDiscovery.print_result_table(rows, representation, metrics=discovery.metrics)
+        file = discovery.metrics.save(self.ctx.session_dir)
+
+        self.assertEqual(os.path.join(self.ctx.session_dir, METRICS_FILENAME), file)
+        with open(file) as f:
+            report = json.load(f)
+        spans = {span["name"]: span for span in report["spans"]}
+        self.assertEqual(["fetch", "process", "render"], list(spans.keys()))
+        self.assertEqual(5, spans["fetch"]["counts"]["messages"])
+        self.assertEqual(5, spans["process"]["counts"]["messages"])
+        self.assertEqual({"rows": 2, "shown_rows": 2}, spans["render"]["counts"])
+        self.assertEqual("label:inbox", report["attributes"]["query"])
+
@@ -0,0 +1,93 @@
+import unittest
+
+from emailsorter.common.model import SenderRollupProcessor, ProcessorResultType
+from emailsorter.core.rollup import get_registrable_domain, split_address, UNKNOWN_DOMAIN
+from tests.fake_gmail import create_gmail_message
+
+SENDERS = [
+    "alice@example.com",
+    "news@mail.example.com",
+    "Bob@Mail.Example.com",
+    "alice@example.com",
+    "noreply@shop.example.co.uk",
+    "info@other.org",
+    "news@mail.example.com",
+    "invalid-address",
+]
+
+
+class DomainHelpersTest(unittest.TestCase):
+    def test_registrable_domain(self):
+        self.assertEqual("example.com", get_registrable_domain("example.com"))
+        self.assertEqual("example.com", get_registrable_domain("a.b.mail.example.com"))
+        self.assertEqual("example.co.uk", get_registrable_domain("shop.example.co.uk"))
+        self.assertEqual("localhost", get_registrable_domain("localhost"))
+
+    def test_split_address(self):
+        self.assertEqual(("Bob", "mail.example.com"), split_address("Bob@Mail.Example.com"))
+        self.assertEqual(("invalid", UNKNOWN_DOMAIN), split_address("invalid"))
+        self.assertEqual(("", UNKNOWN_DOMAIN), split_address(None))
+
+
+class SenderRollupProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = [create_gmail_message(f"m{i}", f"t{i}", sender, subject=f"Subject {i}")
+                         for i, sender in enumerate(SENDERS)]
+
+    def _process(self, result_type: ProcessorResultType, drill_down: str = None, messages=None):
+        processor = SenderRollupProcessor(result_type, drill_down=drill_down)
+        for message in messages if messages is not None else self.messages:
+            processor.process(message)
+        return processor
+
+    def test_organization_rows(self):
+        grouping, rows = self._process(ProcessorResultType.ORGANIZATION).convert_to_table_rows()
+        self.assertEqual([["example.com", 5, 2, 3], ["example.co.uk", 1, 1, 1], ["other.org", 1, 1, 1],
+                          [UNKNOWN_DOMAIN, 1, 1, 1]], rows)
+        self.assertEqual(("t6", "m6", "Subject 6"), grouping["example.com"])
+
+    def test_domain_rows(self):
+        _, rows = self._process(ProcessorResultType.DOMAIN).convert_to_table_rows()
+        self.assertEqual([["example.com", "example.com", 5, 3], ["mail.example.com", "example.com", 3, 2],
+                          ["shop.example.co.uk", "example.co.uk", 1, 1], ["other.org", "other.org", 1, 1],
+                          [UNKNOWN_DOMAIN, UNKNOWN_DOMAIN, 1, 1]], rows)
+
+    def test_sender_rows(self):
+        grouping, rows = self._process(ProcessorResultType.SENDER).convert_to_table_rows()
+        self.assertIn(["news@mail.example.com", "mail.example.com", "example.com", 2], rows)
+        self.assertIn(["Bob@mail.example.com", "mail.example.com", "example.com", 1], rows)
+        self.assertIn(["invalid-address", UNKNOWN_DOMAIN, UNKNOWN_DOMAIN, 1], rows)
+        self.assertEqual(len(SENDERS), sum(row[3] for row in rows))
+        self.assertEqual(("t3", "m3", "Subject 3"), grouping["alice@example.com"])
+
+    def test_drill_down_uses_counts_of_all_levels(self):
+        processor = self._process(ProcessorResultType.SENDER, drill_down="mail.example.com")
+        _, rows = processor.convert_to_table_rows()
+        self.assertEqual([["news@mail.example.com", "mail.example.com", "example.com", 2],
+                          ["Bob@mail.example.com", "mail.example.com", "example.com", 1]], rows)
+
+        processor.result_type, processor.drill_down = ProcessorResultType.ORGANIZATION, "uk"
+        self.assertEqual([["example.co.uk", 1, 1, 1]], processor.convert_to_table_rows()[1])
+        processor.drill_down = "unknown.com"
+        self.assertEqual([], processor.convert_to_table_rows()[1])
+
+    def test_merged_results_match_serial_results(self):
+        for result_type in [ProcessorResultType.SENDER, ProcessorResultType.DOMAIN, ProcessorResultType.ORGANIZATION]:
+            serial = self._process(result_type)
+            merged = self._process(result_type, messages=self.messages[:3])
+            merged.merge(self._process(result_type, messages=self.messages[3:]))
+            self.assertEqual(serial.convert_to_table_rows(), merged.convert_to_table_rows(), msg=result_type)
+
+    def test_sender_of_parent_domain_added_later(self):
+        messages = [create_gmail_message(f"m{i}", f"t{i}", sender)
+                    for i, sender in enumerate(["c@example.co.uk", "x@co.uk", "y@mail.example.com", "z@example.com"])]
+        for result_type in [ProcessorResultType.SENDER, ProcessorResultType.DOMAIN, ProcessorResultType.ORGANIZATION]:
+            serial = self._process(result_type, messages=messages)
+            merged = self._process(result_type, messages=messages[:1])
+            merged.merge(self._process(result_type, messages=messages[1:]))
+            self.assertEqual(serial.convert_to_table_rows(), merged.convert_to_table_rows(), msg=result_type)
+        _, rows = self._process(ProcessorResultType.SENDER, messages=messages).convert_to_table_rows()
+        self.assertIn(["x@co.uk", "co.uk", "co.uk", 1], rows)
+        self.assertIn(["z@example.com", "example.com", "example.com", 1], rows)
+        _, rows = self._process(ProcessorResultType.DOMAIN, messages=messages).convert_to_table_rows()
+        self.assertIn(["co.uk", "co.uk", 2, 2], rows)
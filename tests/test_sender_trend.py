@@ -0,0 +1,74 @@
+import datetime
+import unittest
+
+from emailsorter.common.model import ProcessorResultType, TimeBucket, MessageRecord, create_message_processor
+from tests.fake_gmail import create_gmail_message
+
+
+@unittest.skipUnless(ProcessorResultType.TREND.is_available, "NumPy is not installed")
+class SenderTrendProcessorTest(unittest.TestCase):
+    def setUp(self):
+        # Monday
+        start = datetime.datetime(2024, 1, 1, 9, 0)
+        self.messages = []
+        # alice sends 1, 2, 3, 4 messages in 4 consecutive weeks, bob 2 messages every week, carol only in week 1
+        for week, counts in enumerate([(1, 2, 1), (2, 2, 0), (3, 2, 0), (4, 2, 0)]):
+            for sender, count in zip(["alice@example.com", "bob@example.com", "carol@example.com"], counts):
+                for i in range(count):
+                    idx = len(self.messages)
+                    date = start + datetime.timedelta(weeks=week, days=i)
+                    self.messages.append(create_gmail_message(f"m{idx}", f"t{idx}", sender, date=date))
+
+    def _process(self, messages, time_bucket=TimeBucket.WEEK, buckets=4):
+        processor = create_message_processor(ProcessorResultType.TREND, time_bucket=time_bucket, buckets=buckets)
+        for message in messages:
+            processor.process(message)
+        return processor
+
+    def test_weekly_histograms_and_trends(self):
+        grouping, rows = self._process(self.messages).convert_to_table_rows()
+        self.assertEqual([
+            ["alice@example.com", 10, 4, 1.0, "▂▄▆█"],
+            ["bob@example.com", 8, 2, 0.0, "████"],
+            ["carol@example.com", 1, 0, -0.3, "█   "],
+        ], rows)
+        self.assertEqual(("t18", "m18", "Subject"), grouping["bob@example.com"])
+
+    def test_only_last_buckets_are_shown(self):
+        _, rows = self._process(self.messages, buckets=2).convert_to_table_rows()
+        self.assertEqual([["alice@example.com", 10, 4, 1.0, "▆█"],
+                          ["bob@example.com", 8, 2, 0.0, "██"],
+                          ["carol@example.com", 1, 0, 0.0, "  "]], rows)
+
+    def test_monthly_and_daily_buckets(self):
+        messages = [create_gmail_message(f"m{i}", f"t{i}", "alice@example.com", date=date)
+                    for i, date in enumerate([datetime.datetime(2023, 12, 31, 23, 59), datetime.datetime(2024, 1, 1),
+                                              datetime.datetime(2024, 2, 29), datetime.datetime(2024, 2, 1)])]
+        messages.append(create_gmail_message("m-none", "t-none", "alice@example.com"))
+        messages[-1].date = None
+        processor = self._process(messages, time_bucket=TimeBucket.MONTH, buckets=3)
+        _, rows = processor.convert_to_table_rows()
+        self.assertEqual([["alice@example.com", 5, 2, 0.5, "▄▄█"]], rows)
+        self.assertEqual(datetime.date(2023, 12, 1), processor.get_bucket_start((2023 - 1970) * 12 + 11))
+
+        _, rows = self._process(messages, time_bucket=TimeBucket.DAY, buckets=2).convert_to_table_rows()
+        self.assertEqual([["alice@example.com", 5, 1, 1.0, " █"]], rows)
+
+    def test_merged_processors_match_single_processor(self):
+        processor = self._process(self.messages[:7])
+        processor.merge(self._process(self.messages[7:]))
+        self.assertEqual(self._process(self.messages).convert_to_table_rows(), processor.convert_to_table_rows())
+
+    def test_matches_pure_python_baseline(self):
+        from benchmarks.trend import PurePythonTrendProcessor, create_records, run
+
+        for time_bucket in TimeBucket:
+            baseline = PurePythonTrendProcessor(time_bucket=time_bucket, buckets=5)
+            processor = create_message_processor(ProcessorResultType.TREND, time_bucket=time_bucket, buckets=5)
+            for message in self.messages:
+                baseline.add(message.sender_email, MessageRecord.from_message(message))
+                processor.process(message)
+            self.assertEqual(baseline.convert_to_table_rows(), processor.convert_to_table_rows(), time_bucket)
+
+        result = run(create_records(2000, 50, 1.1, days=100), TimeBucket.WEEK, buckets=8)
+        self.assertTrue(result["rows_match"])
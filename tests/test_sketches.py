@@ -0,0 +1,130 @@
+import pickle
+import unittest
+from argparse import Namespace
+from collections import Counter
+
+from benchmarks.synthetic import iter_sender_indices
+from emailsorter.common.model import ProcessorResultType, create_message_processor
+from emailsorter.core.sketch import HyperLogLog, SpaceSaving
+from tests.fake_gmail import create_gmail_message
+
+
+class HyperLogLogTest(unittest.TestCase):
+    def _create(self, values, precision: int = 12) -> HyperLogLog:
+        sketch = HyperLogLog(precision)
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def test_estimate_is_within_error(self):
+        for count in [0, 1, 100, 5000, 50000]:
+            sketch = self._create(f"sender{i}@example.com" for i in range(count))
+            self.assertLessEqual(abs(sketch.estimate() - count), max(1, 3 * sketch.relative_error * count), count)
+
+    def test_repeated_values_are_counted_once(self):
+        sketch = self._create(f"user{i % 10}@example.com" for i in range(10000))
+        self.assertEqual(10, sketch.estimate())
+
+    def test_merge(self):
+        values = [f"sender{i}@example.com" for i in range(20000)]
+        sketch = self._create(values[:12000])
+        sketch.merge(self._create(values[8000:]))
+        expected = self._create(values)
+        self.assertEqual(expected.estimate(), sketch.estimate())
+        self.assertEqual(expected.registers, sketch.registers)
+        # Sketches of the worker processes of parallel processing are pickled with their buffered values
+        unpickled = pickle.loads(pickle.dumps(self._create(values)))
+        self.assertEqual(expected.registers, unpickled.registers)
+
+        with self.assertRaises(ValueError):
+            sketch.merge(HyperLogLog(10))
+        with self.assertRaises(ValueError):
+            HyperLogLog(2)
+
+
+class SpaceSavingTest(unittest.TestCase):
+    def setUp(self):
+        self.items = list(iter_sender_indices(20000, 2000, skew=1.1))
+        self.true_counts = Counter(self.items)
+
+    def _create(self, items, capacity: int = 100) -> SpaceSaving:
+        sketch = SpaceSaving(capacity)
+        for item in items:
+            sketch.add(item, value=f"value{item}")
+        return sketch
+
+    def _assert_bounds(self, sketch: SpaceSaving):
+        for item, count in sketch.counts.items():
+            self.assertLessEqual(count - sketch.errors[item], self.true_counts[item], item)
+            self.assertLessEqual(self.true_counts[item], count, item)
+        for item, count in self.true_counts.items():
+            if item not in sketch.counts:
+                self.assertLessEqual(count, sketch.max_error, item)
+
+    def test_counts_are_exact_under_capacity(self):
+        sketch = self._create(self.items, capacity=len(self.true_counts))
+        self.assertEqual(dict(self.true_counts), sketch.counts)
+        self.assertEqual(0, sketch.max_error)
+        self.assertEqual({item: f"value{item}" for item in self.true_counts}, sketch.values)
+
+    def test_bounds_contain_true_counts(self):
+        sketch = self._create(self.items)
+        self.assertEqual(100, len(sketch.counts))
+        self.assertLessEqual(sketch.max_error, len(self.items) / 100)
+        self._assert_bounds(sketch)
+        top = [item for item, _ in self.true_counts.most_common(10)]
+        self.assertTrue(set(top).issubset(sketch.counts))
+
+    def test_merged_bounds_contain_true_counts(self):
+        sketch = self._create(self.items[:7000])
+        sketch.merge(self._create(self.items[7000:15000]))
+        sketch.merge(self._create(self.items[15000:]))
+        self.assertEqual(100, len(sketch.counts))
+        self._assert_bounds(sketch)
+
+        with self.assertRaises(ValueError):
+            sketch.merge(SpaceSaving(10))
+
+
+class ApproximateSenderProcessorTest(unittest.TestCase):
+    def setUp(self):
+        senders = ["alice@example.com", "bob@example.com", None, "alice@example.com", "carol@example.org"]
+        self.messages = [create_gmail_message(f"m{i}", f"t{i}", senders[i % len(senders)], subject=f"Subject {i}")
+                         for i in range(20)]
+
+    def _process(self, messages, top_senders: int = 10):
+        processor = create_message_processor(ProcessorResultType.APPROXIMATE, top_senders=top_senders)
+        for message in messages:
+            processor.process(message)
+        return processor
+
+    def test_rows_are_exact_under_capacity(self):
+        examples, rows = self._process(self.messages).convert_to_table_rows()
+        self.assertEqual([["alice@example.com", 8, 8, 0, 40.0], ["bob@example.com", 4, 4, 0, 20.0],
+                          [None, 4, 4, 0, 20.0], ["carol@example.org", 4, 4, 0, 20.0]], rows)
+        self.assertEqual(("t18", "m18", "Subject 18"), examples["alice@example.com"])
+
+    def test_merged_processors_match_single_processor(self):
+        processor = self._process(self.messages[:7])
+        processor.merge(self._process(self.messages[7:]))
+        expected = self._process(self.messages)
+        self.assertEqual(expected.convert_to_table_rows(), processor.convert_to_table_rows())
+        self.assertEqual(expected.get_summary(), processor.get_summary())
+
+    def test_summary(self):
+        summary = self._process(self.messages, top_senders=2).get_summary()
+        self.assertEqual(20, summary["messages"])
+        self.assertEqual(4, summary["distinct_senders"])
+        self.assertEqual(1, summary["distinct_recipients"])
+        self.assertEqual(2, summary["counted_senders"])
+        self.assertGreaterEqual(summary["max_messages_of_other_senders"], 4)
+
+    def test_benchmark_accuracy(self):
+        from benchmarks.approximate import run
+
+        result = run(Namespace(messages=20000, senders=5000, recipients=1000, skew=1.1, top_senders=500))
+        self.assertTrue(result["messages_match"])
+        self.assertEqual(1.0, result["within_bounds"])
+        self.assertGreaterEqual(result["top_100_recall"], 0.9)
+        self.assertLess(result["distinct_senders_error_pct"], 5)
+        self.assertLess(result["distinct_recipients_error_pct"], 5)
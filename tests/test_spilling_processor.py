@@ -0,0 +1,185 @@
+import datetime
+import functools
+import os
+import tempfile
+import unittest
+
+from googleapiwrapper.gmail_domain import ThreadQueryFormat
+
+from emailsorter.actions.inbox_discovery import InboxDiscovery, InboxDiscoveryConfig
+from emailsorter.common.model import ProcessorResultType, GroupingEngine, create_message_processor
+from emailsorter.core.common import EmailSorterConfig
+from emailsorter.core.output import create_processor_representation
+from emailsorter.core.source import InMemoryMessageSource
+from emailsorter.core.spill import SpillingGroupingProcessor
+from emailsorter.display.export import ExportFormat
+from emailsorter.display.table import EmailTable, TableRenderSettings, SortedRows
+from tests.fake_gmail import FakeGmailWrapperFactory, FakeEmailSorterContext, FakeMailboxSource, \
+    create_gmail_message
+
+# Small enough to spill every few messages
+MEMORY_BUDGET = 2000
+
+
+class FailingMessageSource(InMemoryMessageSource):
+    """
+    Fails after the messages, like a mailbox that can't be fetched completely
+    """
+    def iter_pages(self):
+        yield from super().iter_pages()
+        raise ConnectionError("Mailbox is not available")
+
+
+class SpillingGroupingProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        start = datetime.datetime(2024, 1, 1, 9, 0)
+        senders = ["alice@example.com", "bob@example.com", None, "alice@example.com", "carol@example.org",
+                   "bob@example.com", "alice@example.com"]
+        self.messages = [create_gmail_message(f"m{i}", f"t{i // 2}", senders[i * i % len(senders)],
+                                              subject=f"Subject {i}", date=start + datetime.timedelta(hours=i))
+                         for i in range(60)]
+        self.representation = create_processor_representation(ProcessorResultType.DETAILED)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _process(self, messages, memory_budget=MEMORY_BUDGET):
+        processor = create_message_processor(ProcessorResultType.DETAILED, memory_budget=memory_budget,
+                                             spill_dir=self.tmp_dir.name)
+        for message in messages:
+            processor.process(message)
+        return processor
+
+    def _create_table(self, top: int = None) -> EmailTable:
+        settings = TableRenderSettings(self.representation.get_col_styles(),
+                                       sort_by_column=self.representation.get_sort_column(), top=top)
+        return EmailTable(self.representation.get_cols(), settings, col_types=self.representation.get_col_types())
+
+    def _get_sorted_rows(self, processor):
+        examples, rows = processor.convert_to_table_rows()
+        return examples, list(self._create_table().sort(rows))
+
+    def test_rows_match_in_memory_mode(self):
+        expected = self._get_sorted_rows(self._process(self.messages, memory_budget=None))
+        processor = self._process(self.messages)
+        self.assertGreater(len(processor.runs), 5)
+        examples, rows = processor.convert_to_table_rows()
+        self.assertIsInstance(rows, SortedRows)
+        self.assertEqual(len(expected[1]), len(rows))
+        self.assertEqual(expected, self._get_sorted_rows(processor))
+        # Rows can be read again, e.g. for rendering and exporting
+        self.assertEqual(expected[1], list(rows))
+
+    def test_merged_processors_match_in_memory_mode(self):
+        expected = self._get_sorted_rows(self._process(self.messages, memory_budget=None))
+        processor = self._process(self.messages[:25])
+        processor.merge(self._process(self.messages[25:27]))
+        processor.merge(self._process(self.messages[27:]))
+        self.assertEqual(expected, self._get_sorted_rows(processor))
+
+    def test_runs_are_merged_in_bounded_passes(self):
+        expected = self._get_sorted_rows(self._process(self.messages, memory_budget=None))
+        processors = [SpillingGroupingProcessor(MEMORY_BUDGET // 4, spill_dir=self.tmp_dir.name, merge_fan_in=3)
+                      for _ in range(2)]
+        for idx, message in enumerate(self.messages):
+            processors[idx * 2 // len(self.messages)].process(message)
+        processor = processors[0]
+        self.assertGreater(max(run.level for run in processor.runs), 1)
+        self.assertLess(len(processor.runs), 3 * 3)
+        processor.merge(processors[1])
+
+        self.assertEqual(expected, self._get_sorted_rows(processor))
+        # The rows read at most 'merge_fan_in' runs, merged runs are deleted
+        self.assertLessEqual(len(processor.runs), 3)
+        self.assertEqual(sorted(run.file_path for run in processor.runs),
+                         sorted(os.path.join(self.tmp_dir.name, f) for f in os.listdir(self.tmp_dir.name)))
+        processor.close()
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+    def test_table_reads_only_rendered_rows(self):
+        processor = self._process(self.messages)
+        _, rows = processor.convert_to_table_rows()
+        table = self._create_table(top=3)
+        table.render(rows)
+        self.assertEqual(list(rows)[:3], table.rendered_rows)
+
+        settings = TableRenderSettings(self.representation.get_col_styles(), sort_by_column="Date")
+        with self.assertRaises(ValueError):
+            EmailTable(self.representation.get_cols(), settings).render(rows)
+
+    def test_close_deletes_runs(self):
+        processor = self._process(self.messages)
+        self.assertTrue(os.listdir(self.tmp_dir.name))
+        processor.close()
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+    def test_memory_budget_is_only_used_by_detailed_view(self):
+        processor = create_message_processor(ProcessorResultType.SIMPLIFIED, memory_budget=MEMORY_BUDGET)
+        self.assertFalse(hasattr(processor, "runs"))
+        with self.assertRaises(ValueError):
+            create_message_processor(ProcessorResultType.DETAILED, memory_budget=MEMORY_BUDGET,
+                                     engine=GroupingEngine.COLUMNAR)
+        with self.assertRaises(ValueError):
+            create_message_processor(ProcessorResultType.DETAILED, memory_budget=0)
+
+
+class SpillingDiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spill_dir = os.path.join(self.tmp_dir.name, "spill")
+        os.mkdir(self.spill_dir)
+        EmailSorterConfig.PROJECT_OUT_ROOT = self.tmp_dir.name
+        self.ctx = FakeEmailSorterContext(self.tmp_dir.name, FakeGmailWrapperFactory({}))
+        self.source = FakeMailboxSource()
+        for i in range(40):
+            message = create_gmail_message(f"m{i}", f"t{i}", f"sender{i * i % 9}@example.com", subject=f"Subject {i}")
+            self.source.put_thread(f"t{i}", "1", [message])
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _run(self, memory_budget: int = None, parallelism: int = 1) -> str:
+        conf = InboxDiscoveryConfig(self.ctx, gmail_query="label:inbox", fetch_mode=ThreadQueryFormat.METADATA,
+                                    offline_mode=False, export_formats=[ExportFormat.CSV, ExportFormat.JSONL],
+                                    result_type=ProcessorResultType.DETAILED, save_snapshot=True,
+                                    memory_budget=memory_budget, spill_dir=self.spill_dir, parallelism=parallelism)
+        discovery = InboxDiscovery(conf, self.ctx)
+        discovery._create_message_source = lambda: self.source
+        discovery.run()
+        exported = ""
+        for fmt in conf.export_formats:
+            with open(os.path.join(self.ctx.session_dir, f"discovery_results.{fmt.extension}")) as f:
+                exported += f.read()
+        return exported
+
+    def test_export_matches_in_memory_mode(self):
+        expected = self._run()
+        for parallelism in [1, 3]:
+            self.assertEqual(expected, self._run(memory_budget=MEMORY_BUDGET, parallelism=parallelism), parallelism)
+            self.assertEqual([], os.listdir(self.spill_dir))
+
+    def test_memory_budget_requires_detailed_view(self):
+        with self.assertRaises(ValueError):
+            InboxDiscoveryConfig(self.ctx, gmail_query="label:inbox", fetch_mode=ThreadQueryFormat.METADATA,
+                                 offline_mode=False, result_type=ProcessorResultType.SIMPLIFIED,
+                                 memory_budget=MEMORY_BUDGET)
+
+    def test_runs_are_deleted_when_discovery_fails(self):
+        messages = [message for _, messages in self.source.mailbox.values() for message in messages]
+        self.source.iter_pages = FailingMessageSource(messages).iter_pages
+        with self.assertRaises(ConnectionError):
+            self._run(memory_budget=MEMORY_BUDGET)
+        self.assertEqual([], os.listdir(self.spill_dir))
+
+    def test_runs_are_deleted_when_shard_fails(self):
+        messages = [message for _, messages in self.source.mailbox.values() for message in messages]
+        factory = functools.partial(create_message_processor, ProcessorResultType.DETAILED,
+                                    memory_budget=MEMORY_BUDGET, spill_dir=self.spill_dir)
+        # Shards after the failed one are not merged, shards before it are
+        for failing_shard in [0, 3]:
+            shards = [InMemoryMessageSource(messages[i:i + 10]) for i in range(0, 40, 10)]
+            shards[failing_shard] = FailingMessageSource(shards[failing_shard].messages)
+            with self.assertRaises(ConnectionError):
+                InboxDiscovery.process_message_shards(shards, None, [], [factory], parallelism=2)
+            self.assertEqual([], os.listdir(self.spill_dir), failing_shard)
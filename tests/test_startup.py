@@ -0,0 +1,21 @@
+import tempfile
+import unittest
+
+from benchmarks.startup import measure_imports, measure_offline_run
+
+
+class StartupTest(unittest.TestCase):
+    def test_commands_do_not_import_gmail_api_client(self):
+        results = measure_imports(repeat=1)
+        self.assertEqual(["import[cli]", "import[emailsorter.actions.inbox_discovery]"],
+                         [r["case"] for r in results])
+        for result in results:
+            self.assertEqual([], result["api_client_modules"], result["case"])
+        # The CLI group doesn't read or write JSON files, the discovery action does
+        self.assertEqual([], results[0]["json_modules"])
+
+    def test_offline_discovery_does_not_import_gmail_api_client(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            result = measure_offline_run(work_dir, messages=50, senders=5, repeat=1)
+        self.assertEqual([], result["api_client_modules"])
+        self.assertGreater(result["wall_seconds"], 0)